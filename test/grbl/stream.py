@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Compare a z-stack move sequence blocking one move at a time vs streamed
+Ex: ./test/grbl/stream.py --port mock
+"""
+
+from uscope.motion.grbl import GRBL
+from uscope.util import add_bool_arg
+import time
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Time a streamed z-stack")
+    add_bool_arg(parser, "--verbose", default=False, help="Verbose output")
+    parser.add_argument("--port", default=None, help="Ex: mock")
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--step", type=float, default=0.01, help="mm")
+    parser.add_argument("--f", type=int, default=100, help="mm / min")
+    parser.add_argument("--poll-period", type=float, default=0.05)
+    args = parser.parse_args()
+
+    grbl = GRBL(port=args.port, verbose=args.verbose)
+    z0 = grbl.qstatus()["MPos"]["z"]
+    zs = [z0 + args.step * (i + 1) for i in range(args.steps)]
+
+    tstart = time.time()
+    for z in zs:
+        grbl.move_absolute({"z": z}, f=args.f)
+    grbl.move_absolute({"z": z0}, f=args.f)
+    print("Blocking: %0.3f sec" % (time.time() - tstart, ))
+
+    tstart = time.time()
+    with grbl.streaming(poll_period=args.poll_period):
+        cmds = [grbl.queue_move_absolute({"z": z}, f=args.f) for z in zs]
+        print("Queued %u moves in %0.3f sec" %
+              (len(cmds), time.time() - tstart))
+        for z, cmd in zip(zs, cmds):
+            cmd.done.result()
+            print("  z %0.3f done @ %0.3f sec" % (z, time.time() - tstart))
+        grbl.move_absolute({"z": z0}, f=args.f)
+    print("Streamed: %0.3f sec" % (time.time() - tstart, ))
+
+
+if __name__ == "__main__":
+    main()
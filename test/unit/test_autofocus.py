@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+import unittest
+from uscope.imager.autofocus import climb_focus, parabolic_peak
+
+
+class AutofocusTestCase(unittest.TestCase):
+    def score_at(self, peak):
+        """
+        Return a score_at() for climb_focus() recording the z's visited
+        """
+        self.visited = []
+
+        def score_at(z):
+            self.visited.append(z)
+            return 100.0 - (z - peak)**2
+
+        return score_at
+
+    def test_parabolic_peak(self):
+        xs = [0.0, 1.0, 2.0, 3.0]
+        self.assertAlmostEqual(
+            parabolic_peak(xs, [-(x - 1.25)**2 for x in xs]), 1.25)
+        # Best sample at an end: can't interpolate
+        self.assertEqual(parabolic_peak(xs, [3.0, 2.0, 1.0, 0.0]), 0.0)
+        self.assertEqual(parabolic_peak(xs, [0.0, 1.0, 2.0, 3.0]), 3.0)
+
+    def test_climb_forward(self):
+        z, score = climb_focus(self.score_at(2.2), z=0.0, step=1.0)
+        self.assertAlmostEqual(z, 2.2)
+        self.assertAlmostEqual(score, 100.0 - 0.2**2)
+        # Stops one step past the peak
+        self.assertEqual(self.visited, [-1.0, 0.0, 1.0, 2.0, 3.0])
+
+    def test_climb_reverse(self):
+        # Worse right away: turns around
+        z, _score = climb_focus(self.score_at(-3.4), z=0.0, step=1.0)
+        self.assertAlmostEqual(z, -3.4)
+        self.assertEqual(self.visited, [-1.0, 0.0, -2.0, -3.0, -4.0])
+
+    def test_climb_descending(self):
+        z, _score = climb_focus(self.score_at(-0.27), z=0.0, step=-0.1)
+        self.assertAlmostEqual(z, -0.27)
+        self.assertEqual(len(self.visited), len(set(self.visited)))
+
+    def test_climb_max_steps(self):
+        z, _score = climb_focus(self.score_at(10.0),
+                                z=0.0,
+                                step=1.0,
+                                max_steps=3)
+        self.assertEqual(z, 3.0)
+        self.assertEqual(max(self.visited), 3.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
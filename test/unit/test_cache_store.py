@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import unittest
+import json
+import os
+import shutil
+import tempfile
+import time
+from uscope.cache_store import CacheStore
+
+
+class CacheStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="pyuscope_")
+        self.fn = os.path.join(self.dir, "argus.j5")
+        self.stores = []
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+        shutil.rmtree(self.dir)
+
+    def store(self, delay=60.0):
+        ret = CacheStore(self.fn, delay=delay, log=lambda s="": None)
+        self.stores.append(ret)
+        return ret
+
+    def read(self):
+        with open(self.fn, "r") as f:
+            return json.load(f)
+
+    def test_change_tracking(self):
+        store = self.store()
+        self.assertEqual(store.load(), {})
+        b = {"c": [1, 2]}
+        self.assertEqual(store.update({"a": 1, "b": b}), ["a", "b"])
+        self.assertEqual(store.update({"a": 1, "b": {"c": [1, 2]}}), [])
+        self.assertEqual(store.update({"a": 2, "b": b}), ["a"])
+        # Removed keys count as changed
+        self.assertEqual(store.update({"a": 2}), ["b"])
+
+    def test_saved_copy(self):
+        """
+        Mutating the caller's dict after update() must still look changed
+        """
+        store = self.store()
+        cachej = {"a": {"b": 1}}
+        store.update(cachej)
+        cachej["a"]["b"] = 2
+        self.assertEqual(store.update(cachej), ["a"])
+
+    def test_debounce(self):
+        store = self.store(delay=0.2)
+        store.update({"a": 1})
+        store.update({"a": 2})
+        store.update({"a": 3})
+        self.assertFalse(os.path.exists(self.fn))
+        deadline = time.time() + 5.0
+        while not store.writes and time.time() < deadline:
+            time.sleep(0.01)
+        # Burst coalesced into one write of the last state
+        self.assertEqual(store.writes, 1)
+        self.assertEqual(self.read(), {"a": 3})
+        self.assertFalse(os.path.exists(self.fn + ".tmp"))
+
+    def test_flush(self):
+        store = self.store()
+        store.flush()
+        self.assertEqual(store.writes, 0)
+        store.update({"b": [1, 2], "a": "x"})
+        store.flush()
+        self.assertEqual(store.writes, 1)
+        with open(self.fn, "r") as f:
+            self.assertEqual(f.read(), '{"a":"x","b":[1,2]}')
+        # Nothing changed: nothing written
+        store.update({"a": "x", "b": [1, 2]})
+        store.flush()
+        self.assertEqual(store.writes, 1)
+
+    def test_close(self):
+        store = self.store()
+        store.update({"a": 1})
+        store.close()
+        self.assertEqual(self.read(), {"a": 1})
+
+    def test_load(self):
+        with open(self.fn, "w") as f:
+            # json5, as written by older versions
+            f.write('{\n    // comment\n    "a": 1,\n}\n')
+        store = self.store()
+        self.assertEqual(store.load(), {"a": 1})
+        # Loaded counts as saved
+        self.assertEqual(store.update({"a": 1}), [])
+
+    def test_load_corrupt(self):
+        with open(self.fn, "w") as f:
+            f.write('{"a": ')
+        self.assertEqual(self.store().load(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+import unittest
+from unittest import mock
+import threading
+from types import SimpleNamespace
+from uscope.motion.motion_util import format_feed, trapezoid_time
+from uscope.planner.fly import FlyRow, FlyFrame, row_runs
+
+
+class FlyRowTestCase(unittest.TestCase):
+    def row(self, start, end):
+        row = FlyRow(start=start,
+                     end=end,
+                     fixed={"y": 2.0},
+                     feed=2.0,
+                     acceleration=10.0)
+        row.t0 = 100.0
+        return row
+
+    def test_row_runs(self):
+        order = [(0, 0), (1, 0), (2, 0), (2, 1), (1, 1), (0, 1), (0, 2)]
+        expected = [
+            [(0, 0), (1, 0), (2, 0)],
+            [(2, 1), (1, 1), (0, 1)],
+            [(0, 2)],
+        ]
+        self.assertEqual(row_runs(order), expected)
+
+    def test_duration(self):
+        row = self.row(1.0, 5.0)
+        self.assertAlmostEqual(row.duration(), trapezoid_time(4.0, 2.0, 10.0))
+
+    def test_feed_commanded(self):
+        # 0.0123456 mm / sec is sent as F0.741 mm / min
+        row = FlyRow(start=0.0,
+                     end=0.1,
+                     fixed={},
+                     feed=0.0123456,
+                     acceleration=10.0,
+                     axis="z")
+        self.assertAlmostEqual(row.feed * 60, 0.741)
+        moves = []
+        row.run(lambda pos, options: moves.append((pos, options)))
+        row.thread.join()
+        self.assertEqual(format_feed(moves[0][1]["feed"]), "0.741")
+
+    def test_position_at(self):
+        for start, end in ((1.0, 5.0), (5.0, 1.0)):
+            row = self.row(start, end)
+            self.assertEqual(row.position_at(row.t0 - 1.0), {
+                "x": start,
+                "y": 2.0
+            })
+            self.assertEqual(row.position_at(row.t0 + 100.0), {
+                "x": end,
+                "y": 2.0
+            })
+            # Constant speed in the middle
+            t = row.t0 + row.duration() / 2
+            self.assertAlmostEqual(row.position_at(t)["x"], (start + end) / 2)
+            dx = row.position_at(t + 0.1)["x"] - row.position_at(t)["x"]
+            self.assertAlmostEqual(dx, row.direction * 0.2)
+
+    def test_time_at(self):
+        for start, end in ((1.0, 5.0), (5.0, 1.0)):
+            row = self.row(start, end)
+            for value in (1.0, 1.05, 2.5, 4.99, 5.0):
+                t = row.time_at(value)
+                self.assertAlmostEqual(row.position_at(t)["x"], value)
+
+    def test_frame_position(self):
+        row = self.row(1.0, 5.0)
+        scan = SimpleNamespace(lock=threading.Lock(), frames={})
+        frame = FlyFrame(scan, row, "c000_r000", {"x": 3.0, "y": 2.0})
+        t = row.time_at(3.0)
+        # Not captured yet: interpolated from the row profile
+        with mock.patch("uscope.planner.fly.time.time", return_value=t):
+            self.assertAlmostEqual(frame.position()["x"], 3.0)
+        scan.frames["c000_r000"] = {"x": 3.01, "y": 2.0, "error": 0.01}
+        self.assertEqual(frame.position(), {"x": 3.01, "y": 2.0})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+import unittest
+from uscope.planner.focus_map import FocusMap, grid_indices, grid_order
+
+
+class FocusMapTestCase(unittest.TestCase):
+    def test_grid_indices(self):
+        self.assertEqual(grid_indices(10, 3), [0, 4, 9])
+        self.assertEqual(grid_indices(10, 1), [4])
+        # More samples than tiles
+        self.assertEqual(grid_indices(2, 5), [0, 1])
+
+    def test_grid_order(self):
+        order = grid_order(10, 10, 3, 4)
+        # Serpentine: alternate direction on every row
+        self.assertEqual(order, [
+            (0, 0),
+            (4, 0),
+            (9, 0),
+            (9, 3),
+            (4, 3),
+            (0, 3),
+            (0, 6),
+            (4, 6),
+            (9, 6),
+            (9, 9),
+            (4, 9),
+            (0, 9),
+        ])
+        # Every tile exactly once
+        self.assertEqual(len(set(order)), 12)
+
+    def test_fit_plane(self):
+        focus_map = FocusMap(model="plane")
+        for x, y in grid_order(3, 3, 3, 3):
+            focus_map.add(x, y, 0.5 + 0.1 * x - 0.2 * y)
+        focus_map.fit()
+        self.assertAlmostEqual(focus_map.z(1.5, 0.5), 0.55)
+        for residual in focus_map.residuals():
+            self.assertAlmostEqual(residual, 0.0)
+
+    def test_fit_auto(self):
+        focus_map = FocusMap()
+        for x, y in grid_order(3, 3, 3, 3):
+            focus_map.add(x, y, 0.01 * x * x)
+        focus_map.fit()
+        self.assertEqual(focus_map.fitted, "quadratic")
+        self.assertAlmostEqual(focus_map.z(1.5, 1.0), 0.0225)
+
+
+if __name__ == "__main__":
+    unittest.main()
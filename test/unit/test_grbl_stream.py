@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+GRBL streaming against MockGRBLSer
+"""
+
+import unittest
+from unittest import mock
+from uscope.motion.grbl import GRBL, MockGRBLSer, GrblException, STATUS_MASK_BUFFER
+
+
+class GRBLStreamTestCase(unittest.TestCase):
+    def setUp(self):
+        gs = MockGRBLSer()
+        # Skip the simulated reset delay
+        gs.state = gs.STATE_IDLE
+        self.gs = gs
+        self.grbl = GRBL(gs=gs, buffer_report=True)
+
+    def tearDown(self):
+        self.grbl.close()
+
+    def test_mock_buffer_report(self):
+        # Stock $10=1: no buffer state
+        self.assertNotIn("Bf", self.grbl.qstatus(max_age=0))
+        with self.grbl.streaming():
+            self.assertIn("Bf", self.grbl.qstatus(max_age=0))
+        self.assertEqual(
+            int(dict(self.grbl.dollar_kvs())["$10"]) & STATUS_MASK_BUFFER,
+            STATUS_MASK_BUFFER)
+
+    def test_no_buffer_report(self):
+        """
+        Machine settings are only changed on request
+        Moves then complete once idle
+        """
+        self.grbl.close()
+        self.grbl = GRBL(gs=self.gs)
+        with self.grbl.streaming():
+            self.assertNotIn("Bf", self.grbl.qstatus(max_age=0))
+            self.grbl.move_absolute({"z": 0.5}, f=600)
+            self.assertEqual(self.grbl.qstatus(max_age=0)["status"], "Idle")
+            self.assertEqual(self.grbl.qstatus(max_age=0)["MPos"]["z"], 0.5)
+            self.assertIsNotNone(self.grbl.last_completion.tidle)
+        self.assertEqual(dict(self.grbl.dollar_kvs())["$10"], "1")
+
+    def test_order(self):
+        zs = [0.2 * (i + 1) for i in range(20)]
+        completed = []
+        with self.grbl.streaming():
+            cmds = [self.grbl.queue_move_absolute({"z": z}, 600) for z in zs]
+            for z, cmd in zip(zs, cmds):
+                cmd.done.add_done_callback(
+                    lambda _future, z=z: completed.append(z))
+            # Moves complete one at a time, not just once the sequence is idle
+            cmds[0].done.result(timeout=5.0)
+            self.assertNotEqual(self.gs.state, self.gs.STATE_IDLE)
+            for cmd in cmds:
+                cmd.done.result(timeout=5.0)
+        self.assertEqual(completed, zs)
+        self.assertAlmostEqual(
+            self.grbl.qstatus(max_age=0)["MPos"]["z"], zs[-1])
+
+    def test_fine_feed(self):
+        # Below 1 mm / min: not truncated
+        with mock.patch.object(self.gs, "j", wraps=self.gs.j) as j:
+            self.grbl.move_absolute({"z": 0.01}, f=0.5)
+        j.assert_called_once_with("G90  Z0.010 F0.500")
+
+    def test_noop(self):
+        with self.grbl.streaming():
+            cmd = self.grbl.queue_move_absolute({"z": 0.0}, 600)
+            self.assertTrue(cmd.done.done())
+
+    def test_cancel(self):
+        with self.grbl.streaming() as streamer:
+            # Fills the planner (15 blocks) with more waiting in the rx buffer
+            cmds = [
+                self.grbl.queue_move_absolute({"z": i + 1.0}, 60)
+                for i in range(20)
+            ]
+            self.assertTrue(streamer.in_flight)
+            self.grbl.jog_cancel()
+            for cmd in cmds:
+                self.assertRaises(GrblException, cmd.done.result, 0)
+            self.assertFalse(streamer.in_flight)
+            self.assertFalse(streamer.planned)
+            status = self.grbl.qstatus(max_age=0)
+            self.assertEqual(status["status"], "Idle")
+            z = status["MPos"]["z"]
+            self.assertLess(z, 1.0)
+            self.assertEqual(self.grbl.stream_target, status["MPos"])
+            # Lines buffered before the cancel didn't run afterwards
+            self.assertFalse(self.gs.planner)
+            self.assertEqual(self.grbl.qstatus(max_age=0)["MPos"]["z"], z)
+            # Still usable
+            cmd = self.grbl.queue_move_absolute({"z": 0.0}, 600)
+            cmd.done.result(timeout=5.0)
+        self.assertEqual(self.grbl.qstatus(max_age=0)["MPos"]["z"], 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
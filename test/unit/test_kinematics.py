@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+import unittest
+import time
+from types import SimpleNamespace
+from uscope.kinematics import Kinematics
+from uscope.motion.completion import MotionCompletion
+from uscope.motion.hal import MockHal
+from uscope.motion.thread import MotionThreadMotion
+
+
+class CompletionHal(MockHal):
+    """
+    Records completions like GrblHal
+    """
+    def _move_absolute(self, pos):
+        MockHal._move_absolute(self, pos)
+        completion = MotionCompletion(velocity_fraction=0.0)
+        completion.set_idle()
+        self.completions.append(completion)
+
+
+class MotionThreadStub:
+    """
+    Runs commands inline instead of on a MotionThread
+    """
+    def __init__(self, motion, microscope):
+        self.motion = motion
+        self.ac = SimpleNamespace(microscope=microscope)
+
+    def move_absolute(self, pos, block=False, options={}):
+        self.motion.move_absolute(pos)
+
+    def pos(self):
+        return self.motion.pos()
+
+
+class KinematicsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.microscope = SimpleNamespace(bc=SimpleNamespace(
+            check_threads=lambda: False))
+        hal = CompletionHal(microscope=self.microscope,
+                            log=lambda *args, **kwargs: None)
+        hal.configure({})
+        self.microscope.motion = MotionThreadMotion(
+            MotionThreadStub(hal, self.microscope))
+        self.kinematics = Kinematics(microscope=self.microscope)
+        self.kinematics.tsettle_motion_adaptive = True
+        self.kinematics.tsettle_motion_adaptive_min = 0.25
+
+    def test_settle_scale(self):
+        # Nothing moved yet: full settle
+        self.assertEqual(self.kinematics.motion_settle_scale(1.0), 1.0)
+        # Through the motion thread wrapper (as in Argus)
+        self.microscope.motion.move_absolute({"x": 0.01})
+        self.assertEqual(len(self.microscope.motion.completions), 1)
+        # Never got up to speed: minimum settle
+        self.assertEqual(self.kinematics.motion_settle_scale(1.0), 0.25)
+        # Long since settled
+        self.microscope.motion.completions[0].tidle = time.time() - 2.0
+        self.assertEqual(self.kinematics.motion_settle_scale(1.0), 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+import unittest
+import pickle
+from uscope import metrics
+from uscope.metrics import Registry
+from uscope.planner.timeline import ScanTimeline
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry(history=2, interval=0.0)
+
+    def lines(self):
+        return self.registry.openmetrics().splitlines()
+
+    def test_counter(self):
+        counter = self.registry.counter("uscope_test_errors", "Errors")
+        counter.inc(error="timeout")
+        counter.inc(2, error="grbl")
+        counter.inc(error="timeout")
+        lines = self.lines()
+        self.assertEqual(lines[0], "# TYPE uscope_test_errors counter")
+        self.assertIn('uscope_test_errors_total{error="timeout"} 2', lines)
+        self.assertIn('uscope_test_errors_total{error="grbl"} 2', lines)
+        self.assertEqual(lines[-1], "# EOF")
+
+    def test_counter_function(self):
+        counter = self.registry.counter("uscope_test_cpu_seconds", "CPU")
+        counter.set_function(lambda: 1.5)
+        self.assertIn("uscope_test_cpu_seconds_total 1.5", self.lines())
+        self.assertEqual(
+            self.registry.getj()["uscope_test_cpu_seconds"], {
+                "type": "counter",
+                "help": "CPU",
+                "values": [{
+                    "labels": {},
+                    "value": 1.5
+                }]
+            })
+        self.assertIsInstance(metrics.process_cpu_seconds, metrics.Counter)
+
+    def test_gauge(self):
+        gauge = self.registry.gauge("uscope_test_info", "Info")
+        gauge.set(1, name='mock "x"\n')
+        self.assertIn('uscope_test_info{name="mock \\"x\\"\\n"} 1',
+                      self.lines())
+
+    def test_histogram(self):
+        histogram = self.registry.histogram("uscope_test_seconds",
+                                            "Latency",
+                                            buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 5.0):
+            histogram.observe(value, stage="capture")
+        lines = self.lines()
+        for line in ('uscope_test_seconds_bucket{stage="capture",le="0.1"} 1',
+                     'uscope_test_seconds_bucket{stage="capture",le="1"} 3',
+                     'uscope_test_seconds_bucket{stage="capture",le="+Inf"} 4',
+                     'uscope_test_seconds_count{stage="capture"} 4',
+                     'uscope_test_seconds_sum{stage="capture"} 6.05'):
+            self.assertIn(line, lines)
+        j = self.registry.getj()["uscope_test_seconds"]["values"][0]
+        self.assertEqual(j["count"], 4)
+        self.assertEqual(j["p50"], 1.0)
+        # Beyond the last bucket: JSON has no inf
+        self.assertIsNone(j["p99"])
+
+    def test_register(self):
+        counter = self.registry.counter("uscope_test_frames", "Frames")
+        self.assertIs(self.registry.counter("uscope_test_frames", "Frames"),
+                      counter)
+        with self.assertRaises(AssertionError):
+            self.registry.gauge("uscope_test_frames", "Frames")
+
+    def test_rolling(self):
+        counter = self.registry.counter("uscope_test_frames", "Frames")
+        for _i in range(3):
+            counter.inc()
+            self.registry.sample()
+        rolling = self.registry.rolling()
+        self.assertEqual(len(rolling), 2)
+        self.assertEqual(
+            rolling[-1]["metrics"]["uscope_test_frames"]["values"][0]["value"],
+            3)
+
+    def test_remotes(self):
+        """
+        Another process' families are merged in with a process label
+        """
+        self.registry.counter("uscope_test_tasks", "Tasks").inc(plugin="a")
+        remote = Registry()
+        remote.counter("uscope_test_tasks", "Tasks").inc(2, plugin="b")
+        remote.gauge("uscope_test_running", "Running").set(1)
+        # Sent over a connection
+        export = pickle.loads(pickle.dumps(remote.export()))
+        lines = self.registry.openmetrics(remotes={
+            "imagep": export
+        }).splitlines()
+        self.assertEqual(lines.count("# TYPE uscope_test_tasks counter"), 1)
+        self.assertIn('uscope_test_tasks_total{plugin="a"} 1', lines)
+        self.assertIn('uscope_test_tasks_total{process="imagep",plugin="b"} 2',
+                      lines)
+        self.assertIn("# TYPE uscope_test_running gauge", lines)
+        self.assertIn('uscope_test_running{process="imagep"} 1', lines)
+        self.assertEqual(lines[-1], "# EOF")
+
+    def test_capture_seconds(self):
+        """
+        Capture latency comes from the scan timeline events
+        """
+
+        def counts():
+            return dict((value["labels"]["stage"], value["count"]) for value in
+                        metrics.getj()["uscope_capture_seconds"]["values"])
+
+        before = counts()
+        timeline = ScanTimeline()
+        timeline.mark("c000_r000", "capture", 1000.0)
+        timeline.mark("c000_r000", "latched", 1000.1)
+        timeline.mark("c000_r000", "processed", 1000.3)
+        timeline.mark("c001_r000", "capture", 1001.0)
+        timeline.mark("c001_r000", "processed", 1001.2)
+        after = counts()
+        for stage in ("latch", "process", "capture"):
+            self.assertEqual(after[stage] - before.get(stage, 0), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
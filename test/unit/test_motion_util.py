@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+import unittest
+from uscope.motion.motion_util import trapezoid_time, trapezoid_distance, trapezoid_time_at, estimate_move
+
+# mm / min, mm / sec2
+VELOCITIES = {"x": 600.0, "y": 1200.0}
+ACCELERATIONS = {"x": 100.0, "y": 100.0}
+
+
+class TrapezoidTestCase(unittest.TestCase):
+    def test_time(self):
+        # 10 mm / sec, 100 mm / sec2: full speed after 0.5 mm
+        self.assertEqual(trapezoid_time(0.0, 10.0, 100.0), 0.0)
+        # Triangular: 0.5 mm up, 0.5 mm down
+        self.assertAlmostEqual(trapezoid_time(1.0, 10.0, 100.0), 0.2)
+        self.assertAlmostEqual(trapezoid_time(-1.0, 10.0, 100.0), 0.2)
+        # 1.0 mm ramping + 9 mm at 10 mm / sec
+        self.assertAlmostEqual(trapezoid_time(10.0, 10.0, 100.0), 1.1)
+
+    def test_distance(self):
+        for distance in (0.5, 1.0, 10.0):
+            total = trapezoid_time(distance, 10.0, 100.0)
+            self.assertEqual(trapezoid_distance(-1.0, distance, 10.0, 100.0),
+                             0.0)
+            self.assertEqual(
+                trapezoid_distance(total + 1.0, distance, 10.0, 100.0),
+                distance)
+            # Symmetric profile
+            self.assertAlmostEqual(
+                trapezoid_distance(total / 2, distance, 10.0, 100.0),
+                distance / 2)
+            # Inverse
+            for fraction in (0.01, 0.25, 0.5, 0.75, 0.99):
+                t = trapezoid_time_at(distance * fraction, distance, 10.0,
+                                      100.0)
+                self.assertAlmostEqual(
+                    trapezoid_distance(t, distance, 10.0, 100.0),
+                    distance * fraction)
+
+
+class EstimateMoveTestCase(unittest.TestCase):
+    def test_no_move(self):
+        self.assertEqual(
+            estimate_move({"x": 1.0}, {"x": 1.0}, VELOCITIES, ACCELERATIONS),
+            (0.0, 0.0))
+
+    def test_single_axis(self):
+        seconds, fraction = estimate_move({"x": 0.0}, {"x": 10.0}, VELOCITIES,
+                                          ACCELERATIONS)
+        self.assertAlmostEqual(seconds, trapezoid_time(10.0, 10.0, 100.0))
+        self.assertEqual(fraction, 1.0)
+        # Never reaches full speed
+        seconds, fraction = estimate_move({"x": 0.0}, {"x": 0.1}, VELOCITIES,
+                                          ACCELERATIONS)
+        self.assertAlmostEqual(seconds, trapezoid_time(0.1, 10.0, 100.0))
+        self.assertAlmostEqual(fraction, 0.1**0.5)
+
+    def test_coordinated(self):
+        # 5 mm path, x 3/5 and y 4/5 of it
+        src = {"x": 0.0, "y": 0.0}
+        dst = {"x": 3.0, "y": 4.0}
+        seconds, fraction = estimate_move(src, dst, VELOCITIES, ACCELERATIONS)
+        # Path speed limited by x: 10 / 0.6 mm / sec
+        # Path acceleration limited by y: 100 / 0.8 mm / sec2
+        self.assertAlmostEqual(seconds,
+                               trapezoid_time(5.0, 10.0 / 0.6, 100.0 / 0.8))
+        self.assertEqual(fraction, 1.0)
+
+    def test_feed(self):
+        seconds, _fraction = estimate_move({"x": 0.0}, {"x": 10.0},
+                                           VELOCITIES,
+                                           ACCELERATIONS,
+                                           feed=60.0)
+        self.assertAlmostEqual(seconds, trapezoid_time(10.0, 1.0, 100.0))
+        # Can't go faster than the axis allows
+        seconds, _fraction = estimate_move({"x": 0.0}, {"x": 10.0},
+                                           VELOCITIES,
+                                           ACCELERATIONS,
+                                           feed=6000.0)
+        self.assertAlmostEqual(seconds, trapezoid_time(10.0, 10.0, 100.0))
+
+
+if __name__ == "__main__":
+    unittest.main()
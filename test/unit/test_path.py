@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+import unittest
+from uscope.motion.motion_util import trapezoid_time
+from uscope.planner.path import MotionModel, XYPattern, raster_order, nearest_order, estimate, simulate, best_order
+
+
+def grid(cols, rows):
+    return set((col, row) for col in range(cols) for row in range(rows))
+
+
+def calc_pos(col, row):
+    return {"x": col * 1.0, "y": row * 1.0}
+
+
+# 10 mm / sec, 100 mm / sec2
+VELOCITIES = {"x": 600.0, "y": 600.0}
+ACCELERATIONS = {"x": 100.0, "y": 100.0}
+
+
+class PathTestCase(unittest.TestCase):
+    def model(self, **kwargs):
+        return MotionModel(velocities=VELOCITIES,
+                           accelerations=ACCELERATIONS,
+                           **kwargs)
+
+    def test_raster_rows(self):
+        tiles = grid(3, 2)
+        expected = [(0, 0), (1, 0), (2, 0), (2, 1), (1, 1), (0, 1)]
+        self.assertEqual(raster_order(tiles, 3, 2, "x-:x+"), expected)
+        self.assertEqual(
+            raster_order(tiles, 3, 2, XYPattern.XM_XP, serpentine=False),
+            [(0, 0), (1, 0), (2, 0), (0, 1), (1, 1), (2, 1)])
+        expected = [(2, 0), (1, 0), (0, 0), (0, 1), (1, 1), (2, 1)]
+        self.assertEqual(raster_order(tiles, 3, 2, "x+:x-"), expected)
+
+    def test_raster_cols(self):
+        tiles = grid(2, 3)
+        expected = [(0, 0), (0, 1), (0, 2), (1, 2), (1, 1), (1, 0)]
+        self.assertEqual(raster_order(tiles, 2, 3, "y-:y+"), expected)
+        expected = [(0, 2), (0, 1), (0, 0), (1, 0), (1, 1), (1, 2)]
+        self.assertEqual(raster_order(tiles, 2, 3, "y+:y-"), expected)
+
+    def test_raster_exclusions(self):
+        # Row 1 excluded: serpentine still alternates between rows 0 and 2
+        tiles = grid(2, 3) - set([(0, 1), (1, 1)])
+        expected = [(0, 0), (1, 0), (1, 2), (0, 2)]
+        self.assertEqual(raster_order(tiles, 2, 3, "x-:x+"), expected)
+
+    def test_move_time(self):
+        model = self.model()
+        # Coordinated: slowest axis sets the time
+        self.assertAlmostEqual(model.move_time(calc_pos(0, 0), calc_pos(3, 1)),
+                               trapezoid_time(3.0, 10.0, 100.0))
+        # Unknown axes are ignored
+        self.assertEqual(model.move_time({"x": 0.0}, {"z": 1.0}), 0.0)
+
+    def test_move_time_backlash(self):
+        model = self.model(backlash={"x": 0.1}, compensation={"x": 1})
+        src = {"x": 1.0}
+        # With compensation direction: plain move
+        self.assertAlmostEqual(model.move_time(src, {"x": 2.0}),
+                               trapezoid_time(1.0, 10.0, 100.0))
+        # Against: overshoot then come back
+        self.assertAlmostEqual(
+            model.move_time(src, {"x": 0.0}),
+            trapezoid_time(1.1, 10.0, 100.0) +
+            trapezoid_time(0.1, 10.0, 100.0))
+
+    def test_estimate(self):
+        model = self.model(tsettle=0.5)
+        positions = dict((tile, calc_pos(*tile)) for tile in grid(2, 1))
+        order = [(0, 0), (1, 0)]
+        move = trapezoid_time(1.0, 10.0, 100.0)
+        self.assertAlmostEqual(estimate(order, positions, model), 1.0 + move)
+        # Return to start
+        start = calc_pos(0, 0)
+        self.assertAlmostEqual(
+            estimate(order, positions, model, start=start, end=start),
+            1.0 + 2 * move)
+
+    def test_nearest(self):
+        tiles = grid(4, 3) - set([(1, 1), (2, 1)])
+        positions = dict((tile, calc_pos(*tile)) for tile in tiles)
+        order = nearest_order(tiles, positions, self.model(), calc_pos(0, 0))
+        self.assertEqual(order[0], (0, 0))
+        self.assertEqual(sorted(order), sorted(tiles))
+        self.assertEqual(nearest_order(set(), {}, self.model(), None), [])
+
+    def test_best_order(self):
+        model = self.model(tsettle=0.1)
+        # Serpentine along the long axis
+        for cols, rows, expected in ((10, 2, "x-:x+ serpentine"),
+                                     (2, 10, "y-:y+ serpentine")):
+            simulated = simulate(grid(cols, rows), cols, rows, calc_pos, model)
+            self.assertEqual(len(simulated), 9)
+            name, order, seconds = best_order(simulated)
+            self.assertEqual(name, expected)
+            self.assertEqual(len(order), cols * rows)
+            self.assertEqual(
+                seconds,
+                min(seconds for _order, seconds in simulated.values()))
+
+
+if __name__ == "__main__":
+    unittest.main()
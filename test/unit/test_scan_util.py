@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import unittest
+from unittest import mock
+import os
+import shutil
+import tempfile
+import time
+from uscope.scan_util import ScanIndex, IINDEX_SIDECAR
+
+
+class ScanIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="pyuscope_")
+        for basename in ("c000_r000.jpg", "c001_r000.jpg", "c000_r001.jpg",
+                         "c001_r001.jpg"):
+            self.touch(basename)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def touch(self, basename):
+        open(os.path.join(self.dir, basename), "w").close()
+
+    def age_dir(self):
+        """
+        Make the directory look like it was last modified a while ago
+        """
+        ns = time.time_ns() - int(60e9)
+        os.utime(self.dir, ns=(ns, ns))
+
+    def test_iindex(self):
+        iindex = ScanIndex(self.dir).refresh().iindex()
+        self.assertEqual(iindex["cols"], 2)
+        self.assertEqual(iindex["rows"], 2)
+        self.assertTrue(iindex["flat"])
+        self.assertEqual(len(iindex["images"]), 4)
+
+    def test_sidecar_round_trip(self):
+        ScanIndex(self.dir).refresh().save_sidecar()
+        self.assertTrue(os.path.exists(os.path.join(self.dir, IINDEX_SIDECAR)))
+        self.age_dir()
+        index = ScanIndex(self.dir, sidecar=True)
+        # Unchanged directory: served from the sidecar without listing it
+        with mock.patch("uscope.scan_util.os.scandir",
+                        side_effect=AssertionError("listed")):
+            iindex = index.refresh().iindex()
+        self.assertEqual(sorted(iindex["images"].keys()), [
+            "c000_r000.jpg", "c000_r001.jpg", "c001_r000.jpg", "c001_r001.jpg"
+        ])
+
+    def test_sidecar_after_unrelated_write(self):
+        ScanIndex(self.dir).refresh().save_sidecar()
+        # ex: uscan.json written after the images
+        self.touch("uscan.json")
+        index = ScanIndex(self.dir, sidecar=True)
+        # Sidecar entries are kept (not re-parsed) even though the directory changed
+        self.assertEqual(len(index.parsed), 4)
+        parsed = index.parsed["c000_r000.jpg"]
+        iindex = index.refresh().iindex()
+        self.assertEqual(len(iindex["images"]), 4)
+        self.assertIs(index.parsed["c000_r000.jpg"], parsed)
+
+    def test_sidecar_stale(self):
+        ScanIndex(self.dir).refresh().save_sidecar()
+        os.unlink(os.path.join(self.dir, "c001_r001.jpg"))
+        self.touch("c002_r000.jpg")
+        iindex = ScanIndex(self.dir, sidecar=True).refresh().iindex()
+        self.assertNotIn("c001_r001.jpg", iindex["images"])
+        self.assertIn("c002_r000.jpg", iindex["images"])
+        self.assertEqual(iindex["cols"], 3)
+
+    def test_sidecar_corrupt(self):
+        with open(os.path.join(self.dir, IINDEX_SIDECAR), "w") as f:
+            f.write("{")
+        iindex = ScanIndex(self.dir, sidecar=True).refresh().iindex()
+        self.assertEqual(len(iindex["images"]), 4)
+
+    def test_get_lru(self):
+        dirs = [tempfile.mkdtemp(prefix="pyuscope_") for _ in range(4)]
+        try:
+            with mock.patch.object(ScanIndex, "indexes_max", 2):
+                first = ScanIndex.get(dirs[0])
+                ScanIndex.get(dirs[1])
+                # Recently used => kept
+                self.assertIs(ScanIndex.get(dirs[0]), first)
+                ScanIndex.get(dirs[2])
+                ScanIndex.get(dirs[3])
+                self.assertLessEqual(len(ScanIndex.indexes), 2)
+                self.assertNotIn(os.path.realpath(dirs[0]), ScanIndex.indexes)
+                self.assertIn(os.path.realpath(dirs[3]), ScanIndex.indexes)
+        finally:
+            for d in dirs:
+                shutil.rmtree(d)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+
+import unittest
+import os
+import shutil
+import tempfile
+from PIL import Image
+from uscope.scan_util import index_scan_images
+from uscope.imagep.summary import viewer_mosaic, write_html_viewer
+
+
+class ViewerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="pyuscope_")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, basename):
+        Image.new("RGB", (40, 30)).save(os.path.join(self.dir, basename))
+
+    def test_grid_excluded_origin(self):
+        # c000_r000 excluded, no uscan.json
+        for basename in ("c001_r000.jpg", "c000_r001.jpg", "c001_r001.jpg"):
+            self.write(basename)
+        placements, width, height, mode = viewer_mosaic(
+            index_scan_images(self.dir))
+        self.assertEqual((width, height, mode), (80, 60, "RGB"))
+        self.assertEqual(sorted((p["x"], p["y"]) for p in placements),
+                         [(0, 0), (40, 0), (40, 30)])
+
+    def test_empty(self):
+        write_html_viewer(index_scan_images(self.dir))
+        self.assertFalse(os.path.exists(os.path.join(self.dir, "index.html")))
+
+
+if __name__ == "__main__":
+    unittest.main()
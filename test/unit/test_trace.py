@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+import unittest
+from uscope.trace import tracer, NULL_SPAN
+from uscope.planner.timeline import ScanTimeline
+
+
+class TraceTestCase(unittest.TestCase):
+    def tearDown(self):
+        for recorder in tracer.recorders:
+            tracer.stop(recorder)
+
+    def names(self, timeline):
+        return [event[0] for event in timeline.spans]
+
+    def test_disabled(self):
+        timeline = ScanTimeline()
+        self.assertFalse(tracer.enabled)
+        self.assertIs(tracer.span("move", "motion"), NULL_SPAN)
+        tracer.complete("move", "motion", 0.0, 1.0)
+        self.assertEqual(len(timeline.spans), 0)
+
+    def test_nested(self):
+        outer = ScanTimeline()
+        outer.trace_start()
+        with tracer.span("move", "motion"):
+            pass
+        # ex: composite snapshot planner inside a scan
+        inner = ScanTimeline()
+        inner.reset(trace_size=10)
+        inner.trace_start()
+        tracer.complete("capture", "imager", 1.0, 2.0)
+        inner.trace_stop()
+        self.assertTrue(tracer.enabled)
+        tracer.complete("save", "save", 2.0, 3.0)
+        outer.trace_stop()
+        self.assertFalse(tracer.enabled)
+        tracer.complete("save", "save", 3.0, 4.0)
+        self.assertEqual(self.names(outer), ["move", "capture", "save"])
+        self.assertEqual(self.names(inner), ["capture"])
+
+    def test_dropped(self):
+        timeline = ScanTimeline()
+        timeline.reset(trace_size=2)
+        timeline.trace_start()
+        for i in range(5):
+            tracer.complete("move", "motion", i, i + 1)
+        timeline.trace_stop()
+        self.assertEqual(len(timeline.spans), 2)
+        self.assertEqual(timeline.dropped(), 3)
+        self.assertEqual(timeline.chrome_trace()["otherData"]["dropped"], 3)
+
+    def test_tile_spans(self):
+        timeline = ScanTimeline()
+        # Small times keep float errors out of the comparisons
+        t0 = timeline.t0 = 1000.0
+        # Pipelined
+        timeline.mark("c000_r000", "settle", t0 + 0.0)
+        timeline.mark("c000_r000", "settled", t0 + 0.1)
+        timeline.mark("c000_r000", "capture", t0 + 0.1)
+        timeline.mark("c000_r000", "latched", t0 + 0.15)
+        timeline.mark("c000_r000", "processed", t0 + 0.3)
+        timeline.mark("c000_r000", "saved", t0 + 0.4)
+        # Not pipelined: capture ends once processed
+        timeline.mark("c001_r000", "capture", t0 + 0.5)
+        timeline.mark("c001_r000", "processed", t0 + 0.7)
+        spans = dict(((event[0], event[6]["tile"]), event[3])
+                     for event in timeline.tile_spans())
+        self.assertEqual(
+            sorted(spans.keys()),
+            sorted([("settle", "c000_r000"), ("capture", "c000_r000"),
+                    ("process", "c000_r000"), ("save", "c000_r000"),
+                    ("capture", "c001_r000")]))
+        self.assertAlmostEqual(spans[("capture", "c000_r000")], 0.05)
+        self.assertAlmostEqual(spans[("capture", "c001_r000")], 0.2)
+
+        summary = timeline.trace_summary()
+        self.assertEqual(summary["tile/capture"]["count"], 2)
+        self.assertAlmostEqual(summary["tile/capture"]["max"], 0.2)
+
+    def test_chrome_trace(self):
+        timeline = ScanTimeline()
+        # Small times keep float errors out of the comparisons
+        t0 = timeline.t0 = 1000.0
+        timeline.mark("c000_r000", "settle", t0 + 1.0)
+        timeline.mark("c000_r000", "settled", t0 + 1.5)
+        timeline.trace_start()
+        tracer.complete("move", "motion", t0 + 0.25, t0 + 1.0, {"x": 1.0})
+        tracer.instant("frame", "gstreamer", t0 + 2.0)
+        timeline.trace_stop()
+        events = timeline.chrome_trace()["traceEvents"]
+        by_name = dict(
+            (event["name"], event) for event in events if event["ph"] != "M")
+        self.assertEqual(by_name["settle"]["ph"], "X")
+        self.assertEqual(by_name["settle"]["ts"], 1e6)
+        self.assertEqual(by_name["settle"]["dur"], 0.5e6)
+        self.assertEqual(by_name["move"]["ts"], 0.25e6)
+        self.assertEqual(by_name["move"]["args"], {"x": 1.0})
+        self.assertEqual(by_name["frame"]["ph"], "i")
+        thread_names = [
+            event["args"]["name"] for event in events if event["ph"] == "M"
+        ]
+        self.assertIn("tiles: settle", thread_names)
+        self.assertIn("MainThread", thread_names)
+
+
+if __name__ == "__main__":
+    unittest.main()
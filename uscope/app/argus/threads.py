@@ -3,12 +3,14 @@ from uscope.planner.planner import PlannerStop
 from uscope.benchmark import Benchmark
 from uscope import cloud_stitch
 from uscope.imagep.thread import ImageProcessingThreadBase
+from uscope.imagep.daemon import ImagepClient
 from uscope.planner.thread import PlannerThreadBase
 from uscope.motion.thread import MotionThreadBase
 from uscope.joystick_thread import JoystickThreadBase
 from uscope.imager.thread import ImagerControlThreadBase
 from uscope.threads import CommandThreadBase, ShutdownPhase
 from uscope.microscope import MicroscopeStop
+from uscope import metrics
 from PyQt5.QtCore import QThread, pyqtSignal
 import traceback
 import time
@@ -60,10 +62,19 @@ class StitcherThread(CommandThreadBase, ArgusThread):
             "imagep": self._imagep,
             "cli": self._cli,
         }
+        # Persistent image processing service, started on first use
+        self.imagep_client = None
 
     def log(self, msg):
         self.log_msg.emit(msg)
 
+    def shutdown_request(self, phase):
+        super().shutdown_request(phase)
+        # Only stop a daemon we started (ex: not one cs_auto is using)
+        client = self.imagep_client
+        if phase == ShutdownPhase.FINAL and client and client.popen:
+            client.shutdown()
+
     # Offload uploads etc to thread since they might take a while
     def cloud_stitch_add(
         self,
@@ -107,7 +118,12 @@ class StitcherThread(CommandThreadBase, ArgusThread):
         self.log(f"Stitch CLI: finished job")
         print(f"Stitch CLI: finished job")
 
-    def imagep_add(self, directory, cs_info=None, ippj={}, block=False):
+    def imagep_add(self,
+                   directory,
+                   cs_info=None,
+                   ippj={},
+                   image_stream=None,
+                   block=False):
         j = {
             #"type": "imagep",
             "directory": directory,
@@ -115,6 +131,8 @@ class StitcherThread(CommandThreadBase, ArgusThread):
         }
         if cs_info is not None:
             j["cs_info"] = cs_info
+        if image_stream is not None:
+            j["image_stream"] = image_stream
         self.command("imagep", j, block=block)
 
     def process_run(self, args, variant, directory_comment):
@@ -143,6 +161,26 @@ class StitcherThread(CommandThreadBase, ArgusThread):
         print(msg)
         return return_code == 0
 
+    def daemon_run(self, j, cs_info, ipp):
+        directory = j["directory"]
+        print(f"Process scan (daemon): starting {directory}")
+        if self.imagep_client is None:
+            self.imagep_client = ImagepClient()
+        try:
+            ret = self.imagep_client.process_dir(directory,
+                                                 cs_info=cs_info,
+                                                 configj=ipp)
+        except Exception as e:
+            # Ex: EOFError if it crashed. Next job starts a new one
+            ret = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        if ret["ok"]:
+            msg = "Process scan (daemon): ok (%0.1f sec)" % (ret["time"], )
+        else:
+            msg = f"Process scan (daemon): error ({ret['error']})"
+            self.log(msg)
+        print(msg)
+        return ret["ok"]
+
     def _imagep_run(self, j):
         # Taking too much CPU
         # For now let's kick off to own process
@@ -161,6 +199,12 @@ class StitcherThread(CommandThreadBase, ArgusThread):
         if not quiet:
             self.log(f"Process scan: starting {j['directory']}")
 
+        # Scan was processed while it was running
+        # Let that finish before picking up where it left off
+        image_stream = j.get("image_stream")
+        if image_stream is not None:
+            image_stream.wait_processed()
+
         # 2024-03-13: these are doing more harm than good as image processing got more complicated
         '''
         if not cs_auto_cli and not simple_cli:
@@ -174,7 +218,9 @@ class StitcherThread(CommandThreadBase, ArgusThread):
 
         # Run this first in case user wants it to pre-process a scan
         # Originally this only did cloud stitching but now has some other stuff
-        if cs_auto_cli:
+        if cs_auto_cli and self.microscope.bc.argus_imagep_daemon():
+            ok = ok and self.daemon_run(j, cs_info, ipp)
+        elif cs_auto_cli:
             args = [
                 cs_auto_cli,
             ]
@@ -464,7 +510,8 @@ class Profiler:
             "argus": {
                 "process": self.process_info(),
             },
-            "statistics": self.microscope.statistics.getj()
+            "statistics": self.microscope.statistics.getj(),
+            "metrics": metrics.getj(),
         }
         self.logj(j)
         self.time_last = time.time()
@@ -617,6 +664,8 @@ class QTaskThread(CommandThreadBase, ArgusThread):
             self.ac.motion_thread.log_info(block=True)
 
     def loop_poll(self):
+        # Rolling history for /get/metrics
+        metrics.sample()
         if self.profiler:
             j = self.profiler.poll()
             if j is not None:
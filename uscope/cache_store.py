@@ -0,0 +1,154 @@
+"""
+Persistent GUI configuration cache (ex: argus.j5)
+
+The GUI collects its state every few seconds
+Rewriting the whole file each time stalls the GUI thread and wears out SD cards
+Instead:
+-Each top level key is compared to what was last saved and only changed keys are re-serialized
+-Nothing is written unless a key changed
+-Writes are coalesced and done from a background thread
+-The file is swapped in atomically (temp file, fsync, rename) as compact JSON
+"""
+
+import copy
+import json
+import json5
+import os
+import threading
+import time
+
+
+def dumps_compact(j):
+    return json.dumps(j, sort_keys=True, separators=(",", ":"))
+
+
+class CacheStore:
+    def __init__(self, fn, delay=1.0, log=None):
+        if log is None:
+
+            def log(s=""):
+                print(s)
+
+        self.log = log
+        self.fn = fn
+        # Coalesce writes within this many seconds
+        self.delay = delay
+        # top level key => (value, compact JSON) as last queued for writing
+        self.saved = {}
+        # File contents not yet written
+        self.pending = None
+        self.tpending = None
+        self.writes = 0
+        self.cv = threading.Condition()
+        # Serialize writer thread vs flush()
+        self.write_lock = threading.Lock()
+        self.running = True
+        self.thread = threading.Thread(target=self.run,
+                                       name="cache-store",
+                                       daemon=True)
+        self.thread.start()
+
+    def load(self):
+        """
+        Return the cached JSON, {} if missing or corrupt
+        Whatever is loaded counts as already saved
+        """
+        cachej = {}
+        if os.path.exists(self.fn):
+            try:
+                with open(self.fn, "r") as f:
+                    cachej = json5.load(f)
+            except Exception as e:
+                self.log(f"Invalid configuration cache. Ignoring {e}")
+                cachej = {}
+        self.saved = dict([(k, (copy.deepcopy(v), dumps_compact(v)))
+                           for k, v in cachej.items()])
+        return cachej
+
+    def update(self, cachej):
+        """
+        Queue cachej for writing if anything changed
+        Return the changed top level keys
+        Keys must be strings (as for JSON)
+        """
+        dirty = []
+        saved = {}
+        for k, v in cachej.items():
+            old = self.saved.get(k)
+            # Comparing is much cheaper than serializing
+            if old is not None and old[0] == v:
+                saved[k] = old
+            else:
+                dirty.append(k)
+                saved[k] = (copy.deepcopy(v), dumps_compact(v))
+        dirty += [k for k in self.saved if k not in cachej]
+        if not dirty:
+            return dirty
+        self.saved = saved
+        # Unchanged keys reuse their JSON
+        contents = "{" + ",".join(
+            [json.dumps(k) + ":" + v[1]
+             for k, v in sorted(saved.items())]) + "}"
+        with self.cv:
+            if self.pending is None:
+                self.tpending = time.time()
+            self.pending = contents
+            self.cv.notify()
+        return dirty
+
+    def write(self, contents):
+        # file getting corrupted on save
+        # https://github.com/Labsmore/pyuscope/issues/366
+        # Be absolutely sure we have a good file before replacing the old one
+        fn_tmp = self.fn + ".tmp"
+        with open(fn_tmp, "w") as f:
+            f.write(contents)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(fn_tmp, self.fn)
+        self.writes += 1
+
+    def take_pending(self):
+        with self.cv:
+            contents = self.pending
+            self.pending = None
+            self.tpending = None
+            return contents
+
+    def run(self):
+        while True:
+            with self.cv:
+                while self.running and self.pending is None:
+                    self.cv.wait()
+                if not self.running:
+                    return
+                # Let a burst of changes land in one write
+                wait = self.tpending + self.delay - time.time()
+                if wait > 0:
+                    self.cv.wait(wait)
+                    continue
+            with self.write_lock:
+                contents = self.take_pending()
+                if contents is None:
+                    continue
+                try:
+                    self.write(contents)
+                except Exception as e:
+                    self.log(
+                        f"WARNING: failed to save configuration cache: {e}")
+
+    def flush(self):
+        """
+        Write anything pending now, from the calling thread
+        """
+        with self.write_lock:
+            contents = self.take_pending()
+            if contents is not None:
+                self.write(contents)
+
+    def close(self):
+        with self.cv:
+            self.running = False
+            self.cv.notify()
+        self.thread.join()
+        self.flush()
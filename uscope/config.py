@@ -267,6 +267,26 @@ class USCImager:
         """
         return self.j.get("save_quality", 95)
 
+    def save_threads(self):
+        """
+        Planner: encode / write images in this many background threads
+        0 => save in the planner thread
+        """
+        return int(self.j.get("save_threads", 2))
+
+    def save_queue_size(self):
+        """
+        Planner: max images waiting to be written before the scan blocks
+        """
+        return int(self.j.get("save_queue_size", 4))
+
+    def pipelined_capture(self):
+        """
+        Planner: move to the next tile once the raw frame is latched
+        Processing + saving continue in the background
+        """
+        return bool(self.j.get("pipelined_capture", False))
+
     def ff_cal_fn(self):
         return os.path.join(self.microscope.usc.get_microscope_data_dir(),
                             "imager_calibration_ff.tif")
@@ -560,6 +580,14 @@ class USCMotion:
     def use_wcs_offsets(self):
         return bool(self.j.get("use_wcs_offsets", 0))
 
+    def status_max_age(self):
+        """
+        GRBL: reuse a status report (position, state) up to this many seconds old
+        Anything sent to the controller since invalidates it regardless
+        0 => always query
+        """
+        return float(self.j.get("status_max_age", 0.1))
+
     def limit_switches(self):
         """
         Used to be extra careful to avoid homing systems without limit switches
@@ -666,6 +694,21 @@ class USCKinematics:
         # Set a semi-reasonable default
         return float(self.j.get("tsettle_hdr", 0.2))
 
+    def tsettle_motion_adaptive(self):
+        """
+        Scale motion / autofocus settle time by how fast recent moves got
+        A short move (ex: z stack step) that never gets up to speed
+        has much less vibration to ring down
+        Requires a motion HAL that tracks move completion (ex: GRBL)
+        """
+        return bool(self.j.get("tsettle_motion_adaptive", False))
+
+    def tsettle_motion_adaptive_min(self):
+        """
+        Fraction of the settle time kept for even the smallest moves
+        """
+        return float(self.j.get("tsettle_motion_adaptive_min", 0.25))
+
     def hdr_closed_loop(self):
         """
         Wait for property to read back before snapping image?
@@ -678,6 +721,60 @@ class USCKinematics:
         return bool(self.j.get("frame_sync", True))
 
 
+class USCAutofocus:
+    def __init__(self, j={}, microscope=None):
+        """
+        j: usj["autofocus"]
+        """
+        self.j = j
+        self.microscope = microscope
+
+    def method(self):
+        """
+        sweep (default): fixed coarse then fine pass of +/- 3 steps each
+        climb: hill climb each pass, stopping once past the peak
+            Fewer frames but noise can stop it early
+        continuous: one z move streaming frames, placed in z by timestamp
+        """
+        ret = self.j.get("method", "sweep")
+        assert ret in ("sweep", "climb", "continuous"), ret
+        return ret
+
+    def max_steps(self):
+        """
+        climb: furthest steps searched either side of the start position
+        """
+        return int(self.j.get("max_steps", 6))
+
+    def patience(self):
+        """
+        climb: frames worse than the best before giving up on a direction
+        1 is fastest but noise can stop it early
+        """
+        return int(self.j.get("patience", 1))
+
+    def frame_period(self):
+        """
+        continuous: seconds between streamed camera frames
+        """
+        return float(self.j.get("frame_period", 0.1))
+
+    def latency(self):
+        """
+        continuous: seconds from end of exposure until the frame reaches pyuscope
+        """
+        return float(self.j.get("latency", 0.0))
+
+    def exposure(self):
+        """
+        continuous: seconds. Default: ask the imager
+        """
+        ret = self.j.get("exposure", None)
+        if ret is not None:
+            ret = float(ret)
+        return ret
+
+
 class USCOptics:
     def __init__(self, j=None, microscope=None):
         self.j = j
@@ -737,6 +834,14 @@ class USCImageProcessingPipeline:
         """
         return self.j.get("snapshot_correction", [])
 
+    def stack_plugin(self):
+        """
+        Focus stacking engine
+        stack-enfuse: enfuse / align_image_stack CLI tools
+        stack-native: in process NumPy / OpenCV
+        """
+        return self.j.get("stack_plugin", "stack-enfuse")
+
     # plugin specific options
     def get_plugin(self, name):
         return self.j.get("plugins", {}).get(name, {})
@@ -851,6 +956,8 @@ class USC:
                                   microscope=self.microscope)
         self.kinematics = USCKinematics(self.usj.get("kinematics", {}),
                                         microscope=self.microscope)
+        self.autofocus = USCAutofocus(self.usj.get("autofocus", {}),
+                                      microscope=self.microscope)
         self.optics = USCOptics(self.usj.get("optics", {}),
                                 microscope=self.microscope)
         self.ipp = USCImageProcessingPipeline(self.usj.get("ipp", {}),
@@ -1083,6 +1190,15 @@ class PCImager:
     def save_quality(self, *args, **kwargs):
         return USCImager.save_quality(self, *args, **kwargs)
 
+    def save_threads(self, *args, **kwargs):
+        return USCImager.save_threads(self, *args, **kwargs)
+
+    def save_queue_size(self, *args, **kwargs):
+        return USCImager.save_queue_size(self, *args, **kwargs)
+
+    def pipelined_capture(self, *args, **kwargs):
+        return USCImager.pipelined_capture(self, *args, **kwargs)
+
 
 class PCMotion:
     def __init__(self, j=None):
@@ -1117,6 +1233,101 @@ class PCKinematics:
         return self.j.get("tsettle_hdr", 0.0)
 
 
+class PCFlyScan:
+    def __init__(self, j=None):
+        self.j = j
+
+    def enabled(self):
+        """
+        Capture XY2P tiles while sweeping each row instead of stop and shoot
+        """
+        return bool(self.j.get("enabled", False))
+
+    def exposure(self):
+        """
+        Seconds
+        None => ask the imager
+        """
+        ret = self.j.get("exposure")
+        if ret is None:
+            return None
+        return float(ret)
+
+    def max_blur_pix(self):
+        """
+        Max motion blur during the exposure, in output image pixels
+        """
+        return float(self.j.get("max_blur_pix", 1.0))
+
+    def frame_period(self):
+        """
+        Seconds between frames as streamed by the camera
+        """
+        return float(self.j.get("frame_period", 0.1))
+
+    def latency(self):
+        """
+        Seconds from the end of exposure until the frame reaches the capture sink
+        """
+        return float(self.j.get("latency", 0.0))
+
+    def max_feed(self):
+        """
+        mm / min
+        None => limited by the XY max velocity
+        """
+        ret = self.j.get("max_feed")
+        if ret is None:
+            return None
+        return float(ret)
+
+
+class PCFocusMap:
+    def __init__(self, j=None):
+        self.j = j
+
+    def enabled(self):
+        """
+        XY3P: take z from a focus map sampled before the scan
+        instead of the plane through the corners
+        """
+        return bool(self.j.get("enabled", False))
+
+    def grid(self):
+        """
+        Sample points as (columns, rows)
+        """
+        ret = self.j.get("grid", [3, 3])
+        return int(ret[0]), int(ret[1])
+
+    def model(self):
+        return self.j.get("model", "auto")
+
+    def smoothing(self):
+        """
+        thin-plate only: 0 => pass exactly through samples
+        """
+        return float(self.j.get("smoothing", 0.0))
+
+    def z_range(self):
+        """
+        mm to sweep above and below the corner plane at each sample
+        """
+        return float(self.j.get("z_range", 0.010))
+
+    def z_steps(self):
+        """
+        Steps each side of the corner plane
+        """
+        return int(self.j.get("z_steps", 3))
+
+    def online(self):
+        """
+        Refine the map from focus stacks as the scan runs (requires stacker-drift)
+        """
+        return bool(self.j.get("online", False))
+
+
 """
 Planner configuration
 """
@@ -1128,6 +1339,9 @@ class PC:
         self.imager = PCImager(self.j.get("imager"))
         self.motion = PCMotion(self.j.get("motion", {}))
         self.kinematics = PCKinematics(self.j.get("kinematics", {}))
+        self.fly_scan = PCFlyScan(self.j.get("fly-scan", {}))
+        self.focus_map = PCFocusMap(
+            self.j.get("points-xy3p", {}).get("focus-map", {}))
         self.apps = {}
 
     def exclude(self):
@@ -1337,6 +1551,22 @@ class BaseConfig:
         """
         return self.j.get("argus_cs_auto", "./utils/cs_auto.py")
 
+    def argus_imagep_daemon(self):
+        """
+        Process scans / composite snapshots in a persistent image processing
+        service (uscope/imagep/daemon.py) instead of running cs_auto each time
+        Default: on unless a custom argus_cs_auto is set
+        """
+        return bool(
+            self.j.get("argus_imagep_daemon", "argus_cs_auto" not in self.j))
+
+    def composite_in_memory(self):
+        """
+        Process composite snapshots (HDR, stack, stabilization) in memory
+        Otherwise frames are saved to a temporary scan directory and processed like a scan
+        """
+        return bool(self.j.get("composite_in_memory", True))
+
     def dev_mode(self):
         """
         Display unsightly extra information
@@ -1434,9 +1664,35 @@ class BaseConfig:
         """
         return bool(self.j.get("profile", False))
 
+    def trace(self):
+        """
+        Record a scan timeline (see uscope/trace.py)
+        Written as trace.json next to uscan.json
+        """
+        if os.getenv("PYUSCOPE_TRACE"):
+            return os.getenv("PYUSCOPE_TRACE") == "Y"
+        return bool(self.j.get("trace", False))
+
+    def trace_buffer(self):
+        """
+        Max events kept per scan. Oldest are dropped first
+        """
+        return int(self.j.get("trace_buffer", 200000))
+
     def qr_regex(self):
         return self.j.get("qr_regex", None)
 
+    def imagep_backend(self):
+        """
+        How CSImageProcessor runs image processing plugins
+        thread: worker threads in this process (default)
+        process: worker processes with warm plugins, avoids GIL contention
+        """
+        env = os.getenv("PYUSCOPE_IMAGEP_BACKEND")
+        if env:
+            return env
+        return self.j.get("imagep_backend", "thread")
+
     def instruments(self):
         return self.j.get("instruments", {})
 
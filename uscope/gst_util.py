@@ -1,7 +1,11 @@
 import os
 import threading
+import time
 import traceback
 from uscope.imager.image_sequence import CapturedImage
+from uscope.imager.frame_pool import FramePool
+from uscope.trace import tracer
+from uscope import metrics
 
 import gi
 
@@ -57,7 +61,7 @@ class CbSink(GstBase.BaseSink):
         assert result
 
         try:
-            # type: bytes
+            # Only valid until unmap
             if self.cb:
                 self.cb(mapinfo.data)
         finally:
@@ -88,6 +92,8 @@ class CaptureSink(CbSink):
         self.source_type = source_type
         self.verbose = False
         self.meta = None
+        # Raw frames + decoded RGB frames
+        self.frame_pool = FramePool()
 
     def request_image(self, cb, meta=None):
         '''
@@ -115,10 +121,12 @@ class CaptureSink(CbSink):
         image_dict = self.images_actual[image_id]
         del self.images_actual[image_id]
         #self.verbose and print("bytes", len(buf), 'w', width, 'h', height)
+        image_dict["frame_pool"] = self.frame_pool
         return CapturedImage(
-            image=self.ac.vidpip.imager_aplugin.gst_decode_image(image_dict),
+            array=self.ac.vidpip.imager_aplugin.gst_decode_image(image_dict),
             meta=image_dict["meta"],
-            microscope=self.ac.microscope)
+            microscope=self.ac.microscope,
+            tcapture=image_dict["tcapture"])
 
     '''
     gstreamer plugin core methods
@@ -134,7 +142,10 @@ class CaptureSink(CbSink):
             In either case the GUI should listen to all events and clear out the ones it doesn't want
             '''
             # print('Got image')
+            metrics.gstreamer_frames.inc()
             if self.image_requested.is_set():
+                # Before the copy: closest to when the frame arrived
+                tcapture = time.time()
                 self.verbose and print('Processing image request')
                 # Does this need to be locked?
                 # Copy buffer so that even as object is reused we don't lose it
@@ -151,12 +162,15 @@ class CaptureSink(CbSink):
                     assert 0, "FIXME"
                 """
 
+                # Mapping goes away after return => one copy into a pooled frame
                 self.images_actual[self.next_image_id] = {
-                    "bytes": bytearray(buffer),
+                    "bytes": self.frame_pool.copy(buffer),
                     "width": self.width,
                     "height": self.height,
-                    "meta": self.meta
+                    "meta": self.meta,
+                    "tcapture": tcapture,
                 }
+                tracer.complete("frame", "gstreamer", tcapture)
                 #                                          "source_type": self.source_type}
                 # Clear before emitting signal so that it can be re-requested in response
                 self.image_requested.clear()
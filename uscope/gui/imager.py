@@ -10,12 +10,15 @@ from uscope.imager.imager import Imager, MockImager
 from uscope.util import LogTimer
 from uscope.planner.planner_util import get_planner, microscope_to_planner_config
 from uscope.imager.image_sequence import CapturedImage
+from uscope import metrics
 
 from PyQt5 import Qt
 from PyQt5.QtGui import *
 from PyQt5.QtCore import *
 from PyQt5.QtWidgets import *
 
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import threading
 import time
 import traceback
@@ -73,12 +76,16 @@ class GstGUIImager(Imager):
 
         self.image_id = None
         self.image_ready.clear()
+        trequest = time.time()
         self.ac.capture_sink.request_image(got_image)
         # self.ac.emit_log('Waiting for next image...')
         if not self.image_ready.wait(timeout=timeout):
+            metrics.frames_dropped.inc()
             raise ImageTimeout(
                 "Failed to get raw image within timeout %0.1f sec" %
                 (timeout, ))
+        metrics.frames_captured.inc()
+        metrics.frame_wait_seconds.observe(time.time() - trequest)
         # self.ac.emit_log('Got image %s' % self.image_id)
         capim = self.ac.capture_sink.pop_captured_image(self.image_id)
         # best estimate for now
@@ -116,6 +123,45 @@ class GstGUIImager(Imager):
                 time.sleep(
                     self.ac.microscope.kinematics.tsettle_video_pipeline * 2)
 
+    def get_processed_async(self,
+                            processing_options={},
+                            recover_errors=True,
+                            snapshot_timeout=None):
+        """
+        Return a Future of the processed image once the raw frame is latched
+        """
+        # Get relatively unprocessed snapshot
+        with LogTimer("get_processed: raw",
+                      variable="PYUSCOPE_PROFILE_TIMAGE"):
+            capim = self.get(timeout=snapshot_timeout,
+                             recover_errors=recover_errors)
+
+        ret = Future()
+        options = {}
+
+        def callback(command, args, ret_e):
+            if isinstance(ret_e, Exception):
+                ret.set_exception(
+                    Exception(f"failed to process image: {ret_e}"))
+            elif ret_e is None:
+                ret.set_exception(Exception("failed to process image"))
+            else:
+                ret_e.meta["objective_config"] = options["objective_config"]
+                ret.set_result(ret_e)
+
+        options["image"] = capim.image
+        options["captured_image"] = capim
+        options["objective_config"] = self.ac.objective_config()
+        options["scale_factor"] = self.ac.usc.imager.scalar()
+        options["scale_expected_wh"] = self.ac.usc.imager.final_wh()
+        if self.ac.usc.imager.videoflip_method():
+            options["videoflip_method"] = self.ac.usc.imager.videoflip_method()
+        options.update(processing_options)
+
+        self.ac.image_processing_thread.process_image(options=options,
+                                                      callback=callback)
+        return ret
+
     def get_processed(self,
                       processing_options={},
                       recover_errors=True,
@@ -127,48 +173,18 @@ class GstGUIImager(Imager):
             )
         with LogTimer("get_processed: net",
                       variable="PYUSCOPE_PROFILE_TIMAGE"):
-            # Get relatively unprocessed snapshot
-            with LogTimer("get_processed: raw",
-                          variable="PYUSCOPE_PROFILE_TIMAGE"):
-                capim = self.get(timeout=snapshot_timeout,
-                                 recover_errors=recover_errors)
-
-            processed = {}
-            ready = threading.Event()
-
-            def callback(command, args, ret_e):
-                if type(ret_e) is Exception:
-                    processed["exception"] = ret_e
-                else:
-                    processed["captured_image"] = ret_e
-                ready.set()
-
-            options = {}
-            options["image"] = capim.image
-            options["captured_image"] = capim
-            options["objective_config"] = self.ac.objective_config()
-            options["scale_factor"] = self.ac.usc.imager.scalar()
-            options["scale_expected_wh"] = self.ac.usc.imager.final_wh()
-            if self.ac.usc.imager.videoflip_method():
-                options[
-                    "videoflip_method"] = self.ac.usc.imager.videoflip_method(
-                    )
-            options.update(processing_options)
-
-            self.ac.image_processing_thread.process_image(options=options,
-                                                          callback=callback)
+            future = self.get_processed_async(
+                processing_options=processing_options,
+                recover_errors=recover_errors,
+                snapshot_timeout=snapshot_timeout)
             with LogTimer("get_processed: waiting",
                           variable="PYUSCOPE_PROFILE_TIMAGE"):
-                if not ready.wait(timeout=processing_timeout):
+                try:
+                    return future.result(timeout=processing_timeout)
+                except FutureTimeoutError:
                     raise ImageTimeout(
                         "Failed to get image within processing timeout %0.1f sec"
                         % (processing_timeout, ))
-            if "exception" in processed:
-                raise Exception(
-                    f"failed to process image: {processed['exception']}")
-            capim = processed["captured_image"]
-            capim.meta["objective_config"] = options["objective_config"]
-            return capim
 
     def get_composite(self, **kwargs):
         return self.composite_grabber.get_composite(**kwargs)
@@ -183,6 +199,11 @@ class GstGUIImager(Imager):
         else:
             assert 0, f"bad mode {mode}"
 
+    def get_by_mode_async(self, mode=None, **kwargs):
+        if mode == "processed":
+            return self.get_processed_async(**kwargs)
+        return Imager.get_by_mode_async(self, mode=mode, **kwargs)
+
     def log_planner_header(self, log):
         log("Imager config")
         log("  Image size")
@@ -221,8 +242,6 @@ class GstGUIImager(Imager):
         return self.ac.control_scroll.captured_image_exposure(captured_image)
 
 
-# TODO: consider doing this in memory
-# a bit of a hack to write to filesystem
 class CompositeImageGrabber:
     def __init__(self, ac, imager):
         self.ac = ac
@@ -230,7 +249,7 @@ class CompositeImageGrabber:
         # delete on exit
         self.temp_dirs = []
 
-    # FIXME: timeouts aren't being respected
+    # FIXME: snapshot_timeout isn't being respected
     def get_composite(self,
                       processing_options={},
                       recover_errors=True,
@@ -283,6 +302,53 @@ class CompositeImageGrabber:
         if save_filename:
             self.ac.microscope.log(f"Composite snapshot: requested w/ {modes}")
 
+        if self.ac.bc.composite_in_memory():
+            capim = self.get_composite_memory(
+                pconfig, processing_timeout=processing_timeout)
+        else:
+            capim = self.get_composite_dir(pconfig,
+                                           verbose=bool(save_filename))
+        # Now save it and/or return it
+        # Only the final image is encoded
+        if save_filename is not None:
+            capim.save(save_filename)
+            capim.set_meta_kv("save_filename", save_filename)
+            # self.ac.microscope.log(f"Composite snapshot: saved to {save_filename}")
+        capim.set_meta_kv("objective_config", self.ac.objective_config())
+        return capim
+
+    def get_composite_memory(self, pconfig, processing_timeout=None):
+        """
+        Frames go straight from the planner to the image processing workers
+        """
+        composite = self.ac.image_processing_thread.ip.process_composite(
+            pconfig)
+        if processing_timeout is None:
+            processing_timeout = self.ac.microscope.usc.imager.processing_timeout(
+            )
+        with LogTimer("get_composite: net",
+                      variable="PYUSCOPE_PROFILE_TIMAGE"):
+            try:
+                planner = get_planner(
+                    microscope=self.ac.microscope,
+                    pconfig=pconfig,
+                    out_dir=None,
+                    dry=False,
+                    progress_callback=composite.progress_callback,
+                    save=False)
+                _meta = planner.run()
+                with LogTimer("get_composite: waiting",
+                              variable="PYUSCOPE_PROFILE_TIMAGE"):
+                    return composite.wait(timeout=processing_timeout)
+            finally:
+                # Planner failed: don't leak intermediates
+                composite.close(timeout=processing_timeout)
+
+    # a bit of a hack to write to filesystem
+    def get_composite_dir(self, pconfig, verbose=False):
+        """
+        Process like a scan: save frames to a temporary directory
+        """
         out_dir_temp = tempfile.TemporaryDirectory()
         try:
             # Collect images but running a lightweight planner
@@ -292,7 +358,7 @@ class CompositeImageGrabber:
                                   dry=False)
             _meta = planner.run()
 
-            if save_filename and self.ac.bc.dev_mode():
+            if verbose and self.ac.bc.dev_mode():
                 self.ac.microscope.log("Composite snapshot: processing images")
 
             # Now process them with minimal settings
@@ -314,15 +380,8 @@ class CompositeImageGrabber:
             if len(out_fn) != 1:
                 raise Exception(
                     "Expected exactly one image (image processing failed?)")
-            capim = CapturedImage.load(out_fn)
-            # Now save it and/or return it
-            if save_filename is not None:
-                # XXX: might re-compress things
-                capim.save(save_filename)
-                capim.set_meta_kv("save_filename", save_filename)
-                # self.ac.microscope.log(f"Composite snapshot: saved to {save_filename}")
-            capim.set_meta_kv("objective_config", self.ac.objective_config())
-            return capim
+            # XXX: might re-compress things
+            return CapturedImage.load(out_fn)
         finally:
             if self.ac.microscope.bc.dev_mode():
                 self.temp_dirs.append(out_dir_temp)
@@ -349,6 +408,9 @@ class GstGUIImagerTS(Imager):
     def get_by_mode(self, *args, **kwargs):
         return self.imager.get_by_mode(*args, **kwargs)
 
+    def get_by_mode_async(self, *args, **kwargs):
+        return self.imager.get_by_mode_async(*args, **kwargs)
+
     def _set_properties(self, vals):
         # self.ac.control_scroll.set_disp_properties(vals)
         # self.imager.change_properties.emit(vals)
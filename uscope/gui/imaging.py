@@ -5,6 +5,7 @@ from uscope.gui.widgets import AWidget, ArgusTab
 from uscope.motion import motion_util
 from uscope.benchmark import Benchmark
 from uscope.app.argus.threads import QPlannerThread
+from uscope.imagep.streams import PlannerImageStream
 from uscope.microscope import StopEvent, MicroscopeStop
 from uscope import version as uscope_version
 
@@ -499,6 +500,7 @@ class ObjectiveWidget(AWidget):
             self.objective_name_le.setText(suffix)
         self.obj_config = obj_config
         self.ac.objectiveChanged.emit(self.obj_config)
+        self.cache_changed()
 
     def get_objective_meta_cache(self):
         return self.obj_config
@@ -902,6 +904,7 @@ class XYPlanner2PWidget(PlannerWidget):
             self.ac.usc.motion.format_position("x", pos["x"]))
         self.plan_y0_le.setText(
             self.ac.usc.motion.format_position("y", pos["y"]))
+        self.cache_changed()
 
     def x_view(self):
         # XXX: maybe put better abstraction on this
@@ -922,6 +925,7 @@ class XYPlanner2PWidget(PlannerWidget):
             self.ac.usc.motion.format_position("x", pos["x"]))
         self.plan_y1_le.setText(
             self.ac.usc.motion.format_position("y", pos["y"]))
+        self.cache_changed()
 
     def corner_clicked(self, corner_name):
         pos_cur = self.ac.motion_thread.get_pos_cache()
@@ -931,6 +935,7 @@ class XYPlanner2PWidget(PlannerWidget):
             self.ac.usc.motion.format_position("x", pos_cur["x"]))
         widgets["y_le"].setText(
             self.ac.usc.motion.format_position("y", pos_cur["y"]))
+        self.cache_changed()
 
     def get_corner_widget_pos(self, corner_name):
         widgets = self.corner_widgets[corner_name]
@@ -1156,6 +1161,7 @@ class XYPlanner3PWidget(PlannerWidget):
         if "z" in pos_cur:
             widgets["z_le"].setText(
                 self.ac.usc.motion.format_position("z", pos_cur["z"]))
+        self.cache_changed()
 
     def get_corner_widget_pos(self, corner_name):
         widgets = self.corner_widgets[corner_name]
@@ -1291,6 +1297,13 @@ class ImagingOptionsWindow(QWidget):
                 layout.addWidget(QLabel("Snapshot grid overview?"), row, 1)
                 row += 1
 
+                self.stream_cb = QCheckBox()
+                self.stream_cb.stateChanged.connect(
+                    self.itw.update_imaging_config)
+                layout.addWidget(self.stream_cb, row, 0)
+                layout.addWidget(QLabel("Process during scan?"), row, 1)
+                row += 1
+
                 self.stitch_gb = QGroupBox("Post-processing")
                 self.stitch_gb.setCheckable(True)
                 self.stitch_gb.setLayout(layout)
@@ -1446,6 +1459,10 @@ class ImagingTaskWidget(AWidget):
         last_scan_config = self.current_planner_hconfig
         self.current_planner_hconfig = None
         self.planner_progress_cache = None
+        # In case scan was aborted
+        image_stream = last_scan_config.get("image_stream")
+        if image_stream:
+            image_stream.close()
 
         # Restore defaults between each run
         # Ex: if HDR doesn't clean up simplifies things
@@ -1503,7 +1520,17 @@ class ImagingTaskWidget(AWidget):
                 self.plannerDone({"result": "init_failure"})
                 return
 
+            # Process images as they come in instead of after the scan
+            image_stream = None
+            if not dry and pconfig.get("ipp", {}).get("stream", False):
+                image_stream = PlannerImageStream(pconfig=pconfig,
+                                                  directory=out_dir)
+                self.current_planner_hconfig["image_stream"] = image_stream
+                self.ac.image_processing_thread.process_stream(image_stream)
+
             def emitCncProgress(state):
+                if image_stream:
+                    image_stream.progress_callback(state)
                 self.ac.cncProgress.emit(state)
 
             # not sure if this is the right place to add this
@@ -1769,6 +1796,7 @@ class ImagingTaskWidget(AWidget):
         ippj["write_quick_pano"] = self.iow.quick_stitch_cb.isChecked()
         ippj["write_snapshot_grid"] = self.iow.snapshot_grid_cb.isChecked()
         ippj["keep_intermediates"] = self.iow.keep_intermediate_cb.isChecked()
+        ippj["stream"] = self.iow.stream_cb.isChecked()
 
     def _cache_save(self, cachej):
         cachej["imaging"] = {
@@ -1785,6 +1813,7 @@ class ImagingTaskWidget(AWidget):
             "html": self.iow.html_cb.isChecked(),
             "quick_stitch": self.iow.quick_stitch_cb.isChecked(),
             "snapshot_grid": self.iow.snapshot_grid_cb.isChecked(),
+            "stream": self.iow.stream_cb.isChecked(),
         }
 
     def _cache_load(self, cachej):
@@ -1800,6 +1829,7 @@ class ImagingTaskWidget(AWidget):
         self.iow.html_cb.setChecked(j.get("html", False))
         self.iow.quick_stitch_cb.setChecked(j.get("quick_stitch", False))
         self.iow.snapshot_grid_cb.setChecked(j.get("snapshot_grid", False))
+        self.iow.stream_cb.setChecked(j.get("stream", False))
 
     def update_imaging_config(self):
         self.imaging_config = {
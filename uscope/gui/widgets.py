@@ -7,6 +7,7 @@ from uscope.imager.autofocus import AutoStacker
 from uscope.gui.common import ArgusShutdown
 from uscope.threads import ShutdownPhase
 from uscope.imager.imager_util import format_mm_3dec
+from uscope.cache_store import CacheStore
 
 from PyQt5 import Qt
 from PyQt5.QtGui import *
@@ -32,6 +33,9 @@ class AMainWindow(QMainWindow):
         self.ac = None
         self.shutting_down = False
         self.cachej = {}
+        self.cache_store = None
+        # Something worth saving changed since the last cache_save()
+        self.cache_dirty = False
 
     def __del__(self):
         self.shutdown()
@@ -81,6 +85,8 @@ class AMainWindow(QMainWindow):
             self.fullscreen_widget.close()
 
         self.cache_save()
+        if self.cache_store:
+            self.cache_store.close()
         for phase in (ShutdownPhase.INITIAL, ShutdownPhase.FINAL):
             self._shutdown_request(phase=phase)
             for awidget in self.awidgets.values():
@@ -115,13 +121,28 @@ class AMainWindow(QMainWindow):
             ret["serial"] = self.ac.microscope.serial()
         return ret
 
+    def get_cache_store(self):
+        if self.cache_store is None:
+            # Writer thread logs => needs thread safe log
+            self.cache_store = CacheStore(self.ac.aconfig.cache_fn(),
+                                          log=self.ac.microscope.log)
+        return self.cache_store
+
+    def cache_changed(self):
+        """
+        Save soon instead of waiting for the next periodic save
+        """
+        self.cache_dirty = True
+
     def cache_save(self):
         """
         Called when saving GUI state to file
         Add your state to JSON object j
+        Only changed state is written, from a background thread
         """
         if not self.ac:
             return
+        self.cache_dirty = False
         # Recycle old value
         # otherwise we can loose some config
         # ex: carry over joystick config when not plugged in
@@ -140,18 +161,7 @@ class AMainWindow(QMainWindow):
         for awidget in self.awidgets.values():
             awidget.cache_sn_save(cachej_sn)
 
-        fn = self.ac.aconfig.cache_fn()
-        # file getting corrupted on save
-        # https://github.com/Labsmore/pyuscope/issues/366
-        # Be absolutely sure we have a good file before saving
-        fn_tmp = fn + ".tmp"
-        with open(fn_tmp, "w") as f:
-            json.dump(cachej,
-                      f,
-                      sort_keys=True,
-                      indent=4,
-                      separators=(",", ": "))
-        os.rename(fn_tmp, fn)
+        self.get_cache_store().update(cachej)
 
     def _cache_load(self, cachej):
         pass
@@ -164,14 +174,7 @@ class AMainWindow(QMainWindow):
         Called when loading GUI state from file
         Read your state from JSON object j
         """
-        fn = self.ac.aconfig.cache_fn()
-        cachej = {}
-        if os.path.exists(fn):
-            try:
-                with open(fn, "r") as f:
-                    cachej = json5.load(f)
-            except Exception as e:
-                print("Invalid configuration cache. Ignoring", e)
+        cachej = self.get_cache_store().load()
 
         # Full
         self.ac.microscope.cache_load(cachej)
@@ -213,8 +216,9 @@ class AMainWindow(QMainWindow):
         for awidget in self.awidgets.values():
             awidget.poll_misc()
 
-        # Save ocassionally / once 3 seconds
-        if self.polli % 15 == 0:
+        # Save soon after a change / check once 3 seconds
+        # Unchanged state is not written
+        if self.cache_dirty or self.polli % 15 == 0:
             self.cache_save()
 
     def _update_pconfig(self, pconfig):
@@ -286,6 +290,12 @@ class AWidget(QWidget):
         for awidget in self.awidgets.values():
             awidget.shutdown_join()
 
+    def cache_changed(self):
+        """
+        Call when state saved by cache_save() / cache_sn_save() changes
+        """
+        self.ac.mw.cache_changed()
+
     def _cache_save(self, cachej):
         pass
 
@@ -1052,10 +1062,14 @@ class StitchingTab(ArgusTab):
                 self.log(
                     "ERROR: requested CloudStitch but don't have credentials")
                 return
+        image_stream = None
+        if scan_config is not None:
+            image_stream = scan_config.get("image_stream")
         self.stitcher_thread.imagep_add(
             directory=directory,
             cs_info=cs_info,
             ippj=ippj,
+            image_stream=image_stream,
         )
 
     def get_cs_info(self):
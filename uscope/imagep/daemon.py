@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+"""
+Persistent image processing service
+
+Launching cs_auto per scan / composite snapshot re-imports OpenCV etc,
+re-parses configs and rebuilds a CSImageProcessor every time
+Instead one long lived process keeps them (and calibration data) warm
+It is still a separate, lower priority process so heavy processing can't stall the GUI
+
+Jobs are sent over a local socket (multiprocessing.connection)
+Connections authenticate with a random key the server writes to a user only file
+The first client that can't connect starts the server (one at a time, see start_lock())
+Jobs run one at a time, like the per scan subprocesses did from StitcherThread
+The server exits after idle_timeout seconds without a job
+
+Job (dict):
+-directory: scan directory
+-microscope: microscope name. Default: from uscan.json
+-cs_info: CloudStitch credentials as CSInfo keyword arguments
+-options: other process_dir() keyword arguments (ex: configj, upload, lazy)
+
+Image processing metrics (uscope.metrics) are counted in this process
+Argus merges them into its /metrics and /get/metrics with ImagepClient.metrics()
+"""
+
+from uscope.imagep.pipeline import CSImageProcessor, microscope_name_from_scan_dir
+from uscope.microscope import get_virtual_microscope
+from uscope.cloud_stitch import CSInfo
+from uscope import config
+from uscope import metrics
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from contextlib import contextmanager
+import os
+import psutil
+import secrets
+import subprocess
+import sys
+import threading
+import time
+import traceback
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+
+
+def default_address():
+    if sys.platform == "win32":
+        return r"\\.\pipe\pyuscope-imagep"
+    return os.path.abspath(
+        os.path.join(config.get_bc().get_data_dir(), "imagep.sock"))
+
+
+def default_authkey_fn():
+    return os.path.join(config.get_bc().get_data_dir(), "imagep.key")
+
+
+def write_authkey(fn):
+    """
+    New random key, readable only by this user
+    Connections unpickle requests: don't let anyone else in
+    """
+    key = secrets.token_bytes(32)
+    tmp_fn = fn + ".%u.tmp" % os.getpid()
+    fd = os.open(tmp_fn, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(key.hex())
+    os.replace(tmp_fn, fn)
+    return key
+
+
+def read_authkey(fn):
+    """
+    Raises FileNotFoundError if no server wrote one yet
+    """
+    with open(fn, "r") as f:
+        return bytes.fromhex(f.read().strip())
+
+
+@contextmanager
+def start_lock(fn):
+    """
+    Serialize server autostart between clients
+    """
+    with open(fn, "a") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def cs_info_j(cs_info):
+    if cs_info is None:
+        return None
+    return {
+        "access_key": cs_info.access_key(required=False),
+        "secret_key": cs_info.secret_key(required=False),
+        "id_key": cs_info.id_key(required=False),
+        "notification_email": cs_info.notification_email(required=False),
+    }
+
+
+class ImagepServer:
+    def __init__(self,
+                 address=None,
+                 authkey_fn=None,
+                 nthreads=None,
+                 backend=None,
+                 idle_timeout=3600,
+                 log=None):
+        if log is None:
+
+            def log(s=""):
+                print(s)
+                sys.stdout.flush()
+
+        self.log = log
+        if address is None:
+            address = default_address()
+        self.address = address
+        if authkey_fn is None:
+            authkey_fn = default_authkey_fn()
+        self.authkey_fn = authkey_fn
+        self.authkey = None
+        self.nthreads = nthreads
+        self.backend = backend
+        self.idle_timeout = idle_timeout
+        # (microscope name, serial) => CSImageProcessor
+        self.processors = {}
+        # CSImageProcessor only runs one high level task at a time
+        self.job_lock = threading.Lock()
+        self.tlast = time.time()
+        self.jobs = 0
+        self.running = True
+
+    def get_processor(self, directory, microscope_name=None):
+        mconfig = {}
+        if microscope_name:
+            mconfig["name"] = microscope_name
+        else:
+            microscope_name_from_scan_dir(directory, mconfig)
+        key = (mconfig.get("name"), mconfig.get("serial"))
+        ip = self.processors.get(key)
+        if ip is None:
+            self.log(f"imagep daemon: loading microscope {key[0]}")
+            # Each microscope needs its own config, not the process wide one
+            microscope = get_virtual_microscope(mconfig=mconfig,
+                                                shared_usc=False)
+            ip = CSImageProcessor(nthreads=self.nthreads,
+                                  backend=self.backend,
+                                  microscope=microscope)
+            ip.start()
+            ip.ready.wait(1.0)
+            self.processors[key] = ip
+        return ip
+
+    def process_dir(self, job):
+        with self.job_lock:
+            if not self.running:
+                return {"ok": False, "error": "shutting down", "time": 0.0}
+            tstart = time.time()
+            try:
+                ip = self.get_processor(job["directory"],
+                                        job.get("microscope"))
+                cs_info = None
+                if job.get("cs_info"):
+                    cs_info = CSInfo(**job["cs_info"])
+                ip.process_dir(job["directory"],
+                               cs_info=cs_info,
+                               **job.get("options", {}))
+                ret = {"ok": True}
+            except Exception as e:
+                traceback.print_exc()
+                ret = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            ret["time"] = time.time() - tstart
+            self.jobs += 1
+            self.tlast = time.time()
+            return ret
+
+    def handle(self, conn):
+        try:
+            while True:
+                try:
+                    request = conn.recv()
+                except EOFError:
+                    return
+                command = request.get("command")
+                if command == "process_dir":
+                    conn.send(self.process_dir(request["job"]))
+                elif command == "ping":
+                    conn.send({
+                        "ok": True,
+                        "pid": os.getpid(),
+                        "jobs": self.jobs
+                    })
+                elif command == "metrics":
+                    conn.send({
+                        "ok": True,
+                        "export": metrics.export(),
+                        "current": metrics.getj(),
+                    })
+                elif command == "shutdown":
+                    conn.send({"ok": True})
+                    self.stop()
+                    return
+                else:
+                    conn.send({"ok": False, "error": f"bad command {command}"})
+        finally:
+            conn.close()
+
+    def stop(self):
+        self.running = False
+        # Wake up accept()
+        try:
+            Client(self.address, authkey=self.authkey).close()
+        except (OSError, AuthenticationError):
+            pass
+
+    def watchdog(self):
+        while self.running:
+            time.sleep(min(10.0, self.idle_timeout))
+            idle = time.time() - self.tlast
+            if not self.job_lock.locked() and idle >= self.idle_timeout:
+                self.log("imagep daemon: idle, exiting")
+                self.stop()
+
+    def serve(self):
+        if sys.platform != "win32" and os.path.exists(self.address):
+            # Another server already up?
+            try:
+                Client(self.address,
+                       authkey=read_authkey(self.authkey_fn)).close()
+                self.log("imagep daemon: already running")
+                return
+            except (OSError, AuthenticationError):
+                # Stale from a crash
+                os.unlink(self.address)
+        self.authkey = write_authkey(self.authkey_fn)
+        listener = Listener(self.address, authkey=self.authkey)
+        self.log(f"imagep daemon: listening on {self.address}")
+        if self.idle_timeout:
+            threading.Thread(target=self.watchdog,
+                             name="imagep-watchdog",
+                             daemon=True).start()
+        try:
+            while self.running:
+                try:
+                    conn = listener.accept()
+                except (OSError, AuthenticationError):
+                    continue
+                if not self.running:
+                    conn.close()
+                    break
+                threading.Thread(target=self.handle,
+                                 args=(conn, ),
+                                 name="imagep-client",
+                                 daemon=True).start()
+        finally:
+            listener.close()
+            # Let a running job finish
+            with self.job_lock:
+                for ip in self.processors.values():
+                    ip.shutdown()
+            self.log("imagep daemon: exited after %u jobs" % (self.jobs, ))
+
+
+class ImagepClient:
+    def __init__(self,
+                 address=None,
+                 authkey_fn=None,
+                 autostart=True,
+                 log=None):
+        if log is None:
+
+            def log(s=""):
+                print(s)
+
+        self.log = log
+        if address is None:
+            address = default_address()
+        self.address = address
+        if authkey_fn is None:
+            authkey_fn = default_authkey_fn()
+        self.authkey_fn = authkey_fn
+        self.autostart = autostart
+        # Server this client started, if any
+        self.popen = None
+
+    def start_server(self):
+        args = [
+            sys.executable, "-m", "uscope.imagep.daemon", "--address",
+            self.address, "--authkey-file", self.authkey_fn
+        ]
+        self.log("imagep daemon: starting")
+        # Output goes to our terminal, like the cs_auto subprocess did
+        self.popen = subprocess.Popen(args)
+
+    def client(self):
+        return Client(self.address, authkey=read_authkey(self.authkey_fn))
+
+    def connect(self, timeout=30.0):
+        try:
+            return self.client()
+        except (FileNotFoundError, ConnectionRefusedError):
+            if not self.autostart:
+                raise
+        # Otherwise clients failing at the same time would each start one
+        with start_lock(self.authkey_fn + ".lock"):
+            # Started by another client while we waited?
+            try:
+                return self.client()
+            except (FileNotFoundError, ConnectionRefusedError):
+                pass
+            self.start_server()
+            tstart = time.time()
+            while True:
+                time.sleep(0.1)
+                try:
+                    return self.client()
+                except (FileNotFoundError, ConnectionRefusedError):
+                    if self.popen.poll() is not None:
+                        raise Exception("imagep daemon: failed to start")
+                    if time.time() - tstart > timeout:
+                        raise Exception("imagep daemon: timed out starting")
+
+    def request(self, request, connect=None):
+        if connect is None:
+            connect = self.connect
+        conn = connect()
+        try:
+            conn.send(request)
+            # EOFError => daemon crashed mid job
+            return conn.recv()
+        finally:
+            conn.close()
+
+    def process_dir(self, directory, microscope=None, cs_info=None, **options):
+        """
+        Block until directory is processed
+        Return {"ok": bool, "error": str if not ok, "time": sec}
+        """
+        job = {
+            "directory": os.path.abspath(directory),
+            "microscope": microscope,
+            "cs_info": cs_info_j(cs_info),
+            "options": options,
+        }
+        return self.request({"command": "process_dir", "job": job})
+
+    def ping(self):
+        return self.request({"command": "ping"})
+
+    def metrics(self):
+        """
+        Server's {"export": metrics.export(), "current": metrics.getj()}
+        None if it isn't running. Never starts one
+        """
+        try:
+            conn = self.client()
+        except (OSError, AuthenticationError):
+            return None
+        try:
+            return self.request({"command": "metrics"}, connect=lambda: conn)
+        except (OSError, EOFError):
+            # Exited in between
+            return None
+
+    def shutdown(self):
+        """
+        Ask the server to exit once any running job is done
+        """
+        try:
+            conn = self.client()
+        except (FileNotFoundError, ConnectionRefusedError):
+            return
+        self.request({"command": "shutdown"}, connect=lambda: conn)
+        self.popen = None
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Persistent image processing service")
+    parser.add_argument("--address", default=None)
+    parser.add_argument("--authkey-file",
+                        default=None,
+                        help="Written with a new key on startup")
+    parser.add_argument("--threads", default=None, type=int)
+    parser.add_argument(
+        "--backend",
+        default=None,
+        help="Image processing workers: thread (default) or process")
+    parser.add_argument("--idle-timeout",
+                        default=3600,
+                        type=float,
+                        help="Exit after this many seconds without a job")
+    parser.add_argument("--nice",
+                        default=10,
+                        type=int,
+                        help="Lower priority so the GUI runs smoothly")
+    args = parser.parse_args()
+
+    if args.nice:
+        psutil.Process().nice(args.nice)
+    server = ImagepServer(address=args.address,
+                          authkey_fn=args.authkey_file,
+                          nthreads=args.threads,
+                          backend=args.backend,
+                          idle_timeout=args.idle_timeout)
+    server.serve()
+
+
+if __name__ == "__main__":
+    main()
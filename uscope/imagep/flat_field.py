@@ -0,0 +1,111 @@
+"""
+Flat field (FF) correction engine
+
+A flat field calibration image (imager_calibration_ff.tif) records how much
+light each pixel gets relative to the brightest area
+It is turned into a float32 gain map once (per calibration file / resolution)
+and applied to a whole HxWx3 image in a single saturating multiply
+
+The gain map is cached as .npy next to the calibration file
+such that worker threads / processes don't each rebuild it
+"""
+
+from PIL import Image
+import numpy as np
+import cv2
+import os
+import threading
+
+# Ignore this fraction of outliers on each end of the histogram
+FF_BOUNDS_THRESH = 0.01
+
+# (ff_fn, mtime) => gain map. Shared by all plugin instances in this process
+_gain_maps = {}
+_gain_maps_lock = threading.Lock()
+
+
+def npf2im(statef):
+    """
+    float HxWx3 array => RGB PIL image (rounded, saturated)
+    """
+    statei = np.clip(np.round(statef), 0, 255).astype(np.uint8)
+    return Image.fromarray(statei, "RGB")
+
+
+def bounds_close(ff_np, thresh=FF_BOUNDS_THRESH):
+    """
+    Return ((rmin, rmax), (gmin, gmax), (bmin, bmax))
+    ignoring thresh fraction of pixels on each end
+    """
+    ret = []
+    npixels = ff_np.shape[0] * ff_np.shape[1]
+    for band in range(3):
+        hist = np.bincount(ff_np[:, :, band].ravel(), minlength=256)
+        cdf = np.cumsum(hist) / npixels
+        low = int(np.argmax(cdf >= thresh))
+        high = int(np.argmax(cdf >= (1.0 - thresh)))
+        ret.append((low, high))
+    return tuple(ret)
+
+
+def gain_map_create(ff_np):
+    """
+    Boost dim values by scalars in the range 1.0 to near 0.0
+    The lower the flat field value, the more it needs to be scaled
+    Values at max flat field value stay the same
+    """
+    bounds = bounds_close(ff_np)
+    band_max = np.array([high for _low, high in bounds], dtype=np.float32)
+    # Dead pixels (0) would otherwise divide by zero
+    ff = np.maximum(ff_np, 1).astype(np.float32)
+    return band_max / ff
+
+
+def gain_map_fn(ff_fn):
+    return os.path.splitext(ff_fn)[0] + ".npy"
+
+
+def load_gain_map(ff_fn, cache=True):
+    """
+    Return float32 HxWx3 gain map for given calibration image
+    Uses in process cache, then .npy cache, then builds from the .tif
+    """
+    mtime = os.path.getmtime(ff_fn)
+    key = (ff_fn, mtime)
+    with _gain_maps_lock:
+        gain = _gain_maps.get(key)
+        if gain is not None:
+            return gain
+
+        npy_fn = gain_map_fn(ff_fn)
+        if cache and os.path.exists(npy_fn) and os.path.getmtime(
+                npy_fn) >= mtime:
+            gain = np.load(npy_fn)
+        else:
+            ff_np = np.asarray(Image.open(ff_fn).convert("RGB"))
+            gain = gain_map_create(ff_np)
+            if cache:
+                # Write then rename so a concurrent reader never sees a partial file
+                tmp_fn = npy_fn + ".%u.tmp" % os.getpid()
+                try:
+                    with open(tmp_fn, "wb") as f:
+                        np.save(f, gain)
+                    os.replace(tmp_fn, npy_fn)
+                except OSError:
+                    # Read only calibration dir: just don't cache
+                    if os.path.exists(tmp_fn):
+                        os.unlink(tmp_fn)
+        _gain_maps[key] = gain
+        return gain
+
+
+def apply_gain_map(im_np, gain):
+    """
+    uint8 HxWx3 => corrected uint8 HxWx3
+    Rounds and saturates at 255 in the same pass
+    """
+    if im_np.shape != gain.shape:
+        raise Exception(
+            "Calibration image size %uw x %uh but got image %uw x %uh" %
+            (gain.shape[1], gain.shape[0], im_np.shape[1], im_np.shape[0]))
+    return cv2.multiply(im_np, gain, dtype=cv2.CV_8U)
@@ -14,12 +14,14 @@ They generally take one or more images in and produce a single image out
 """
 
 from uscope.scan_util import index_scan_images
-from uscope.imagep.util import EtherealImageR, EtherealImageW
-from uscope.imagep.streams import DirCSIP, SnapshotCSIP
+from uscope.imagep.util import EtherealImageR, EtherealImageW, PRIORITY_DEFAULT
+from uscope.imagep.streams import DirCSIP, SnapshotCSIP, StreamCSIP, CompositeCSIP
 from uscope.imagep.plugins import get_plugins, get_plugin_ctors
 from uscope import config
 from uscope.microscope import get_virtual_microscope, get_mconfig
 from uscope.threads import ShutdownPhase
+from uscope.trace import tracer
+from uscope import metrics
 
 import os
 import glob
@@ -28,8 +30,13 @@ import shutil
 from collections import OrderedDict
 import traceback
 import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
+import pickle
+import numpy as np
 import threading
 import queue
+import itertools
+import time
 import tempfile
 import json
 
@@ -50,10 +57,47 @@ def already_uploaded(directory):
                          recursive=True)) > 0
 
 
-class CSImageProcessorThread(threading.Thread):
+def run_plugin_task(plugins, ip_params, temp_dir):
     """
-    A single worker thread that can perform a number of low level corrections
+    Run a single plugin or, for task "chain", several plugins back to back
+    Chain intermediate images are passed in memory
+    such that only the final image is encoded
+    unless dump_fns requests a copy of each intermediate (debugging)
+    """
+    if ip_params.task_name != "chain":
+        return plugins[ip_params.task_name].run(data_in=ip_params.data_in,
+                                                data_out=ip_params.data_out,
+                                                options=ip_params.options)
+
+    chain = ip_params.options["chain"]
+    dump_fns = ip_params.options.get("dump_fns")
+    data_in = ip_params.data_in
+    last_out = None
+    for linki, task_name in enumerate(chain):
+        if linki == len(chain) - 1:
+            data_out = ip_params.data_out
+        else:
+            data_out = {
+                "image": EtherealImageW(want_im=True, temp_dir=temp_dir)
+            }
+        plugins[task_name].run(data_in=data_in,
+                               data_out=data_out,
+                               options=ip_params.options)
+        # Previous output has been consumed
+        if last_out:
+            last_out.flush()
+        if linki != len(chain) - 1:
+            last_out = data_out["image"]
+            if dump_fns and dump_fns[linki]:
+                last_out.save(dump_fns[linki])
+            data_in = {"image": last_out.to_image_r()}
+
+
+class CSImageProcessorWorker(threading.Thread):
+    """
+    A single worker that can perform a number of low level corrections
     Intended to be used with CSImageProcessor
+    Subclasses decide where the plugin actually runs
     """
     def __init__(self, csip, name):
         super().__init__()
@@ -61,62 +105,53 @@ class CSImageProcessorThread(threading.Thread):
         self.log = self.csip.log
         self.name = name
         self.running = threading.Event()
-        # Set for single commands
-        self.simple_idle = threading.Event()
-        self.simple_idle.set()
-        self.queue_in = queue.Queue()
-        # self.queue_out = queue.Queue()
-
-        # Each thrread gets its own set of correction engines
-        self.plugins = get_plugins(log=self.log,
-                                   microscope=self.csip.microscope)
         self.running.set()
 
     def stop(self):
         self.running.clear()
 
-    def queue_command(self, ip_params):
-        self.queue_in.put(ip_params)
-
-    """
-    def wait_queue_out(self, command=None, timeout=None):
-        (call_info, result, info) = self.queue_in.get(True, timeout)
-        (name, data_in, data_out, options) = call_info
-        if result != "ok":
-            raise Exception(f"Command {name} failed: {result} {info}")
-        if command:
-            assert name == command
-        return info
-    """
+    def execute(self, ip_params):
+        assert 0, "required"
 
     def run(self):
 
         while self.running.is_set():
-            try:
-                ip_params = self.queue_in.get(True, 0.1)
-            except queue.Empty:
-                continue
+            # Blocks until work is available
+            # All workers pull from the same queue => first free worker takes it
+            ip_params = self.csip.get_task()
+            # Shutdown
+            if ip_params is None:
+                break
+            self.csip.stats.task_start(ip_params)
 
             def finish_command(result, info):
                 out = (ip_params, result, info)
-                # self.queue_out.put(out)
+                self.csip.stats.task_done(ip_params, result)
+                tracer.complete(ip_params.task_name,
+                                "imagep",
+                                ip_params.t_started,
+                                args={"result": result})
                 if ip_params.tb:
                     if result != "ok":
                         ip_params.tb.add_exception()
                     ip_params.tb.callback()
                 if ip_params.callback:
                     ip_params.callback(*out)
-                self.simple_idle.set()
 
-            plugin = self.plugins.get(ip_params.task_name)
-            if plugin is None:
-                self.log(f"Invalid plugin {ip_params.task_name}")
+            if ip_params.task_name == "chain":
+                task_names = ip_params.options["chain"]
+            else:
+                task_names = [ip_params.task_name]
+            invalid = [
+                task_name for task_name in task_names
+                if task_name not in get_plugin_ctors()
+            ]
+            if invalid:
+                self.log(f"Invalid plugin {invalid[0]}")
                 finish_command("error", "invalid command")
                 continue
             try:
-                ret = plugin.run(data_in=ip_params.data_in,
-                                 data_out=ip_params.data_out,
-                                 options=ip_params.options)
+                ret = self.execute(ip_params)
                 # self.log("Command done")
                 finish_command("ok", ret)
             except Exception as e:
@@ -127,6 +162,256 @@ class CSImageProcessorThread(threading.Thread):
                 continue
 
 
+class CSImageProcessorThread(CSImageProcessorWorker):
+    """
+    Runs plugins in this thread
+    Simple but pure Python / NumPy plugins contend for the GIL
+    """
+    def __init__(self, csip, name):
+        super().__init__(csip, name)
+        # Each thrread gets its own set of correction engines
+        self.plugins = get_plugins(log=self.log,
+                                   microscope=self.csip.microscope)
+
+    def execute(self, ip_params):
+        return run_plugin_task(self.plugins, ip_params, self.csip.temp_dir)
+
+
+"""
+Process pool backend
+
+Each CSImageProcessorProcess is a thin thread that forwards tasks
+to a dedicated worker process holding a warm set of plugins
+Filenames are passed as is
+In memory pixel data is passed through shared memory (one copy each way)
+
+Processes are forked such that they inherit the loaded configuration
+and the (virtual) microscope without pickling it
+"""
+
+
+def _shm_put(arr):
+    """
+    Copy array into a new shared memory block
+    Return (shm, descriptor). Caller owns unlinking shm
+    """
+    arr = np.ascontiguousarray(arr)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, arr.nbytes))
+    np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+    return shm, (shm.name, arr.shape, arr.dtype.str)
+
+
+def _shm_get(desc, unlink=False):
+    """
+    Copy array out of shared memory block created by the other side
+    """
+    name, shape, dtype = desc
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+
+
+def _pack_image_r(image, shms):
+    if image.im is None:
+        return {"fn": image.fn, "meta": image.meta}
+    shm, desc = _shm_put(image.to_np())
+    shms.append(shm)
+    return {"shm": desc, "meta": image.meta}
+
+
+def _unpack_image_r(packed, temp_dir):
+    if "fn" in packed:
+        return EtherealImageR(fn=packed["fn"], meta=packed["meta"])
+    return EtherealImageR(im=_shm_get(packed["shm"]),
+                          meta=packed["meta"],
+                          temp_dir=temp_dir)
+
+
+def _pack_options(options):
+    """
+    Options may carry live objects (ex: captured_image) plugins don't use
+    Only forward what can be pickled
+    Return (forwarded options, dropped keys)
+    """
+    ret = {}
+    dropped = []
+    for k, v in options.items():
+        try:
+            pickle.dumps(v)
+        except Exception:
+            dropped.append(k)
+            continue
+        ret[k] = v
+    return ret, dropped
+
+
+def _process_worker_main(name, mconfig, temp_dir, queue_task, queue_result):
+
+    def log(s):
+        print(f"{name}: {s}")
+
+    # Rebuilt from config rather than inheriting the parent's live object
+    microscope = None
+    if mconfig is not None:
+        microscope = get_virtual_microscope(mconfig=mconfig)
+    plugins = get_plugins(log=log, microscope=microscope)
+    while True:
+        task = queue_task.get()
+        # Shutdown
+        if task is None:
+            break
+        task_name, data_in, data_out, options = task
+        try:
+            if "images" in data_in:
+                data_in = {
+                    "images": [
+                        _unpack_image_r(image, temp_dir)
+                        for image in data_in["images"]
+                    ]
+                }
+            elif "image" in data_in:
+                data_in = {
+                    "image": _unpack_image_r(data_in["image"], temp_dir)
+                }
+            # Plugin writes its own output (ex: deep-zoom-band)
+            image_out = None
+            if data_out is None:
+                data_out = {}
+            elif data_out["want_fn"]:
+                image_out = EtherealImageW(want_fn=data_out["want_fn"])
+            else:
+                image_out = EtherealImageW(want_im=True, temp_dir=temp_dir)
+            if image_out:
+                data_out = {"image": image_out}
+            ip_params = CSIPParams(task_name=task_name,
+                                   data_in=data_in,
+                                   data_out=data_out,
+                                   options=options)
+            ret = run_plugin_task(plugins, ip_params, temp_dir)
+            out = None
+            if image_out and image_out.want_im:
+                # Encoded outputs (ex: enfuse) are decoded here to keep the parent light
+                shm, desc = _shm_put(np.asarray(image_out.get_im()))
+                # Parent unlinks after copying out
+                shm.close()
+                image_out.flush()
+                out = {"shm": desc, "save_kwargs": image_out.save_kwargs}
+            try:
+                pickle.dumps(ret)
+            except Exception:
+                ret = None
+            queue_result.put(("ok", ret, out))
+        except Exception:
+            queue_result.put(("exception", traceback.format_exc(), None))
+
+
+class CSImageProcessorProcess(CSImageProcessorWorker):
+    """
+    Runs plugins in a dedicated worker process
+    Thread semantics (callbacks, TaskBarrier) are kept on the parent side
+    """
+    def __init__(self, csip, name):
+        super().__init__(csip, name)
+        self.process = None
+        self.queue_task = None
+        self.queue_result = None
+        # Options already warned about
+        self.dropped_options = set()
+        self.start_process()
+
+    def start_process(self):
+        # Never fork: the parent is multithreaded (ex: Argus)
+        # and fork isn't available / safe on all platforms
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            ctx = multiprocessing.get_context("forkserver")
+        else:
+            ctx = multiprocessing.get_context("spawn")
+        # Share one tracker such that shared memory created on one side
+        # and unlinked on the other is accounted correctly
+        resource_tracker.ensure_running()
+        mconfig = None
+        microscope = self.csip.microscope
+        if microscope:
+            mconfig = get_mconfig(name=microscope.name,
+                                  serial=microscope.serial())
+        self.queue_task = ctx.Queue()
+        self.queue_result = ctx.Queue()
+        self.process = ctx.Process(target=_process_worker_main,
+                                   args=(self.name, mconfig,
+                                         self.csip.temp_dir, self.queue_task,
+                                         self.queue_result),
+                                   daemon=True)
+        self.process.start()
+
+    def stop(self):
+        super().stop()
+        if self.process and self.process.is_alive():
+            self.queue_task.put(None)
+
+    def join(self, timeout=None):
+        super().join(timeout=timeout)
+        if self.process:
+            self.process.join(timeout=timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process = None
+
+    def execute(self, ip_params):
+        shms = []
+        try:
+            data_in = ip_params.data_in
+            if "images" in data_in:
+                data_in = {
+                    "images": [
+                        _pack_image_r(image, shms)
+                        for image in data_in["images"]
+                    ]
+                }
+            elif "image" in data_in:
+                data_in = {"image": _pack_image_r(data_in["image"], shms)}
+            image_out = ip_params.data_out.get("image")
+            data_out = None
+            if image_out:
+                data_out = {"want_fn": image_out.want_fn}
+            options, dropped = _pack_options(ip_params.options)
+            for k in dropped:
+                if k not in self.dropped_options:
+                    self.dropped_options.add(k)
+                    self.log(
+                        f"WARNING: {self.name}: option {k} can't be passed to worker process, dropping"
+                    )
+            self.queue_task.put(
+                (ip_params.task_name, data_in, data_out, options))
+
+            while True:
+                try:
+                    # Timeout only to notice a dead worker
+                    result, ret, out = self.queue_result.get(True, 1.0)
+                    break
+                except queue.Empty:
+                    if not self.process.is_alive():
+                        # Ex: segfault in native code. Get a fresh worker
+                        exitcode = self.process.exitcode
+                        self.start_process()
+                        raise Exception(
+                            f"Worker process {self.name} died w/ code {exitcode}"
+                        )
+            if result != "ok":
+                raise Exception(f"Worker process {self.name} failed\n{ret}")
+            if out:
+                image_out.im = _shm_get(out["shm"], unlink=True)
+                image_out.save_kwargs = out["save_kwargs"]
+            return ret
+        finally:
+            for shm in shms:
+                shm.close()
+                shm.unlink()
+
+
 """
 Command passed to image processing thread
 """
@@ -139,7 +424,8 @@ class CSIPParams:
                  data_out={},
                  options={},
                  callback=None,
-                 tb=None):
+                 tb=None,
+                 priority=PRIORITY_DEFAULT):
         self.task_name = task_name
         self.data_in = data_in
         self.data_out = data_out
@@ -159,6 +445,86 @@ class CSIPParams:
         self.tb.callback called on completion
         """
         self.tb = tb
+        # Lower runs first. See PRIORITY_*
+        self.priority = priority
+        # Filled in by CSIPStats
+        self.t_queued = None
+        self.t_started = None
+
+
+"""
+Queue depth and latency counters for CSImageProcessor
+wait: queued => started, run: started => finished
+"""
+
+
+class CSIPStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        # priority => number queued
+        self.queued_priority = {}
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.run_total = 0.0
+        self.run_max = 0.0
+
+    def task_queued(self, ip_params):
+        with self.lock:
+            ip_params.t_queued = time.time()
+            self.queued += 1
+            self.queued_priority[
+                ip_params.priority] = self.queued_priority.get(
+                    ip_params.priority, 0) + 1
+        metrics.imagep_queue_depth.inc()
+
+    def task_start(self, ip_params):
+        with self.lock:
+            ip_params.t_started = time.time()
+            dt = ip_params.t_started - ip_params.t_queued
+            self.queued -= 1
+            self.queued_priority[ip_params.priority] -= 1
+            self.running += 1
+            self.wait_total += dt
+            self.wait_max = max(self.wait_max, dt)
+        metrics.imagep_queue_depth.dec()
+        metrics.imagep_running.inc()
+
+    def task_done(self, ip_params, result):
+        with self.lock:
+            dt = time.time() - ip_params.t_started
+            self.running -= 1
+            if result == "ok":
+                self.completed += 1
+            else:
+                self.failed += 1
+            self.run_total += dt
+            self.run_max = max(self.run_max, dt)
+        # Process wide, across all CSImageProcessor's
+        metrics.imagep_running.dec()
+        metrics.imagep_task_seconds.observe(dt, plugin=ip_params.task_name)
+        metrics.imagep_tasks.inc(plugin=ip_params.task_name, result=result)
+
+    def get(self):
+        with self.lock:
+            finished = self.completed + self.failed
+            return {
+                "queued": self.queued,
+                "queued_priority": {
+                    k: v
+                    for k, v in self.queued_priority.items() if v
+                },
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "wait_avg": self.wait_total / finished if finished else None,
+                "wait_max": self.wait_max,
+                "run_avg": self.run_total / finished if finished else None,
+                "run_max": self.run_max,
+            }
 
 
 """
@@ -175,7 +541,7 @@ Probably would need to make this a thread to handle that
 
 
 class CSImageProcessor(threading.Thread):
-    def __init__(self, nthreads=None, log=None, microscope=None):
+    def __init__(self, nthreads=None, log=None, microscope=None, backend=None):
         super().__init__()
         self.microscope = microscope
         if log is None:
@@ -184,8 +550,11 @@ class CSImageProcessor(threading.Thread):
                 print(s)
 
         self.log = log
-        self.queue_in = queue.Queue()
-        # self.queue_out = queue.Queue()
+        # (priority, sequence, CSIPParams)
+        # Sequence keeps FIFO order within a priority
+        self.queue_in = queue.PriorityQueue()
+        self.task_sequence = itertools.count()
+        self.stats = CSIPStats()
         self.running = threading.Event()
         self.ready = threading.Event()
         self.workers = OrderedDict()
@@ -194,11 +563,20 @@ class CSImageProcessor(threading.Thread):
         self.temp_dir_object = tempfile.TemporaryDirectory()
         self.temp_dir = self.temp_dir_object.name
 
+        if backend is None:
+            backend = config.get_bc().imagep_backend()
+        worker_ctor = {
+            "thread": CSImageProcessorThread,
+            "process": CSImageProcessorProcess,
+        }.get(backend)
+        assert worker_ctor, f"Bad image processing backend {backend}"
+        self.backend = backend
+
         if not nthreads:
             nthreads = multiprocessing.cpu_count()
-        for i in range(nthreads):
+        for i in range(int(nthreads)):
             name = f"w{i}"
-            self.workers[name] = CSImageProcessorThread(self, name)
+            self.workers[name] = worker_ctor(self, name)
         self.running.set()
 
     def __del__(self):
@@ -216,6 +594,8 @@ class CSImageProcessor(threading.Thread):
                 self.log("Shutting down: requesting")
                 for worker in self.workers.values():
                     worker.stop()
+                    # Wake up an idle worker. Sorts ahead of any real task
+                    self.queue_in.put((-1, next(self.task_sequence), None))
                 self.log("Shutting down: joining")
 
     def shutdown_join(self, timeout=3.0):
@@ -235,7 +615,22 @@ class CSImageProcessor(threading.Thread):
             # Mark task allocated
             # tb callback will be manually invoked on result
             ip_params.tb.allocate_callback()
-        self.queue_in.put(ip_params)
+        self.stats.task_queued(ip_params)
+        self.queue_in.put(
+            (ip_params.priority, next(self.task_sequence), ip_params))
+
+    def get_task(self):
+        """
+        Called by workers. Block until a task (or None => shutdown) is ready
+        """
+        _priority, _sequence, ip_params = self.queue_in.get()
+        return ip_params
+
+    def get_stats(self):
+        """
+        Queue depth and latency counters
+        """
+        return self.stats.get()
 
     def queue_n_to_1_plugin(self,
                             task_name=None,
@@ -248,7 +643,8 @@ class CSImageProcessor(threading.Thread):
                             options={},
                             callback=None,
                             tb=None,
-                            block=None):
+                            block=None,
+                            priority=PRIORITY_DEFAULT):
         """
         Use enfuse to HDR process a sequence of images of varying exposures
         """
@@ -271,8 +667,10 @@ class CSImageProcessor(threading.Thread):
                                data_out=data_out,
                                options=options,
                                callback=callback,
-                               tb=tb)
+                               tb=tb,
+                               priority=priority)
         self.queue_task(ip_params=ip_params, block=block)
+        return data_out
 
     def queue_1_to_1_plugin(self,
                             plugin,
@@ -285,7 +683,8 @@ class CSImageProcessor(threading.Thread):
                             options={},
                             callback=None,
                             tb=None,
-                            block=None):
+                            block=None,
+                            priority=PRIORITY_DEFAULT):
         if plugin not in get_plugin_ctors():
             print("Valid plugins:", get_plugin_ctors().keys())
             assert 0, f"Bad plugin {plugin}"
@@ -304,18 +703,70 @@ class CSImageProcessor(threading.Thread):
                                data_out=data_out,
                                options=options,
                                callback=callback,
-                               tb=tb)
+                               tb=tb,
+                               priority=priority)
+        self.queue_task(ip_params=ip_params, block=block)
+        return data_out
+
+    def queue_chain(self,
+                    chain,
+                    fns_in=None,
+                    fn_in=None,
+                    im_in=None,
+                    fn_out=None,
+                    want_im_out=False,
+                    dump_fns=None,
+                    options={},
+                    callback=None,
+                    tb=None,
+                    block=None,
+                    priority=PRIORITY_DEFAULT):
+        """
+        Run a sequence of plugins as a single task
+        The first plugin may be n to 1 (fns_in) or 1 to 1 (fn_in / im_in)
+        All following plugins must be 1 to 1
+        dump_fns: optionally write intermediate images to these filenames
+        """
+        for plugin in chain:
+            if plugin not in get_plugin_ctors():
+                print("Valid plugins:", get_plugin_ctors().keys())
+                assert 0, f"Bad plugin {plugin}"
+        if fns_in is not None:
+            data_in = {
+                "images": [EtherealImageR(fn=fn_in) for fn_in in fns_in]
+            }
+        if fn_in is not None:
+            data_in = {"image": EtherealImageR(fn=fn_in)}
+        if im_in is not None:
+            data_in = {"image": EtherealImageR(im=im_in)}
+        if fn_out is not None:
+            data_out = {"image": EtherealImageW(want_fn=fn_out)}
+        if want_im_out:
+            data_out = {
+                "image": EtherealImageW(want_im=True, temp_dir=self.temp_dir)
+            }
+        options = dict(options)
+        options["chain"] = list(chain)
+        options["dump_fns"] = dump_fns
+        ip_params = CSIPParams(task_name="chain",
+                               data_in=data_in,
+                               data_out=data_out,
+                               options=options,
+                               callback=callback,
+                               tb=tb,
+                               priority=priority)
         self.queue_task(ip_params=ip_params, block=block)
         return data_out
 
     def queue_hdr(self, **kwargs):
-        self.queue_n_to_1_plugin(task_name="hdr-luminance", **kwargs)
+        return self.queue_n_to_1_plugin(task_name="hdr-luminance", **kwargs)
 
     def queue_stack(self, **kwargs):
-        self.queue_n_to_1_plugin(task_name="stack-enfuse", **kwargs)
+        return self.queue_n_to_1_plugin(
+            task_name=self.microscope.usc.ipp.stack_plugin(), **kwargs)
 
     def queue_stabilization(self, **kwargs):
-        self.queue_n_to_1_plugin(task_name="stabilization", **kwargs)
+        return self.queue_n_to_1_plugin(task_name="stabilization", **kwargs)
 
     def queue_correct_ff1(self, **kwargs):
         return self.queue_1_to_1_plugin(plugin="correct-ff1", **kwargs)
@@ -370,7 +821,8 @@ class CSImageProcessor(threading.Thread):
             else:
                 args = [
                     "convert", "-quality",
-                    str(config.get_usc().imager.save_quality()), fn_in, fn_out
+                    str(self.microscope.usc.imager.save_quality()), fn_in,
+                    fn_out
                 ]
                 self.log(" ".join(args))
                 subprocess.check_call(args)
@@ -387,10 +839,14 @@ class CSImageProcessor(threading.Thread):
             healthy = False
         return healthy
 
-    '''
     def process_stream(self, *args, **kwargs):
         StreamCSIP(self, *args, microscope=self.microscope, **kwargs).run()
-    '''
+
+    def process_composite(self, *args, **kwargs):
+        """
+        Return a CompositeCSIP: feed it planner progress, then wait() for the image
+        """
+        return CompositeCSIP(self, *args, microscope=self.microscope, **kwargs)
 
     def process_snapshot(self, *args, **kwargs):
         options = kwargs.pop("options", {})
@@ -408,17 +864,9 @@ class CSImageProcessor(threading.Thread):
         for worker in self.workers.values():
             worker.start()
 
+        # Workers pull tasks themselves, nothing to dispatch
         self.ready.set()
 
-        while self.running.is_set():
-            for worker in self.workers.values():
-                if worker.simple_idle.is_set():
-                    try:
-                        ip_params = self.queue_in.get(True, 0.1)
-                    except queue.Empty:
-                        break
-                    worker.queue_command(ip_params)
-
 
 def microscope_name_from_scan_dir(directory, mconfig):
     """
@@ -445,6 +893,7 @@ def microscope_name_from_scan_dir(directory, mconfig):
 def process_dir(directory,
                 *args,
                 nthreads=None,
+                backend=None,
                 microscope=None,
                 microscope_name=None,
                 **kwargs):
@@ -459,7 +908,9 @@ def process_dir(directory,
 
     ip = None
     try:
-        ip = CSImageProcessor(nthreads=nthreads, microscope=microscope)
+        ip = CSImageProcessor(nthreads=nthreads,
+                              backend=backend,
+                              microscope=microscope)
         ip.start()
         ip.ready.wait(1.0)
         ip.process_dir(directory, *args, **kwargs)
@@ -10,6 +10,9 @@ import glob
 import os
 import math
 from uscope import config
+from uscope.imagep import flat_field
+from uscope.imagep import stabilization
+from uscope.imagep import tiled
 import cv2
 from pathlib import Path
 """
@@ -34,7 +37,8 @@ class IPPlugin:
                 print(s)
 
         self.verbose = False
-        self.usc = config.get_usc()
+        # A process may serve several microscopes (ex: imagep daemon)
+        self.usc = microscope.usc if microscope else config.get_usc()
         self.log = log
         self.default_options = default_options
 
@@ -289,34 +293,169 @@ class StackEnfusePlugin(IPPlugin):
                 os.unlink(fn)
 
 
+"""
+Stack in process using NumPy / OpenCV
+Laplacian pyramid fusion: at each pyramid level keep the coefficient
+from the image with the highest local contrast (like enfuse --hard-mask)
+Images are folded in one at a time so memory is a few pyramids regardless of stack size
+
+Optional alignment against the middle image of the stack
+-phase: translation only via phase correlation. Fast
+-ecc: ECC maximization. Translation or, with align_zoom, affine
+"""
+
+
+class StackNativePlugin(IPPlugin):
+    def __init__(self, log, default_options={}, microscope=None):
+        super().__init__(log=log,
+                         microscope=microscope,
+                         default_options=default_options)
+        pluginj = self.usc.ipp.get_plugin("stack-native")
+        # none, phase, ecc
+        self.align = pluginj.get("align", "none")
+        env_align = os.getenv("PYUSCOPE_STACK_NATIVE_ALIGN")
+        if env_align:
+            self.align = env_align
+            print("StackNativePlugin: align via environment: %s" %
+                  (self.align))
+        assert self.align in ("none", "phase", "ecc"), self.align
+        self.align_zoom = pluginj.get("align_zoom", False)
+        # None => as deep as image size allows
+        self.levels = pluginj.get("levels", None)
+        # Local contrast window (pixels, odd)
+        self.contrast_window = pluginj.get("contrast_window", 5)
+
+    def get_levels(self, shape):
+        if self.levels:
+            return self.levels
+        # Stop around 16 pixels on the short side
+        return max(1, int(math.log2(min(shape[0], shape[1]) / 16)))
+
+    def align_image(self, image, ref_gray, best_effort):
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY).astype(np.float32)
+        height, width = gray.shape
+        if self.align == "phase":
+            window = cv2.createHanningWindow((width, height), cv2.CV_32F)
+            (dx, dy), _response = cv2.phaseCorrelate(ref_gray, gray, window)
+            warp = np.array([[1, 0, dx], [0, 1, dy]], dtype=np.float32)
+        else:
+            if self.align_zoom:
+                motion = cv2.MOTION_AFFINE
+            else:
+                motion = cv2.MOTION_TRANSLATION
+            warp = np.eye(2, 3, dtype=np.float32)
+            criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 50,
+                        1e-4)
+            try:
+                _cc, warp = cv2.findTransformECC(ref_gray, gray, warp, motion,
+                                                 criteria, None, 5)
+            except cv2.error:
+                if not best_effort:
+                    raise
+                self.log("WARNING: ECC alignment failed, using unaligned")
+                return image
+        return cv2.warpAffine(image,
+                              warp, (width, height),
+                              flags=cv2.INTER_LINEAR + cv2.WARP_INVERSE_MAP,
+                              borderMode=cv2.BORDER_REFLECT)
+
+    def _run(self, data_in, data_out, options={}):
+        best_effort = options.get("best_effort", False)
+        images_in = data_in["images"]
+        exif = images_in[0].to_im().info.get("exif")
+
+        ref_gray = None
+        if self.align != "none":
+            ref = images_in[len(images_in) // 2].to_np()
+            ref_gray = cv2.cvtColor(ref, cv2.COLOR_RGB2GRAY).astype(np.float32)
+
+        levels = None
+        # Per level: best laplacian so far and its contrast
+        fused = []
+        best_contrast = []
+        top_sum = None
+        for imi, image_in in enumerate(images_in):
+            image = image_in.to_np()
+            if ref_gray is not None and imi != len(images_in) // 2:
+                image = self.align_image(image, ref_gray, best_effort)
+            image = image.astype(np.float32)
+            if levels is None:
+                levels = self.get_levels(image.shape)
+
+            # Build laplacian pyramid
+            gaussian = image
+            for level in range(levels):
+                down = cv2.pyrDown(gaussian)
+                up = cv2.pyrUp(down,
+                               dstsize=(gaussian.shape[1], gaussian.shape[0]))
+                laplacian = gaussian - up
+                contrast = np.abs(laplacian).sum(axis=2)
+                contrast = cv2.GaussianBlur(
+                    contrast, (self.contrast_window, self.contrast_window), 0)
+                if len(fused) <= level:
+                    fused.append(laplacian)
+                    best_contrast.append(contrast)
+                else:
+                    mask = contrast > best_contrast[level]
+                    fused[level][mask] = laplacian[mask]
+                    best_contrast[level][mask] = contrast[mask]
+                gaussian = down
+            # Low frequency residual: average
+            if top_sum is None:
+                top_sum = gaussian
+            else:
+                top_sum += gaussian
+
+        # Collapse pyramid
+        merged = top_sum / len(images_in)
+        for laplacian in reversed(fused):
+            merged = cv2.pyrUp(
+                merged,
+                dstsize=(laplacian.shape[1], laplacian.shape[0])) + laplacian
+        merged = np.clip(merged, 0, 255).astype(np.uint8)
+        kwargs = {"quality": 90}
+        if exif:
+            kwargs["exif"] = exif
+        data_out["image"].write_im(merged, **kwargs)
+
+
 class StabilizationPlugin(IPPlugin):
     def __init__(self, log, default_options={}, microscope=None):
         super().__init__(log=log,
                          microscope=microscope,
                          default_options=default_options,
                          need_tmp_dir=True)
+        pluginj = self.usc.ipp.get_plugin("stabilization")
+        # median, mean, sigma_clip
+        self.mode = pluginj.get("mode", "median")
+        assert self.mode in stabilization.MODES, self.mode
+        self.sigma = pluginj.get("sigma", 2.0)
+        # Spill frames to disk beyond this
+        self.max_ram_mb = pluginj.get("max_ram_mb", 1024)
 
     def _run(self, data_in, data_out, options={}):
         # https://stackoverflow.com/questions/34865765/finding-the-median-of-a-set-of-pictures-using-pil-and-numpy-gives-a-black-and-wh
 
-        images_np = []
+        images_in = data_in["images"]
         exif = None
-        for image_in in data_in["images"]:
-            fn = image_in.get_filename()
-            im = Image.open(fn)
-            image_matrix = np.array(im)
-            images_np.append(image_matrix)
-            if exif is None:
-                exif = im.info.get('exif')
-
-        image_stack = np.concatenate([im[..., None] for im in images_np],
-                                     axis=3)
-        median_array = np.median(image_stack, axis=3)
-        median_array = median_array.astype(np.uint8)
-        median_image = Image.fromarray(median_array)
-        median_image.save(data_out["image"].get_filename(),
-                          quality=90,
-                          exif=exif)
+        frames = stabilization.FrameStack(len(images_in),
+                                          max_ram_bytes=self.max_ram_mb *
+                                          1024 * 1024,
+                                          spill_dir=self.get_tmp_dir())
+        try:
+            for image_in in images_in:
+                if exif is None:
+                    exif = image_in.to_im().info.get('exif')
+                frames.add(image_in.to_np())
+            final_np = stabilization.stabilize(frames,
+                                               mode=self.mode,
+                                               sigma=self.sigma)
+        finally:
+            frames.close()
+        kwargs = {"quality": 90}
+        if exif:
+            kwargs["exif"] = exif
+        data_out["image"].write_im(final_np, **kwargs)
 
 
 """
@@ -328,128 +467,20 @@ class CorrectFF1Plugin(IPPlugin):
     def __init__(self, log, default_options={}, microscope=None):
         super().__init__(log=log,
                          microscope=microscope,
-                         default_options=default_options,
-                         need_tmp_dir=True)
+                         default_options=default_options)
         # Plugin is always registered
         # Maybe should have a mechanism to exclude if it can't actually run?
-        self.ff_im = None
-
-        if self.usc.imager.has_ff_cal():
-            self.ff_im = Image.open(self.usc.imager.ff_cal_fn())
-            self.ff_rband_im, self.ff_gband_im, self.ff_bband_im = self.ff_im.split(
-            )
-            self.ff_rband_np = np.array(self.ff_rband_im)
-            self.ff_gband_np = np.array(self.ff_gband_im)
-            self.ff_bband_np = np.array(self.ff_bband_im)
-            self.ff_minmax()
-
-            # Boost dim values by scalars in the range 1.0 to near 0.0
-            # The lower the flat field value, the more it needs to be scaled
-            # Values at max flat field value stay the same
-            # Note: dead pixels always 0 not currently handled / will crash
-            self.rband_scalar = self.ff_rmax / self.ff_rband_np
-            self.gband_scalar = self.ff_gmax / self.ff_gband_np
-            self.bband_scalar = self.ff_bmax / self.ff_bband_np
-
-            # It's easy to have an outlier that boosts everything
-            self.verbose and print(f"ffi r: {self.ffi_rmin} : {self.ffi_rmax}")
-            self.verbose and print(f"ffi g: {self.ffi_gmin} : {self.ffi_gmax}")
-            self.verbose and print(f"ffi b: {self.ffi_bmin} : {self.ffi_bmax}")
-
-    def npf2im(self, statef):
-        #return statef, None
-        rounded = np.round(statef)
-        #print("row1: %s" % rounded[1])
-        statei = np.array(rounded, dtype=np.uint16)
-        #print(len(statei), len(statei[0]), len(statei[0]))
-        height = len(statef)
-        width = len(statef[0])
-
-        # for some reason I isn't working correctly
-        # only L
-        # workaround by plotting manually
-        im = Image.new("RGB", (width, height), "Black")
-        for y, row in enumerate(statei):
-            for x, val in enumerate(row):
-                # this causes really weird issues if not done
-                val = tuple(int(x) for x in val)
-                im.putpixel((x, y), val)
-
-        return im
-
-    def ff_minmax(self):
-        def bounds_close_band(band):
-            hist = band.histogram()
-            width, height = band.size
-            npixels = width * height
-            thresh = 0.01
-
-            low = None
-            high = None
-            pixels = 0
-            for i, vals in enumerate(hist):
-                pixels += vals
-                if low is None and pixels / npixels >= thresh:
-                    low = i
-                if high is None and pixels / npixels >= (1.0 - thresh):
-                    high = i
-                    break
-            return low, high
-
-        (self.ff_rmin, self.ff_rmax) = bounds_close_band(self.ff_rband_im)
-        (self.ff_gmin, self.ff_gmax) = bounds_close_band(self.ff_gband_im)
-        (self.ff_bmin, self.ff_bmax) = bounds_close_band(self.ff_bband_im)
 
     def _run(self, data_in, data_out, options={}):
-        # Calibration must be loaded
-        assert self.ff_im
-
-        print(f"FF1: run")
-
-        self.verbose and print("")
-
-        image_in = data_in["image"]
-        # im_in = "cal/cal06_ff_1.5x/2023-06-20_01-22-25_blue_20x_cal6_1.5x_pic/c000_r001.jpg"
-        im = image_in.to_mutable_im()
-        if im.size != self.ff_im.size:
-            raise Exception(
-                "Calibration image size %uw x %uh but got image %uw x %uh" %
-                (self.ff_im.width, self.ff_im.height, im.width, im.height))
-
-        rband_im, gband_im, bband_im = im.split()
-        # fixme = Image.merge("RGB", (rband_im, gband_im, bband_im))
-        rband_np = np.array(rband_im)
-        gband_np = np.array(gband_im)
-        bband_np = np.array(bband_im)
-
-        # Rescale based on flat field
-        rband_np = np.multiply(rband_np, self.rband_scalar)
-        gband_np = np.multiply(gband_np, self.gband_scalar)
-        bband_np = np.multiply(bband_np, self.bband_scalar)
+        # Loaded per run: warm workers (ex: imagep daemon) outlive calibrations
+        # Shared across workers, cached to disk and reloaded if the file changes
+        assert self.usc.imager.has_ff_cal(), "FF calibration required"
+        gain = flat_field.load_gain_map(self.usc.imager.ff_cal_fn())
 
-        # floats aren't ideal for images
-        rband_np = np.round(rband_np)
-        gband_np = np.round(gband_np)
-        bband_np = np.round(bband_np)
-        # print("max", rband_np.max(), gband_np.max(), bband_np.max())
+        self.verbose and print(f"FF1: run")
 
-        rband_np = np.minimum(rband_np, 255)
-        gband_np = np.minimum(gband_np, 255)
-        bband_np = np.minimum(bband_np, 255)
-        # print("max", rband_np.max(), gband_np.max(), bband_np.max())
-
-        rband_np = rband_np.astype(np.uint8)
-        gband_np = gband_np.astype(np.uint8)
-        bband_np = bband_np.astype(np.uint8)
-        # print("max", rband_np.max(), gband_np.max(), bband_np.max())
-
-        # Convert back into more standard PIL format
-        final_im_r = Image.fromarray(rband_np, "L")
-        final_im_g = Image.fromarray(gband_np, "L")
-        final_im_b = Image.fromarray(bband_np, "L")
-        final_im = Image.merge("RGB", (final_im_r, final_im_g, final_im_b))
-
-        final_im.save(data_out["image"].get_filename(), quality=90)
+        final_np = flat_field.apply_gain_map(data_in["image"].to_np(), gain)
+        data_out["image"].write_im(final_np, quality=90)
 
 
 """
@@ -485,8 +516,8 @@ class CorrectSharp1Plugin(IPPlugin):
         pil_im = data_in["image"].to_im()
         cv_im = np.array(pil_im.convert('RGB'))[:, :, ::-1].copy()
         result = cv2.filter2D(cv_im, -1, self.kernel)
-        cv2.imwrite(data_out["image"].get_filename(), result,
-                    [int(cv2.IMWRITE_JPEG_QUALITY), 90])
+        # BGR => RGB
+        data_out["image"].write_im(result[:, :, ::-1], quality=90)
 
 
 """
@@ -581,8 +612,8 @@ class CorrectVM1V1Plugin(IPPlugin):
                                corrected_b[0][0].dtype)
 
         merged = cv2.merge([corrected_b, g, r])
-        cv2.imwrite(data_out["image"].get_filename(), merged,
-                    [int(cv2.IMWRITE_JPEG_QUALITY), 90])
+        # BGR => RGB
+        data_out["image"].write_im(merged[:, :, ::-1], quality=90)
 
 
 class AnnotateScalebarPlugin(IPPlugin):
@@ -681,12 +712,25 @@ class AnnotateScalebarPlugin(IPPlugin):
         scale_text = draw_scale_text()
         draw_labsmore(scale_text)
 
-        modified_image.save(data_out["image"].get_filename(), quality=90)
+        data_out["image"].write_im(modified_image, quality=90)
+
+
+"""
+Render one band of rows of a Deep Zoom tile pyramid
+No image in / out: tiles are written directly
+See tiled.write_deep_zoom()
+"""
+
+
+class DeepZoomBandPlugin(IPPlugin):
+    def _run(self, data_in, data_out, options={}):
+        tiled.write_band(**options["deep_zoom_band"])
 
 
 def get_plugin_ctors():
     return {
         "stack-enfuse": StackEnfusePlugin,
+        "stack-native": StackNativePlugin,
         "hdr-enfuse": HDREnfusePlugin,
         "hdr-luminance": HDRLuminancePlugin,
         "stabilization": StabilizationPlugin,
@@ -694,6 +738,7 @@ def get_plugin_ctors():
         "correct-sharp1": CorrectSharp1Plugin,
         "correct-vm1v1": CorrectVM1V1Plugin,
         "annotate-scalebar": AnnotateScalebarPlugin,
+        "deep-zoom-band": DeepZoomBandPlugin,
     }
 
 
@@ -1,13 +1,17 @@
 from uscope import cloud_stitch
-from uscope.scan_util import index_scan_images, bucket_group, reduce_iindex_filename, is_tif_scan
+from uscope.scan_util import ScanIndex, index_scan_images, bucket_group, reduce_iindex_filename, is_tif_scan, iindex_parse_fn
 from uscope import config
-from uscope.imagep.util import TaskBarrier, EtherealImageR, EtherealImageW, remove_intermediate_directories, find_qr_code_match, check_valid_image_dir
+from uscope.imagep.util import TaskBarrier, PRIORITY_BATCH, PRIORITY_INTERACTIVE, EtherealImageR, EtherealImageW, remove_intermediate_directories, find_qr_code_match, check_valid_image_dir
 from uscope.imagep.summary import write_html_viewer, write_snapshot_grid, write_quick_pano
 from uscope.util import writej
+from uscope.imager.image_sequence import CapturedImage
 import glob
 import shutil
 import os
+import queue
+import threading
 from PIL import Image
+import numpy as np
 """
 Support the following:
 -Planner running
@@ -28,13 +32,46 @@ class ImageStream:
         pass
 
 
-# FIXME: how to integrate this?
-# might require binding to a plugin and adding a queue
 class PlannerImageStream(ImageStream):
-    def __init__(self, pconfig, directory, planner_image_queue_plugin):
+    """
+    Images as they are saved by a running Planner
+    Register progress_callback() as a planner progress callback
+    and hand the stream to StreamCSIP
+    """
+    def __init__(self, pconfig, directory):
         self.pconfig = pconfig
         self.directory = directory
-        self.planner_image_queue_plugin = planner_image_queue_plugin
+        # Filenames saved but not yet picked up by the orchestrator
+        self.queue = queue.Queue()
+        # Planner won't produce any more images
+        self.scan_done = threading.Event()
+        # Orchestrator finished all work it could do for this stream
+        self.processed = threading.Event()
+
+    def progress_callback(self, state):
+        """
+        Planner progress callback
+        Called from the planner thread or an image writer thread
+        """
+        # Not "image": the file may still be being written
+        if state["type"] == "image-saved":
+            fn = state.get("image_filename_rel")
+            if fn:
+                self.queue.put(fn)
+        elif state["type"] == "end":
+            self.scan_done.set()
+
+    def close(self):
+        """
+        No more images are coming (ex: scan was aborted)
+        """
+        self.scan_done.set()
+
+    def done(self):
+        return self.scan_done.is_set() and self.queue.empty()
+
+    def wait_processed(self, timeout=None):
+        return self.processed.wait(timeout)
 
     def working_dir(self):
         return self.directory
@@ -43,8 +80,17 @@ class PlannerImageStream(ImageStream):
         """
         Return an iterable of EtherealImageR
         """
-        fns = self.planner_image_queue_plugin.new_images()
-        return [EtherealImageR(fn=fn) for fn in fns]
+        ret = []
+        while True:
+            try:
+                fn = self.queue.get(block=False)
+            except queue.Empty:
+                break
+            ret.append(EtherealImageR(fn=fn))
+        return ret
+
+    def has_stabilization(self):
+        return "image-stabilization" in self.pconfig
 
     def has_stack(self):
         return "points-stacker" in self.pconfig
@@ -52,6 +98,9 @@ class PlannerImageStream(ImageStream):
     def has_hdr(self):
         return "hdr" in self.pconfig["imager"]
 
+    def ippj(self):
+        return self.pconfig.get("ipp", {})
+
     def bucket_size(self, operation):
         """
         Ex:
@@ -60,9 +109,11 @@ class PlannerImageStream(ImageStream):
         Check the scan config to see if stacks have 3 elements
         """
         if operation == "stack":
-            return self.pconfig["points-stacker"]["number"]
+            return int(self.pconfig["points-stacker"]["number"])
         elif operation == "hdr":
             return len(self.pconfig["imager"]["hdr"]["properties_list"])
+        elif operation == "stabilization":
+            return int(self.pconfig["image-stabilization"]["n"])
         else:
             assert 0, "FIXME"
 
@@ -88,10 +139,11 @@ class IPPConfigJ:
 
     def write_html_viewer(self):
         """
-        Write a simple .html file at the final image level
+        Write a zoomable .html viewer at the final image level
         Its not so much stitched as plastered together
         """
-        # Very little disk space, easy to distinguish from other image files
+        # Tile pyramid takes about as much disk space as the final images
+        # but is not uploaded
         # Turn on by default
         return bool(self.j.get("write_html_viewer", True))
 
@@ -116,6 +168,27 @@ class IPPConfigJ:
         # In part due to no lock file which caused GUI / CLI contention
         return bool(self.j.get("keep_intermediates", True))
 
+    def stream(self):
+        """
+        Process images while the scan is running (StreamCSIP)
+        Post-processing then only needs to generate summary output
+        """
+        return bool(self.j.get("stream", False))
+
+    def chain_corrections(self):
+        """
+        Run 1 to 1 corrections (ex: ff1) in memory right after the last
+        bucket stage (ex: stack) instead of writing a directory per stage
+        """
+        return bool(self.j.get("chain_corrections", True))
+
+    def dump_intermediates(self):
+        """
+        When chaining, still write each intermediate stage to its usual directory
+        Debugging aid: costs the disk I/O chaining is meant to save
+        """
+        return bool(self.j.get("dump_intermediates", False))
+
 
 class DirCSIP:
     def __init__(self,
@@ -172,7 +245,8 @@ class DirCSIP:
                 self.csip.queue_n_to_1_plugin(task_name=task_name,
                                               fns_in=fns,
                                               fn_out=fn_out,
-                                              tb=tb)
+                                              tb=tb,
+                                              priority=PRIORITY_BATCH)
         tb.wait()
 
     # FIXME: unify this + run_1_to_1
@@ -191,7 +265,8 @@ class DirCSIP:
                                               fn_in=os.path.join(
                                                   iindex_in["dir"], fn_in),
                                               fn_out=fn_out,
-                                              tb=tb)
+                                              tb=tb,
+                                              priority=PRIORITY_BATCH)
         # print("TB: wait w/ alloc %s vs completed %s" % (tb.ntasks_allocated, tb.ntasks_completed))
         tb.wait()
 
@@ -208,15 +283,69 @@ class DirCSIP:
                                               fn_in=os.path.join(
                                                   iindex_in["dir"], fn_in),
                                               fn_out=fn_out,
-                                              tb=tb)
+                                              tb=tb,
+                                              priority=PRIORITY_BATCH)
         # print("TB: wait w/ alloc %s vs completed %s" % (tb.ntasks_allocated, tb.ntasks_completed))
         tb.wait()
 
+    def chain_run(self, chain, dir_names, iindex_in, bucket_name=None):
+        """
+        Run an optional n to 1 stage followed by 1 to 1 corrections
+        as a single task per output image
+        Output lands in the same nested directory as running stages one by one
+        """
+        dirs_out = []
+        dir_out = iindex_in["dir"]
+        for dir_name in dir_names:
+            dir_out = os.path.join(dir_out, dir_name)
+            dirs_out.append(dir_out)
+        dump = self.ipp_config.dump_intermediates()
+        for this_dir in dirs_out if dump else dirs_out[-1:]:
+            os.makedirs(this_dir, exist_ok=True)
+
+        # (queue_chain input kwargs, output basename)
+        tasks = []
+        if bucket_name:
+            image_suffix = get_image_suffix(iindex_in["dir"])
+            buckets = bucket_group(iindex_in, bucket_name)
+            for fn_prefix, bucket in sorted(buckets.items()):
+                fns = [
+                    os.path.join(iindex_in["dir"], fn)
+                    for _i, fn in sorted(bucket.items())
+                ]
+                tasks.append(({"fns_in": fns}, fn_prefix + image_suffix))
+        else:
+            for fn_in in iindex_in["images"].keys():
+                tasks.append(({
+                    "fn_in": os.path.join(iindex_in["dir"], fn_in)
+                }, os.path.basename(fn_in)))
+
+        tb = TaskBarrier()
+        for kwargs, basename in tasks:
+            fn_out = os.path.join(dirs_out[-1], basename)
+            if self.lazy and os.path.exists(fn_out):
+                self.log(f"lazy: skip {fn_out}")
+                continue
+            dump_fns = None
+            if dump:
+                dump_fns = [
+                    os.path.join(this_dir, basename)
+                    for this_dir in dirs_out[:-1]
+                ]
+            self.csip.queue_chain(chain=chain,
+                                  fn_out=fn_out,
+                                  dump_fns=dump_fns,
+                                  tb=tb,
+                                  priority=PRIORITY_BATCH,
+                                  **kwargs)
+        tb.wait()
+        return dirs_out[-1]
+
     def hdr_run(self, **kwargs):
         self.run_n_to_1(task_name="hdr-luminance", bucket_name="hdr", **kwargs)
 
     def stack_run(self, **kwargs):
-        self.run_n_to_1(task_name="stack-enfuse",
+        self.run_n_to_1(task_name=self.microscope.usc.ipp.stack_plugin(),
                         bucket_name="stack",
                         **kwargs)
 
@@ -231,6 +360,35 @@ class DirCSIP:
     def correct_ff1_run(self, **kwargs):
         self.run_1_to_1(task_name="correct-ff1", **kwargs)
 
+    def post_correction_run(self, working_iindex):
+        """
+        Apply 1 to 1 corrections one stage (directory) at a time
+        """
+        if self.ipp_config.snapshot_correction():
+            ipp = self.microscope.usc.ipp.snapshot_correction()
+            if len(ipp) == 0:
+                self.verbose and self.log("Post corrections: skip")
+            else:
+                for pipeline_this in ipp:
+                    plugin = pipeline_this["plugin"]
+                    this_dir = pipeline_this["dir"]
+                    self.verbose and self.log(f"{plugin}: start")
+                    next_dir = os.path.join(working_iindex["dir"], this_dir)
+                    self.correct_plugin_run(pipeline_this,
+                                            iindex_in=working_iindex,
+                                            dir_out=next_dir)
+                    working_iindex = index_scan_images(next_dir)
+
+        if not self.microscope.usc.imager.has_ff_cal():
+            self.verbose and self.log("FF correction: skip")
+        else:
+            self.verbose and self.log("FF correction: start")
+            next_dir = os.path.join(working_iindex["dir"], "ff1")
+            self.correct_ff1_run(iindex_in=working_iindex, dir_out=next_dir)
+            working_iindex = index_scan_images(next_dir)
+
+        return working_iindex
+
     def run(self):
         """
         Process a completed scan into processed images
@@ -238,12 +396,13 @@ class DirCSIP:
         """
 
         self.log("Reading metadata...")
-        working_iindex = index_scan_images(self.directory)
+        # Sidecar lets a re-run skip listing a large scan directory
+        working_iindex = index_scan_images(self.directory, sidecar=True)
         dst_basename = os.path.basename(os.path.abspath(self.directory))
 
         print("Microscope: %s" % (self.microscope.name, ))
         print("Serial: %s" % (self.microscope.serial(), ))
-        print("Has FF cal: %s" % config.get_usc().imager.has_ff_cal())
+        print("Has FF cal: %s" % self.microscope.usc.imager.has_ff_cal())
         print("Options")
         print("  Keep intermediates:", self.ipp_config.keep_intermediates())
         print("  Write HTML viewer:", self.ipp_config.write_html_viewer())
@@ -254,7 +413,7 @@ class DirCSIP:
 
         self.log("")
 
-        ipp = config.get_usc().ipp.pipeline_first()
+        ipp = self.microscope.usc.ipp.pipeline_first()
         if len(ipp) == 0:
             self.log("Pre corrections: skip")
         else:
@@ -267,8 +426,36 @@ class DirCSIP:
                                         iindex_in=working_iindex,
                                         dir_out=next_dir)
                 working_iindex = index_scan_images(next_dir)
-
+        """
+        Corrections after the bucket stages are 1 to 1
+        and can be chained in memory onto the last bucket stage
+        """
+        post_corrections = []
+        if self.ipp_config.snapshot_correction():
+            for pipeline_this in self.microscope.usc.ipp.snapshot_correction():
+                post_corrections.append(
+                    (pipeline_this["plugin"], pipeline_this["dir"]))
+        if self.microscope.usc.imager.has_ff_cal():
+            post_corrections.append(("correct-ff1", "ff1"))
+        chain = self.ipp_config.chain_corrections() and len(
+            post_corrections) > 0
+        # (task name, bucket name, dir name)
+        bucket_stages = []
         if working_iindex["stabilization"]:
+            bucket_stages.append(
+                ("stabilization", "stabilization", "stabilization"))
+        if working_iindex["hdrs"]:
+            bucket_stages.append(("hdr-luminance", "hdr", "hdr"))
+        if working_iindex["stacks"]:
+            bucket_stages.append(
+                (self.microscope.usc.ipp.stack_plugin(), "stack", "stack"))
+        chain_bucket = None
+        if chain and bucket_stages:
+            chain_bucket = bucket_stages[-1][1]
+
+        if working_iindex["stabilization"] and chain_bucket == "stabilization":
+            self.log("Stabilization: yes. Chaining corrections")
+        elif working_iindex["stabilization"]:
             self.log("Stabilization: yes. Processing")
             # dir name needs to be reasonable for CloudStitch to name it well
             next_dir = os.path.join(working_iindex["dir"], "stabilization")
@@ -277,7 +464,9 @@ class DirCSIP:
                                    lazy=self.lazy)
             working_iindex = index_scan_images(next_dir)
 
-        if working_iindex["hdrs"]:
+        if working_iindex["hdrs"] and chain_bucket == "hdr":
+            self.log("HDR: yes. Chaining corrections")
+        elif working_iindex["hdrs"]:
             self.log("HDR: yes. Processing")
             # dir name needs to be reasonable for CloudStitch to name it well
             next_dir = os.path.join(working_iindex["dir"], "hdr")
@@ -288,7 +477,9 @@ class DirCSIP:
 
         self.log("")
 
-        if working_iindex["stacks"]:
+        if working_iindex["stacks"] and chain_bucket == "stack":
+            self.log("Stacker: yes. Chaining corrections")
+        elif working_iindex["stacks"]:
             self.log("Stacker: yes. Processing")
             # dir name needs to be reasonable for CloudStitch to name it well
             next_dir = os.path.join(working_iindex["dir"], "stack")
@@ -301,28 +492,23 @@ class DirCSIP:
         Now apply custom correction plugins
         TODO: let the user actually determine order for these...ff1 before stack, etc
         """
-        if self.ipp_config.snapshot_correction():
-            ipp = config.get_usc().ipp.snapshot_correction()
-            if len(ipp) == 0:
-                self.verbose and self.log("Post corrections: skip")
-            else:
-                for pipeline_this in ipp:
-                    plugin = pipeline_this["plugin"]
-                    this_dir = pipeline_this["dir"]
-                    self.verbose and self.log(f"{plugin}: start")
-                    next_dir = os.path.join(working_iindex["dir"], this_dir)
-                    self.correct_plugin_run(pipeline_this,
-                                            iindex_in=working_iindex,
-                                            dir_out=next_dir)
-                    working_iindex = index_scan_images(next_dir)
-
-        if not config.get_usc().imager.has_ff_cal():
-            self.verbose and self.log("FF correction: skip")
-        else:
-            self.verbose and self.log("FF correction: start")
-            next_dir = os.path.join(working_iindex["dir"], "ff1")
-            self.correct_ff1_run(iindex_in=working_iindex, dir_out=next_dir)
+        if chain:
+            dir_names = [dir_name for _plugin, dir_name in post_corrections]
+            plugins = [plugin for plugin, _dir_name in post_corrections]
+            bucket_name = None
+            if chain_bucket:
+                task_name, bucket_name, dir_name = bucket_stages[-1]
+                dir_names = [dir_name] + dir_names
+                plugins = [task_name] + plugins
+            self.verbose and self.log("Corrections: chaining %s" %
+                                      (" => ".join(plugins), ))
+            next_dir = self.chain_run(chain=plugins,
+                                      dir_names=dir_names,
+                                      iindex_in=working_iindex,
+                                      bucket_name=bucket_name)
             working_iindex = index_scan_images(next_dir)
+        else:
+            working_iindex = self.post_correction_run(working_iindex)
 
         self.verbose and self.log("")
         healthy = self.csip.inspect_final_dir(working_iindex)
@@ -361,11 +547,7 @@ class DirCSIP:
         if healthy:
             if self.ipp_config.write_html_viewer():
                 self.verbose and self.log("Writing HTML viewer")
-                if is_tif_scan(working_iindex["dir"]):
-                    # Only Safari supports .tif
-                    self.log(
-                        "WARNING: HTML viewer only works reliably with jpg")
-                write_html_viewer(working_iindex)
+                write_html_viewer(working_iindex, csip=self.csip)
 
             if self.ipp_config.write_snapshot_grid():
                 self.verbose and self.log("Writing tile image")
@@ -391,6 +573,9 @@ class DirCSIP:
             next_dir = self.directory
             working_iindex = index_scan_images(next_dir)
 
+        # Processing created sub directories / files => refresh sidecar
+        ScanIndex.get(self.directory).refresh().save_sidecar()
+
         if not self.upload:
             self.log("CloudStitch: skip (requested by CLI)")
         elif not self.ipp_config.cloud_stitch():
@@ -459,7 +644,7 @@ class SnapshotCSIP:
         self.verbose and self.log("Microscope: %s" % (self.microscope.name, ))
         self.verbose and self.log("Serial: %s" % (self.microscope.serial(), ))
         self.verbose and self.log(
-            "Has FF cal: %s" % config.get_usc().imager.has_ff_cal())
+            "Has FF cal: %s" % self.microscope.usc.imager.has_ff_cal())
 
         self.verbose and self.log("")
         '''
@@ -489,34 +674,29 @@ class SnapshotCSIP:
         capim = options["captured_image"]
         self.microscope.imager.add_captured_image_meta(capim)
 
-        ipp = config.get_usc().ipp.snapshot_correction()
+        ipp = self.microscope.usc.ipp.snapshot_correction()
         current_plugins = [p["plugin"] for p in ipp]
         for plugin in options.get("plugins", []):
             if plugin not in current_plugins:
                 ipp.append({"plugin": plugin})
-        if len(ipp) == 0:
-            self.verbose and self.log("Post corrections: skip")
-        else:
-            for pipeline_this in ipp:
-                plugin = pipeline_this["plugin"]
-                self.verbose and self.log(f"{plugin}: start")
-                tb = TaskBarrier()
-                data_out = self.csip.queue_1_to_1_plugin(plugin=plugin,
-                                                         im_in=current_image,
-                                                         want_im_out=True,
-                                                         tb=tb,
-                                                         options=options)
-                tb.wait()
-                current_image = data_out["image"].get_im()
-
-        if not config.get_usc().imager.has_ff_cal():
+        chain = [pipeline_this["plugin"] for pipeline_this in ipp]
+        if not self.microscope.usc.imager.has_ff_cal():
             self.verbose and self.log("FF correction: skip")
         else:
-            self.verbose and self.log("FF correction: start")
+            chain.append("correct-ff1")
+        if len(chain) == 0:
+            self.verbose and self.log("Post corrections: skip")
+        else:
+            # Single task such that intermediates are never encoded
+            self.verbose and self.log("Corrections: %s" %
+                                      (" => ".join(chain), ))
             tb = TaskBarrier()
-            data_out = self.csip.queue_correct_ff1(im_in=current_image,
-                                                   want_im_out=True,
-                                                   tb=tb)
+            data_out = self.csip.queue_chain(chain=chain,
+                                             im_in=current_image,
+                                             want_im_out=True,
+                                             tb=tb,
+                                             priority=PRIORITY_INTERACTIVE,
+                                             options=options)
             tb.wait()
             current_image = data_out["image"].get_im()
 
@@ -524,159 +704,392 @@ class SnapshotCSIP:
 
 
 """
-WIP, not tested / used currently
+Second generation image processing orchestrator
 See https://github.com/Labsmore/pyuscope/issues/190
 
-Second generation image processing orchestrator
-Constructs a pipeline based on expected input data
-Expects all images to be present
-If it fails you'll need to fall back to DirCSIP
+Processes images while a scan is still running
+Each bucket (ex: an HDR bracket or a focus stack) is queued as soon as it is full
+Produces the same directory layout as DirCSIP
+such that a (lazy) DirCSIP run afterwards only needs to generate summary output
 """
-'''
+
+
 class StreamCSIP:
-    def __init__(self, csip, image_stream, microscope=None, upload=False):
-        assert 0, "WIP"
+    def __init__(self,
+                 csip,
+                 image_stream,
+                 lazy=True,
+                 microscope=None,
+                 verbose=False):
         self.csip = csip
+        self.log = csip.log
         self.image_stream = image_stream
         self.microscope = microscope
-
-        # TODO: auto figure this out
-        # Might also want to move these to be objects
-        self.pipeline = []
+        self.lazy = lazy
+        self.verbose = verbose
+        self.ipp_config = IPPConfigJ(self.image_stream.ippj())
+        # (stagei, fn_out, result) from worker callbacks
+        self.completed = queue.Queue()
+        # Tasks queued to workers but not yet in self.completed
+        self.pending = 0
+        self.pipeline = self.make_pipeline()
+
+    def make_pipeline(self):
+        """
+        Same order of operations as DirCSIP
+        bucket: iindex key that gets collapsed by this stage
+            None => 1 to 1 correction
+        """
+        pipeline = []
+        for pipeline_this in self.microscope.usc.ipp.pipeline_first():
+            pipeline.append({
+                "plugin": pipeline_this["plugin"],
+                "dir": pipeline_this["dir"],
+                "bucket": None,
+            })
+        if self.image_stream.has_stabilization():
+            pipeline.append({
+                "plugin": "stabilization",
+                "dir": "stabilization",
+                "bucket": "stabilization",
+            })
         if self.image_stream.has_hdr():
-            self.pipeline.append({"plugin": "hdr-enfuse"})
+            pipeline.append({
+                "plugin": "hdr-luminance",
+                "dir": "hdr",
+                "bucket": "hdr",
+            })
         if self.image_stream.has_stack():
-            self.pipeline.append({"plugin": "stack-enfuse"})
-        # Should this be before or after other steps?
-        # Currently expensive so put at the end
-        if config.get_usc().imager.has_ff_cal():
-            self.pipeline.append({"plugin": "correct-illumination"})
-
-        next_directory = self.image_stream.working_dir()
-        for pipe in self.pipeline:
-            """
-            keys are the next file basename w/o extension
-            ex: 
-            """
-            plugin = pipe["plugin"]
-
-            if plugin == "hdr-enfuse":
-                ptype = "hdr"
-            elif plugin == "stack-enfuse":
-                ptype = "stack"
-            elif plugin == "correct-illumination":
-                ptype = "correct"
+            pipeline.append({
+                "plugin": self.microscope.usc.ipp.stack_plugin(),
+                "dir": "stack",
+                "bucket": "stack",
+            })
+        if self.ipp_config.snapshot_correction():
+            for pipeline_this in self.microscope.usc.ipp.snapshot_correction():
+                pipeline.append({
+                    "plugin": pipeline_this["plugin"],
+                    "dir": pipeline_this["dir"],
+                    "bucket": None,
+                })
+        if self.microscope.usc.imager.has_ff_cal():
+            pipeline.append({
+                "plugin": "correct-ff1",
+                "dir": "ff1",
+                "bucket": None,
+            })
+
+        # Nest directories like .../mz_mit20x/hdr/stack/
+        dir_in = self.image_stream.working_dir()
+        for pipe in pipeline:
+            pipe["dir_out"] = os.path.join(dir_in, pipe["dir"])
+            if pipe["bucket"]:
+                pipe["bucket_size"] = self.image_stream.bucket_size(
+                    pipe["bucket"])
             else:
-                assert 0, plugin
-
+                pipe["bucket_size"] = 1
+            # bucket key => {bucket index: filename}
             pipe["buckets"] = {}
-            pipe["type"] = ptype
-            pipe["remove_key"] = ptype
-            pipe["dir_in"] = next_directory
-            """
-            Nest directories like .../mz_mit20x/hdr/stack/
-            """
-            next_directory = os.path.join(next_directory, ptype)
-            pipe["dir_out"] = next_directory
-
-        self.tb = TaskBarrier()
-
-    def bucket_images(self, pipe, images):
-        """
-        Place new images into given pipeline stage
-        Don't trigger any processing, even if it could be done now
-        """
-        for image in images:
-            # iindex_filename_key[image.get_filename]
-            fn = image.get_filename()
-            bucketk = reduce_iindex_filename(fn, remove_key=pipe["remove_key"])
-            pipe.buckets.setdefault(bucketk, set()).add(os.path.basename(fn))
-
-    def bucket_full(self, statei, bucketk):
-        plugin = self.pipeline[statei]
-        if plugin == "hdr-enfuse":
-            expected = self.image_stream.bucket_size("hdr")
-        elif plugin == "stack-enfuse":
-            expected = self.image_stream.bucket_size("stack")
-        elif plugin == "correct-illumination":
-            expected = 1
-        else:
-            assert 0, f"bad plugin {plugin}"
-        return len(self.state[statei][bucketk]) >= expected
+            dir_in = pipe["dir_out"]
+        return pipeline
 
-    def process_bucket(self, pipe, bucketk):
-        if not self.bucket_full(pipe, bucketk):
+    def add_image(self, stagei, fn):
+        """
+        Place a new image into given pipeline stage
+        Queue the bucket if this filled it
+        """
+        pipe = self.pipeline[stagei]
+        basename = os.path.basename(fn)
+        if pipe["bucket"]:
+            bucketk = reduce_iindex_filename(basename,
+                                             remove_key=pipe["bucket"])
+            bucketi = iindex_parse_fn(basename)[pipe["bucket"]]
+        else:
+            bucketk = basename
+            bucketi = 0
+        bucket = pipe["buckets"].setdefault(bucketk, {})
+        bucket[bucketi] = fn
+        if len(bucket) >= pipe["bucket_size"]:
+            del pipe["buckets"][bucketk]
+            self.queue_bucket(stagei, bucketk, bucket)
+
+    def queue_bucket(self, stagei, bucketk, bucket):
+        pipe = self.pipeline[stagei]
+        # Must be in exposure order
+        fns_in = [fn for _i, fn in sorted(bucket.items())]
+        if pipe["bucket"]:
+            fn_out = os.path.join(pipe["dir_out"],
+                                  bucketk + os.path.splitext(fns_in[0])[1])
+        else:
+            fn_out = os.path.join(pipe["dir_out"], bucketk)
+        self.pending += 1
+        if self.lazy and os.path.exists(fn_out):
+            self.log(f"lazy: skip {fn_out}")
+            self.completed.put((stagei, fn_out, "ok"))
             return
-        plugin = pipe["plugin"]
-        if plugin == "hdr-enfuse":
-            fn_out = os.path.join(pipe["dir_out"], bucketk + ".tif")
-            self.csip.queue_hdr_enfuse(fns_in=pipe["buckets"][bucketk],
-                                       fn_out=fn_out)
-        elif plugin == "stack-enfuse":
-            fn_out = os.path.join(pipe["dir_out"], bucketk + ".tif")
-            self.csip.queue_stack_enfuse(fns_in=pipe["buckets"][bucketk],
-                                         fn_out=fn_out)
-        elif plugin == "correct-illumination":
-            fn_out = os.path.join(pipe["dir_out"], bucketk + ".tif")
-            fns_in = list(pipe["buckets"][bucketk])
-            assert len(fns_in) == 1
-            self.csip.queue_correct_illumination(fn_in=fns_in[0],
-                                                 fn_out=fn_out)
-        elif plugin == "save-jpg":
-            fns_in = list(pipe["buckets"][bucketk])
-            assert len(fns_in) == 1
-            fn_out = os.path.join(pipe["dir_out"], bucketk + ".jpg")
-            self.csip.queue_convert_jpg(fn_in=fns_in[0], fn_out=fn_out)
+
+        def callback(_ip_params, result, _info):
+            # Called from worker thread
+            self.completed.put((stagei, fn_out, result))
+
+        self.verbose and self.log(f"{pipe['plugin']}: queue {fn_out}")
+        if pipe["bucket"]:
+            self.csip.queue_n_to_1_plugin(task_name=pipe["plugin"],
+                                          fns_in=fns_in,
+                                          fn_out=fn_out,
+                                          callback=callback,
+                                          priority=PRIORITY_BATCH)
         else:
-            assert 0, f"bad plugin {plugin}"
-        del self.pipe["buckets"][bucketk]
+            self.csip.queue_1_to_1_plugin(plugin=pipe["plugin"],
+                                          fn_in=fns_in[0],
+                                          fn_out=fn_out,
+                                          callback=callback,
+                                          priority=PRIORITY_BATCH)
+
+    def process_completed(self, timeout):
+        """
+        Move finished images to the next pipeline stage
+        """
+        block = True
+        while True:
+            try:
+                stagei, fn_out, result = self.completed.get(block, timeout)
+            except queue.Empty:
+                return
+            block = False
+            self.pending -= 1
+            if result != "ok":
+                self.log(f"WARNING: stream: failed to generate {fn_out}")
+                continue
+            # Ex: best effort stack failure
+            if not os.path.exists(fn_out):
+                self.log(f"WARNING: stream: missing output {fn_out}")
+                continue
+            if stagei + 1 < len(self.pipeline):
+                self.add_image(stagei + 1, fn_out)
 
     def run(self):
         """
         Stream images (ie from an in progress capture)
-        Two steams of data:
+        Two streams of data:
         -Raw images
         -Completed intermediate steps
-        Could also just grab from a filesystem hmm
-        """
-        """
-        Keep track of images at each state of the pipeline
-        Key them based on file basenames / assume they are written to the filesystem
-        """
-        self.states = []
-        for _element in self.pipeline:
-            # Buckets
-            self.states.append({})
-
-        # Done when all images have been put into pipeline and all pipeline tasks are processed
-        while not self.image_stream.done() or not self.tb.idle():
-            # New images for the pipeline?
-            new_images = self.image_stream.new_images()
-            self.bucket_images(self.pipeline[0], new_images)
-
-            # In progress images
-            for statei, new_images in self.pop_completed_images():
-                # Move to next pipeline stage if not done
-                if statei != len(self.pipeline) - 1:
-                    self.bucket_images(self.pipeline[statei + 1], new_images)
-
-            # Since images move down the pipeline, any newly completed images will move to next state
-            # Since we check earlier pipeline stages first bias towards BFS
-            # Could reorder if wanted DFS
-            for statei, pipe in enumerate(self.pipeline):
-                for bucketk in list(pipe["state"].keys()):
-                    self.process_bucket(pipe, bucketk)
-        # Finish all remaining allocated tasks
-        self.tb.wait()
-
-        # Last step after all processed
-        if self.upload:
-            assert 0, "fixme"
-            """
-            self.log("Ready to stitch " + working_iindex["dir"])
-            cloud_stitch.upload_dir(working_iindex["dir"],
-                                    cs_info=cs_info,
-                                    dst_basename=dst_basename,
-                                    verbose=verbose)
-            """
-'''
+        Returns once the image stream is done and all queued work completes
+        Incomplete buckets (ex: aborted scan) are left for DirCSIP to sort out
+        """
+        try:
+            self.log("Stream processing: %s" %
+                     ", ".join([pipe["plugin"] for pipe in self.pipeline]))
+            for pipe in self.pipeline:
+                if not os.path.exists(pipe["dir_out"]):
+                    os.mkdir(pipe["dir_out"])
+
+            while not self.image_stream.done() or self.pending:
+                # New images for the pipeline?
+                for image in self.image_stream.new_images():
+                    if self.pipeline:
+                        self.add_image(0, image.get_filename())
+                # Since images move down the pipeline as they complete
+                # this is biased towards finishing buckets (DFS)
+                self.process_completed(timeout=0.05)
+
+            for pipe in self.pipeline:
+                if pipe["buckets"]:
+                    self.log("WARNING: stream: %s: %u incomplete buckets" %
+                             (pipe["plugin"], len(pipe["buckets"])))
+            self.log("Stream processing: done")
+        finally:
+            self.image_stream.processed.set()
+
+
+class CompositeCSIP:
+    """
+    Reduce the frames of a single composite snapshot (ex: GUI focus stack) in memory
+    Same order of operations as DirCSIP: stabilization => HDR => stack
+    Frames are bucketed by their planner state index (ex: stacki)
+    and a bucket is queued as soon as it fills so processing overlaps capture
+    Nothing is encoded: intermediates stay PIL images / arrays
+    (except for plugins that can only work on files, ex: enfuse)
+
+    Register progress_callback() as a planner progress callback (planner w/o image-save)
+    then wait() for the final CapturedImage
+    If the planner fails instead, close() to remove temporary files
+    """
+    def __init__(self, csip, pconfig, microscope=None, verbose=False):
+        self.csip = csip
+        self.log = csip.log
+        self.pconfig = pconfig
+        self.microscope = microscope
+        self.verbose = verbose
+        # Frames come from the planner thread, intermediates from workers
+        self.cv = threading.Condition()
+        # Tasks queued to workers but not yet moved to the next stage
+        self.pending = 0
+        self.errors = []
+        # Worker outputs, including any temporary files
+        self.data_outs = []
+        self.first_captured_image = None
+        self.result = None
+        self.pipeline = self.make_pipeline()
+
+    def make_pipeline(self):
+        """
+        key: planner state key that gets collapsed by this stage
+        """
+        pipeline = []
+
+        def add(plugin, key, bucket_size):
+            pipeline.append({
+                "plugin": plugin,
+                "key": key,
+                "bucket_size": int(bucket_size),
+                # bucket key => {bucket index: EtherealImageR}
+                "buckets": {},
+            })
+
+        if "image-stabilization" in self.pconfig:
+            add("stabilization", "image_stabilization_i",
+                self.pconfig["image-stabilization"]["n"])
+        if "hdr" in self.pconfig["imager"]:
+            add("hdr-luminance", "hdri",
+                len(self.pconfig["imager"]["hdr"]["properties_list"]))
+        if "points-stacker" in self.pconfig:
+            add(self.microscope.usc.ipp.stack_plugin(), "stacki",
+                self.pconfig["points-stacker"]["number"])
+        return pipeline
+
+    def progress_callback(self, state):
+        """
+        Planner progress callback
+        """
+        if state["type"] != "image":
+            return
+        indices = {}
+        for pipe in self.pipeline:
+            indices[pipe["key"]] = state.get(pipe["key"], 0)
+        capim = state.get("captured_image")
+        if capim is not None:
+            self.add_captured_image(indices, capim)
+            return
+        # Pipelined capture: don't stall the planner waiting on processing
+        future = state["captured_image_future"]
+        with self.cv:
+            self.pending += 1
+
+        def done(future):
+            try:
+                self.add_captured_image(indices, future.result())
+            except Exception as e:
+                with self.cv:
+                    self.errors.append(f"capture failed: {e}")
+            with self.cv:
+                self.pending -= 1
+                self.cv.notify_all()
+
+        future.add_done_callback(done)
+
+    def add_captured_image(self, indices, capim):
+        with self.cv:
+            # Metadata comes from the first frame (ex: stack bottom)
+            if not any(indices.values()):
+                self.first_captured_image = capim
+            self.add_image(0, indices, EtherealImageR(im=capim.image))
+
+    def add_image(self, stagei, indices, image):
+        """
+        Place an image into given pipeline stage
+        Queue the bucket if this filled it
+        Must hold self.cv
+        """
+        if stagei >= len(self.pipeline):
+            self.result = image
+            return
+        pipe = self.pipeline[stagei]
+        indices = dict(indices)
+        bucketi = indices.pop(pipe["key"])
+        bucketk = tuple(sorted(indices.items()))
+        bucket = pipe["buckets"].setdefault(bucketk, {})
+        bucket[bucketi] = image
+        if len(bucket) >= pipe["bucket_size"]:
+            del pipe["buckets"][bucketk]
+            self.queue_bucket(stagei, indices, bucket)
+
+    def queue_bucket(self, stagei, indices, bucket):
+        pipe = self.pipeline[stagei]
+        # Must be in exposure / z order
+        images = [image for _i, image in sorted(bucket.items())]
+        self.pending += 1
+
+        def callback(_ip_params, result, info):
+            # Called from worker thread
+            with self.cv:
+                if result == "ok":
+                    self.add_image(stagei + 1, indices,
+                                   data_out["image"].to_image_r())
+                else:
+                    self.errors.append(f"{pipe['plugin']}: {info}")
+                self.pending -= 1
+                self.cv.notify_all()
+
+        self.verbose and self.log("%s: queue %u images %s" %
+                                  (pipe["plugin"], len(images), indices))
+        data_out = {
+            "image": EtherealImageW(want_im=True, temp_dir=self.csip.temp_dir)
+        }
+        self.data_outs.append(data_out["image"])
+        self.csip.queue_n_to_1_plugin(task_name=pipe["plugin"],
+                                      data_in={"images": images},
+                                      data_out=data_out,
+                                      callback=callback,
+                                      priority=PRIORITY_INTERACTIVE)
+
+    def wait(self, timeout=None):
+        """
+        Call once the planner is done
+        Return the final CapturedImage
+        """
+        try:
+            with self.cv:
+                if not self.cv.wait_for(lambda: self.pending == 0,
+                                        timeout=timeout or None):
+                    raise Exception("Composite: timed out processing images")
+                if self.errors:
+                    raise Exception("Composite: " + ", ".join(self.errors))
+                for pipe in self.pipeline:
+                    if pipe["buckets"]:
+                        raise Exception(
+                            "Composite: %s: %u incomplete buckets" %
+                            (pipe["plugin"], len(pipe["buckets"])))
+                if self.result is None:
+                    raise Exception("Composite: no images captured")
+                if isinstance(self.result.im, np.ndarray):
+                    image = None
+                    array = self.result.im
+                else:
+                    # Decode now: temporary files are about to be removed
+                    image = self.result.to_im()
+                    image.load()
+                    array = None
+            meta = None
+            if self.first_captured_image and self.first_captured_image.meta:
+                meta = dict(self.first_captured_image.meta)
+            return CapturedImage(image=image,
+                                 array=array,
+                                 meta=meta,
+                                 microscope=self.microscope)
+        finally:
+            self.close()
+
+    def close(self, timeout=None):
+        """
+        Remove temporary files once queued work is done
+        Safe to call more than once
+        """
+        with self.cv:
+            # Workers may still be writing them
+            self.cv.wait_for(lambda: self.pending == 0,
+                             timeout=timeout or None)
+            data_outs = self.data_outs
+            self.data_outs = []
+        for data_out in data_outs:
+            data_out.flush()
@@ -1,10 +1,12 @@
 from uscope.util import add_bool_arg
-from uscope.scan_util import index_scan_images, is_tif_scan
+from uscope.scan_util import index_scan_images
 import os
 from PIL import Image
 import struct
 from uscope.util import readj
+from uscope.imagep.tiled import DEFAULT_SINGLE_MAX_PIXELS, DEFAULT_TILE_SIZE, MosaicRenderer, TilePyramidWriter, rotated_size, single_fits, write_deep_zoom
 import math
+import json
 
 # /usr/local/lib/python2.7/dist-packages/PIL/Image.py:2210: DecompressionBombWarning: Image size (941782785 pixels) exceeds limit of 89478485 pixels, could be decompression bomb DOS attack.
 #   DecompressionBombWarning)
@@ -23,14 +25,89 @@ class HugeTIF(HugeImage):
     pass
 
 
-# FIXME: for some reason this doesn't work on .tif images
-def write_html_viewer(iindex, output_filename=None):
+class ScanJSONNotFound(Exception):
+    pass
+
+
+def first_image(iindex):
+    """
+    Index entry of the first existing (col, row)
+    c000_r000 may not exist (ex: excluded tile)
+    """
+    return iindex["crs"][min(iindex["crs"])]
+
+
+def viewer_mosaic(iindex):
+    """
+    Return (placements, width, height, mode) to lay out the final images
+    Uses stage positions from uscan.json if available, otherwise the grid
+    """
+    pano = QuickPano(iindex)
+    try:
+        pano.load_scan_json()
+    except ScanJSONNotFound:
+        pano = None
+    if pano:
+        pano.calc_dst()
+        return pano.get_placements(), pano.width, pano.height, pano.mode
+
+    print("WARNING: no uscan.json, viewer using grid layout")
+    this0 = first_image(iindex)
+    im0 = Image.open(os.path.join(iindex["dir"], this0["basename"]))
+    placements = []
+    for this in iindex["images"].values():
+        # lower left vs uppper left coordinate systems
+        row0 = iindex["rows"] - this["row"] - 1
+        placements.append({
+            "fn": os.path.join(iindex["dir"], this["basename"]),
+            "x": im0.width * this["col"],
+            "y": im0.height * row0,
+            "width": im0.width,
+            "height": im0.height,
+        })
+    return (placements, im0.width * iindex["cols"],
+            im0.height * iindex["rows"], summary_mode(im0))
+
+
+def write_html_viewer(iindex, output_filename=None, csip=None):
+    """
+    Write a Deep Zoom tile pyramid (summary/viewer.dzi + summary/viewer_files/)
+    and an index.html that only loads the tiles in view
+    The .dzi can also be opened with OpenSeadragon
+    csip: optionally render tiles on a CSImageProcessor's workers
+    """
     if output_filename is None:
         output_filename = os.path.join(iindex["dir"], "index.html")
 
     assert iindex[
         "flat"], "HTML viewer only supported on final level image set"
-
+    if not iindex["crs"]:
+        print("WARNING: no images, skipping HTML viewer")
+        return
+
+    placements, width, height, mode = viewer_mosaic(iindex)
+    d = os.path.join(iindex["dir"], "summary")
+    if not os.path.exists(d):
+        os.mkdir(d)
+    tiles_base = os.path.join(d, "viewer")
+    write_deep_zoom(placements,
+                    width,
+                    height,
+                    tiles_base,
+                    mode=mode,
+                    csip=csip,
+                    tile_size=DEFAULT_TILE_SIZE)
+
+    # Relative such that the scan directory can be moved / served as is
+    url = os.path.relpath(tiles_base + "_files",
+                          os.path.dirname(os.path.abspath(output_filename)))
+    dzi = {
+        "url": url + "/",
+        "format": "jpg",
+        "tileSize": DEFAULT_TILE_SIZE,
+        "width": width,
+        "height": height,
+    }
     out = """\
 <!DOCTYPE html>
 <html lang="en">
@@ -38,69 +115,241 @@ def write_html_viewer(iindex, output_filename=None):
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Labsmore Capture Grid View</title>
+    <title>Labsmore Scan Viewer</title>
     <style>
+        html,
         body {
+            margin: 0;
+            height: 100%;
+            overflow: hidden;
             font-family: Arial, Helvetica, sans-serif;
             color: gray;
             background-color: #000000;
         }
-        table {
-            border-collapse: collapse;
-        }
 
-        table,
-        th,
-        td {
-            border: 5px solid #000000;
+        #viewer {
+            position: absolute;
+            left: 0;
+            top: 0;
+            right: 0;
+            bottom: 0;
+            overflow: hidden;
+            cursor: grab;
+            touch-action: none;
         }
 
-        th,
-        td {
-            padding: 0px;
-            text-align: center;
+        #viewer img {
+            position: absolute;
+            user-select: none;
+            -webkit-user-drag: none;
         }
 
-        img {
-            width: 110px;
+        #info {
+            position: absolute;
+            left: 8px;
+            top: 8px;
+            z-index: 100;
+            pointer-events: none;
         }
     </style>
 </head>
 
 <body>
-    <h2><center>Labsmore Grid Viewer</center></h2>
-"""
-    if is_tif_scan(iindex["dir"]):
-        out += "WARNING: HTML viewer only works reliably with .jpg (have .tif)<br>\n"
-    out += """
-    <table>
-        <tbody>
-        """
+    <div id="viewer"></div>
+    <div id="info">Labsmore Scan Viewer: drag to pan, scroll to zoom, 0 to reset</div>
+    <script>
+        // Deep Zoom layout (Overlap 0). Embedded since file:// can't fetch the .dzi
+        const DZI = DZI_JSON;
+        const maxLevel = Math.ceil(Math.log2(Math.max(DZI.width, DZI.height)));
+        // Always keep a coarse level loaded such that there are no holes while panning
+        const baseLevel = Math.min(maxLevel, 10);
+        const viewer = document.getElementById("viewer");
+        // Full resolution coordinate at viewer upper left, screen pixels per full resolution pixel
+        let viewX = 0;
+        let viewY = 0;
+        let scale = 1;
+        let minScale = 1;
+        // "level/col_row" => img
+        const tiles = new Map();
+        let updatePending = false;
+
+        function levelSize(level) {
+            const div = Math.pow(2, maxLevel - level);
+            return [Math.ceil(DZI.width / div), Math.ceil(DZI.height / div), div];
+        }
+
+        function visibleTiles(level, want) {
+            const [w, h, div] = levelSize(level);
+            const span = DZI.tileSize * div;
+            const col0 = Math.max(0, Math.floor(viewX / span));
+            const row0 = Math.max(0, Math.floor(viewY / span));
+            const col1 = Math.min(Math.ceil(w / DZI.tileSize), Math.ceil((viewX + viewer.clientWidth / scale) / span));
+            const row1 = Math.min(Math.ceil(h / DZI.tileSize), Math.ceil((viewY + viewer.clientHeight / scale) / span));
+            for (let row = row0; row < row1; row++) {
+                for (let col = col0; col < col1; col++) {
+                    want.set(level + "/" + col + "_" + row, [level, col, row]);
+                }
+            }
+        }
+
+        function placeTile(img, level, col, row) {
+            const [w, h, div] = levelSize(level);
+            const x0 = col * DZI.tileSize;
+            const y0 = row * DZI.tileSize;
+            const x1 = Math.min(w, x0 + DZI.tileSize);
+            const y1 = Math.min(h, y0 + DZI.tileSize);
+            // Round edges, not sizes, to avoid hairline gaps between tiles
+            const left = Math.round((x0 * div - viewX) * scale);
+            const top = Math.round((y0 * div - viewY) * scale);
+            img.style.left = left + "px";
+            img.style.top = top + "px";
+            img.style.width = (Math.round((x1 * div - viewX) * scale) - left) + "px";
+            img.style.height = (Math.round((y1 * div - viewY) * scale) - top) + "px";
+        }
+
+        function update() {
+            updatePending = false;
+            // About one tile pixel per device pixel
+            const level = Math.max(0, Math.min(maxLevel,
+                maxLevel + Math.ceil(Math.log2(scale * window.devicePixelRatio))));
+            const want = new Map();
+            visibleTiles(Math.min(level, baseLevel), want);
+            visibleTiles(level, want);
+            for (const [key, img] of tiles) {
+                if (!want.has(key)) {
+                    img.remove();
+                    tiles.delete(key);
+                }
+            }
+            for (const [key, [tileLevel, col, row]] of want) {
+                let img = tiles.get(key);
+                if (!img) {
+                    img = document.createElement("img");
+                    img.src = DZI.url + tileLevel + "/" + col + "_" + row + "." + DZI.format;
+                    img.style.zIndex = tileLevel;
+                    viewer.appendChild(img);
+                    tiles.set(key, img);
+                }
+                placeTile(img, tileLevel, col, row);
+            }
+        }
+
+        function scheduleUpdate() {
+            if (!updatePending) {
+                updatePending = true;
+                window.requestAnimationFrame(update);
+            }
+        }
+
+        function fit() {
+            scale = Math.min(viewer.clientWidth / DZI.width, viewer.clientHeight / DZI.height);
+            minScale = scale / 2;
+            viewX = (DZI.width - viewer.clientWidth / scale) / 2;
+            viewY = (DZI.height - viewer.clientHeight / scale) / 2;
+            scheduleUpdate();
+        }
 
-    for row in range(iindex["rows"]):
-        out += """\
-            <tr>
-"""
-        for col in range(iindex["cols"]):
-            fn_rel = iindex["crs"][(col, row)]["basename"]
-            out += f"""\
-            <td><img src="{fn_rel}"></td>
-"""
-        out += """\
-            </tr>
-"""
-    out += """\
-        </tbody>
-    </table>
+        function zoomAt(screenX, screenY, factor) {
+            const x = viewX + screenX / scale;
+            const y = viewY + screenY / scale;
+            // Up to 4 screen pixels per image pixel
+            scale = Math.max(minScale, Math.min(4 * window.devicePixelRatio, scale * factor));
+            viewX = x - screenX / scale;
+            viewY = y - screenY / scale;
+            scheduleUpdate();
+        }
+
+        viewer.addEventListener("wheel", function (e) {
+            e.preventDefault();
+            zoomAt(e.clientX, e.clientY, Math.pow(1.002, -e.deltaY));
+        }, { passive: false });
+        viewer.addEventListener("dblclick", function (e) {
+            zoomAt(e.clientX, e.clientY, 2);
+        });
+        let drag = null;
+        viewer.addEventListener("pointerdown", function (e) {
+            drag = [e.clientX, e.clientY];
+            viewer.setPointerCapture(e.pointerId);
+            viewer.style.cursor = "grabbing";
+        });
+        viewer.addEventListener("pointermove", function (e) {
+            if (drag) {
+                viewX -= (e.clientX - drag[0]) / scale;
+                viewY -= (e.clientY - drag[1]) / scale;
+                drag = [e.clientX, e.clientY];
+                scheduleUpdate();
+            }
+        });
+        viewer.addEventListener("pointerup", function (e) {
+            drag = null;
+            viewer.style.cursor = "grab";
+        });
+        window.addEventListener("keydown", function (e) {
+            if (e.key === "0") {
+                fit();
+            } else if (e.key === "+" || e.key === "=") {
+                zoomAt(viewer.clientWidth / 2, viewer.clientHeight / 2, 2);
+            } else if (e.key === "-") {
+                zoomAt(viewer.clientWidth / 2, viewer.clientHeight / 2, 0.5);
+            }
+        });
+        window.addEventListener("resize", scheduleUpdate);
+        fit();
+    </script>
 </body>
 
 </html>
-"""
+""".replace("DZI_JSON", json.dumps(dzi))
     with open(output_filename, "w") as f:
         f.write(out)
 
 
-def write_snapshot_grid(iindex, output_filename=None):
+def summary_writer(output_filename,
+                   width,
+                   height,
+                   mode,
+                   tiles=None,
+                   single_max_pixels=DEFAULT_SINGLE_MAX_PIXELS):
+    """
+    tiles
+    -None: write a tile pyramid if output_filename can't hold full resolution
+    -True: always write a tile pyramid
+    -False: never write a tile pyramid. output_filename may be downsampled
+    Tiles go next to output_filename ex: summary/tiles.dzi + summary/tiles_files/
+    single_max_pixels: downsample output_filename beyond this many pixels (None: no limit)
+    """
+    bands = len(mode)
+    if tiles is None:
+        tiles = not single_fits(output_filename, width, height, bands,
+                                single_max_pixels)
+    tiles_base = None
+    if tiles:
+        tiles_base = os.path.splitext(output_filename)[0]
+    writer = TilePyramidWriter(width,
+                               height,
+                               mode=mode,
+                               tiles_base=tiles_base,
+                               single_fn=output_filename,
+                               single_max_pixels=single_max_pixels)
+    if writer.single_downsampled():
+        level = writer.single_level
+        print("WARNING: %s downsampled to %uw x %uh from %uw x %uh" %
+              (output_filename, level.width, level.height, width, height))
+    if tiles_base:
+        print("Full resolution tiles: %s.dzi" % (tiles_base, ))
+    return writer
+
+
+def summary_mode(im):
+    if im.mode in ("L", "RGB"):
+        return im.mode
+    return "RGB"
+
+
+def write_snapshot_grid(iindex,
+                        output_filename=None,
+                        tiles=None,
+                        single_max_pixels=DEFAULT_SINGLE_MAX_PIXELS):
     if output_filename is None:
         d = os.path.join(iindex["dir"], "summary")
         if not os.path.exists(d):
@@ -118,26 +367,32 @@ def write_snapshot_grid(iindex, output_filename=None):
     spacing = int(im0.height * 0.05)
     w = im0.size[0] * iindex["cols"] + spacing * (iindex["cols"] - 1)
     h = im0.size[1] * iindex["rows"] + spacing * (iindex["rows"] - 1)
-    dst = Image.new(im0.mode, (w, h))
-
-    if output_filename.find('.jpg') >= 0:
-        if w >= 2**16 or h >= 2**16:
-            raise HugeJPEG('Image exceeds maximum JPEG w/h')
-        # think this was tiff, not jpg...?
-        if w * h >= 2**32:
-            raise HugeJPEG('Image exceeds maximum JPEG size')
+    mode = summary_mode(im0)
 
+    placements = []
     for this in iindex["images"].values():
         x = im0.width * this["col"] + spacing * this["col"]
         # lower left vs uppper left coordinate systems
         row0 = iindex["rows"] - this["row"] - 1
         y = im0.height * row0 + spacing * row0
-        im = Image.open(os.path.join(iindex["dir"], this["basename"]))
-        dst.paste(im, (x, y))
+        placements.append({
+            "fn": os.path.join(iindex["dir"], this["basename"]),
+            "x": x,
+            "y": y,
+            "width": im0.width,
+            "height": im0.height,
+        })
 
     print(('Saving %s...' % (output_filename, )))
+    writer = summary_writer(output_filename,
+                            w,
+                            h,
+                            mode,
+                            tiles=tiles,
+                            single_max_pixels=single_max_pixels)
     try:
-        dst.save(output_filename, quality=95)
+        MosaicRenderer(placements, w, h, mode=mode).run(writer)
+        writer.close()
     # File "/usr/lib/python2.7/dist-packages/PIL/TiffImagePlugin.py", line 550, in _pack
     #   return struct.pack(self._endian + fmt, *values)
     # struct.error: 'L' format requires 0 <= number <= 4294967295
@@ -151,9 +406,15 @@ def write_snapshot_grid(iindex, output_filename=None):
 
 
 class QuickPano:
-    def __init__(self, iindex, output_filename=None):
+    def __init__(self,
+                 iindex,
+                 output_filename=None,
+                 tiles=None,
+                 single_max_pixels=DEFAULT_SINGLE_MAX_PIXELS):
         self.iindex = iindex
         self.verbose = False
+        self.tiles = tiles
+        self.single_max_pixels = single_max_pixels
 
         if output_filename is None:
             d = os.path.join(iindex["dir"], "summary")
@@ -176,7 +437,7 @@ class QuickPano:
             # assert 0, "FIXME: only support simple scans right now"
             d = os.path.dirname(d)
             if d == "/":
-                raise Exception("Failed to find uscan.json")
+                raise ScanJSONNotFound("Failed to find uscan.json")
         self.uscan = readj(scan_fn)
 
         self.cr2info = {}
@@ -193,11 +454,11 @@ class QuickPano:
             assert os.path.exists(thisj["filename"]), thisj["filename"]
             self.cr2info[(col, row)] = thisj
 
-    def new_dst(self):
+    def calc_dst(self):
         self.verbose and print('Calculating dimensions...')
 
         #with Image.open(fns_in[0]) as im0:
-        this0 = self.iindex["crs"][(0, 0)]
+        this0 = first_image(self.iindex)
         self.im0 = Image.open(
             os.path.join(self.iindex["dir"], this0["basename"]))
         im0 = self.im0
@@ -229,14 +490,18 @@ class QuickPano:
             f"Calculate image size: {global_width}w x {global_height}h")
         assert global_width > 0 and global_height > 0
 
-        if self.output_filename.find('.jpg') >= 0:
-            if global_width >= 2**16 or global_height >= 2**16:
-                raise HugeJPEG('Image exceeds maximum JPEG w/h')
-            # think this was tiff, not jpg...?
-            if global_width * global_height >= 2**32:
-                raise HugeJPEG('Image exceeds maximum JPEG size')
+        self.width = global_width
+        self.height = global_height
+        self.mode = summary_mode(im0)
 
-        self.dst = Image.new(im0.mode, (global_width, global_height))
+    def new_dst(self):
+        self.calc_dst()
+        self.dst = summary_writer(self.output_filename,
+                                  self.width,
+                                  self.height,
+                                  self.mode,
+                                  tiles=self.tiles,
+                                  single_max_pixels=self.single_max_pixels)
 
     def image_coordinate(self, col, row):
         """
@@ -281,103 +546,95 @@ class QuickPano:
                                          {}).get("optics",
                                                  {}).get("rotation_ccw")
 
-    def fill_dst_simple(self):
+    def placement(self, col, row):
+        info = self.cr2info[(col, row)]
+        x, y = self.image_coordinate(col, row)
+        self.verbose and print(f"{row}r {col}c => {x} x {y} y")
+        return {
+            "fn": os.path.join(self.iindex["dir"], info["filename"]),
+            "x": x,
+            "y": y,
+            "width": self.im0.width,
+            "height": self.im0.height,
+        }
+
+    def placements_simple(self):
         """
         Paste images in simplified manner
         Directly at coordinates, no rotation / alpha required
         """
         print('"Quick pano": fast w/o rotation')
+        ret = []
         # Fill from bottom up such that upper left is on top
         for row in range(self.iindex["rows"]):
             row = self.iindex["rows"] - row - 1
             for col in range(self.iindex["cols"]):
                 col = self.iindex["cols"] - col - 1
-                #for this in self.iindex["images"].values():
-                # col, row = this["col"], this["row"]
-                info = self.cr2info[(col, row)]
-                x, y = self.image_coordinate(col, row)
-                self.verbose and print(f"{row}r {col}c => {x} x {y} y")
-                im = Image.open(
-                    os.path.join(self.iindex["dir"], info["filename"]))
-                self.dst.paste(im, (x, y))
-
-    def fill_dst_rotate(self):
+                ret.append(self.placement(col, row))
+        return ret
+
+    def placements_rotate(self):
+        """
+        Each snapshot is rotated (and trimmed) on its own as its strip is rendered
+        """
         overlaps = self.get_overlaps()
         rotation_ccw = self.get_rotation_ccw()
-        # print("overlaps", overlaps)
         # Half each side of image
         # Need a few percent of overlap to ensure no gaps
         # TODO: calculate this based on rotation
         trim_x = int(overlaps["x"]["overlap_pixels"] * 0.48)
         trim_y = int(overlaps["y"]["overlap_pixels"] * 0.48)
-        # print("x y", trim_x, trim_y)
-        # print("rotation_ccw", rotation_ccw)
-        orig_mode = self.dst.mode
-        # self.dst.putalpha(255)
-        self.dst = self.dst.convert('RGBA')
+        rotated_width, rotated_height = rotated_size(self.im0.width,
+                                                     self.im0.height,
+                                                     rotation_ccw)
         print('"Quick pano": slower w/ rotation')
 
-        # assert 0
-
+        ret = []
         # Fill from bottom up such that upper left is on top
         for row in range(self.iindex["rows"]):
-            print("  Row %u / %u" % (row + 1, self.iindex["rows"]))
             row = self.iindex["rows"] - row - 1
             for col in range(self.iindex["cols"]):
                 col = self.iindex["cols"] - col - 1
-                # print("col", col, row)
-                #for this in self.iindex["images"].values():
-                # col, row = this["col"], this["row"]
-                info = self.cr2info[(col, row)]
-                x, y = self.image_coordinate(col, row)
-                self.verbose and print(f"{row}r {col}c => {x} x {y} y")
-                im_orig = Image.open(
-                    os.path.join(self.iindex["dir"], info["filename"]))
-
-                im = im_orig.convert('RGBA')
-                # im.putalpha(255)
-                im = im.rotate(rotation_ccw, Image.BICUBIC, expand=True)
-                offset_x = 0
-                offset_y = 0
-                """
-                if rotation_ccw > 0:
-                    offset_x = -int(math.sin(rotation_ccw * 3.14 / 180) * im_orig.height)
-                else:
-                    offset_y = -int(math.sin(-rotation_ccw * 3.14 / 180) * im_orig.width)
-                print("offsets", offset_x, offset_y)
-                """
-
+                placement = self.placement(col, row)
                 crop_x0 = 0
-                crop_x1 = im.width
+                crop_x1 = rotated_width
                 crop_y0 = 0
-                crop_y1 = im.height
+                crop_y1 = rotated_height
                 if col > 0:
                     crop_x0 = trim_x
-                    offset_x += crop_x0
                 if row > 0:
                     crop_y0 = trim_y
-                    offset_y += crop_y0
                 if col < self.iindex["cols"] - 1:
                     crop_x1 -= trim_x
                 if row < self.iindex["rows"] - 1:
                     crop_y1 -= trim_y
-                # print("crop", crop_x0, crop_y0, crop_x1, crop_y1)
-                im = im.crop((crop_x0, crop_y0, crop_x1, crop_y1))
-                # print("paste", (x, y), (x + offset_x, y + offset_y))
-
-                self.dst.paste(im, (x + offset_x, y + offset_y), im)
-        self.dst = self.dst.convert(orig_mode)
+                placement["x"] += crop_x0
+                placement["y"] += crop_y0
+                placement["width"] = crop_x1 - crop_x0
+                placement["height"] = crop_y1 - crop_y0
+                placement["rotate_ccw"] = rotation_ccw
+                placement["crop"] = (crop_x0, crop_y0, crop_x1, crop_y1)
+                ret.append(placement)
+        return ret
 
-    def fill_dst(self):
+    def get_placements(self):
         if self.get_rotation_ccw():
-            self.fill_dst_rotate()
+            return self.placements_rotate()
         else:
-            self.fill_dst_simple()
+            return self.placements_simple()
+
+    def fill_dst(self):
+        placements = self.get_placements()
+        MosaicRenderer(placements,
+                       self.width,
+                       self.height,
+                       mode=self.mode,
+                       verbose=self.verbose).run(self.dst)
 
     def save(self):
         self.verbose and print(('Saving %s...' % (self.output_filename, )))
         try:
-            self.dst.save(self.output_filename, quality=95)
+            self.dst.close()
         # File "/usr/lib/python2.7/dist-packages/PIL/TiffImagePlugin.py", line 550, in _pack
         #   return struct.pack(self._endian + fmt, *values)
         # struct.error: 'L' format requires 0 <= number <= 4294967295
@@ -387,7 +644,7 @@ class QuickPano:
             except OSError:
                 pass
             raise HugeTIF("Failed to save image of size %uw x %uh" %
-                          (self.dst.width, self.dst.height))
+                          (self.width, self.height))
 
     def run(self):
         assert self.iindex[
@@ -410,6 +667,15 @@ def main():
     add_bool_arg(parser, "--html", default=True)
     add_bool_arg(parser, "--snapshot-grid", default=True)
     add_bool_arg(parser, "--quick-pano", default=True)
+    parser.add_argument("--tiles",
+                        action="store_true",
+                        default=None,
+                        help="Always write full resolution tile pyramid")
+    parser.add_argument(
+        "--single-max-pixels",
+        type=int,
+        default=None,
+        help="Downsample single image output beyond this many pixels")
     parser.add_argument("dir_in")
     args = parser.parse_args()
 
@@ -419,10 +685,14 @@ def main():
         write_html_viewer(iindex)
 
     if args.snapshot_grid:
-        write_snapshot_grid(iindex)
-
-    if args.tile_image:
-        write_quick_pano(iindex)
+        write_snapshot_grid(iindex,
+                            tiles=args.tiles,
+                            single_max_pixels=args.single_max_pixels)
+
+    if args.quick_pano:
+        write_quick_pano(iindex,
+                         tiles=args.tiles,
+                         single_max_pixels=args.single_max_pixels)
 
 
 if __name__ == "__main__":
@@ -75,6 +75,17 @@ class ImageProcessingThreadBase(CommandThreadBase):
         }
         self.command("process_image", j, block=block, callback=callback)
 
+    def process_stream(self, image_stream):
+        """
+        Process images as a scan saves them (see StreamCSIP)
+        Runs outside of the command queue so snapshots / autofocus still work during the scan
+        """
+        thread = threading.Thread(target=self.ip.process_stream,
+                                  args=(image_stream, ),
+                                  daemon=True)
+        thread.start()
+        return thread
+
     # TODO: move more of this to the image processing thread
     # rotate, scaling
     def _do_process_image(self, j):
@@ -0,0 +1,484 @@
+"""
+Tiled, streaming mosaic output for scans too large for a single image
+
+A mosaic is described by a list of placements (image file + upper left paste coordinate)
+It is rendered in full width row strips such that only one strip
+plus the snapshots overlapping it are in memory at a time
+
+Strips are fed into a TilePyramidWriter which writes
+-full resolution tiles and 2x downsampled overview levels
+ in Deep Zoom (.dzi) layout: <name>_files/<level>/<col>_<row>.jpg
+-optionally a single image file at the largest level that fits
+ (ex: JPEG is limited to 65500 x 65500)
+
+write_deep_zoom() splits a pyramid into bands of rows that can be rendered in parallel
+Each band writes its full resolution tiles and the overview levels that align with it
+The remaining (small) levels are built from those afterwards
+"""
+
+from uscope.imagep.util import TaskBarrier, PRIORITY_BATCH
+from PIL import Image
+import numpy as np
+import cv2
+import math
+import os
+import shutil
+
+# Deep Zoom / OpenSeadragon default is 254 + 1 overlap. No overlap keeps strips simple
+DEFAULT_TILE_SIZE = 256
+# Target level 0 strip size. Rounded to a multiple of the tile size
+DEFAULT_STRIP_BYTES = 64 * 1024 * 1024
+# Levels written per parallel band => band is 256 * 2**4 = 4096 rows
+DEFAULT_BAND_LEVELS = 5
+# Single image output is held in memory
+# Optionally cap it (ex: 2**27) to downsample it instead. Default: only format limits apply
+DEFAULT_SINGLE_MAX_PIXELS = None
+JPEG_MAX_DIM = 65500
+TIF_MAX_BYTES = 2**32 - 2**20
+
+
+def single_fits(fn,
+                width,
+                height,
+                bands,
+                max_pixels=DEFAULT_SINGLE_MAX_PIXELS):
+    """
+    Can a single image file of this size be written?
+    """
+    if max_pixels and width * height > max_pixels:
+        return False
+    ext = os.path.splitext(fn)[1].lower()
+    if ext in (".jpg", ".jpeg"):
+        return width <= JPEG_MAX_DIM and height <= JPEG_MAX_DIM
+    if ext in (".tif", ".tiff"):
+        return width * height * bands < TIF_MAX_BYTES
+    return True
+
+
+def level_count(width, height):
+    """
+    Deep Zoom levels: level 0 is 1x1, last level is full resolution
+    """
+    return int(math.ceil(math.log2(max(width, height, 1)))) + 1
+
+
+def strip_rows(width,
+               bands,
+               tile_size=DEFAULT_TILE_SIZE,
+               strip_bytes=DEFAULT_STRIP_BYTES):
+    rows = strip_bytes // (width * bands)
+    return max(tile_size, rows // tile_size * tile_size)
+
+
+def write_dzi(tiles_base, width, height, tile_size, tile_format):
+    with open(tiles_base + ".dzi", "w") as f:
+        f.write("""\
+<?xml version="1.0" encoding="UTF-8"?>
+<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="%s" Overlap="0" TileSize="%u">
+    <Size Width="%u" Height="%u"/>
+</Image>
+""" % (tile_format, tile_size, width, height))
+
+
+class PyramidLevel:
+    """
+    Consumes full width rows of one level top to bottom
+    Cuts them into tiles and feeds a 2x downsample to the next (smaller) level
+    height / tile_row: rows of this level handled by this writer (may be a band)
+    """
+    def __init__(self, writer, level, width, height, tile_row=0):
+        self.writer = writer
+        self.level = level
+        self.width = width
+        self.height = height
+        self.write_tiles = False
+        # Smaller level
+        self.next = None
+        # Rows not yet written as tiles
+        self.pending = []
+        self.pending_rows = 0
+        self.tile_row = tile_row
+        # Odd row waiting for its pair to downsample
+        self.carry = None
+        self.single = None
+        self.y = 0
+
+    def tile_dir(self):
+        return os.path.join(self.writer.tiles_dir, str(self.level))
+
+    def write(self, rows):
+        n = rows.shape[0]
+        assert self.y + n <= self.height, (self.level, self.y, n, self.height)
+        if self.single is not None:
+            self.single[self.y:self.y + n] = rows
+        if self.write_tiles:
+            self.pending.append(rows)
+            self.pending_rows += n
+            while self.pending_rows >= self.writer.tile_size:
+                self.flush_tiles(self.writer.tile_size)
+        if self.next:
+            if self.carry is not None:
+                rows = np.concatenate((self.carry, rows))
+                self.carry = None
+            even = rows.shape[0] & ~1
+            if even < rows.shape[0]:
+                self.carry = rows[even:]
+            if even:
+                self.next.write(self.downsample(rows[:even]))
+        self.y += n
+
+    def downsample(self, rows):
+        return cv2.resize(rows, (self.next.width, max(1, rows.shape[0] // 2)),
+                          interpolation=cv2.INTER_AREA)
+
+    def flush_tiles(self, n):
+        buf = np.concatenate(self.pending) if len(
+            self.pending) > 1 else self.pending[0]
+        rows, rest = buf[:n], buf[n:]
+        self.pending = [rest] if len(rest) else []
+        self.pending_rows = len(rest)
+        tile_size = self.writer.tile_size
+        for tile_col, x in enumerate(range(0, self.width, tile_size)):
+            fn = os.path.join(
+                self.tile_dir(), "%u_%u.%s" %
+                (tile_col, self.tile_row, self.writer.tile_format))
+            self.writer.save_tile(rows[:, x:x + tile_size], fn)
+        self.tile_row += 1
+
+    def finish(self):
+        assert self.y == self.height, (self.level, self.y, self.height)
+        if self.write_tiles and self.pending_rows:
+            self.flush_tiles(self.pending_rows)
+        if self.next:
+            if self.carry is not None:
+                self.next.write(self.downsample(self.carry))
+                self.carry = None
+            self.next.finish()
+
+
+class TilePyramidWriter:
+    """
+    Write an image too large to hold in memory given its rows top to bottom
+    Memory use is roughly one tile row per level + the single image (if any)
+
+    tiles
+    -True: write Deep Zoom tile pyramid <tiles_base>.dzi + <tiles_base>_files/
+    -False: only write the single image
+    single_fn: also write a single image at the largest level satisfying single_fits()
+    band: (y0, y1) only these full resolution rows will be written. See write_band()
+    nlevels: only write this many levels, starting at full resolution
+    """
+    def __init__(self,
+                 width,
+                 height,
+                 mode="RGB",
+                 tiles_base=None,
+                 single_fn=None,
+                 tile_size=DEFAULT_TILE_SIZE,
+                 tile_format="jpg",
+                 quality=90,
+                 single_max_pixels=DEFAULT_SINGLE_MAX_PIXELS,
+                 single_quality=95,
+                 band=None,
+                 nlevels=None,
+                 dzi=True):
+        assert mode in ("RGB", "L"), mode
+        assert tiles_base or single_fn
+        assert not (band and single_fn)
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.bands = len(mode)
+        self.tiles_base = tiles_base
+        self.tiles_dir = None
+        if tiles_base:
+            self.tiles_dir = tiles_base + "_files"
+        self.single_fn = single_fn
+        self.tile_size = tile_size
+        self.tile_format = tile_format
+        self.quality = quality
+        self.single_quality = single_quality
+        self.single_level = None
+        self.dzi = dzi
+
+        self.nlevels = level_count(width, height)
+        if nlevels is None:
+            nlevels = self.nlevels
+        y0, y1 = band or (0, height)
+        # Band must start on a tile boundary of every level it writes
+        assert y0 % (tile_size * 2**(nlevels - 1)) == 0, (y0, nlevels)
+        # Full resolution first
+        self.levels = []
+        for i in range(nlevels):
+            scale = 2**i
+            level_y0 = y0 // scale
+            self.levels.append(
+                PyramidLevel(self,
+                             self.nlevels - 1 - i,
+                             int(math.ceil(width / scale)),
+                             int(math.ceil(y1 / scale)) - level_y0,
+                             tile_row=level_y0 // tile_size))
+        for level in self.levels:
+            level.write_tiles = bool(tiles_base)
+        if single_fn:
+            for level in self.levels:
+                if single_fits(single_fn, level.width, level.height,
+                               self.bands, single_max_pixels):
+                    self.single_level = level
+                    break
+            assert self.single_level, "Failed to fit single image"
+            self.single_level.single = np.zeros(self.shape(
+                self.single_level.width, self.single_level.height),
+                                                dtype=np.uint8)
+        # Only chain down as far as something needs the rows
+        last = self.levels[-1] if tiles_base else self.single_level
+        for above, below in zip(self.levels, self.levels[1:]):
+            if above is last:
+                break
+            above.next = below
+        if self.tiles_dir:
+            for level in self.levels:
+                os.makedirs(level.tile_dir(), exist_ok=True)
+
+    def shape(self, width, height):
+        if self.bands == 1:
+            return (height, width)
+        return (height, width, self.bands)
+
+    def single_downsampled(self):
+        """
+        Is the single image smaller than full resolution?
+        """
+        return self.single_level is not None and self.single_level is not self.levels[
+            0]
+
+    def save_tile(self, rows, fn):
+        Image.fromarray(np.ascontiguousarray(rows),
+                        self.mode).save(fn, quality=self.quality)
+
+    def write(self, rows):
+        """
+        Next rows (full width, top to bottom) as a numpy array or PIL image
+        """
+        self.levels[0].write(np.asarray(rows))
+
+    def close(self):
+        self.levels[0].finish()
+        if self.tiles_base and self.dzi:
+            write_dzi(self.tiles_base, self.width, self.height, self.tile_size,
+                      self.tile_format)
+        if self.single_level:
+            im = Image.fromarray(self.single_level.single, self.mode)
+            self.single_level.single = None
+            im.save(self.single_fn, quality=self.single_quality)
+
+
+"""
+Mosaic rendering
+Placement: dict
+-fn: image file name
+-x, y: upper left paste coordinate in the mosaic
+-width, height: size of the pasted (possibly rotated + cropped) image
+-rotate_ccw: optional degrees CCW to rotate the image before pasting
+-crop: optional (x0, y0, x1, y1) crop after rotation
+Later placements are pasted on top of earlier ones
+"""
+
+
+def rotated_size(width, height, rotate_ccw):
+    """
+    Size Image.rotate(expand=True) will produce
+    """
+    return Image.new("L", (width, height)).rotate(rotate_ccw, expand=True).size
+
+
+def load_placement(placement, mode):
+    im = Image.open(placement["fn"])
+    rotate_ccw = placement.get("rotate_ccw")
+    if rotate_ccw:
+        # Alpha marks the rotated image area so corners don't cover neighbors
+        im = im.convert(mode + "A").rotate(rotate_ccw,
+                                           Image.BICUBIC,
+                                           expand=True)
+    else:
+        im = im.convert(mode)
+    crop = placement.get("crop")
+    if crop:
+        im = im.crop(crop)
+    return im
+
+
+class MosaicRenderer:
+    """
+    Render a mosaic in row strips
+    Snapshots are decoded (and rotated) once and dropped after the last strip they overlap
+    """
+    def __init__(self, placements, width, height, mode="RGB", verbose=False):
+        self.placements = placements
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.verbose = verbose
+        # placement index => loaded image
+        self.cache = {}
+
+    def render_strip(self, y0, y1):
+        strip = Image.new(self.mode, (self.width, y1 - y0))
+        for i, placement in enumerate(self.placements):
+            py0 = placement["y"]
+            py1 = py0 + placement["height"]
+            if py1 <= y0 or py0 >= y1:
+                continue
+            im = self.cache.get(i)
+            if im is None:
+                im = load_placement(placement, self.mode)
+                self.cache[i] = im
+            mask = im if im.mode.endswith("A") else None
+            strip.paste(im, (placement["x"], py0 - y0), mask)
+            if py1 <= y1:
+                del self.cache[i]
+        return strip
+
+    def run(self, writer, rows=None, band=None):
+        if rows is None:
+            rows = strip_rows(self.width, len(self.mode), writer.tile_size)
+        band_y0, band_y1 = band or (0, self.height)
+        for y0 in range(band_y0, band_y1, rows):
+            y1 = min(band_y1, y0 + rows)
+            self.verbose and print("  Rows %u - %u / %u" %
+                                   (y0, y1, self.height))
+            writer.write(self.render_strip(y0, y1))
+        self.cache = {}
+
+
+def write_band(placements,
+               width,
+               height,
+               tiles_base,
+               y0,
+               y1,
+               band_levels,
+               mode="RGB",
+               tile_size=DEFAULT_TILE_SIZE,
+               tile_format="jpg",
+               quality=90):
+    """
+    Render full resolution rows y0:y1 and write their tiles for band_levels levels
+    Independent of other bands => can run in any worker
+    """
+    writer = TilePyramidWriter(width,
+                               height,
+                               mode=mode,
+                               tiles_base=tiles_base,
+                               tile_size=tile_size,
+                               tile_format=tile_format,
+                               quality=quality,
+                               band=(y0, y1),
+                               nlevels=band_levels,
+                               dzi=False)
+    MosaicRenderer(placements, width, height, mode=mode).run(writer,
+                                                             band=(y0, y1))
+    writer.close()
+
+
+def read_tile_row(tiles_dir, level, tile_row, width, mode, tile_size,
+                  tile_format):
+    ims = []
+    for tile_col in range(int(math.ceil(width / tile_size))):
+        fn = os.path.join(tiles_dir, str(level),
+                          "%u_%u.%s" % (tile_col, tile_row, tile_format))
+        ims.append(np.asarray(Image.open(fn).convert(mode)))
+    return np.concatenate(ims, axis=1)
+
+
+def write_deep_zoom(placements,
+                    width,
+                    height,
+                    tiles_base,
+                    mode="RGB",
+                    csip=None,
+                    tile_size=DEFAULT_TILE_SIZE,
+                    tile_format="jpg",
+                    quality=90,
+                    band_levels=DEFAULT_BAND_LEVELS,
+                    log=print):
+    """
+    Write a full Deep Zoom pyramid <tiles_base>.dzi + <tiles_base>_files/
+    Bands are queued on csip (CSImageProcessor) if given, otherwise run here
+    """
+    tiles_dir = tiles_base + "_files"
+    # Don't mix in tiles from a differently sized previous run
+    if os.path.exists(tiles_dir):
+        shutil.rmtree(tiles_dir)
+    nlevels = level_count(width, height)
+    band_levels = min(band_levels, nlevels)
+    band_rows = tile_size * 2**(band_levels - 1)
+
+    tasks = []
+    for y0 in range(0, height, band_rows):
+        y1 = min(height, y0 + band_rows)
+        tasks.append({
+            "placements": [
+                placement for placement in placements
+                if placement["y"] < y1 and placement["y"] +
+                placement["height"] > y0
+            ],
+            "width":
+            width,
+            "height":
+            height,
+            "tiles_base":
+            tiles_base,
+            "y0":
+            y0,
+            "y1":
+            y1,
+            "band_levels":
+            band_levels,
+            "mode":
+            mode,
+            "tile_size":
+            tile_size,
+            "tile_format":
+            tile_format,
+            "quality":
+            quality,
+        })
+    log("Deep zoom: %uw x %uh, %u levels, %u bands" %
+        (width, height, nlevels, len(tasks)))
+    if csip:
+        tb = TaskBarrier()
+        for task in tasks:
+            csip.queue_1_to_1_plugin(plugin="deep-zoom-band",
+                                     data_in={},
+                                     data_out={},
+                                     options={"deep_zoom_band": task},
+                                     tb=tb,
+                                     priority=PRIORITY_BATCH)
+        tb.wait()
+    else:
+        for task in tasks:
+            write_band(**task)
+
+    # Smallest level written by the bands feeds the remaining levels
+    if band_levels < nlevels:
+        scale = 2**(band_levels - 1)
+        top_width = int(math.ceil(width / scale))
+        top_height = int(math.ceil(height / scale))
+        writer = TilePyramidWriter(top_width,
+                                   top_height,
+                                   mode=mode,
+                                   tiles_base=tiles_base,
+                                   tile_size=tile_size,
+                                   tile_format=tile_format,
+                                   quality=quality,
+                                   dzi=False)
+        top = writer.levels[0]
+        assert top.level == nlevels - band_levels
+        top.write_tiles = False
+        for tile_row in range(int(math.ceil(top_height / tile_size))):
+            writer.write(
+                read_tile_row(tiles_dir, top.level, tile_row, top_width, mode,
+                              tile_size, tile_format))
+        writer.close()
+    write_dzi(tiles_base, width, height, tile_size, tile_format)
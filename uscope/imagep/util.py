@@ -1,10 +1,13 @@
 import time
 import os
+import threading
 from PIL import Image, UnidentifiedImageError
+import numpy as np
 import subprocess
 import tempfile
 import shutil
 import re
+from uscope import metrics
 # 2024-02-29: this package keeps being problematic
 try:
     import pyzbar
@@ -22,12 +25,16 @@ class EtherealImageR:
     An image that may be on filesystem or in memory
     User tells it what it wants it will munge it into place
     Read only
+    In memory images may be a PIL image or a numpy array (RGB, HxWxC)
     """
-    def __init__(self, im=None, fn=None, meta=None):
+    def __init__(self, im=None, fn=None, meta=None, temp_dir=None):
         self.im = im
         self.fn = fn
         self.tmp_files = set()
         self.meta = meta
+        self.temp_dir = temp_dir
+        # Lazily written copy of an in memory image
+        self.temp_filename = None
 
     def __del__(self):
         self.flush()
@@ -37,17 +44,27 @@ class EtherealImageR:
         Remove all temporary files
         """
         for fn in self.tmp_files:
-            os.unlink(fn)
+            if os.path.lexists(fn):
+                os.unlink(fn)
         self.tmp_files.clear()
+        self.temp_filename = None
 
     def get_filename(self):
         """
         Return any valid filename
+        In memory images are written to a temporary .tif on first use
         """
         if self.fn:
             return self.fn
-        else:
-            assert 0, "FIXME"
+        if self.temp_filename is None:
+            handle, fn = tempfile.mkstemp(prefix="ethereal_",
+                                          suffix=".tif",
+                                          dir=self.temp_dir)
+            os.close(handle)
+            self.to_im().save(fn)
+            self.tmp_files.add(fn)
+            self.temp_filename = fn
+        return self.temp_filename
 
     def to_filename(self, fn):
         """
@@ -56,8 +73,8 @@ class EtherealImageR:
         Image may be written or symlinked to
         """
         assert fn not in self.tmp_files
-        if self.im:
-            self.im.write(fn)
+        if self.im is not None:
+            self.to_im().save(fn)
         else:
             os.symlink(self.fn, fn)
         self.tmp_files.add(fn)
@@ -69,8 +86,8 @@ class EtherealImageR:
         if self.fn:
             subprocess.check_call(["convert", self.fn, fn])
             assert os.path.exists(fn)
-        elif self.im:
-            self.im.write(fn)
+        elif self.im is not None:
+            self.to_im().save(fn)
         else:
             assert 0
 
@@ -84,39 +101,44 @@ class EtherealImageR:
         """
         Return a read only PIL image
         """
-        if self.im:
-            return self.im
-        else:
+        if self.im is None:
             return Image.open(self.fn)
+        elif isinstance(self.im, np.ndarray):
+            return Image.fromarray(self.im)
+        else:
+            return self.im
 
     def to_mutable_im(self):
         """
         Return a writable PIL image
         """
-        if self.im:
-            return self.im.copy()
-        else:
+        if self.im is None:
             return Image.open(self.fn)
+        elif isinstance(self.im, np.ndarray):
+            return Image.fromarray(self.im)
+        else:
+            return self.im.copy()
+
+    def to_np(self):
+        """
+        Return a read only numpy array
+        Avoids a PIL round trip when the previous step produced an array
+        """
+        if isinstance(self.im, np.ndarray):
+            return self.im
+        return np.asarray(self.to_im())
 
 
 class EtherealImageW:
     """
     An image that will be written to output
     User gives some hints as to how it would like the image to be output
-    FIXME: filename centric. Allow setting an Image
-    This mostly works as we currently write all intermediate images anyway
-    """
-
-    temp_images = 0
-
-    # NOTE: this is thread safe because EtherealImageW()s are constructed in the queing process
-    # from the controller
-    # However it would be ideal to make this thread safe
-    @staticmethod
-    def get_image_id():
-        EtherealImageW.temp_images += 1
-        return EtherealImageW.temp_images
 
+    want_fn: plugin output is written (encoded) to the given file
+    want_im: plugin output is kept in memory
+        Plugins that can only write files (ex: enfuse) can still call get_filename()
+        In that case a temporary file is used instead
+    """
     def __init__(self,
                  want_dir=None,
                  want_basename=None,
@@ -128,9 +150,10 @@ class EtherealImageW:
         self.im = None
         self.want_fn = None
         self.temp_filename = None
+        self.temp_dir = temp_dir
         self.want_im = False
-
-        tempfile.TemporaryDirectory()
+        # Options used if / when the image is encoded
+        self.save_kwargs = {}
 
         if want_fn:
             self.want_fn = want_fn
@@ -138,48 +161,117 @@ class EtherealImageW:
             self.want_fn = os.path.join(want_dir, want_basename)
         elif want_im:
             self.want_im = True
-            assert temp_dir
-            self.temp_filename = os.path.join(
-                temp_dir, "ethereal_%u04u.tif" % EtherealImageW.get_image_id())
-            self.want_fn = self.temp_filename
         else:
             assert 0, "Unknown operating mode"
         self.meta = meta
 
     def get_filename(self):
-        return self.want_fn
+        """
+        Filename plugin should write output to
+        """
+        if self.want_fn:
+            return self.want_fn
+        if self.temp_filename is None:
+            # Process pool workers share temp_dir
+            # A per process counter would hand out the same name in each of them
+            handle, self.temp_filename = tempfile.mkstemp(prefix="ethereal_",
+                                                          suffix=".tif",
+                                                          dir=self.temp_dir)
+            os.close(handle)
+        return self.temp_filename
+
+    def write_im(self, im, **kwargs):
+        """
+        Plugin output as a PIL image or numpy array (RGB)
+        kwargs are PIL save() options (ex: quality, exif)
+        In memory outputs are not encoded
+        """
+        if self.want_im:
+            self.im = im
+            self.save_kwargs = kwargs
+        else:
+            if isinstance(im, np.ndarray):
+                im = Image.fromarray(im)
+            im.save(self.want_fn, **kwargs)
+            metrics.bytes_written.inc(os.path.getsize(self.want_fn),
+                                      source="imagep")
 
     def get_im(self):
-        return Image.open(self.want_fn)
+        """
+        Return the output as a PIL image
+        """
+        if self.im is None:
+            return Image.open(self.get_filename())
+        elif isinstance(self.im, np.ndarray):
+            return Image.fromarray(self.im)
+        else:
+            return self.im
+
+    def save(self, fn):
+        """
+        Write a copy of the output to given file (ex: debug dump)
+        """
+        # Re-encode as fn's format may differ from the temporary file
+        self.get_im().save(fn, **self.save_kwargs)
+
+    def to_image_r(self):
+        """
+        Return output as an input to the next processing step
+        """
+        if self.im is not None:
+            return EtherealImageR(im=self.im, temp_dir=self.temp_dir)
+        else:
+            return EtherealImageR(fn=self.get_filename(),
+                                  temp_dir=self.temp_dir)
+
+    def flush(self):
+        """
+        Remove temporary file, if any
+        """
+        if self.temp_filename and os.path.exists(self.temp_filename):
+            os.unlink(self.temp_filename)
+        self.temp_filename = None
 
 
 class SubtaskException(Exception):
     pass
 
 
+"""
+Image processing task priorities, lower runs first
+Ex: an interactive snapshot jumps ahead of a scan being processed
+"""
+PRIORITY_INTERACTIVE = 0
+PRIORITY_DEFAULT = 10
+PRIORITY_BATCH = 20
+
+
 class TaskBarrier:
     """
     Track when all allocated tasks are complete
-    TODO: consider an event to wake up for faster response
+    Waiters wake as soon as the last task completes
     """
     def __init__(self):
         self.ntasks_allocated = 0
         self.ntasks_completed = 0
         self.exceptions = 0
+        # Callbacks come from worker threads
+        self.cv = threading.Condition()
 
     def callback(self):
-        self.ntasks_completed += 1
+        with self.cv:
+            self.ntasks_completed += 1
+            self.cv.notify_all()
 
     def allocate_callback(self):
-        self.ntasks_allocated += 1
+        with self.cv:
+            self.ntasks_allocated += 1
         return self.callback
 
     def wait(self, timeout=None):
-        tstart = time.time()
-        while self.ntasks_allocated > self.ntasks_completed:
-            if timeout and time.time() - tstart > timeout:
+        with self.cv:
+            if not self.cv.wait_for(self.idle, timeout=timeout or None):
                 raise Exception("Timed out")
-            time.sleep(0.1)
         if self.exceptions:
             raise SubtaskException("Task(s) completed with exception")
 
@@ -187,7 +279,8 @@ class TaskBarrier:
         return self.ntasks_allocated == self.ntasks_completed
 
     def add_exception(self):
-        self.exceptions += 1
+        with self.cv:
+            self.exceptions += 1
 
 
 def remove_intermediate_directories(top_dir, nested_dir):
@@ -2,6 +2,8 @@ import cv2 as cv
 import numpy as np
 from uscope.imagep.util import RC_CONST
 from uscope.microscope import StopEvent
+from uscope.planner.fly import FlyRow
+import time
 
 
 def choose_best_image(images_iter, log=None, verbose=False):
@@ -44,6 +46,79 @@ def choose_best_image(images_iter, log=None, verbose=False):
     return k, fni
 
 
+def focus_score(image, crop=3, binning=2):
+    """
+    Cheap sharpness metric, higher is sharper
+    Much faster than choose_best_image() scoring: intended for sweeps
+    image: PIL image or numpy array (ex: CapturedImage.array)
+    Uses the center 1 / crop of the image, binned by binning
+    """
+    im = np.asarray(image)
+    if im.ndim == 3:
+        # Green has the most signal on a Bayer sensor
+        im = im[:, :, 1]
+    height, width = im.shape
+    h = height // crop // binning * binning
+    w = width // crop // binning * binning
+    top = (height - h) // 2
+    left = (width - w) // 2
+    im = im[top:top + h, left:left + w].astype(np.float32)
+    if binning > 1:
+        im = im.reshape(h // binning, binning, w // binning,
+                        binning).mean(axis=(1, 3))
+    return float(cv.Laplacian(im, cv.CV_32F).var())
+
+
+def parabolic_peak(xs, ys):
+    """
+    Sub-step location of the maximum of ys
+    Fits a parabola through the best sample and its neighbors
+    xs must be sorted
+    """
+    i = int(np.argmax(ys))
+    if i == 0 or i == len(xs) - 1:
+        return xs[i]
+    a, b, _c = np.polyfit(xs[i - 1:i + 2], ys[i - 1:i + 2], 2)
+    if a >= 0:
+        return xs[i]
+    return float(min(max(-b / (2 * a), xs[i - 1]), xs[i + 1]))
+
+
+def climb_focus(score_at, z, step, max_steps=6, patience=1):
+    """
+    Hill climb for best focus, stopping once the peak has been passed
+    Starts one step behind z and climbs along step (sign is direction)
+    Turns around if focus gets worse right away
+    score_at(z): move to z and return its focus_score()
+    Return (best z, best score), best z interpolated between steps
+    """
+    scores = {}
+
+    def sample(i):
+        scores[i] = score_at(z + i * step)
+
+    sample(-1)
+    best = -1
+    for direction in (1, -1):
+        i = -1
+        falls = 0
+        while falls < patience and abs(i + direction) <= max_steps:
+            i += direction
+            if i not in scores:
+                sample(i)
+            if scores[i] > scores[best]:
+                best = i
+                falls = 0
+            else:
+                falls += 1
+        # Improved going forward => peak is bracketed
+        if best != -1:
+            break
+    samples = sorted((z + i * step, score) for i, score in scores.items())
+    zs = [this_z for this_z, _score in samples]
+    return parabolic_peak(zs, [score for _z, score in samples]), scores[best]
+
+
 class Autofocus:
     # FIXME: pass in a Microscope object w/ correct / thread safe objects
     def __init__(self,
@@ -61,11 +136,26 @@ class Autofocus:
         self.imager = imager
         self.kinematics = kinematics
         self.poll = poll
+        self.config = microscope.usc.autofocus
+        # Last run: method, duration (sec), frames
+        self.metrics = {}
+
+    def move_absolute_block(self, pos, options={}):
+        self.move_absolute(pos, block=True, options=options)
 
     def move_absolute_wait(self, pos):
-        self.move_absolute(pos, block=True)
+        self.move_absolute_block(pos)
         self.kinematics.wait_autofocus()
 
+    def check_poll(self, se):
+        se.poll()
+        if self.poll:
+            self.poll()
+
+    def get_image(self):
+        self.metrics["frames"] += 1
+        return self.imager.get()
+
     def auto_focus_pass(self,
                         se,
                         step_size,
@@ -99,7 +189,7 @@ class Autofocus:
                 0 and self.log("autofocus round %u / %u: try %0.6f" %
                                (focusi + 1, steps, target_pos))
                 self.move_absolute_wait({"z": target_pos})
-                im_pil = self.imager.get().image
+                im_pil = self.get_image().image
                 yield target_pos, im_pil
 
         se.poll()
@@ -127,6 +217,78 @@ class Autofocus:
         rounded_move = steps * machine_epsilon
         return rounded_move
 
+    def climb_pass(self, se, step_size, max_steps, start_pos=None):
+        """
+        Like auto_focus_pass() but stop once past the peak
+        """
+        if start_pos is None:
+            start_pos = self.pos()["z"]
+
+        def score_at(z):
+            self.check_poll(se)
+            self.move_absolute_wait({"z": z})
+            return focus_score(self.get_image().array)
+
+        # Descend like auto_focus_pass()
+        target_pos, score = climb_focus(score_at,
+                                        start_pos,
+                                        -step_size,
+                                        max_steps=max_steps,
+                                        patience=self.config.patience())
+        self.log("autofocus: peak %0.6f (score %0.1f)" % (target_pos, score))
+        return target_pos
+
+    def continuous_pass(self, se, step_size, distance, start_pos=None):
+        """
+        Sweep z once over start_pos +/- distance while streaming frames
+        About one frame every step_size, each placed in z by its timestamp
+        Avoids a settle per step but needs a steady frame rate
+        """
+        if start_pos is None:
+            start_pos = self.pos()["z"]
+        exposure = self.config.exposure()
+        if exposure is None:
+            # GUI imager reports us
+            exposure = self.imager.get_exposure_cache() / 1e6
+        latency = self.config.latency()
+        frame_period = self.config.frame_period()
+        feed = step_size / max(frame_period, exposure)
+        acceleration = self.microscope.motion.get_max_accelerations()["z"]
+        # Be at speed over the whole range
+        lead = feed * feed / (2 * acceleration) + feed * frame_period
+        # Descend like auto_focus_pass()
+        row = FlyRow(start=start_pos + distance + lead,
+                     end=start_pos - distance - lead,
+                     fixed={},
+                     feed=feed,
+                     acceleration=acceleration,
+                     axis="z")
+        self.move_absolute_wait(row.pos(row.start))
+        samples = []
+        row.run(self.move_absolute_block)
+        tend = row.t0 + row.duration()
+        while row.thread.is_alive():
+            self.check_poll(se)
+            capim = self.get_image()
+            # Middle of the exposure
+            t = capim.tcapture - latency - exposure / 2
+            # Stationary frames would all land on the ends
+            if row.t0 < t < tend:
+                samples.append(
+                    (row.position_at(t)["z"], focus_score(capim.array)))
+        row.join(self.pos, tolerance=step_size)
+        if len(samples) < 3:
+            raise Exception("autofocus: only %u frames during z sweep" %
+                            len(samples))
+        samples.sort()
+        zs = [z for z, _score in samples]
+        scores = [score for _z, score in samples]
+        target_pos = parabolic_peak(zs, scores)
+        self.log("autofocus: peak %0.6f (score %0.1f) over %u frames" %
+                 (target_pos, max(scores), len(samples)))
+        self.move_absolute_wait({"z": target_pos})
+        return target_pos
+
     def coarse_parameters(self, objective_config):
         base_step = self.calc_die_normal_step(objective_config)
         return {
@@ -142,22 +304,46 @@ class Autofocus:
         }
 
     def coarse(self, objective_config):
+        method = self.config.method()
+        tstart = time.time()
+        self.metrics = {"method": method, "frames": 0}
         with StopEvent(self.microscope) as se:
-            # MVP intended for 20x
-            # 2 um is standard focus step size
-            self.log("autofocus: coarse")
-            parameters = self.coarse_parameters(objective_config)
-            coarse_z = self.auto_focus_pass(se,
-                                            step_size=parameters["step_size"],
-                                            step_pm=parameters["step_pm"],
-                                            move_target=False)
-            self.log("autofocus: fine")
-            parameters = self.fine_parameters(objective_config)
-            self.auto_focus_pass(se,
-                                 step_size=parameters["step_size"],
-                                 step_pm=parameters["step_pm"],
-                                 start_pos=coarse_z)
-            self.log("autofocus: done")
+            coarse = self.coarse_parameters(objective_config)
+            fine = self.fine_parameters(objective_config)
+            if method == "continuous":
+                # Fine spacing over the coarse range in one move
+                self.log("autofocus: continuous")
+                distance = coarse["step_size"] * coarse["step_pm"]
+                self.continuous_pass(se,
+                                     step_size=fine["step_size"],
+                                     distance=distance)
+            elif method == "climb":
+                self.log("autofocus: coarse")
+                coarse_z = self.climb_pass(se,
+                                           step_size=coarse["step_size"],
+                                           max_steps=self.config.max_steps())
+                self.log("autofocus: fine")
+                target_pos = self.climb_pass(se,
+                                             step_size=fine["step_size"],
+                                             max_steps=fine["step_pm"],
+                                             start_pos=coarse_z)
+                self.move_absolute_wait({"z": target_pos})
+            else:
+                # MVP intended for 20x
+                # 2 um is standard focus step size
+                self.log("autofocus: coarse")
+                coarse_z = self.auto_focus_pass(se,
+                                                step_size=coarse["step_size"],
+                                                step_pm=coarse["step_pm"],
+                                                move_target=False)
+                self.log("autofocus: fine")
+                self.auto_focus_pass(se,
+                                     step_size=fine["step_size"],
+                                     step_pm=fine["step_pm"],
+                                     start_pos=coarse_z)
+        self.metrics["duration"] = time.time() - tstart
+        self.log("autofocus: done in %0.2f sec, %u frames" %
+                 (self.metrics["duration"], self.metrics["frames"]))
 
 
 class AutoStacker:
@@ -0,0 +1,63 @@
+"""
+Preallocated, reusable frame buffers for the capture path
+
+A full resolution frame is 10s of MB
+Allocating (and zeroing) a fresh one per capture is expensive and fragments memory
+Instead buffers are handed out as numpy arrays
+and go back to the pool once no array (or view) references them anymore
+"""
+
+import numpy as np
+import threading
+import weakref
+
+
+class FramePool:
+    def __init__(self, max_free=4):
+        # Buffers kept around per size. Beyond this they are freed normally
+        self.max_free = max_free
+        self.lock = threading.Lock()
+        # nbytes => [bytearray]
+        self.free = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, shape, dtype=np.uint8):
+        """
+        Return an uninitialized array of given shape
+        Views (ex: reshape, slice) keep the buffer checked out
+        """
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        with self.lock:
+            slots = self.free.get(nbytes)
+            if slots:
+                slot = slots.pop()
+                self.hits += 1
+            else:
+                slot = None
+                self.misses += 1
+        if slot is None:
+            slot = bytearray(nbytes)
+        # Views of this array reference it as their base => it is the last to go
+        owner = np.frombuffer(slot, dtype=dtype)
+        weakref.finalize(owner, self._put, slot)
+        return owner.reshape(shape)
+
+    def _put(self, slot):
+        # Runs from whichever thread dropped the last reference
+        with self.lock:
+            slots = self.free.setdefault(len(slot), [])
+            if len(slots) < self.max_free:
+                slots.append(slot)
+
+    def copy(self, buf, shape=None):
+        """
+        Copy a (mapped, short lived) buffer into a pooled uint8 array
+        """
+        src = np.frombuffer(buf, dtype=np.uint8)
+        if shape is None:
+            shape = src.shape
+        ret = self.get(shape)
+        np.copyto(ret.reshape(-1), src)
+        return ret
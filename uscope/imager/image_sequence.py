@@ -1,22 +1,69 @@
 import threading
+import time
 from PIL import Image
+import numpy as np
+import os
+from uscope.trace import tracer
+from uscope import metrics
 """
 PIL im objects are core
 However EXIF and stuff isn't written until end in some API contexts
+
+Captures from a camera come in as a numpy array (possibly a pooled frame buffer)
+and are only converted to PIL when something asks for .image
 """
 
 
 class CapturedImage:
-    def __init__(self, image, meta=None, exif_bytes=None, microscope=None):
-        self.image = image
+    def __init__(self,
+                 image=None,
+                 meta=None,
+                 exif_bytes=None,
+                 microscope=None,
+                 array=None,
+                 tcapture=None):
+        assert image is not None or array is not None
+        # PIL image
+        self._image = image
+        # HxWxC uint8 RGB
+        self._array = array
         self.meta = meta
         self.exif_bytes = exif_bytes
         self.microscope = microscope
+        # When the frame came off the camera, as best known
+        self.tcapture = time.time() if tcapture is None else tcapture
+
+    @property
+    def image(self):
+        if self._image is None:
+            self._image = Image.fromarray(self._array)
+        return self._image
+
+    @image.setter
+    def image(self, image):
+        self._image = image
+        self._array = None
+
+    @property
+    def array(self):
+        """
+        numpy view of the image. Don't modify
+        """
+        if self._array is None:
+            self._array = np.asarray(self._image)
+        return self._array
+
+    def size(self):
+        if self._array is not None:
+            return (self._array.shape[1], self._array.shape[0])
+        return self._image.size
 
     def save(self, fn, **kwargs):
         if self.exif_bytes is not None:
             kwargs["exif"] = self.exif_bytes
-        self.image.save(fn, **kwargs)
+        with tracer.span("save", "save", {"fn": os.path.basename(fn)}):
+            self.image.save(fn, **kwargs)
+        metrics.bytes_written.inc(os.path.getsize(fn), source="capture")
 
     def set_meta(self, meta):
         self.meta = meta
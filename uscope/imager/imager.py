@@ -1,4 +1,5 @@
 import time
+from concurrent.futures import Future
 from PIL import Image
 from uscope.imager.image_sequence import CapturedImage
 '''
@@ -74,6 +75,23 @@ class Imager:
         '''
         raise Exception('Required')
 
+    def get_by_mode(self, mode=None, **kwargs):
+        """
+        mode: raw, processed, composite
+        Simple imagers don't post process => all the same
+        """
+        return self.get(**kwargs)
+
+    def get_by_mode_async(self, mode=None, **kwargs):
+        """
+        Return a concurrent.futures.Future of the CapturedImage
+        once the frame is latched (ie safe to move)
+        Processing may still be running when this returns
+        """
+        ret = Future()
+        ret.set_result(self.get_by_mode(mode=mode, **kwargs))
+        return ret
+
     def take(self):
         '''Take and store to internal storage'''
         raise Exception('Required')
@@ -153,7 +171,7 @@ class MockImager(Imager):
     def get(self):
         # Small test image
         return CapturedImage(
-            im=Image.new("RGB", (self.width, self.height), 'white'))
+            image=Image.new("RGB", (self.width, self.height), 'white'))
 
     def _set_properties(self, vals):
         for k, v in vals.items():
@@ -57,4 +57,9 @@ class ArgusGstImagerPlugin(ArgusImagerPlugin):
         return GstGUIImager(self.ac)
 
     def gst_decode_image(self, image_dict):
+        """
+        image_dict["bytes"]: raw frame as a flat uint8 numpy array
+        Return HxWx3 uint8 RGB numpy array
+        Prefer views or image_dict["frame_pool"] buffers over new allocations
+        """
         assert 0, "Required"
@@ -70,5 +70,5 @@ class Plugin(ArgusGstImagerPlugin):
             (width * height * 3, len(buf), width, height))
         # Need 59535360 bytes, got 59535360
         # print("Need %u bytes, got %u" % (3 * width * height, len(buf)))
-        return Image.frombytes('RGB', (width, height), bytes(buf), 'raw',
-                               'RGB')
+        # Already RGB: just a view
+        return buf.reshape(height, width, 3)
@@ -67,8 +67,8 @@ class Plugin(ArgusGstImagerPlugin):
         w = width
         h = height
         shape = (h, w, 2)
-        yuv = np.frombuffer(buf, dtype=np.uint8)
-        yuv = yuv.reshape(shape)
-        rgba = cv2.cvtColor(yuv, cv2.COLOR_YUV2RGBA_YUYV)
-        rgb = cv2.cvtColor(rgba, cv2.COLOR_RGBA2RGB)
-        return Image.fromarray(rgb)
+        yuv = buf.reshape(shape)
+        # Single pass straight to RGB
+        rgb = image_dict["frame_pool"].get((h, w, 3))
+        cv2.cvtColor(yuv, cv2.COLOR_YUV2RGB_YUYV, dst=rgb)
+        return rgb
@@ -37,7 +37,7 @@ class Plugin(ArgusGstImagerPlugin):
         w = width
         h = height
         shape = (h, w, 4)
-        rgba = np.frombuffer(buf, dtype=np.uint8)
-        rgba = rgba.reshape(shape)
-        rgb = cv2.cvtColor(rgba, cv2.COLOR_BGRA2RGB)
-        return Image.fromarray(rgb)
+        rgba = buf.reshape(shape)
+        rgb = image_dict["frame_pool"].get((h, w, 3))
+        cv2.cvtColor(rgba, cv2.COLOR_BGRA2RGB, dst=rgb)
+        return rgb
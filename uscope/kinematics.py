@@ -1,5 +1,6 @@
 import time
 from uscope.util import LogTimer
+from uscope.trace import tracer
 
 
 class Kinematics:
@@ -40,6 +41,10 @@ class Kinematics:
             )
         self.tsettle_autofocus = tsettle_autofocus
         self.should_frame_sync = self.microscope.usc.kinematics.frame_sync()
+        self.tsettle_motion_adaptive = self.microscope.usc.kinematics.tsettle_motion_adaptive(
+        )
+        self.tsettle_motion_adaptive_min = self.microscope.usc.kinematics.tsettle_motion_adaptive_min(
+        )
         self.tsettle_video_pipeline = 3.0
 
         # self.diagnostic_info()
@@ -69,10 +74,32 @@ class Kinematics:
                 tsettle)
             self.sleep(tsettle)
 
+    def motion_settle_scale(self, tsettle):
+        """
+        Fraction of tsettle actually needed given recent moves
+        Moves that ended more than tsettle ago have already settled
+        """
+        if not self.tsettle_motion_adaptive:
+            return 1.0
+        ret = None
+        now = time.time()
+        for completion in list(self.microscope.motion.completions):
+            # Failed / unknown => be conservative
+            if completion.tidle is None:
+                return 1.0
+            if now - completion.tidle >= tsettle:
+                continue
+            scale = completion.settle_scale(self.tsettle_motion_adaptive_min)
+            ret = scale if ret is None else max(ret, scale)
+        if ret is None:
+            return 1.0
+        return ret
+
     def wait_motion(self):
         if self.microscope.motion is None or self.tsettle_motion <= 0:
             return
-        tsettle = self.tsettle_motion - self.microscope.motion.since_last_motion(
+        scale = self.motion_settle_scale(self.tsettle_motion)
+        tsettle = self.tsettle_motion * scale - self.microscope.motion.since_last_motion(
         )
         self.verbose and self.log(
             "FIXME TMP: this tsettle_motion: %0.3f" % tsettle)
@@ -96,7 +123,8 @@ class Kinematics:
         """
         if self.microscope.imager is None or self.tsettle_autofocus <= 0:
             return
-        tsettle = self.tsettle_autofocus - self.microscope.motion.since_last_motion(
+        scale = self.motion_settle_scale(self.tsettle_autofocus)
+        tsettle = self.tsettle_autofocus * scale - self.microscope.motion.since_last_motion(
         )
         if tsettle > 0.0:
             self.sleep(tsettle)
@@ -117,6 +145,7 @@ class Kinematics:
         imager = self.microscope.imager_ts()
         _image = imager.get()
         tend = time.time()
+        tracer.complete("frame-sync", "kinematics", tstart, tend)
         self.verbose and self.log("FIXME TMP: flush image took %0.3f" %
                                   (tend - tstart, ))
         self.last_frame_sync = time.time()
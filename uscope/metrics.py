@@ -0,0 +1,396 @@
+"""
+Process wide metrics: counters, gauges and histograms
+
+Unlike tracing (uscope/trace.py) metrics are always on:
+an update is a lock and an add, cheap enough for per frame / per serial command use
+
+Export:
+-OpenMetrics (Prometheus) text: scrape /metrics from each scope into one dashboard
+-JSON snapshot + rolling history of periodic samples: /get/metrics
+
+Other processes (ex: imagep daemon) keep their own registry
+Their export() can be merged into openmetrics() with a process label
+
+Naming follows Prometheus conventions: uscope_<what>_<unit>
+Counters get _total appended on export
+
+Usage:
+from uscope import metrics
+metrics.frames_captured.inc()
+with metrics.motion_command_seconds.time(command="move_absolute"):
+"""
+
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+import math
+import os
+import psutil
+import threading
+import time
+
+# Seconds. Covers serial round trips (ms) through slow moves / stacks (s)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE_OPENMETRICS = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+def label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def escape_label(v):
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(key):
+    if not key:
+        return ""
+    return "{" + ",".join('%s="%s"' % (k, escape_label(v))
+                          for k, v in key) + "}"
+
+
+def format_value(v):
+    if v == math.inf:
+        return "+Inf"
+    if isinstance(v, float) and v.is_integer() and abs(v) < 1e15:
+        return "%u" % v if v >= 0 else "%d" % v
+    return repr(v)
+
+
+class Metric:
+    type_ = None
+
+    def __init__(self, name, help_):
+        self.name = name
+        self.help = help_
+        self.lock = threading.Lock()
+        # label key => value
+        self.values = OrderedDict()
+        # Sampled on read instead (ex: process memory)
+        self.function = None
+
+    def set_function(self, function):
+        """
+        function() returns the (unlabeled) value when metrics are read
+        """
+        self.function = function
+
+    def update(self):
+        if not self.function:
+            return
+        try:
+            value = self.function()
+        except Exception:
+            return
+        with self.lock:
+            self.values[()] = value
+
+    def samples(self):
+        """
+        Return [(sample name, label key, value)]
+        """
+        self.update()
+        with self.lock:
+            return [(self.name, key, value)
+                    for key, value in self.values.items()]
+
+    def openmetrics(self):
+        ret = [
+            "# TYPE %s %s" % (self.name, self.type_),
+            "# HELP %s %s" % (self.name, self.help),
+        ]
+        for name, key, value in self.samples():
+            ret.append("%s%s %s" %
+                       (name, format_labels(key), format_value(value)))
+        return ret
+
+    def getj(self):
+        self.update()
+        with self.lock:
+            values = [{
+                "labels": dict(key),
+                "value": value
+            } for key, value in self.values.items()]
+        return {"type": self.type_, "help": self.help, "values": values}
+
+
+class Counter(Metric):
+    type_ = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        self.update()
+        with self.lock:
+            return [(self.name + "_total", key, value)
+                    for key, value in self.values.items()]
+
+
+class Gauge(Metric):
+    type_ = "gauge"
+
+    def set(self, value, **labels):
+        key = label_key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type_ = "histogram"
+
+    def __init__(self, name, help_, buckets=None):
+        super().__init__(name, help_)
+        if buckets is None:
+            buckets = DEFAULT_BUCKETS
+        self.buckets = tuple(sorted(buckets)) + (math.inf, )
+
+    def observe(self, value, **labels):
+        key = label_key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                # [per bucket counts, sum]
+                state = [[0] * len(self.buckets), 0.0]
+                self.values[key] = state
+            for i, le in enumerate(self.buckets):
+                if value <= le:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        tstart = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - tstart, **labels)
+
+    def snapshot(self):
+        """
+        Return [(label key, cumulative bucket counts, count, sum)]
+        """
+        ret = []
+        with self.lock:
+            for key, (counts, sum_) in self.values.items():
+                cumulative = []
+                total = 0
+                for count in counts:
+                    total += count
+                    cumulative.append(total)
+                ret.append((key, cumulative, total, sum_))
+        return ret
+
+    def samples(self):
+        ret = []
+        for key, cumulative, count, sum_ in self.snapshot():
+            for le, bucket_count in zip(self.buckets, cumulative):
+                ret.append(
+                    (self.name + "_bucket",
+                     key + (("le", format_value(float(le))), ), bucket_count))
+            ret.append((self.name + "_count", key, count))
+            ret.append((self.name + "_sum", key, sum_))
+        return ret
+
+    def quantile(self, cumulative, count, fraction):
+        """
+        Upper bound of the bucket holding given quantile
+        """
+        for le, bucket_count in zip(self.buckets, cumulative):
+            if bucket_count >= fraction * count:
+                return le
+        return math.inf
+
+    def getj(self):
+        values = []
+        for key, cumulative, count, sum_ in self.snapshot():
+            j = {
+                "labels": dict(key),
+                "count": count,
+                "sum": sum_,
+                "avg": sum_ / count if count else None,
+            }
+            # JSON has no inf
+            for k, fraction in (("p50", 0.50), ("p90", 0.90), ("p99", 0.99)):
+                v = self.quantile(cumulative, count, fraction)
+                j[k] = None if v == math.inf else v
+            values.append(j)
+        return {"type": self.type_, "help": self.help, "values": values}
+
+
+class Registry:
+    def __init__(self, history=60, interval=10.0):
+        self.lock = threading.Lock()
+        self.metrics = OrderedDict()
+        # Periodic getj() samples for dashboards that don't keep history
+        self.history = deque(maxlen=history)
+        self.interval = interval
+        self.tlast_sample = None
+
+    def register(self, metric):
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                assert type(existing) is type(
+                    metric), "metric %s registered as %s" % (metric.name,
+                                                             existing.type_)
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_):
+        return self.register(Counter(name, help_))
+
+    def gauge(self, name, help_):
+        return self.register(Gauge(name, help_))
+
+    def histogram(self, name, help_, buckets=None):
+        return self.register(Histogram(name, help_, buckets=buckets))
+
+    def export(self):
+        """
+        Picklable raw samples for openmetrics(remotes=) in another process
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return OrderedDict([(metric.name, {
+            "type": metric.type_,
+            "help": metric.help,
+            "samples": metric.samples(),
+        }) for metric in metrics])
+
+    def openmetrics(self, remotes={}):
+        """
+        remotes: process label => export() from that process
+        A family may only appear once => remote samples are merged into ours
+        """
+        families = OrderedDict()
+        sources = [(None, self.export())] + list(remotes.items())
+        for process, export in sources:
+            for name, family in export.items():
+                if name not in families:
+                    families[name] = {
+                        "type": family["type"],
+                        "help": family["help"],
+                        "lines": [],
+                    }
+                for sample_name, key, value in family["samples"]:
+                    if process is not None:
+                        key = (("process", process), ) + tuple(key)
+                    families[name]["lines"].append(
+                        "%s%s %s" %
+                        (sample_name, format_labels(key), format_value(value)))
+        lines = []
+        for name, family in families.items():
+            lines.append("# TYPE %s %s" % (name, family["type"]))
+            lines.append("# HELP %s %s" % (name, family["help"]))
+            lines += family["lines"]
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def getj(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return OrderedDict([(metric.name, metric.getj())
+                            for metric in metrics])
+
+    def sample(self, force=False):
+        """
+        Record a history entry if interval has elapsed
+        Call periodically (ex: from a poll loop)
+        """
+        now = time.time()
+        with self.lock:
+            if not force and self.tlast_sample is not None and now - self.tlast_sample < self.interval:
+                return
+            self.tlast_sample = now
+        self.history.append({"time": now, "metrics": self.getj()})
+
+    def rolling(self):
+        return list(self.history)
+
+
+registry = Registry()
+
+# Well known metrics
+# Imaging
+frames_captured = registry.counter(
+    "uscope_frames_captured", "Frames requested and received from the camera")
+frames_dropped = registry.counter(
+    "uscope_frames_dropped",
+    "Frame requests that timed out waiting for the camera")
+frame_wait_seconds = registry.histogram(
+    "uscope_frame_wait_seconds", "Frame request to frame received latency")
+gstreamer_frames = registry.counter(
+    "uscope_gstreamer_frames",
+    "Frames out of the video pipeline (stream rate)")
+capture_seconds = registry.histogram(
+    "uscope_capture_seconds",
+    "Planner image capture latency by stage (capture, latch, process)")
+bytes_written = registry.counter("uscope_bytes_written",
+                                 "Image bytes written to disk by source")
+# Motion
+motion_command_seconds = registry.histogram(
+    "uscope_motion_command_seconds", "Motion command latency by command")
+serial_round_trip_seconds = registry.histogram(
+    "uscope_serial_round_trip_seconds",
+    "Motion controller command to ok latency")
+serial_errors = registry.counter(
+    "uscope_serial_errors", "Motion controller command failures by error")
+jog_loop_seconds = registry.histogram(
+    "uscope_jog_loop_seconds",
+    "Time between jog updates (nominal 0.2 sec)",
+    buckets=(0.05, 0.1, 0.15, 0.2, 0.25, 0.3, 0.4, 0.5, 1.0, 2.0))
+jog_slow = registry.counter(
+    "uscope_jog_slow", "Jog updates more than 1.5x late (jogging may stutter)")
+# Image processing
+imagep_queue_depth = registry.gauge(
+    "uscope_imagep_queue_depth", "Image processing tasks waiting for a worker")
+imagep_running = registry.gauge("uscope_imagep_running",
+                                "Image processing tasks running")
+imagep_task_seconds = registry.histogram(
+    "uscope_imagep_task_seconds", "Image processing run time by plugin")
+imagep_tasks = registry.counter("uscope_imagep_tasks",
+                                "Image processing tasks by plugin and result")
+# Host
+process_resident_memory_bytes = registry.gauge(
+    "uscope_process_resident_memory_bytes", "Resident memory")
+process_resident_memory_bytes.set_function(
+    lambda: psutil.Process(os.getpid()).memory_info().rss)
+process_cpu_seconds = registry.counter("uscope_process_cpu_seconds",
+                                       "User + system CPU time")
+process_cpu_seconds.set_function(lambda: sum(os.times()[:2]))
+microscope_info = registry.gauge(
+    "uscope_microscope_info",
+    "Always 1, labels identify the microscope (name, serial)")
+
+
+def getj():
+    return registry.getj()
+
+
+def export():
+    return registry.export()
+
+
+def openmetrics(remotes={}):
+    return registry.openmetrics(remotes=remotes)
+
+
+def sample(force=False):
+    registry.sample(force=force)
+
+
+def rolling():
+    return registry.rolling()
@@ -1,4 +1,4 @@
-from uscope.config import get_bc, get_usc
+from uscope.config import get_bc, get_usc, USC
 from uscope.motion.plugins import get_motion_hal, configure_motion_hal
 from uscope.kinematics import Kinematics
 from uscope.objective import MicroscopeObjectives
@@ -120,6 +120,7 @@ class Microscope:
         imager_cli=False,
         auto=True,
         virtual=False,
+        shared_usc=True,
     ):
         if bc is None:
             bc = get_bc()
@@ -140,7 +141,11 @@ class Microscope:
         self.name = mconfig["name"]
         self._serial = mconfig.get("serial", None)
         if usc is None:
-            usc = get_usc(microscope=self)
+            if shared_usc:
+                usc = get_usc(microscope=self)
+            else:
+                # Process serves several microscopes (ex: imagep daemon)
+                usc = USC(microscope=self)
         self.usc = usc
 
         self.objectives = None
@@ -540,11 +545,15 @@ def get_mconfig(name=None, serial=None, mconfig=None):
 
 # used by stitcher
 # also used by get_microscope_info.py
-def get_virtual_microscope(mconfig=None):
+def get_virtual_microscope(mconfig=None, shared_usc=True):
+    """
+    shared_usc: use the process wide config.get_usc()
+    """
     return Microscope(auto=False,
                       configure=False,
                       hardware=False,
-                      mconfig=mconfig)
+                      mconfig=mconfig,
+                      shared_usc=shared_usc)
 
 
 def get_microscope_for_motion(name=None):
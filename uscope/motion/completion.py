@@ -0,0 +1,93 @@
+"""
+Detect the end of a move without fixed sleep polling
+
+Typical scan moves take 5 - 50 ms
+Polling status every 100 ms means most of that time is spent waiting on the poll
+Instead estimate when the move should end (trapezoidal profile)
+and poll slowly until just before that, then as fast as the controller answers
+"""
+
+from concurrent.futures import Future
+import threading
+import time
+
+
+class MotionCompletion:
+    def __init__(self, expected=None, velocity_fraction=None, tstart=None):
+        """
+        expected: estimated move seconds, None if unknown
+        velocity_fraction: peak speed / max speed, None if unknown
+        """
+        self.tstart = time.time() if tstart is None else tstart
+        self.expected = expected
+        self.velocity_fraction = velocity_fraction
+        # Set the moment the controller reported idle
+        self.event = threading.Event()
+        # Resolves to tidle
+        self.future = Future()
+        self.tidle = None
+        self.polls = 0
+
+    def set_idle(self, tidle=None):
+        self.tidle = time.time() if tidle is None else tidle
+        self.event.set()
+        self.future.set_result(self.tidle)
+
+    def set_exception(self, e):
+        self.future.set_exception(e)
+        self.event.set()
+
+    def done(self):
+        return self.event.is_set()
+
+    def elapsed(self):
+        if self.tidle is None:
+            return None
+        return self.tidle - self.tstart
+
+    def settle_scale(self, min_scale):
+        """
+        Scale for post move vibration settling
+        A short move that never gets up to speed has less to ring down
+        """
+        if self.velocity_fraction is None:
+            return 1.0
+        return min_scale + (1.0 - min_scale) * self.velocity_fraction
+
+
+class MotionCompletionPoller:
+    def __init__(self, slow_period=0.1, fast_period=0.002, lead=0.8):
+        """
+        slow_period: seconds between polls well before the expected end
+        fast_period: seconds between polls near the expected end
+        lead: start fast polling at this fraction of the expected time
+        """
+        self.slow_period = slow_period
+        self.fast_period = fast_period
+        self.lead = lead
+
+    def wait(self, is_idle, completion):
+        """
+        Poll is_idle() until true, then mark completion
+        """
+        tfast = None
+        if completion.expected is not None:
+            tfast = completion.tstart + completion.expected * self.lead
+        try:
+            while True:
+                completion.polls += 1
+                if is_idle():
+                    completion.set_idle()
+                    return completion
+                now = time.time()
+                if tfast is None:
+                    period = self.slow_period
+                elif now < tfast:
+                    period = min(self.slow_period, tfast - now)
+                else:
+                    period = self.fast_period
+                time.sleep(period)
+        except BaseException as e:
+            if not completion.done():
+                completion.set_exception(e)
+            raise
@@ -7,7 +7,9 @@ Case insensitive best I can tell
 
 from uscope.motion.hal import MotionHAL, MotionCritical
 from uscope import util
-from uscope.motion.motion_util import parse_move
+from uscope import metrics
+from uscope.motion.motion_util import parse_move, estimate_move, format_feed
+from uscope.motion.completion import MotionCompletion, MotionCompletionPoller
 from uscope.util import tobytes, tostr
 from uscope.config import get_bc
 
@@ -19,8 +21,15 @@ import threading
 import glob
 import struct
 import hashlib
+import queue
+from collections import deque, OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
 from bitarray import bitarray
 
+# $10 status report mask: report buffer state (Bf:)
+STATUS_MASK_BUFFER = 2
+
 
 class GrblException(Exception):
     pass
@@ -77,6 +86,40 @@ def trim_status_line(l):
     return l[1:-1]
 
 
+def parse_qstatus(raw):
+    """
+    Idle|MPos:8.000,0.000,0.000|FS:0,0|WCO:0.000,0.000,0.000
+    Alarm|MPos:0.000,0.000,0.000|Bf:35,254|FS:0,0|Pn:Y
+    =>
+    {"status": "Idle", "MPos": {"x": 8.0, "y": 0.0, "z": 0.0}, "FS": "0,0", ...}
+    """
+    parts = raw.split("|")
+    ret = {
+        # Idle, Jog
+        "status": parts[0],
+    }
+    for part in parts[1:]:
+        k, v = part.split(":")
+        if k == "MPos":
+            v = (float(x) for x in v.split(","))
+            v = dict([(k, v) for k, v in zip("xyz", v)])
+        elif k == "Pn":
+            # Y and Z are valid values
+            # Z appears to be when unhomed?
+            # assert v == "Y"
+            # v = True
+            pass
+        ret[k] = v
+    return ret
+
+
+def copy_status(status):
+    ret = dict(status)
+    if "MPos" in ret:
+        ret["MPos"] = dict(ret["MPos"])
+    return ret
+
+
 def format_axis3(v):
     """
     Rounding errors on float can cause fine positioning errors?
@@ -86,6 +129,14 @@ def format_axis3(v):
     return ret
 
 
+def format_axes(pos):
+    """
+    {"x": 1.0, "z": 2.5} => " X1.000 Z2.500"
+    """
+    return ''.join(
+        [' %c%s' % (k.upper(), format_axis3(v)) for k, v in pos.items()])
+
+
 """
 https://www.sainsmart.com/blogs/news/grbl-v1-1-quick-reference
 """
@@ -278,6 +329,13 @@ class GRBLSer:
         self.check_threads = get_bc().dev_mode()
         self.last_thread = None
         self.ser_timeout = ser_timeout
+        # See read_stream_line()
+        self.rx_partial = b""
+        # Bumped on anything that may change controller state
+        # A status report from before a change is stale. See GRBL.qstatus()
+        self.generation = 0
+        # status_cb(raw, generation): status report seen while waiting on a command
+        self.status_cb = None
 
         self.verbose and print("opening %s in thread %s" %
                                (port, threading.get_ident()))
@@ -372,6 +430,8 @@ class GRBLSer:
             else:
                 self.update_check_thread()
 
+        if out != "?":
+            self.generation += 1
         if nl:
             out = out + '\r'
         out = out.encode('ascii')
@@ -382,6 +442,8 @@ class GRBLSer:
     def txb(self, out):
         # self.verbose and print("tx '%s'" % (out, ))
         # util.hexdump(out)
+        if out != b"?":
+            self.generation += 1
         self.serial.write(out)
         self.serial.flush()
 
@@ -395,26 +457,48 @@ class GRBLSer:
                 util.hexdump(b)
         return b.decode("ascii").strip()
 
+    def read_stream_line(self):
+        """
+        Return the next complete line or None if nothing came in before timeout
+        A partial line (serial timeout mid line) is kept for the next call
+        """
+        self.rx_partial += self.serial.readline()
+        if not self.rx_partial.endswith(b"\n"):
+            return None
+        l = self.rx_partial.decode("ascii", errors="replace").strip()
+        self.rx_partial = b""
+        self.verbose and print("rx '%s'" % (l, ))
+        return l
+
     def txrxs(self, out, nl=True, trim_data=True, timeout=None):
         """
         Send a command and return array of lines before ok line
         """
         if timeout is None:
             timeout = self.ser_timeout
+        # Any status report seen below may predate this command
+        generation = self.generation
         self.tx(out, nl=nl)
         ret = []
         tstart = time.time()
         while True:
             if time.time() - tstart > timeout:
+                metrics.serial_errors.inc(error="timeout")
                 raise Timeout(f"Timed out after {timeout} sec")
             l = self.readline().strip()
             self.verbose and print("rx '%s'" % (l, ))
             if not l:
                 continue
             elif l == "ok":
+                metrics.serial_round_trip_seconds.observe(time.time() - tstart)
                 return ret
             elif l.find("error") == 0:
+                metrics.serial_errors.inc(error="grbl")
                 raise GrblError(l)
+            elif l[0] == "<" and l[-1] == ">":
+                # Late or unsolicited status report
+                if self.status_cb:
+                    self.status_cb(trim_status_line(l), generation)
             else:
                 if trim_data:
                     ret.append(trim_data_line(l))
@@ -655,12 +739,56 @@ class GRBLSer:
 
 """
 Emulate a GRBL serial port for testng on the go
+
+Regular commands complete instantly
+Raw lines written with txb() (ie GRBLStreamer) go through an emulated
+serial rx buffer + planner and execute in real time at the requested feed rate
 """
 
 
 class MockGRBLSer(GRBLSer):
     STATE_RESET = None
     STATE_IDLE = "Idle"
+    STATE_JOG = "Jog"
+    # Reported by i()
+    RX_BUFFER_SIZE = 128
+    BLOCK_BUFFER_SIZE = 15
+    SETTINGS = (
+        "$0=10",
+        "$1=25",
+        "$2=0",
+        "$3=2",
+        "$4=0",
+        "$5=0",
+        "$6=0",
+        "$10=1",
+        "$11=0.010",
+        "$12=0.002",
+        "$13=0",
+        "$20=0",
+        "$21=0",
+        "$22=0",
+        "$23=0",
+        "$24=25.000",
+        "$25=500.000",
+        "$26=250",
+        "$27=1.000",
+        "$30=1000",
+        "$31=0",
+        "$32=0",
+        "$100=800.000",
+        "$101=800.000",
+        "$102=800.000",
+        "$110=1000.000",
+        "$111=1000.000",
+        "$112=600.000",
+        "$120=30.000",
+        "$121=30.000",
+        "$122=30.000",
+        "$130=130.000",
+        "$131=231.000",
+        "$132=332.000",
+    )
 
     def __init__(
         self,
@@ -676,6 +804,20 @@ class MockGRBLSer(GRBLSer):
         self.ser_timeout = -1
         self.serial = None
         self.check_threads = get_bc().dev_mode()
+        # Streaming emulation
+        self.stream_lock = threading.RLock()
+        self.stream_thread = None
+        # Received but not yet parsed bytes
+        self.rx_buf = b""
+        # [(target pos, seconds)]. Head is executing
+        self.planner = deque()
+        self.block_start = None
+        # Lines for read_stream_line()
+        self.stream_out = queue.Queue()
+        self.generation = 0
+        self.status_cb = None
+        # $$ settings. Only $10 (status report mask) changes behavior
+        self.settings = OrderedDict([l.split("=") for l in self.SETTINGS])
         self.reset()
 
     def in_reset(self):
@@ -690,12 +832,124 @@ class MockGRBLSer(GRBLSer):
 
     def tx(self, out, nl=True):
         self.verbose and print("MOCK: tx", out)
+        if out != "?":
+            self.generation += 1
 
     def txb(self, out):
         self.verbose and print("MOCK: txb", out)
+        if out != b"?":
+            self.generation += 1
+        with self.stream_lock:
+            if self.stream_thread is None:
+                self.stream_thread = threading.Thread(target=self.stream_run,
+                                                      name="mock-grbl",
+                                                      daemon=True)
+                self.stream_thread.start()
+            for c in out:
+                c = bytes([c])
+                # Realtime commands never hit the rx buffer
+                if c == b"?":
+                    self.stream_out.put("<%s>" % self.status_line())
+                elif c == b"\x85":
+                    self.stream_cancel()
+                elif c in b"~!":
+                    pass
+                else:
+                    self.rx_buf += c
+                    if len(self.rx_buf) > self.RX_BUFFER_SIZE:
+                        raise GrblException("MOCK: rx buffer overflow")
+
+    def stream_run(self):
+        while True:
+            with self.stream_lock:
+                self.stream_step()
+            time.sleep(0.002)
+
+    def stream_step(self):
+        now = time.time()
+        if self.planner:
+            target, dt = self.planner[0]
+            if self.block_start is None:
+                self.block_start = (dict(self.mpos), now)
+            elif now - self.block_start[1] >= dt:
+                self.mpos = dict(target)
+                self.planner.popleft()
+                self.block_start = None
+        if not self.planner and self.state == self.STATE_JOG:
+            self.state = self.STATE_IDLE
+        # Parse the next line once the planner has room
+        i = self.rx_buf.find(b"\r")
+        if i >= 0 and len(self.planner) < self.BLOCK_BUFFER_SIZE:
+            line = self.rx_buf[:i].decode("ascii").strip()
+            self.rx_buf = self.rx_buf[i + 1:]
+            if line:
+                self.stream_out.put(self.stream_line(line))
+
+    def stream_line(self, line):
+        """
+        Execute a streamed line, returning the response
+        """
+        if not line.upper().startswith("$J="):
+            # Unsupported statement
+            return "error:20"
+        src = self.planner[-1][0] if self.planner else self.mpos
+        target, f = self.jog_target(line[3:], src)
+        if not f:
+            return "error:22"
+        dist = sum((target[k] - src[k])**2 for k in target)**0.5
+        # GRBL drops zero length blocks
+        if dist:
+            self.planner.append((target, dist / (f / 60.0)))
+            self.state = self.STATE_JOG
+        return "ok"
+
+    def stream_pos(self):
+        """
+        Position including the executing block
+        """
+        if not self.planner or self.block_start is None:
+            return dict(self.mpos)
+        target, dt = self.planner[0]
+        src, tstart = self.block_start
+        frac = min(1.0, (time.time() - tstart) / dt)
+        return dict([(k, src[k] + (target[k] - src[k]) * frac) for k in src])
+
+    def stream_cancel(self):
+        """
+        Jog cancel: flush the planner and stop where we are
+        """
+        with self.stream_lock:
+            self.mpos = self.stream_pos()
+            self.planner.clear()
+            self.block_start = None
+            self.state = self.STATE_IDLE
+
+    def read_stream_line(self):
+        try:
+            l = self.stream_out.get(timeout=0.1)
+        except queue.Empty:
+            return None
+        self.verbose and print("MOCK: rx", l)
+        return l
 
     def txrx0(self, out, nl=True):
         self.verbose and print("MOCK: txrx0", out)
+        self.generation += 1
+        if out.startswith("$") and "=" in out:
+            k, v = out.split("=")
+            assert k in self.settings, out
+            self.settings[k] = v
+
+    def status_line(self):
+        pos = self.stream_pos()
+        ret = "%s|MPos:%0.3f,%0.3f,%0.3f" % (self.state, pos["x"], pos["y"],
+                                             pos["z"])
+        # Buffer state is only reported if enabled in the $10 mask
+        if int(self.settings["$10"]) & STATUS_MASK_BUFFER:
+            blocks_free = self.BLOCK_BUFFER_SIZE - len(self.planner)
+            rx_free = self.RX_BUFFER_SIZE - len(self.rx_buf)
+            ret += "|Bf:%u,%u" % (blocks_free, rx_free)
+        return ret + "|FS:0,0"
 
     def question(self):
         """
@@ -705,56 +959,77 @@ class MockGRBLSer(GRBLSer):
         """
         assert self.state
         time.sleep(0.05)
-        return "%s|MPos:%0.3f,%0.3f,%0.3f|FS:0,0" % (
-            self.state, self.mpos["x"], self.mpos["y"], self.mpos["z"])
+        with self.stream_lock:
+            return self.status_line()
 
-    def j(self, command):
-        # Parse a jog command and update state
-        # Command completes instantly
+    def jog_target(self, command, src):
+        """
+        Parse a jog command relative to src
+        Return target position, feed rate (None if not given)
+        """
         command = command.upper()
+        f = None
         # remove feedrate
         if "F" in command:
-            command = command.split("F")[0]
+            command, f = command.split("F")
+            f = float(f)
         parts = command.split(" ")
         g = parts[0]
+        target = dict(src)
         if g == "G90":
             pos = parse_move(command.replace("G90 ", ""))
             for k, v in pos.items():
                 k = k.lower()
-                assert k in self.mpos
+                assert k in target
                 assert type(v) in (int, float)
-                self.mpos[k] = v
+                target[k] = v
         elif g == "G91":
             pos = parse_move(command.replace("G91 ", ""))
             for k, v in pos.items():
                 k = k.lower()
-                assert k in self.mpos
+                assert k in target
                 assert type(v) in (int, float)
-                self.mpos[k] += v
+                target[k] += v
         else:
             raise ValueError(command)
+        return target, f
+
+    def j(self, command):
+        # Parse a jog command and update state
+        # Command completes instantly
+        self.generation += 1
+        with self.stream_lock:
+            self.mpos, _f = self.jog_target(command, self.mpos)
         time.sleep(0.05)
 
     def reset(self):
-        self.mpos = {
-            "x": 0.0,
-            "y": 0.0,
-            "z": 0.0,
-        }
-        self.state = self.STATE_RESET
+        self.generation += 1
+        with self.stream_lock:
+            self.planner.clear()
+            self.block_start = None
+            self.rx_buf = b""
+            self.mpos = {
+                "x": 0.0,
+                "y": 0.0,
+                "z": 0.0,
+            }
+            self.state = self.STATE_RESET
         time.sleep(0.05)
 
     def jog_cancel(self):
-        self.state = self.STATE_IDLE
+        self.generation += 1
+        self.stream_cancel()
         time.sleep(0.05)
 
     def tilda(self):
+        self.generation += 1
         time.sleep(0.05)
 
     def flush(self):
         time.sleep(0.05)
 
     def txrxs(self, out, nl=True, trim_data=True, timeout=None):
+        self.generation += 1
         return "mock"
 
     def hash(self):
@@ -775,47 +1050,324 @@ class MockGRBLSer(GRBLSer):
     def i(self):
         return [
             "VER:mock:",
-            "OPT:V,15,128",
+            "OPT:V,%u,%u" % (self.BLOCK_BUFFER_SIZE, self.RX_BUFFER_SIZE),
         ]
 
     def dollar(self):
-        return [
-            "$$",
-            "$0=10",
-            "$1=25",
-            "$2=0",
-            "$3=2",
-            "$4=0",
-            "$5=0",
-            "$6=0",
-            "$10=1",
-            "$11=0.010",
-            "$12=0.002",
-            "$13=0",
-            "$20=0",
-            "$21=0",
-            "$22=0",
-            "$23=0",
-            "$24=25.000",
-            "$25=500.000",
-            "$26=250",
-            "$27=1.000",
-            "$30=1000",
-            "$31=0",
-            "$32=0",
-            "$100=800.000",
-            "$101=800.000",
-            "$102=800.000",
-            "$110=1000.000",
-            "$111=1000.000",
-            "$112=600.000",
-            "$120=30.000",
-            "$121=30.000",
-            "$122=30.000",
-            "$130=130.000",
-            "$131=231.000",
-            "$132=332.000",
-        ]
+        return ["$$"] + ["%s=%s" % (k, v) for k, v in self.settings.items()]
+
+
+"""
+Streaming sender using GRBL's character counting flow control
+https://github.com/gnea/grbl/wiki/Grbl-v1.1-Interface#streaming-protocol-character-counting-recommended-with-reservation
+
+Regular commands are sent one line at a time, waiting on each ok
+Instead keep as many lines in flight as fit in the controller serial rx buffer
+such that the planner always has the next move queued
+Status is polled in the background
+
+WARNING: while streaming the streamer owns the serial port
+Only use it (or GRBL functions that route to it) until close()
+"""
+
+
+class GRBLStreamCommand:
+    def __init__(self, line, motion=False):
+        self.line = line
+        # done once executed by the planner, not just acknowledged
+        self.motion = motion
+        # Counted against the controller rx buffer, including \r
+        self.nbytes = len(line) + 1
+        # Lines received before ok
+        self.data = []
+        # Resolved with data once GRBL parsed it ("ok")
+        self.acked = Future()
+        # Resolved with data once done (motion: executed)
+        self.done = Future()
+
+    @staticmethod
+    def noop(line=""):
+        """
+        Already complete (ex: zero length move)
+        """
+        ret = GRBLStreamCommand(line)
+        ret.acked.set_result([])
+        ret.done.set_result([])
+        return ret
+
+
+class GRBLStreamer:
+    def __init__(self,
+                 gs,
+                 rx_buffer_size=128,
+                 block_buffer_size=15,
+                 poll_period=0.05,
+                 status_cb=None,
+                 verbose=False):
+        """
+        rx_buffer_size / block_buffer_size: as GRBL.i_parsed()["OPT"]
+        poll_period: seconds between ? status requests
+        status_cb(status): parsed status. Called from the reader thread
+        """
+        self.gs = gs
+        self.rx_buffer_size = rx_buffer_size
+        self.block_buffer_size = block_buffer_size
+        self.poll_period = poll_period
+        self.status_cb = status_cb
+        self.verbose = verbose
+        self.cond = threading.Condition()
+        # Realtime bytes may come from other threads
+        self.tx_lock = threading.Lock()
+        # Sent, waiting on ok / error
+        self.in_flight = deque()
+        # Bytes of in_flight
+        self.rx_used = 0
+        # Acknowledged motion still in the planner
+        self.planned = deque()
+        # cancel() in progress: hold off new lines
+        self.cancelling = False
+        self.status = None
+        self.status_seq = 0
+        # Fatal (ex: alarm). Fails all pending commands
+        self.exception = None
+        self.closed = threading.Event()
+        self.threads = []
+        for name, target in (("grbl-stream-rx", self.reader),
+                             ("grbl-stream-poll", self.poller)):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def check(self):
+        if self.exception is not None:
+            raise self.exception
+
+    def send(self, line, motion=False, timeout=None):
+        """
+        Queue line, blocking only while the controller rx buffer is full
+        Return GRBLStreamCommand
+        """
+        cmd = GRBLStreamCommand(line, motion=motion)
+        assert cmd.nbytes <= self.rx_buffer_size, line
+
+        def ready():
+            if self.exception is not None or self.closed.is_set():
+                return True
+            return not self.cancelling and self.rx_used + cmd.nbytes <= self.rx_buffer_size
+
+        with self.cond:
+            ok = self.cond.wait_for(ready, timeout=timeout)
+            self.check()
+            assert not self.closed.is_set(), "streamer closed"
+            if not ok:
+                raise Timeout(f"Timed out after {timeout} sec")
+            # Written under lock to keep in_flight in wire order
+            self.in_flight.append(cmd)
+            self.rx_used += cmd.nbytes
+            self.verbose and print("stream tx '%s'" % (line, ))
+            with self.tx_lock:
+                self.gs.txb((line + "\r").encode("ascii"))
+        return cmd
+
+    def send_realtime(self, c):
+        with self.tx_lock:
+            self.gs.txb(c)
+
+    def wait(self, cmd, timeout=None):
+        try:
+            return cmd.done.result(timeout=timeout)
+        except FutureTimeoutError:
+            raise Timeout(f"Timed out after {timeout} sec")
+
+    def wait_idle(self, timeout=None):
+        """
+        Wait for everything sent to complete
+        """
+        with self.cond:
+            ok = self.cond.wait_for(lambda: self.exception is not None or
+                                    (not self.in_flight and not self.planned),
+                                    timeout=timeout)
+            self.check()
+            if not ok:
+                raise Timeout(f"Timed out after {timeout} sec")
+
+    def qstatus(self, timeout=1.0):
+        """
+        Return a status newer than this call
+        """
+        with self.cond:
+            seq = self.status_seq
+        self.send_realtime(b"?")
+        with self.cond:
+            ok = self.cond.wait_for(
+                lambda: self.exception is not None or self.status_seq > seq,
+                timeout=timeout)
+            self.check()
+            if not ok:
+                raise Timeout(f"Timed out after {timeout} sec")
+            return self.status
+
+    def fail_pending(self, e):
+        """
+        Motion not yet done won't complete
+        In flight lines stay queued until acknowledged to keep the rx buffer count right
+        """
+        with self.cond:
+            for cmd in self.in_flight:
+                if not cmd.done.done():
+                    cmd.done.set_exception(e)
+            while self.planned:
+                cmd = self.planned.popleft()
+                if not cmd.done.done():
+                    cmd.done.set_exception(e)
+            self.cond.notify_all()
+
+    def cancel(self, timeout=2.0):
+        """
+        Jog cancel everything sent so far and wait for the controller to stop
+        Everything pending fails
+
+        Jog cancel only flushes the planner
+        Lines still in the controller rx buffer are parsed (and run) after it
+        => cancel again once all of them were acknowledged
+        """
+        e = GrblException("Jog cancelled")
+        with self.cond:
+            self.cancelling = True
+        try:
+            self.fail_pending(e)
+            self.send_realtime(b"\x85")
+            with self.cond:
+                ok = self.cond.wait_for(
+                    lambda: self.exception is not None or not self.in_flight,
+                    timeout=timeout)
+                self.check()
+                if not ok:
+                    raise Timeout(f"Timed out after {timeout} sec")
+            self.fail_pending(e)
+            tstart = time.time()
+            while True:
+                self.send_realtime(b"\x85")
+                if self.qstatus()["status"] == "Idle":
+                    return
+                if time.time() - tstart > timeout:
+                    raise Timeout(f"Failed to cancel jog after {timeout} sec")
+        finally:
+            with self.cond:
+                self.cancelling = False
+                self.cond.notify_all()
+
+    def poller(self):
+        while not self.closed.wait(self.poll_period):
+            try:
+                self.send_realtime(b"?")
+            except Exception as e:
+                self.fail(e)
+                return
+
+    def reader(self):
+        while True:
+            try:
+                l = self.gs.read_stream_line()
+            except Exception as e:
+                self.fail(e)
+                return
+            if l is None:
+                # Stop once the port went quiet after close()
+                if self.closed.is_set():
+                    return
+                continue
+            if l:
+                self.rx_line(l)
+
+    def rx_line(self, l):
+        if l[0] == "<":
+            self.rx_status(parse_qstatus(trim_status_line(l)))
+            return
+        with self.cond:
+            if l == "ok" or l.find("error") == 0:
+                if not self.in_flight:
+                    print("WARNING: grbl stream: unexpected '%s'" % (l, ))
+                    return
+                cmd = self.in_flight.popleft()
+                self.rx_used -= cmd.nbytes
+                if l == "ok":
+                    cmd.acked.set_result(cmd.data)
+                    # Already failed (cancelled) => nothing to track
+                    if cmd.done.done():
+                        pass
+                    elif cmd.motion:
+                        self.planned.append(cmd)
+                    else:
+                        cmd.done.set_result(cmd.data)
+                else:
+                    e = GrblError(l)
+                    cmd.acked.set_exception(e)
+                    if not cmd.done.done():
+                        cmd.done.set_exception(e)
+                self.cond.notify_all()
+                return
+        # Alarm or unexpected reset: nothing queued is going to happen
+        if l.find("ALARM") == 0 or "Grbl" in l:
+            self.fail(GrblException("grbl stream: " + l))
+            return
+        with self.cond:
+            if self.in_flight:
+                self.in_flight[0].data.append(trim_data_line(l))
+
+    def rx_status(self, status):
+        with self.cond:
+            self.status = status
+            self.status_seq += 1
+            # Everything acknowledged has executed
+            if status["status"] == "Idle":
+                ndone = len(self.planned)
+            # Blocks still in the planner are the most recent ones
+            # Without Bf (see stream_begin()) moves only complete once idle
+            elif "Bf" in status:
+                blocks_free = int(status["Bf"].split(",")[0])
+                queued = self.block_buffer_size - blocks_free
+                ndone = len(self.planned) - queued
+            else:
+                ndone = 0
+            for _i in range(ndone):
+                cmd = self.planned.popleft()
+                cmd.done.set_result(cmd.data)
+            self.cond.notify_all()
+        if self.status_cb:
+            try:
+                self.status_cb(status)
+            except Exception as e:
+                print("WARNING: grbl stream: status callback failed: %s" %
+                      (e, ))
+
+    def fail(self, e):
+        with self.cond:
+            if self.exception is None:
+                self.exception = e
+            for cmd in list(self.in_flight) + list(self.planned):
+                if not cmd.acked.done():
+                    cmd.acked.set_exception(e)
+                if not cmd.done.done():
+                    cmd.done.set_exception(e)
+            self.in_flight.clear()
+            self.planned.clear()
+            self.rx_used = 0
+            self.cond.notify_all()
+
+    def close(self):
+        """
+        Stop threads. Anything still pending fails
+        """
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        with self.cond:
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join()
+        if self.in_flight or self.planned:
+            self.fail(GrblException("grbl stream closed"))
 
 
 class GRBL:
@@ -825,6 +1377,8 @@ class GRBL:
                  probe=True,
                  reset=False,
                  gs=None,
+                 status_max_age=0.1,
+                 buffer_report=False,
                  verbose=None):
         """
         port: serial port file name
@@ -832,12 +1386,30 @@ class GRBL:
         flush: try to clear old serial port communications before initializing
         probe: check communications at init to make sure controlelr is working
         reset: do a full reset at initialization. You will loose position and it will take a while
+        status_max_age: reuse a status report up to this many seconds old. 0 => always query
+        buffer_report: let stream_begin() enable buffer state in status reports ($10, saved to EEPROM)
         verbose: yell stuff to the screen
         """
 
         self.gs = None
         self.qstatus_updated_cb = None
         self.pos_cache = None
+        # (time, serial generation, status) of the last status report
+        self.status_cache = None
+        self.status_max_age = status_max_age
+        # Serial ? round trips vs served from cache
+        self.status_queries = 0
+        self.status_cache_hits = 0
+        # See stream_begin()
+        self.buffer_report = buffer_report
+        self.streamer = None
+        self.stream_target = None
+        # Cached from $110 / $120 for move time estimates
+        self.max_rates = None
+        self.max_accelerations = None
+        self.completion_poller = MotionCompletionPoller()
+        # MotionCompletion of the last blocking move
+        self.last_completion = None
         self.verbose = verbose if verbose is not None else bool(
             int(os.getenv("GRBL_VERBOSE", "0")))
         self.port = None
@@ -851,6 +1423,7 @@ class GRBL:
                 self.port = port
         assert gs
         self.gs = gs
+        self.gs.status_cb = self.status_report
         if flush:
             pass
         if probe:
@@ -867,6 +1440,9 @@ class GRBL:
         self.qstatus_updated_cb = cb
 
     def close(self):
+        if self.streamer:
+            self.streamer.close()
+            self.streamer = None
         if self.gs:
             self.gs.close()
             self.gs = None
@@ -874,6 +1450,85 @@ class GRBL:
     def __del__(self):
         self.close()
 
+    def stream_begin(self, poll_period=0.05):
+        """
+        Hand the serial port to a GRBLStreamer
+        While streaming qstatus(), move_absolute(), wait_idle() and jog_cancel() go through it
+        Other commands must wait until stream_end()
+        """
+        assert self.streamer is None, "already streaming"
+        opt = self.i_parsed()["OPT"]
+        if self.buffer_report:
+            self.enable_buffer_report()
+        # Zero length moves must be skipped, see queue_move_absolute()
+        self.stream_target = dict(self.qstatus()["MPos"])
+        self.streamer = GRBLStreamer(
+            self.gs,
+            rx_buffer_size=opt["rx_buffer_size"],
+            block_buffer_size=opt["block_buffer_size"],
+            poll_period=poll_period,
+            status_cb=self.qstatus_parsed,
+            verbose=self.verbose)
+        return self.streamer
+
+    def enable_buffer_report(self):
+        """
+        Per move completion while streaming needs buffer state (Bf:) in status reports
+        Stock configuration is $10=1 (MPos only): streamed moves then complete once idle
+        This changes a machine setting (stored in EEPROM) => only with buffer_report
+        Left set: restoring it would rewrite EEPROM every stream
+        """
+        mask = int(dict(self.dollar_kvs()).get("$10", "0"))
+        if mask & STATUS_MASK_BUFFER:
+            return
+        try:
+            self.gs.txrx0("$10=%u" % (mask | STATUS_MASK_BUFFER))
+        except GrblError as e:
+            print("WARNING: failed to enable GRBL buffer reports: %s" % (e, ))
+            print("  Streamed moves only complete once idle")
+
+    def stream_end(self, wait=True, timeout=None):
+        streamer = self.streamer
+        if streamer is None:
+            return
+        self.streamer = None
+        try:
+            if wait:
+                streamer.wait_idle(timeout=timeout)
+        finally:
+            streamer.close()
+
+    @contextmanager
+    def streaming(self, poll_period=0.05):
+        """
+        with grbl.streaming():
+            cmds = [grbl.queue_move_absolute({"z": z}, 100) for z in zs]
+        """
+        streamer = self.stream_begin(poll_period=poll_period)
+        try:
+            yield streamer
+        except BaseException:
+            self.stream_end(wait=False)
+            raise
+        self.stream_end()
+
+    def queue_move_absolute(self, pos, f):
+        """
+        Queue a move without waiting on it
+        Return GRBLStreamCommand: .done resolves once the move completed
+        """
+        assert self.streamer, "requires stream_begin()"
+        # GRBL doesn't plan a block for a zero length move => can't be tracked
+        pos = dict([(k, v) for k, v in pos.items()
+                    if format_axis3(v) != format_axis3(self.stream_target[k])])
+        if not pos:
+            return GRBLStreamCommand.noop()
+        cmd = self.streamer.send("$J=G90%s F%s" %
+                                 (format_axes(pos), format_feed(f)),
+                                 motion=True)
+        self.stream_target.update(pos)
+        return cmd
+
     def stop(self):
         # sometimes the stop is ignored
         # seems to happen especially for very low jog amounts
@@ -911,7 +1566,7 @@ class GRBL:
         self.gs.reset_recover()
 
         # Run full status command to be sure
-        self.qstatus()
+        self.qstatus(max_age=0)
         # grbl: recovered after 1.388 sec
         # print("grbl: recovered after %0.3f sec" % (time.time() - tbegin, ))
 
@@ -928,7 +1583,7 @@ class GRBL:
                 # Clear any commands in progress
                 self.gs.flush()
                 # Try a simple command
-                self.qstatus(retry=retry)
+                self.qstatus(retry=retry, max_age=0)
                 # Success!
                 return
             except Exception:
@@ -944,7 +1599,7 @@ class GRBL:
     def update_pos_cache(self):
         self.qstatus()
 
-    def qstatus(self, retry=True):
+    def qstatus(self, retry=True, max_age=None):
         """
         Idle|MPos:8.000,0.000,0.000|FS:0,0|WCO:0.000,0.000,0.000
         Idle|MPos:8.000,0.000,0.000|FS:0,0|Ov:100,100,100
@@ -955,33 +1610,25 @@ class GRBL:
 
         limit switch triggered line
         Alarm|MPos:0.000,0.000,0.000|Bf:35,254|FS:0,0|Pn:Y
-        """
+
+        max_age: accept a cached report this many seconds old (default status_max_age)
+        Reports from before any command since are never reused
+        """
+        if max_age is None:
+            max_age = self.status_max_age
+        ret = self.cached_qstatus(max_age)
+        if ret is not None:
+            self.status_cache_hits += 1
+            return ret
+        if self.streamer:
+            return copy_status(self.streamer.qstatus())
         tries = 3
         for i in range(tries):
             try:
-                raw = self.gs.question()
-                parts = raw.split("|")
-                # FIXME: extra
-                ij = parts[0]
-                ret = {
-                    # Idle, Jog
-                    "status": ij,
-                }
-                for part in parts[1:]:
-                    k, v = part.split(":")
-                    if k == "MPos":
-                        v = (float(x) for x in v.split(","))
-                        v = dict([(k, v) for k, v in zip("xyz", v)])
-                        self.set_pos_cache(v)
-                    elif k == "Pn":
-                        # Y and Z are valid values
-                        # Z appears to be when unhomed?
-                        # assert v == "Y"
-                        # v = True
-                        pass
-                    ret[k] = v
-                if self.qstatus_updated_cb:
-                    self.qstatus_updated_cb(ret)
+                generation = self.gs.generation
+                ret = parse_qstatus(self.gs.question())
+                self.status_queries += 1
+                self.qstatus_parsed(ret, generation)
                 return ret
             except Exception:
                 if not retry:
@@ -993,6 +1640,38 @@ class GRBL:
                 self.general_recover(retry=False)
         assert 0
 
+    def cached_qstatus(self, max_age):
+        cache = self.status_cache
+        if not max_age or cache is None:
+            return None
+        tstatus, generation, status = cache
+        if generation != self.gs.generation or time.time() - tstatus > max_age:
+            return None
+        return copy_status(status)
+
+    def status_report(self, raw, generation):
+        """
+        A status report not from qstatus() (ex: late reply)
+        """
+        try:
+            status = parse_qstatus(raw)
+        except Exception:
+            self.verbose and print("WARNING: bad status report '%s'" % (raw, ))
+            return
+        self.qstatus_parsed(status, generation)
+
+    def qstatus_parsed(self, status, generation=None):
+        """
+        generation: serial generation the report was requested at
+        """
+        if generation is None:
+            generation = self.gs.generation
+        self.status_cache = (time.time(), generation, copy_status(status))
+        if "MPos" in status:
+            self.set_pos_cache(status["MPos"])
+        if self.qstatus_updated_cb:
+            self.qstatus_updated_cb(status)
+
     def mpos(self):
         """Return current absolute machine position (as opposed to WCS)"""
         return self.qstatus()["MPos"]
@@ -1004,17 +1683,24 @@ class GRBL:
         return self.qstatus().get("Pn", "N") in ("Y", "Z")
 
     def move_absolute(self, pos, f, blocking=True):
+        self.last_completion = None
+        if self.streamer:
+            completion = self.move_completion(pos, f)
+            cmd = self.queue_move_absolute(pos, f)
+            if blocking:
+                self.streamer.wait(cmd)
+                completion.set_idle()
+                self.last_completion = completion
+            return
         tries = 3
         for i in range(tries):
             try:
+                completion = self.move_completion(pos, f)
                 # implies G1
-                ax_str = ''.join([
-                    ' %c%s' % (k.upper(), format_axis3(v))
-                    for k, v in pos.items()
-                ])
-                self.gs.j("G90 %s F%u" % (ax_str, f))
+                self.gs.j("G90 %s F%s" % (format_axes(pos), format_feed(f)))
                 if blocking:
-                    self.wait_idle()
+                    self.wait_idle(completion)
+                return
             except Exception:
                 self.verbose and print("WARNING: bad absolute move")
                 if i == tries - 1:
@@ -1045,23 +1731,46 @@ class GRBL:
             ax_str = ''.join([
                 ' %c%s' % (k.upper(), format_axis3(v)) for k, v in pos.items()
             ])
-            self.gs.j("G91 %s F%u" % (ax_str, f))
+            self.gs.j("G91 %s F%s" % (ax_str, format_feed(f)))
             if blocking:
                 self.wait_idle()
 
-    def wait_idle(self):
-        while True:
-            qstatus = self.qstatus()
-            if qstatus["status"] == "Idle":
-                break
-            time.sleep(0.1)
+    def move_completion(self, pos, f):
+        """
+        Estimate an absolute move from the last known position
+        """
+        if None in (self.pos_cache, self.max_rates, self.max_accelerations):
+            return MotionCompletion()
+        expected, velocity_fraction = estimate_move(self.pos_cache,
+                                                    pos,
+                                                    self.max_rates,
+                                                    self.max_accelerations,
+                                                    feed=f)
+        return MotionCompletion(expected=expected,
+                                velocity_fraction=velocity_fraction)
+
+    def wait_idle(self, completion=None):
+        """
+        completion: MotionCompletion with the expected move time, if known
+        Polls quickly only near the expected end
+        """
+        if self.streamer:
+            self.streamer.wait_idle()
+            return
+        if completion is None:
+            completion = MotionCompletion()
+        self.last_completion = completion
+        self.completion_poller.wait(self.is_idle, completion)
+
+    def is_idle(self):
+        return self.qstatus(max_age=0)["status"] == "Idle"
 
     def jog_rel(self, pos, rate):
         assert rate >= 0, rate
         try:
             axes_str = " ".join(
                 ["%s%0.3f" % (axis, scalar) for axis, scalar in pos.items()])
-            cmd = "G91 %s F%u" % (axes_str, rate)
+            cmd = "G91 %s F%s" % (axes_str, format_feed(rate))
             self.verbose and print("JOG:", cmd)
             # print("JOG:", cmd)
             # print("  ", self.qstatus()["MPos"])
@@ -1084,10 +1793,8 @@ class GRBL:
         try:
             axes_str = " ".join(
                 ["%s%0.3f" % (axis, scalar) for axis, scalar in pos.items()])
-            cmd = "G90 %s F%u" % (axes_str, rate)
+            cmd = "G90 %s F%s" % (axes_str, format_feed(rate))
             self.verbose and print("JOG:", cmd)
-            print("JOG:", cmd)
-            print("  ", self.qstatus()["MPos"])
             # Cancel the previous jog and immediately submit the new jog
             # Clears the queue to make the new command take effect
             # Small window => rotor initeria should make this smooth
@@ -1147,6 +1854,13 @@ class GRBL:
                 self.general_recover()
 
     def jog_cancel(self):
+        if self.streamer:
+            # The streamer owns the serial port: no direct gs access / general_recover()
+            self.streamer.cancel()
+            self.streamer.send_realtime(b"~")
+            # Next queued move is relative to where we actually stopped
+            self.stream_target = dict(self.streamer.qstatus()["MPos"])
+            return
         self.do_jog_cancel()
         # Remove the feed hold a jog cancel causes
         self.gs.tilda()
@@ -1225,10 +1939,13 @@ class GRBL:
         return self.get_dollar_xyz_float("$130", "$131", "$132")
 
     def axes_max_rate(self):
-        return self.get_dollar_xyz_float("$110", "$111", "$112")
+        self.max_rates = self.get_dollar_xyz_float("$110", "$111", "$112")
+        return dict(self.max_rates)
 
     def axes_max_acceleration(self):
-        return self.get_dollar_xyz_float("$120", "$121", "$122")
+        self.max_accelerations = self.get_dollar_xyz_float(
+            "$120", "$121", "$122")
+        return dict(self.max_accelerations)
 
     def axes_set_max_rate(self, axes):
         axis2reg = {
@@ -1287,7 +2004,12 @@ However the pos command needs to be scaled to reflect that
 
 
 class GrblHal(MotionHAL):
-    def __init__(self, verbose=None, port=None, grbl=None, **kwargs):
+    def __init__(self,
+                 verbose=None,
+                 port=None,
+                 grbl=None,
+                 buffer_report=False,
+                 **kwargs):
         self.grbl = None
         self.feedrate = None
         self._soft_mins = None
@@ -1301,7 +2023,9 @@ class GrblHal(MotionHAL):
         if grbl:
             self.grbl = grbl
         else:
-            self.grbl = GRBL(port=port, verbose=verbose)
+            self.grbl = GRBL(port=port,
+                             buffer_report=buffer_report,
+                             verbose=verbose)
         """
         # Hack, move out of here to Microscope or similar
         # Run early before any config is overriten though
@@ -1360,6 +2084,9 @@ class GrblHal(MotionHAL):
             self.apply_damper_early(damper)
         """
 
+        self.grbl.status_max_age = options.get("status_max_age",
+                                               self.grbl.status_max_age)
+
         # Used to be in ScalarMM but moved here
         # Too much nuance / tied ot GRBL specific things
         self._wcs_offsets_cache = {}
@@ -1566,11 +2293,25 @@ class GrblHal(MotionHAL):
     def _move_absolute(self, pos, tries=3):
         # print("grbl mv_abs", pos)
         self.grbl.move_absolute(self._move_absolute_adjust_wcs(pos), f=1000)
+        if self.grbl.last_completion is not None:
+            self.completions.append(self.grbl.last_completion)
+
+    def _move_absolute_feed(self, pos, feed):
+        pos = self._move_absolute_adjust_wcs(pos)
+        self.grbl.move_absolute(pos, f=feed)
+        if self.grbl.last_completion is not None:
+            self.completions.append(self.grbl.last_completion)
 
     def _move_relative(self, pos):
         # print("grbl mv_rel", pos)
         self.grbl.move_relative(pos, f=1000)
 
+    def stream_begin(self):
+        self.grbl.stream_begin()
+
+    def stream_end(self):
+        self.grbl.stream_end()
+
     def _stop(self):
         # May be called during unclean shutdown
         if self.grbl:
@@ -1,9 +1,11 @@
 import time
 from uscope.imager.imager import Imager
 import os
-from collections import OrderedDict
+from collections import OrderedDict, deque
 from uscope.util import time_str
 from uscope.motion.motion_util import parse_move
+from uscope.trace import tracer
+from uscope import metrics
 import threading
 
 
@@ -654,6 +656,9 @@ class MotionHAL:
         # self.progress = lambda pos: None
         self.status_cbs = []
         self.mv_lastt = time.time()
+        # MotionCompletion of recent moves, if the HAL tracks them
+        # See Kinematics.motion_settle_scale()
+        self.completions = deque(maxlen=8)
         # An *estimate* of where jogs will land us if they all complete
         # There are several ways this can go wrong
         # ex: if we start jogging when not idle
@@ -973,6 +978,20 @@ class MotionHAL:
         """
         self.enable_modifier("backlash", lazy=True)
 
+    def stream_begin(self):
+        """
+        Several moves in a row are coming (ex: focus stack)
+        Controllers that support it queue them instead of a round trip + idle poll each
+        Moves still block until done
+        """
+        pass
+
+    def stream_end(self):
+        """
+        Revert above. Safe to call if not streaming
+        """
+        pass
+
     def iter_active_modifiers(self):
         assert self.modifiers is not None, "Not configured yet"
         for modifier_name, modifier in self.modifiers.items():
@@ -1090,7 +1109,9 @@ class MotionHAL:
         self.validate_axes(pos.keys())
         self.verbose and print("motion: move_absolute(%s)" % (pos_str(pos)))
         self.cur_pos_cache_invalidate()
-        self._move_absolute_wrap(pos, options=options)
+        with tracer.span("move", "motion", args=pos), \
+                metrics.motion_command_seconds.time(command="move_absolute"):
+            self._move_absolute_wrap(pos, options=options)
 
     def _move_absolute_wrap(self, pos, options={}):
         '''Absolute move to positions specified by pos dict'''
@@ -1098,7 +1119,11 @@ class MotionHAL:
         try:
             for modifier in self.iter_active_modifiers():
                 modifier.move_absolute_pre(pos, options=options)
-            _ret = self._move_absolute(pos)
+            feed = options.get("feed")
+            if feed is None:
+                _ret = self._move_absolute(pos)
+            else:
+                _ret = self._move_absolute_feed(pos, feed)
             for modifier in self.iter_active_modifiers():
                 modifier.move_absolute_post(True, options=options)
             self.mv_lastt = time.time()
@@ -1109,6 +1134,13 @@ class MotionHAL:
         '''Absolute move to positions specified by pos dict'''
         raise NotSupported("Required for planner")
 
+    def _move_absolute_feed(self, pos, feed):
+        '''
+        Absolute move at a specific path speed
+        feed: mm / min (GRBL units)
+        '''
+        raise NotSupported("Required for fly scan")
+
     def move_absolute_str(self, pos, options={}):
         self.move_absolute(parse_move(pos), options=options)
 
@@ -1139,7 +1171,9 @@ class MotionHAL:
         # Relative move full stack just too hard to support well for now
         # Ex: setting up w/ backlash compensation is difficult
         # And don't see a real reason to support it
-        return self._move_absolute_wrap(final_abs_pos, options=options)
+        with tracer.span("move", "motion", args=final_abs_pos), \
+                metrics.motion_command_seconds.time(command="move_relative"):
+            return self._move_absolute_wrap(final_abs_pos, options=options)
         """
         try:
             for modifier in self.iter_active_modifiers():
@@ -1453,6 +1487,9 @@ class MockHal(MotionHAL):
         0 and self._log('absolute move to ' + pos_str(pos))
         self.update_status({"pos": self._pos_cache})
 
+    def _move_absolute_feed(self, pos, feed):
+        self._move_absolute(pos)
+
     def _move_relative(self, delta):
         for axis, adelta in delta.items():
             self._pos_cache[axis] += adelta
@@ -1523,6 +1560,9 @@ class DryHal(MotionHAL):
             'absolute move to ' +
             ' '.join(['%c%0.3f' % (k.upper(), v) for k, v in pos.items()]))
 
+    def _move_absolute_feed(self, pos, feed):
+        self._move_absolute(pos)
+
     def _move_relative(self, delta):
         for axis, adelta in delta.items():
             self._posd[axis] += adelta
@@ -1,3 +1,4 @@
+import math
 import re
 
 
@@ -40,3 +41,96 @@ def parse_move(s):
         ret[axist[1].lower()] = float(numbert[1])
 
     return ret
+
+
+def format_feed(feed):
+    """
+    Feed rate (mm / min) as sent in G-code
+    Slow moves (ex: continuous autofocus) need finer than 1 mm / min
+    """
+    return "%0.3f" % feed
+
+
+def trapezoid_time(distance, velocity, acceleration):
+    """
+    Seconds to move distance starting and ending at rest
+    velocity: mm / sec
+    acceleration: mm / sec2
+    """
+    distance = abs(distance)
+    if not distance:
+        return 0.0
+    # Triangular: never reaches full speed
+    if distance <= velocity * velocity / acceleration:
+        return 2 * math.sqrt(distance / acceleration)
+    return distance / velocity + velocity / acceleration
+
+
+def trapezoid_distance(t, distance, velocity, acceleration):
+    """
+    Distance covered t seconds into a trapezoid_time() move
+    """
+    distance = abs(distance)
+    total = trapezoid_time(distance, velocity, acceleration)
+    if t <= 0.0:
+        return 0.0
+    if t >= total:
+        return distance
+    # Lower than velocity if triangular
+    peak = min(velocity, math.sqrt(distance * acceleration))
+    taccel = peak / acceleration
+    if t <= taccel:
+        return acceleration * t * t / 2
+    if t <= total - taccel:
+        return peak * taccel / 2 + peak * (t - taccel)
+    tleft = total - t
+    return distance - acceleration * tleft * tleft / 2
+
+
+def trapezoid_time_at(position, distance, velocity, acceleration):
+    """
+    Seconds into a trapezoid_time() move until position has been covered
+    Inverse of trapezoid_distance()
+    """
+    distance = abs(distance)
+    position = min(max(abs(position), 0.0), distance)
+    total = trapezoid_time(distance, velocity, acceleration)
+    peak = min(velocity, math.sqrt(distance * acceleration))
+    taccel = peak / acceleration
+    daccel = peak * taccel / 2
+    if position <= daccel:
+        return math.sqrt(2 * position / acceleration)
+    if position <= distance - daccel:
+        return taccel + (position - daccel) / peak
+    return total - math.sqrt(2 * (distance - position) / acceleration)
+
+
+def estimate_move(src, dst, velocities, accelerations, feed=None):
+    """
+    Estimate a single coordinated (ex: GRBL G1 / jog) move from rest to rest
+    velocities: mm / min (GRBL units)
+    accelerations: mm / sec2
+    feed: requested mm / min, if any
+
+    Like the GRBL planner, path speed and acceleration are
+    limited such that no axis exceeds its own maximum
+
+    Return (seconds, peak path speed / path speed limit)
+    """
+    deltas = dict([(axis, dst[axis] - src[axis]) for axis in dst
+                   if axis in src and dst[axis] != src[axis]])
+    distance = math.sqrt(sum(delta * delta for delta in deltas.values()))
+    if not distance:
+        return 0.0, 0.0
+    velocity = feed / 60.0 if feed else None
+    acceleration = None
+    for axis, delta in deltas.items():
+        unit = abs(delta) / distance
+        axis_velocity = velocities[axis] / 60.0 / unit
+        if velocity is None or axis_velocity < velocity:
+            velocity = axis_velocity
+        axis_acceleration = accelerations[axis] / unit
+        if acceleration is None or axis_acceleration < acceleration:
+            acceleration = axis_acceleration
+    peak = min(velocity, math.sqrt(acceleration * distance))
+    return trapezoid_time(distance, velocity, acceleration), peak / velocity
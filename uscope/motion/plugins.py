@@ -57,7 +57,9 @@ def register_plugins():
     def grbl_ser(usc_motion, kwargs):
         grblc = usc_motion.j.get("grbl", {})
         port = grblc.get("port")
-        ret = GrblHal(port=port, **kwargs)
+        ret = GrblHal(port=port,
+                      buffer_report=grblc.get("buffer_report", False),
+                      **kwargs)
         return ret
 
     register_plugin("grbl-ser", grbl_ser)
@@ -95,6 +97,7 @@ def configure_motion_hal(microscope):
         "backlash_compensation": usc_motion.backlash_compensation(),
         "soft_limits": usc_motion.soft_limits(),
         "use_wcs_offsets": usc_motion.use_wcs_offsets(),
+        "status_max_age": usc_motion.status_max_age(),
     }
 
     # Escape hatch for system initialization
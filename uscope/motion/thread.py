@@ -1,6 +1,7 @@
 from uscope.motion.plugins import get_motion_hal
 from uscope.motion.hal import AxisExceeded, MotionHAL, MotionCritical
 from uscope.threads import CommandThreadBase
+from uscope import metrics
 
 import threading
 import queue
@@ -23,6 +24,9 @@ class MotionThreadMotion(MotionHAL):
                            log=mt.motion.log,
                            verbose=mt.motion.verbose,
                            microscope=self.mt.ac.microscope)
+        # Moves complete on the real HAL: share its history
+        # (ex: Kinematics.motion_settle_scale())
+        self.completions = mt.motion.completions
 
         # Don't re-apply pipeline (scaling, etc)
         self.configure({})
@@ -36,6 +40,9 @@ class MotionThreadMotion(MotionHAL):
     def _move_absolute(self, pos):
         self.mt.move_absolute(pos, block=True)
 
+    def _move_absolute_feed(self, pos, feed):
+        self.mt.move_absolute(pos, block=True, options={"feed": feed})
+
     def _move_relative(self, pos):
         self.mt.move_relative(pos, block=True)
 
@@ -56,6 +63,12 @@ class MotionThreadMotion(MotionHAL):
     def backlash_enable(self):
         self.mt.backlash_enable(block=True)
 
+    def stream_begin(self):
+        self.mt.stream_begin(block=True)
+
+    def stream_end(self):
+        self.mt.stream_end(block=True)
+
     def _get_max_velocities(self):
         return self.mt.motion.get_max_velocities()
 
@@ -102,6 +115,7 @@ class JogController:
         this_dt = None
         if self.tlast is not None:
             this_dt = tthis - self.tlast
+            metrics.jog_loop_seconds.observe(this_dt)
             if this_dt < self.period:
                 """
                 looks like qt can undershoot period maybe depending on how events stack up
@@ -115,6 +129,7 @@ class JogController:
                 )
             if this_dt > 1.5 * self.period:
                 self.slow_jogs += 1
+                metrics.jog_slow.inc()
                 1 and print(
                     f"JOG WARNING: actual loop time {this_dt} is significantly larger than estimated period {self.period}. Jogging may stutter"
                 )
@@ -291,9 +306,21 @@ class MotionThreadBase(CommandThreadBase):
     def backlash_enable(self, block=False):
         self.command("backlash_enable", block=block)
 
-    def move_absolute(self, pos, block=False, callback=None, done=None):
+    def stream_begin(self, block=False):
+        self.command("stream_begin", block=block)
+
+    def stream_end(self, block=False):
+        self.command("stream_end", block=block)
+
+    def move_absolute(self,
+                      pos,
+                      block=False,
+                      callback=None,
+                      done=None,
+                      options={}):
         self.command("move_absolute",
                      pos,
+                     options,
                      block=block,
                      callback=callback,
                      done=done)
@@ -414,9 +441,9 @@ class MotionThreadBase(CommandThreadBase):
                 def default(*args):
                     raise Exception("Bad command %s" % (command, ))
 
-                def move_absolute(pos):
+                def move_absolute(pos, options={}):
                     try:
-                        self.motion.move_absolute(pos)
+                        self.motion.move_absolute(pos, options=options)
                     except AxisExceeded as e:
                         self.log(str(e))
                     return self.motion.pos()
@@ -452,6 +479,8 @@ class MotionThreadBase(CommandThreadBase):
                     'home': self.motion.home,
                     'backlash_disable': self.motion.backlash_disable,
                     'backlash_enable': self.motion.backlash_enable,
+                    'stream_begin': self.motion.stream_begin,
+                    'stream_end': self.motion.stream_end,
                     # 'stop': self.motion.stop,
                     # 'estop': self.motion.estop,
                     'unestop': self.motion.unestop,
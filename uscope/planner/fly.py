@@ -0,0 +1,280 @@
+"""
+Fly scan: capture XY tiles while the stage sweeps each row at constant speed
+
+Stop and shoot pays to accelerate, decelerate and settle on every tile
+Instead each row is one long move at a feed slow enough that
+an exposure blurs by at most max_blur_pix
+A frame is requested just before the stage passes each tile
+and is then positioned from its timestamp along the row's motion profile
+
+While a row is sweeping its thread is the only motion controller user
+Nothing else in the pipeline may move or query the stage (see FlyFrame.position())
+
+There is no hardware trigger: frames are timestamped as they reach the capture sink
+latency (config) is how long before that the exposure ended
+"""
+
+from uscope.motion.motion_util import format_feed, trapezoid_distance, trapezoid_time, trapezoid_time_at
+from collections import OrderedDict
+import threading
+import time
+
+
+def row_runs(order):
+    """
+    Split a tile order into runs of consecutive tiles on the same row
+    Tiles are (ll_col, ll_row)
+    """
+    ret = []
+    for tile in order:
+        if ret and ret[-1][-1][1] == tile[1]:
+            ret[-1].append(tile)
+        else:
+            ret.append([tile])
+    return ret
+
+
+class FlyRow:
+    def __init__(self, start, end, fixed, feed, acceleration, axis="x"):
+        """
+        start, end: swept axis positions including lead in / out
+        fixed: the other axes, ex {"y": 1.2}
+        feed: mm / sec
+        acceleration: mm / sec2
+        """
+        self.axis = axis
+        self.start = start
+        self.end = end
+        self.fixed = dict(fixed)
+        # Model the sweep with the feed the controller actually gets
+        self.feed = float(format_feed(feed * 60)) / 60
+        self.acceleration = acceleration
+        self.direction = 1 if end >= start else -1
+        self.distance = abs(end - start)
+        # When the sweep was issued
+        self.t0 = None
+        self.thread = None
+        self.exception = None
+
+    def pos(self, value):
+        ret = dict(self.fixed)
+        ret[self.axis] = value
+        return ret
+
+    def duration(self):
+        return trapezoid_time(self.distance, self.feed, self.acceleration)
+
+    def time_at(self, value):
+        """
+        When the stage passes value
+        """
+        return self.t0 + trapezoid_time_at(value - self.start, self.distance,
+                                           self.feed, self.acceleration)
+
+    def position_at(self, t):
+        offset = trapezoid_distance(t - self.t0, self.distance, self.feed,
+                                    self.acceleration)
+        return self.pos(self.start + self.direction * offset)
+
+    def run(self, move_absolute):
+        """
+        Issue the sweep without waiting on it
+        move_absolute(pos, options): blocking move, must already be at start
+        """
+
+        def move():
+            try:
+                move_absolute(self.pos(self.end),
+                              options={"feed": self.feed * 60})
+            except Exception as e:
+                self.exception = e
+
+        self.t0 = time.time()
+        self.thread = threading.Thread(target=move,
+                                       name="fly-row",
+                                       daemon=True)
+        self.thread.start()
+
+    def join(self, pos, tolerance):
+        """
+        pos(): current position
+        """
+        self.thread.join()
+        if self.exception is not None:
+            raise Exception("Fly scan: row move failed") from self.exception
+        # Ex: MotionThread logs AxisExceeded instead of raising
+        actual = pos()[self.axis]
+        if abs(actual - self.end) > tolerance:
+            raise Exception("Fly scan: row ended at %0.3f, expected %0.3f" %
+                            (actual, self.end))
+
+
+class FlyFrame:
+    """
+    Passed down the planner pipeline as state["fly"]
+    Capture reports the frame back through captured()
+    """
+    def __init__(self, scan, row, key, target):
+        self.scan = scan
+        self.row = row
+        self.key = key
+        self.target = target
+
+    def captured(self, capim):
+        self.scan.captured(self, capim.tcapture)
+
+    def position(self):
+        """
+        Where this frame was taken without asking the motion controller:
+        it is busy with the sweep until the row ends
+        Exposure position once captured, otherwise where the row profile puts the stage now
+        """
+        with self.scan.lock:
+            pos = self.scan.frames.get(self.key)
+        if pos is None:
+            return self.row.position_at(time.time())
+        return dict([(k, v) for k, v in pos.items() if k != "error"])
+
+
+class FlyScan:
+    def __init__(self,
+                 pc,
+                 axis,
+                 exposure,
+                 velocities,
+                 accelerations,
+                 log=None):
+        """
+        axis: PlannerAxis being swept (X)
+        exposure: seconds
+        velocities: mm / min (GRBL units)
+        accelerations: mm / sec2
+        """
+        if log is None:
+
+            def log(msg=""):
+                print(msg)
+
+        self.log = log
+        self.exposure = exposure
+        self.frame_period = pc.fly_scan.frame_period()
+        self.latency = pc.fly_scan.latency()
+        self.max_blur_pix = pc.fly_scan.max_blur_pix()
+        self.acceleration = accelerations["x"]
+        mm_per_pix = axis.view_mm / axis.view_pixels
+        overlap_mm = axis.view_mm - axis.step()
+
+        # mm / sec
+        self.limits = OrderedDict()
+        self.limits["blur"] = self.max_blur_pix * mm_per_pix / exposure
+        # A frame lands up to half a frame period off its tile
+        # Keep that within half the overlap
+        self.limits["overlap"] = overlap_mm / self.frame_period
+        # One frame to latch the previous tile, one of margin
+        self.limits["frame rate"] = axis.step() / (2 * self.frame_period)
+        self.limits["velocity"] = velocities["x"] / 60.0
+        max_feed = pc.fly_scan.max_feed()
+        if max_feed is not None:
+            self.limits["max_feed"] = max_feed / 60.0
+        self.limited_by = min(self.limits, key=lambda k: self.limits[k])
+        self.feed = self.limits[self.limited_by]
+        # Reach full speed plus one frame before the first tile
+        # and keep it until one frame after the last
+        accel_mm = self.feed * self.feed / (2 * self.acceleration)
+        self.lead_in = 1.5 * accel_mm + self.feed * (self.frame_period +
+                                                     self.latency)
+        self.lead_out = 1.5 * accel_mm + self.feed * self.frame_period
+
+        self.lock = threading.Lock()
+        # filename part => measured position
+        self.frames = OrderedDict()
+        self.rows = 0
+        self.late = 0
+        self.sweep_time = 0.0
+
+    def row(self, positions):
+        """
+        positions: tile positions in visiting order, all on one row
+        """
+        first = positions[0]["x"]
+        last = positions[-1]["x"]
+        direction = 1 if last >= first else -1
+        fixed = dict([(k, v) for k, v in positions[0].items() if k != "x"])
+        return FlyRow(start=first - direction * self.lead_in,
+                      end=last + direction * self.lead_out,
+                      fixed=fixed,
+                      feed=self.feed,
+                      acceleration=self.acceleration)
+
+    def wait_request(self, row, value):
+        """
+        Sleep until the next frame should be requested for the tile at value
+        The next frame arrives within a frame period of the request
+        => aim for its exposure to be centered on the tile on average
+        """
+        t = row.time_at(value) - self.frame_period / 2 + self.latency
+        t += self.exposure / 2
+        now = time.time()
+        if now < t:
+            time.sleep(t - now)
+        elif now - t > self.frame_period / 2:
+            self.late += 1
+            self.log("Fly scan: frame request %0.3f sec late" % (now - t, ))
+
+    def frame(self, row, key, target):
+        return FlyFrame(self, row, key, target)
+
+    def captured(self, frame, tcapture):
+        # Middle of the exposure
+        t = tcapture - self.latency - self.exposure / 2
+        pos = frame.row.position_at(t)
+        pos["error"] = pos["x"] - frame.target["x"]
+        with self.lock:
+            self.frames[frame.key] = pos
+
+    def row_done(self, row):
+        self.rows += 1
+        self.sweep_time += row.duration()
+
+    def log_plan(self, rows):
+        """
+        rows: tile positions per row, as given to row()
+        """
+        self.log("  Fly scan: %0.3f mm / sec (limited by %s)" %
+                 (self.feed, self.limited_by))
+        estimate = sum(self.row(positions).duration() for positions in rows)
+        self.log("    %u rows, estimated %0.1f sec sweeping + row changes" %
+                 (len(rows), estimate))
+        for name, limit in self.limits.items():
+            self.log("    %s: %0.3f mm / sec" % (name, limit))
+        self.log("    exposure: %0.4f sec, frame period %0.4f sec" %
+                 (self.exposure, self.frame_period))
+        self.log("    lead in: %0.3f mm, lead out %0.3f mm" %
+                 (self.lead_in, self.lead_out))
+
+    def log_scan_end(self):
+        with self.lock:
+            errors = [abs(pos["error"]) for pos in self.frames.values()]
+        self.log("Fly scan: %u rows, %0.1f sec sweeping, %u late requests" %
+                 (self.rows, self.sweep_time, self.late))
+        if errors:
+            self.log("Fly scan: max tile position error %0.4f mm" %
+                     (max(errors), ))
+
+    def meta(self):
+        with self.lock:
+            frames = OrderedDict(self.frames)
+        return {
+            "feed": self.feed,
+            "limited_by": self.limited_by,
+            "limits": dict(self.limits),
+            "exposure": self.exposure,
+            "frame_period": self.frame_period,
+            "latency": self.latency,
+            "lead_in": self.lead_in,
+            "lead_out": self.lead_out,
+            "rows": self.rows,
+            "late": self.late,
+            "sweep_time": self.sweep_time,
+            "frames": frames,
+        }
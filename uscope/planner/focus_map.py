@@ -0,0 +1,175 @@
+"""
+Focus map: best focus z as a smooth function of XY
+
+XY3P's plane through three corners can't follow a curved / warped die
+and per tile autofocus is far too slow
+Instead sample best focus on a sparse grid, fit a surface and query z per tile
+The map can also be refined during the scan from focus stack results (see StackerDrift)
+
+Models:
+-plane: z = a + bx + cy
+-quadratic: plane + x2, xy, y2 terms (bowl / saddle warp)
+-thin-plate: thin plate spline through the samples (smoothing relaxes it)
+-auto: quadratic with enough samples, otherwise plane
+"""
+
+from uscope.imager.autofocus import focus_score, parabolic_peak
+import numpy as np
+import threading
+
+MODELS = ("auto", "plane", "quadratic", "thin-plate")
+
+
+def grid_indices(n, count):
+    """
+    count indices spread evenly over 0 to n - 1, ends included
+    """
+    if count <= 1 or n <= 1:
+        return [(n - 1) // 2]
+    count = min(count, n)
+    return sorted(
+        set([int(round(i * (n - 1) / (count - 1))) for i in range(count)]))
+
+
+def grid_order(n_cols, n_rows, grid_cols, grid_rows):
+    """
+    Sample tiles as [(ll_col, ll_row)]
+    Serpentine: every other row is visited right to left
+    """
+    ll_cols = grid_indices(n_cols, grid_cols)
+    ret = []
+    for rowi, ll_row in enumerate(grid_indices(n_rows, grid_rows)):
+        cols = ll_cols if rowi % 2 == 0 else ll_cols[::-1]
+        ret += [(ll_col, ll_row) for ll_col in cols]
+    return ret
+
+
+def sweep_focus(move_absolute, wait, get_image, z, step, steps_pm, poll=None):
+    """
+    Step z through z +/- steps_pm * step and return (best z, best score)
+    Best z is interpolated between steps
+    get_image(): return an image focus_score() accepts
+    """
+    zs = [z + i * step for i in range(-steps_pm, steps_pm + 1)]
+    scores = []
+    for this_z in zs:
+        if poll:
+            poll()
+        move_absolute({"z": this_z})
+        wait()
+        scores.append(focus_score(get_image()))
+    # parabolic_peak() wants increasing xs
+    if step < 0:
+        zs = zs[::-1]
+        scores = scores[::-1]
+    return parabolic_peak(zs, scores), max(scores)
+
+
+class FocusMap:
+    def __init__(self, model="auto", smoothing=0.0):
+        assert model in MODELS, "bad focus map model %s" % (model, )
+        self.model = model
+        self.smoothing = smoothing
+        # Online updates come from the planner thread
+        # but queries may come from elsewhere (ex: path estimates)
+        self.lock = threading.Lock()
+        # (x, y, z, source)
+        self.samples = []
+        # Model actually fitted
+        self.fitted = None
+        self.coefficients = None
+        self.rbf = None
+        # Normalization keeps the fit well conditioned
+        self.center = (0.0, 0.0)
+        self.scale = 1.0
+
+    def add(self, x, y, z, source="grid"):
+        with self.lock:
+            self.samples.append((x, y, z, source))
+
+    def ready(self):
+        return self.fitted is not None
+
+    def choose_model(self, n):
+        if self.model != "auto":
+            return self.model
+        if n >= 6:
+            return "quadratic"
+        return "plane"
+
+    def terms(self, model, x, y):
+        """
+        Design matrix columns for normalized x, y
+        """
+        ret = [np.ones_like(x), x, y]
+        if model == "quadratic":
+            ret += [x * x, x * y, y * y]
+        return np.stack(ret, axis=-1)
+
+    def fit(self):
+        with self.lock:
+            samples = list(self.samples)
+            model = self.choose_model(len(samples))
+            need = {"plane": 3, "quadratic": 6, "thin-plate": 3}[model]
+            if len(samples) < need:
+                raise ValueError("focus map: %s needs %u samples, have %u" %
+                                 (model, need, len(samples)))
+            xy = np.array([(x, y) for x, y, _z, _source in samples])
+            zs = np.array([z for _x, _y, z, _source in samples])
+            center = xy.mean(axis=0)
+            scale = max(float(np.abs(xy - center).max()), 1e-6)
+            nxy = (xy - center) / scale
+            coefficients = None
+            rbf = None
+            if model == "thin-plate":
+                from scipy.interpolate import RBFInterpolator
+                rbf = RBFInterpolator(nxy,
+                                      zs,
+                                      kernel="thin_plate_spline",
+                                      smoothing=self.smoothing)
+            else:
+                a = self.terms(model, nxy[:, 0], nxy[:, 1])
+                coefficients = np.linalg.lstsq(a, zs, rcond=None)[0]
+            self.fitted = model
+            self.center = (float(center[0]), float(center[1]))
+            self.scale = scale
+            self.coefficients = coefficients
+            self.rbf = rbf
+
+    def z(self, x, y):
+        with self.lock:
+            assert self.fitted, "focus map not fitted"
+            nx = (x - self.center[0]) / self.scale
+            ny = (y - self.center[1]) / self.scale
+            if self.rbf is not None:
+                return float(self.rbf(np.array([[nx, ny]]))[0])
+            a = self.terms(self.fitted, np.array(nx), np.array(ny))
+            return float(a.dot(self.coefficients))
+
+    def residuals(self):
+        """
+        Sample z - fitted z, per sample
+        """
+        return [z - self.z(x, y) for x, y, z, _source in list(self.samples)]
+
+    def log_fit(self, log):
+        residuals = self.residuals()
+        rms = (sum(r * r for r in residuals) / len(residuals))**0.5
+        worst = max(abs(r) for r in residuals)
+        log("Focus map: %s fit over %u samples, rms residual %0.6f, max %0.6f"
+            % (self.fitted, len(residuals), rms, worst))
+
+    def meta(self):
+        samples = [{
+            "x": x,
+            "y": y,
+            "z": z,
+            "source": source,
+        } for x, y, z, source in list(self.samples)]
+        ret = {
+            "model": self.fitted,
+            "samples": samples,
+        }
+        if self.fitted:
+            ret["residuals"] = self.residuals()
+        return ret
@@ -0,0 +1,98 @@
+"""
+Background image encode + write for the planner
+Encoding a large .jpg / .tif can take a good fraction of a second
+which is otherwise time the stage sits still
+
+Bounded: put() blocks once max_pending saves are waiting
+such that a slow disk throttles the scan instead of filling RAM
+
+A concurrent.futures.Future may be given instead of the image
+(ex: pipelined capture, still being processed)
+It is resolved in the writer thread
+"""
+
+from concurrent.futures import Future
+import queue
+import threading
+import traceback
+
+
+class ImageWriter:
+    def __init__(self,
+                 nthreads=2,
+                 max_pending=4,
+                 result_timeout=None,
+                 log=None):
+        if log is None:
+
+            def log(s=""):
+                print(s)
+
+        self.log = log
+        # Max wait on an image Future once a writer picks it up
+        self.result_timeout = result_timeout
+        # (CapturedImage, filename, save kwargs, callback) or None => exit
+        self.queue = queue.Queue(maxsize=max_pending)
+        # First failure, re-raised in the planner thread
+        self.exception = None
+        self.threads = []
+        for i in range(nthreads):
+            thread = threading.Thread(target=self.worker,
+                                      name=f"image-writer-{i}",
+                                      daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def worker(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                capim, fn, kwargs, callback = item
+                # Already failed => don't pile on
+                if self.exception is None:
+                    if isinstance(capim, Future):
+                        capim = capim.result(timeout=self.result_timeout)
+                    capim.save(fn, **kwargs)
+                    if callback:
+                        callback(fn)
+            except Exception as e:
+                self.log(f"WARNING: failed to save image: {e}")
+                self.log(traceback.format_exc())
+                if self.exception is None:
+                    self.exception = e
+            finally:
+                self.queue.task_done()
+
+    def check(self):
+        if self.exception is not None:
+            raise Exception("Image save failed") from self.exception
+
+    def put(self, capim, fn, kwargs={}, callback=None):
+        """
+        Queue capim (CapturedImage or Future) to be saved as fn
+        callback(fn) is called from a writer thread once written
+        """
+        self.check()
+        assert self.threads, "writer closed"
+        self.queue.put((capim, fn, kwargs, callback))
+
+    def flush(self):
+        """
+        Wait for all queued images to be written
+        """
+        self.queue.join()
+        self.check()
+
+    def close(self):
+        """
+        Write out anything queued and stop threads
+        """
+        if not self.threads:
+            return
+        for _thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
@@ -0,0 +1,246 @@
+"""
+Scan path planning: choose the order XY tiles are visited in
+
+Moves are estimated with a per axis trapezoidal velocity profile
+Axes move together (GRBL coordinated move) => slowest axis sets the time
+Arriving against the backlash compensation direction costs an overshoot + return
+
+Tiles are (ll_col, ll_row) and need not be a full grid (ex: exclusions)
+"""
+
+from uscope.motion.motion_util import trapezoid_time
+from collections import OrderedDict
+from enum import Enum
+
+
+class XYPattern(Enum):
+    # For reach row:
+    # Start at left side and move right
+    # "left right"
+    XM_XP = "x-:x+"
+    # For reach row:
+    # Start at right side and move left
+    XP_XM = "x+:x-"
+    # Column major
+    # For each column:
+    # Start at bottom and move up
+    YM_YP = "y-:y+"
+    # For each column:
+    # Start at top and move down
+    YP_YM = "y+:y-"
+    # Fastest estimated of the above + nearest neighbor
+    AUTO = "auto"
+
+
+RASTER_PATTERNS = (XYPattern.XM_XP, XYPattern.XP_XM, XYPattern.YM_YP,
+                   XYPattern.YP_YM)
+
+
+class MotionModel:
+    def __init__(self,
+                 velocities,
+                 accelerations,
+                 backlash={},
+                 compensation={},
+                 tsettle=0.0):
+        """
+        velocities: mm / min (GRBL units, as MotionHAL.get_max_velocities())
+        accelerations: mm / sec2
+        compensation: as BacklashMM, +1 => arrive moving positive
+        tsettle: fixed cost per tile
+        """
+        self.velocities = dict([(axis, v / 60.0)
+                                for axis, v in velocities.items()])
+        self.accelerations = dict(accelerations)
+        self.backlash = dict(backlash)
+        self.compensation = dict(compensation)
+        self.tsettle = tsettle
+
+    @staticmethod
+    def from_motion(motion, pc=None, tsettle=0.0):
+        """
+        Return None if motion isn't configured yet
+        """
+        if motion.modifiers is None:
+            return None
+        backlash = {}
+        compensation = {}
+        backlash_mm = motion.modifiers.get("backlash")
+        if backlash_mm:
+            backlash = backlash_mm.backlash
+            compensation = backlash_mm.compensation
+        # ex: GUI planner motion, backlash is applied by the motion thread
+        elif pc:
+            backlash = pc.motion.backlash()
+            compensation = pc.motion.backlash_compensation()
+        return MotionModel(velocities=motion.get_max_velocities(),
+                           accelerations=motion.get_max_accelerations(),
+                           backlash=backlash,
+                           compensation=compensation,
+                           tsettle=tsettle)
+
+    def axis_time(self, axis, distance):
+        return trapezoid_time(distance, self.velocities[axis],
+                              self.accelerations[axis])
+
+    def move_time(self, src, dst):
+        ret = 0.0
+        for axis, val in dst.items():
+            if axis not in self.velocities or axis not in src:
+                continue
+            delta = val - src[axis]
+            backlash = self.backlash.get(axis, 0.0)
+            compensation = self.compensation.get(axis, 0)
+            if backlash and delta * compensation < 0:
+                # Arriving against compensation direction: overshoot then come back
+                t = self.axis_time(axis, abs(delta) + backlash)
+                t += self.axis_time(axis, backlash)
+            else:
+                t = self.axis_time(axis, delta)
+            ret = max(ret, t)
+        return ret
+
+
+def raster_order(tiles, cols, rows, pattern, serpentine=True):
+    """
+    Return tiles in raster order
+    Serpentine alternates on lines that actually have tiles
+    """
+    pattern = XYPattern(pattern)
+    if pattern in (XYPattern.XM_XP, XYPattern.XP_XM):
+        nlines, nsteps = rows, cols
+        reverse = pattern == XYPattern.XP_XM
+    elif pattern in (XYPattern.YM_YP, XYPattern.YP_YM):
+        nlines, nsteps = cols, rows
+        reverse = pattern == XYPattern.YP_YM
+    else:
+        assert 0, pattern
+
+    lines = []
+    for line in range(nlines):
+        line_tiles = []
+        for step in range(nsteps):
+            if pattern in (XYPattern.XM_XP, XYPattern.XP_XM):
+                tile = (step, line)
+            else:
+                tile = (line, step)
+            if tile in tiles:
+                line_tiles.append(tile)
+        if not line_tiles:
+            continue
+        if reverse:
+            line_tiles.reverse()
+        lines.append(line_tiles)
+
+    ret = []
+    for linei, line_tiles in enumerate(lines):
+        if serpentine and linei % 2 == 1:
+            line_tiles = line_tiles[::-1]
+        ret += line_tiles
+    return ret
+
+
+def nearest_order(tiles, positions, model, start):
+    """
+    Greedy nearest (by move time) neighbor
+    Searches outward in grid rings so large scans stay fast
+    """
+    remaining = set(tiles)
+    if not remaining:
+        return []
+    max_ring = max(max(c for c, _r in tiles), max(r for _c, r in tiles)) + 1
+    ret = []
+    cur_tile = None
+    cur_pos = start
+    while remaining:
+        candidates = []
+        if cur_tile is None:
+            candidates = list(remaining)
+        else:
+            found = None
+            for ring in range(1, max_ring + 1):
+                for tile in ring_tiles(cur_tile, ring):
+                    if tile in remaining:
+                        candidates.append(tile)
+                # Non-uniform axis speeds / backlash:
+                # next ring out may still be faster
+                if candidates and found is None:
+                    found = ring
+                elif found is not None:
+                    break
+        best = min(
+            candidates,
+            key=lambda tile:
+            (model.move_time(cur_pos, positions[tile]), tile[1], tile[0]))
+        remaining.remove(best)
+        ret.append(best)
+        cur_tile = best
+        cur_pos = positions[best]
+    return ret
+
+
+def ring_tiles(center, ring):
+    """
+    Tiles at Chebyshev distance ring
+    """
+    c0, r0 = center
+    for dc in range(-ring, ring + 1):
+        yield (c0 + dc, r0 - ring)
+        yield (c0 + dc, r0 + ring)
+    for dr in range(-ring + 1, ring):
+        yield (c0 - ring, r0 + dr)
+        yield (c0 + ring, r0 + dr)
+
+
+def estimate(order, positions, model, start=None, end=None):
+    """
+    Estimated seconds to visit tiles in order
+    Includes the move from start and back to end (ex: scan end return)
+    """
+    ret = len(order) * model.tsettle
+    cur = start
+    for tile in order:
+        pos = positions[tile]
+        if cur is not None:
+            ret += model.move_time(cur, pos)
+        cur = pos
+    if end is not None and cur is not None:
+        ret += model.move_time(cur, end)
+    return ret
+
+
+def candidate_name(pattern, serpentine):
+    return "%s%s" % (XYPattern(pattern).value,
+                     " serpentine" if serpentine else "")
+
+
+def simulate(tiles, cols, rows, calc_pos, model, start=None):
+    """
+    Estimate scan duration of every pattern
+    start: defaults to the lower left tile, where the scan also returns to
+    Return OrderedDict name => (order, seconds)
+    """
+    tiles = set(tiles)
+    positions = dict([(tile, calc_pos(*tile)) for tile in tiles])
+    if start is None:
+        start = calc_pos(0, 0)
+    ret = OrderedDict()
+    orders = OrderedDict()
+    for pattern in RASTER_PATTERNS:
+        for serpentine in (True, False):
+            orders[candidate_name(pattern, serpentine)] = raster_order(
+                tiles, cols, rows, pattern, serpentine)
+    orders["nearest"] = nearest_order(tiles, positions, model, start)
+    for name, order in orders.items():
+        ret[name] = (order,
+                     estimate(order, positions, model, start=start, end=start))
+    return ret
+
+
+def best_order(simulated):
+    """
+    Return name, order, seconds of the fastest simulate() result
+    """
+    name = min(simulated, key=lambda k: simulated[k][1])
+    order, seconds = simulated[name]
+    return name, order, seconds
@@ -22,10 +22,12 @@ import datetime
 from uscope.motion.hal import DryHal
 # FIXME: hack, maybe just move the baacklash parsing out
 # at least to stand alone function
-from uscope.config import PC
+from uscope.config import PC, get_bc
 from uscope.planner.plugin import get_planner_plugin
 from uscope.microscope import StopEvent, MicroscopeStop
 from uscope.threads import ShutdownPhase
+from uscope.scan_util import ScanIndex
+from uscope.planner.timeline import ScanTimeline
 
 
 class PlannerStop(Exception):
@@ -119,6 +121,10 @@ class Planner:
         # Optimization for planner stacking to avoid extra movements
         # https://github.com/Labsmore/pyuscope/issues/180
         self.z_center = None
+        # Per tile capture / processing / save timestamps
+        # While tracing also spans across all threads (see uscope/trace.py)
+        self.timeline = ScanTimeline()
+        self.tracing = False
 
         # polarity such that can wait on being set
         self.unpaused = threading.Event()
@@ -180,7 +186,7 @@ class Planner:
     def write_meta(self):
         # Copy config for reference
         def dumpj(j, fn):
-            if self.dry:
+            if self.dry or self.out_dir is None:
                 return
             with open(os.path.join(self.out_dir, fn), 'w') as f:
                 f.write(
@@ -191,12 +197,24 @@ class Planner:
 
         meta = self.gen_meta()
         dumpj(meta, 'uscan.json')
+        # No output directory => images were only kept in memory
+        if self.dry or self.out_dir is None:
+            return meta
+        if self.tracing:
+            self.timeline.write_trace(os.path.join(self.out_dir, "trace.json"))
+        # Scan is complete: post processing can skip listing the directory
+        ScanIndex.get(self.out_dir).refresh().save_sidecar()
         return meta
 
     def img_fn_prefix(self):
         return "_".join(self.state.fn_prefixes)
 
     def scan_begin(self):
+        bc = get_bc()
+        self.timeline.reset(trace_size=bc.trace_buffer())
+        self.tracing = bc.trace()
+        if self.tracing:
+            self.timeline.trace_start()
         self.log('Generated by pyuscope on %s' %
                  (time.strftime("%Y-%m-%d %H:%M:%S"), ))
         self.log("General notes:")
@@ -207,7 +225,7 @@ class Planner:
             plugin.log_scan_begin()
         if self.dry:
             self.log('DRY: mkdir(%s)' % self.out_dir)
-        else:
+        elif self.out_dir is not None:
             if not os.path.exists(self.out_dir):
                 self.log('Creating output directory %s' % self.out_dir)
                 os.mkdir(self.out_dir)
@@ -231,6 +249,9 @@ class Planner:
         for plugin in self.pipeline.values():
             self.check_yield()
             plugin.scan_end(state)
+        # Image writers have been flushed
+        if self.tracing:
+            self.timeline.trace_stop()
         assert state["images_to_capture"] == state[
             "images_captured"], f'expected {state["images_to_capture"]}, got {state["images_captured"]}'
         self.log()
@@ -239,6 +260,9 @@ class Planner:
         self.log("Done!")
         for plugin in self.pipeline.values():
             plugin.log_scan_end()
+        self.timeline.log_summary(self.log)
+        if self.tracing:
+            self.timeline.log_trace_summary(self.log)
         # Really done, make it the last thing we do
         self.emit_progress(state)
 
@@ -297,22 +321,28 @@ class Planner:
 
     def run(self):
         with StopEvent(self.microscope) as self.se:
-            self.check_yield()
-            self.full_start_time = time.time()
-            self.scan_begin()
-            self.scan_start_time = time.time()
-            for state in self.run_pipeline():
+            try:
+                self.check_yield()
+                self.full_start_time = time.time()
+                self.scan_begin()
+                self.scan_start_time = time.time()
+                for state in self.run_pipeline():
+                    self.emit_progress(state)
+                self.scan_end_time = time.time()
+                self.check_yield()
+                self.scan_end()
+                meta = self.write_meta()
+                state = {
+                    "type": "meta",
+                    "meta": meta,
+                }
                 self.emit_progress(state)
-            self.scan_end_time = time.time()
-            self.check_yield()
-            self.scan_end()
-            meta = self.write_meta()
-            state = {
-                "type": "meta",
-                "meta": meta,
-            }
-            self.emit_progress(state)
-            return meta
+                return meta
+            finally:
+                if self.tracing:
+                    self.timeline.trace_stop()
+                for plugin in self.pipeline.values():
+                    plugin.scan_cleanup()
 
     def emit_progress(self, state):
         # self.pipeline["scraper"].emit_progress(state)
@@ -346,6 +376,9 @@ class Planner:
 
         for plugin in self.pipeline.values():
             plugin.gen_meta(ret)
+        ret["timeline"] = self.timeline.meta()
+        if self.tracing:
+            ret["trace"] = self.timeline.trace_summary()
 
         self.full_end_time = time.time()
         ret["full_time"] = self.full_end_time - self.full_start_time
@@ -365,6 +398,10 @@ class Planner:
     def filanme_prefix(self, state):
         return os.path.join(self.out_dir, "_".join(state["filename_parts"]))
 
+    def timeline_key(self, state):
+        """Identifies the image being taken in the timeline"""
+        return "_".join(state.get("filename_parts", []))
+
     def register_progress_callback(self, callback):
         # self.pipeline["scraper"].register_progress_callback(callback)
         self.progress_callbacks.append(callback)
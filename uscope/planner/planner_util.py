@@ -87,6 +87,10 @@ def microscope_to_planner_config(microscope,
     v = usj["imager"].get("save_quality")
     if v:
         ret["imager"]["save_quality"] = v
+    for k in ("save_threads", "save_queue_size", "pipelined_capture"):
+        v = usj["imager"].get(k)
+        if v is not None:
+            ret["imager"][k] = v
 
     v = usj["motion"].get("origin")
     if v:
@@ -125,7 +129,13 @@ def get_planner(microscope,
                 meta_base=None,
                 log=None,
                 progress_callback=None,
-                verbosity=None):
+                verbosity=None,
+                save=True):
+    """
+    save: write images to out_dir
+        Otherwise images are only handed to progress callbacks
+        (state["captured_image"] or, if pipelined, state["captured_image_future"])
+    """
     pipeline_names = []
 
     imager = microscope.imager_ts()
@@ -145,7 +155,7 @@ def get_planner(microscope,
     if not imager.remote():
         pipeline_names.append("kinematics")
     pipeline_names.append("image-capture")
-    if not imager.remote():
+    if save and not imager.remote():
         pipeline_names.append("image-save")
     # pipeline_names.append("scraper")
     if "stacker-drift" in pconfig:
@@ -25,6 +25,13 @@ class PlannerPlugin:
         """
         pass
 
+    def scan_cleanup(self):
+        """
+        Called once after the scan, even if it failed / was stopped
+        Release resources (ex: threads)
+        """
+        pass
+
     def gen_meta(self, meta):
         """
         Generate final metadata output
@@ -1,5 +1,6 @@
 import math
 from collections import OrderedDict
+from concurrent.futures import Future
 import os
 import time
 from uscope.planner.plugin import PlannerPlugin, register_plugin
@@ -7,9 +8,14 @@ from PIL import Image
 from uscope.imager.imager_util import get_scaled
 from uscope.motion.hal import pos_str
 from uscope.kinematics import Kinematics
+from uscope.scan_util import ScanIndex
+from uscope.planner.image_writer import ImageWriter
+from uscope.planner import path
+from uscope.planner.path import MotionModel, XYPattern
+from uscope.planner.fly import FlyScan, row_runs
+from uscope.planner.focus_map import FocusMap, grid_order, sweep_focus
 from scipy import polyfit
 from uscope.imager.autofocus import choose_best_image, Autofocus
-from enum import Enum
 
 
 class PlannerAxis:
@@ -313,6 +319,43 @@ class PointGenerator2P(PlannerPlugin):
         # Number of images_actual taken at unique x, y coordinates
         # May be different than all_imags if image stacking
         self.itered_xy_points = 0
+        self.xy_gen = None
+        # Sweep rows instead of stop and shoot
+        # Dry runs just walk the points
+        self.fly = self.pc.fly_scan.enabled() and not self.dry
+        self.fly_scan = None
+
+    def xy_generator(self):
+        # Path planning isn't free: do it once
+        if self.xy_gen is None:
+            self.xy_gen = XYPosGenerator(rows=self.rows,
+                                         cols=self.cols,
+                                         calc_pos=self.calc_pos,
+                                         pc=self.pc,
+                                         motion=self.motion,
+                                         log=self.log,
+                                         rows_only=self.fly)
+        return self.xy_gen
+
+    def fly_scanner(self):
+        if self.fly_scan is None:
+            origin = self.pc.motion_origin()
+            assert origin == "ll", "fly scan requires ll origin"
+            # The row sweep owns the motion controller until the row ends
+            for name in ("points-stacker", "stacker-drift"):
+                assert name not in self.planner.pipeline, "fly scan doesn't support " + name
+            exposure = self.pc.fly_scan.exposure()
+            if exposure is None:
+                # GUI imager reports us
+                exposure = self.imager.get_exposure_cache() / 1e6
+            self.fly_scan = FlyScan(
+                pc=self.pc,
+                axis=self.x,
+                exposure=exposure,
+                velocities=self.motion.get_max_velocities(),
+                accelerations=self.motion.get_max_accelerations(),
+                log=self.log)
+        return self.fly_scan
 
     def init_contour(self):
         contour = self.pc.j["points-xy2p"]["contour"]
@@ -390,10 +433,7 @@ class PointGenerator2P(PlannerPlugin):
         # Should probably just drop the other algorithms at this point
         # Every major system now uses this
         if self.pc.motion_origin() == "ll":
-            for x in XYPosGenerator(rows=self.rows,
-                                    cols=self.cols,
-                                    calc_pos=self.calc_pos,
-                                    pc=self.pc).run():
+            for x in self.xy_generator().run():
                 yield x
             return
 
@@ -421,34 +461,18 @@ class PointGenerator2P(PlannerPlugin):
 
                 yield (pos, (ll_col, ll_row), (ul_col, ul_row))
 
-    """
-    def exclude(self, p):
-        (_xy, (cur_row, cur_col)) = p
-        for exclusion in self.pc.exclude():
-            '''
-            If neither limit is specified don't exclude
-            maybe later: if one limit is specified but not the other take it as the single bound
-            '''
-            r0 = exclusion.get('r0', float('inf'))
-            r1 = exclusion.get('r1', float('-inf'))
-            c0 = exclusion.get('c0', float('inf'))
-            c1 = exclusion.get('c1', float('-inf'))
-            if cur_row >= r0 and cur_row <= r1 and cur_col >= c0 and cur_col <= c1:
-                self.log('Excluding r%d, c%d on r%s:%s, c%s:%s' %
-                         (cur_row, cur_col, r0, r1, c0, c1))
-                return True
-        return False
-    """
-
     def gen_xys(self):
         for (x, y), _cr in self.gen_xycr():
             yield (x, y)
 
     def points_expected(self):
+        if self.pc.motion_origin() == "ll":
+            # Less any exclusions
+            return self.xy_generator().points()
         return self.rows * self.cols
 
     def images_expected(self):
-        return self.rows * self.cols
+        return self.points_expected()
 
     def log_scan_begin(self):
         self.log("XY2P")
@@ -457,18 +481,69 @@ class PointGenerator2P(PlannerPlugin):
         log_scan_xy_begin(self)
         # Try actually generating the points and see if it matches how many we thought we were going to get
         if self.pc.exclude():
-            self.log("  ROI exclusions active")
+            self.log("  ROI exclusions active: %u / %u points" %
+                     (self.points_expected(), self.rows * self.cols))
+        if self.pc.motion_origin() == "ll":
+            self.xy_generator().log_plan()
+        if self.fly:
+            self.fly_scanner().log_plan(self.fly_rows())
+
+    def log_point(self, pos, ul_col, ul_row):
+        self.itered_xy_points += 1
+        self.log('')
+        self.log("XY2P: %u / %u @ c=%u, r=%u, %s" %
+                 (self.itered_xy_points, self.images_expected(), ul_col,
+                  ul_row, self.microscope.usc.motion.format_positions(pos)))
+
+    def fly_rows(self):
+        """
+        Tile positions per row, in visiting order
+        """
+        return [[self.calc_pos(*tile) for tile in tiles]
+                for tiles in row_runs(self.xy_generator().order)]
+
+    def iterate_fly(self, state):
+        fly_scan = self.fly_scanner()
+        xy_gen = self.xy_generator()
+        tolerance = max(self.motion.epsilon()["x"] * 2, 0.001)
+        for tiles in row_runs(xy_gen.order):
+            positions = [self.calc_pos(*tile) for tile in tiles]
+            row = fly_scan.row(positions)
+            self.motion.move_absolute(row.pos(row.start))
+            # Backlash compensation would split the sweep into several moves
+            # The move to the row start above is still compensated
+            self.motion.backlash_disable()
+            try:
+                row.run(self.motion.move_absolute)
+                try:
+                    for (ll_col, ll_row), pos in zip(tiles, positions):
+                        ul_col = ll_col
+                        ul_row = xy_gen.rows - 1 - ll_row
+                        self.log_point(pos, ul_col, ul_row)
+                        fly_scan.wait_request(row, pos["x"])
+                        key = self.filename_part(ul_col, ul_row)
+                        modifiers = {
+                            "filename_part": key,
+                        }
+                        replace_keys = {
+                            "col": ul_col,
+                            "row": ul_row,
+                            "fly": fly_scan.frame(row, key, pos),
+                        }
+                        yield modifiers, replace_keys
+                finally:
+                    row.join(self.motion.pos, tolerance)
+                fly_scan.row_done(row)
+            finally:
+                self.motion.backlash_enable()
 
     def iterate(self, state):
+        if self.fly:
+            yield from self.iterate_fly(state)
+            return
         # columns
         for (pos, _ll, (ul_col, ul_row)) in self.gen_pos_ll_ul():
-            self.itered_xy_points += 1
-            self.log('')
-            self.log(
-                "XY2P: %u / %u @ c=%u, r=%u, %s" %
-                (self.itered_xy_points, self.images_expected(), ul_col, ul_row,
-                 self.microscope.usc.motion.format_positions(pos)))
-
+            self.log_point(pos, ul_col, ul_row)
             self.motion.move_absolute(pos)
 
             modifiers = {
@@ -491,6 +566,8 @@ class PointGenerator2P(PlannerPlugin):
     def log_scan_end(self):
         self.log('XY2P: generated points: %u / %u' %
                  (self.itered_xy_points, self.points_expected()))
+        if self.fly_scan:
+            self.fly_scan.log_scan_end()
         if self.itered_xy_points != self.points_expected():
             raise Exception(
                 'pictures taken mismatch (taken: %d, to take: %d)' %
@@ -502,6 +579,9 @@ class PointGenerator2P(PlannerPlugin):
             k = self.filename_part(ul_col, ul_row)
             v = dict(pos)
             v.update({"col": ul_col, "row": ul_row})
+            if self.fly_scan:
+                # Where the stage actually was mid exposure
+                v["fly"] = self.fly_scan.frames.get(k)
             points[k] = v
         axes = {}
         for axisc, axis in self.axes.items():
@@ -512,6 +592,10 @@ class PointGenerator2P(PlannerPlugin):
             "points": points,
             "axes": axes,
         }
+        if self.pc.motion_origin() == "ll":
+            meta["points-xy2p"]["path"] = self.xy_generator().meta()
+        if self.fly_scan:
+            meta["points-xy2p"]["fly"] = self.fly_scan.meta()
 
 
 """
@@ -523,26 +607,28 @@ TODO: consider leaving Z along if all three points are the same or is omitted en
 """
 
 
-class XYPattern(Enum):
-    # For reach row:
-    # Start at left side and move right
-    # "left right"
-    XM_XP = "x-:x+"
-    # For reach row:
-    # Start at right side and move left
-    XP_XM = "x+:x-"
-    YM_YP = "y-:y+"
-    YP_YM = "y+:y-"
-
-
 class XYPosGenerator:
-    def __init__(self, rows, cols, calc_pos, pc):
+    def __init__(self,
+                 rows,
+                 cols,
+                 calc_pos,
+                 pc,
+                 motion=None,
+                 log=None,
+                 rows_only=False):
         assert pc.motion_origin() == "ll"
+        if log is None:
+
+            def log(msg=""):
+                print(msg)
+
+        self.log = log
         self.rows = rows
         self.cols = cols
         self.pattern = pc.xy_pattern()
         # TODO: optimal pattern might depend more on backlash
         # traditional value is XM_XP but with negative backlash correction XP_XM may be better
+        # AUTO picks based on estimated motion time
         if self.pattern is None:
             self.pattern = XYPattern.XM_XP
         self.pattern = XYPattern(self.pattern)
@@ -550,28 +636,105 @@ class XYPosGenerator:
         # Faster but less precise
         if self.serpentine is None:
             self.serpentine = True
-        print("XYPosGenerator", self.pattern, self.serpentine)
         self.calc_pos = calc_pos
+        self.exclusions = pc.exclude()
+        # Fly scan sweeps along X
+        self.rows_only = rows_only
+        # Move time estimates need velocities etc
+        self.model = None
+        if motion is not None:
+            self.model = MotionModel.from_motion(
+                motion, pc=pc, tsettle=pc.kinematics.tsettle_motion())
+        # name => (order, seconds)
+        self.simulated = None
+        self.path_name = None
+        self.estimate = None
+        self.order = self.plan()
+
+    def excluded(self, ul_col, ul_row):
+        for exclusion in self.exclusions:
+            '''
+            If neither limit is specified don't exclude
+            maybe later: if one limit is specified but not the other take it as the single bound
+            '''
+            r0 = exclusion.get('r0', float('inf'))
+            r1 = exclusion.get('r1', float('-inf'))
+            c0 = exclusion.get('c0', float('inf'))
+            c1 = exclusion.get('c1', float('-inf'))
+            if ul_row >= r0 and ul_row <= r1 and ul_col >= c0 and ul_col <= c1:
+                return True
+        return False
+
+    def tiles(self):
+        """
+        (ll_col, ll_row) to image
+        Exclusions are in filename (ul) coordinates
+        """
+        ret = set()
+        for ll_row in range(self.rows):
+            for ll_col in range(self.cols):
+                if not self.excluded(ll_col, self.rows - 1 - ll_row):
+                    ret.add((ll_col, ll_row))
+        return ret
+
+    def plan(self):
+        tiles = self.tiles()
+        if self.rows_only and self.pattern not in (XYPattern.XM_XP,
+                                                   XYPattern.XP_XM):
+            self.log("XY path: %s isn't row major, using %s" %
+                     (self.pattern.value, XYPattern.XM_XP.value))
+            self.pattern = XYPattern.XM_XP
+        if self.model:
+            self.simulated = path.simulate(tiles=tiles,
+                                           cols=self.cols,
+                                           rows=self.rows,
+                                           calc_pos=self.calc_pos,
+                                           model=self.model)
+        if self.pattern == XYPattern.AUTO:
+            if self.simulated:
+                self.path_name, order, self.estimate = path.best_order(
+                    self.simulated)
+                return order
+            self.log("XY path: no motion model, using %s" %
+                     XYPattern.XM_XP.value)
+            self.pattern = XYPattern.XM_XP
+        self.path_name = path.candidate_name(self.pattern, self.serpentine)
+        if self.simulated:
+            self.estimate = self.simulated[self.path_name][1]
+        return path.raster_order(tiles, self.cols, self.rows, self.pattern,
+                                 self.serpentine)
+
+    def points(self):
+        return len(self.order)
+
+    def log_plan(self):
+        if self.estimate is None:
+            self.log("  XY path: %s" % (self.path_name, ))
+            return
+        self.log("  XY path: %s, estimated %0.1f sec motion + settle" %
+                 (self.path_name, self.estimate))
+        if self.pattern == XYPattern.AUTO:
+            for name, (_order, seconds) in self.simulated.items():
+                self.log("    %s: %0.1f sec" % (name, seconds))
+
+    def meta(self):
+        ret = {
+            "pattern": self.path_name,
+            "estimate": self.estimate,
+        }
+        if self.simulated:
+            ret["simulated"] = dict([
+                (name, seconds)
+                for name, (_order, seconds) in self.simulated.items()
+            ])
+        return ret
 
     def run(self):
-        if self.pattern in (XYPattern.XM_XP, XYPattern.XP_XM):
-            for ll_row in range(self.rows):
-                for ll_col in range(self.cols):
-                    # Start at right instead of left?
-                    if self.pattern == XYPattern.XP_XM:
-                        ll_col = self.cols - 1 - ll_col
-                    if self.serpentine:
-                        if ll_row % 2 == 1:
-                            ll_col = self.cols - 1 - ll_col
-
-                    pos = self.calc_pos(ll_col, ll_row)
-                    ul_col = ll_col
-                    ul_row = self.rows - 1 - ll_row
-                    yield (pos, (ll_col, ll_row), (ul_col, ul_row))
-        elif self.pattern in (XYPattern.YM_YP, XYPattern.YP_YM):
-            assert 0, "FIXME"
-        else:
-            assert 0, self.pattern
+        for ll_col, ll_row in self.order:
+            pos = self.calc_pos(ll_col, ll_row)
+            ul_col = ll_col
+            ul_row = self.rows - 1 - ll_row
+            yield (pos, (ll_col, ll_row), (ul_col, ul_row))
 
 
 class PointGenerator3P(PlannerPlugin):
@@ -591,7 +754,13 @@ class PointGenerator3P(PlannerPlugin):
         self.calc_per_rc()
         self.itered_xy_points = 0
         assert self.pc.motion_origin() == "ll"
-        self.xy_pattern = self.pc.xy_pattern()
+        self.xy_gen = None
+        # Replaces the corner plane z once sampled
+        self.focus_map = None
+        if self.pc.focus_map.enabled():
+            assert self.tracking_z, "focus map requires corner z"
+            self.focus_map = FocusMap(model=self.pc.focus_map.model(),
+                                      smoothing=self.pc.focus_map.smoothing())
 
     def has_z(self, corners):
         ret = None
@@ -758,11 +927,23 @@ class PointGenerator3P(PlannerPlugin):
                 self.log("per_row xs %s, ys %s" % (xs, ys))
                 self.per_row[axis] = polyfit(xs, ys, 1)[0]
 
+    def xy_generator(self):
+        # Path planning isn't free: do it once
+        if self.xy_gen is None:
+            self.xy_gen = XYPosGenerator(rows=self.rows,
+                                         cols=self.cols,
+                                         calc_pos=self.calc_pos,
+                                         pc=self.pc,
+                                         motion=self.motion,
+                                         log=self.log)
+        return self.xy_gen
+
     def points_expected(self):
-        return self.rows * self.cols
+        # Less any exclusions
+        return self.xy_generator().points()
 
     def images_expected(self):
-        return self.rows * self.cols
+        return self.points_expected()
 
     def calc_pos(self, ll_col, ll_row):
         ret = {}
@@ -776,16 +957,65 @@ class PointGenerator3P(PlannerPlugin):
                 offset += self.y.view_mm / 2
             ret[axis] = self.per_row[axis] * ll_row + self.per_col[
                 axis] * ll_col + offset
+        if self.focus_map and self.focus_map.ready():
+            ret["z"] = self.focus_map.z(ret["x"], ret["y"])
         return ret
 
+    def focus_kinematics(self):
+        planner_kinematics = self.planner.pipeline.get("kinematics")
+        if planner_kinematics:
+            return planner_kinematics.kinematics
+        return self.microscope.kinematics
+
+    def sample_focus_map(self):
+        """
+        Sweep z at a sparse grid of tiles and fit the focus map
+        Each sweep is centered on the corner plane
+        """
+        grid_cols, grid_rows = self.pc.focus_map.grid()
+        steps_pm = self.pc.focus_map.z_steps()
+        # Arrive in the backlash compensated direction, like the stacker
+        direction = -1
+        if "backlash" in self.motion.modifiers:
+            direction = self.motion.modifiers["backlash"].compensation.get(
+                "z", -1) or -1
+        step = direction * self.pc.focus_map.z_range() / max(1, steps_pm)
+        kinematics = self.focus_kinematics()
+        tiles = grid_order(self.cols, self.rows, grid_cols, grid_rows)
+        self.log("Focus map: sampling %u tiles, %u z steps of %0.6f" %
+                 (len(tiles), 2 * steps_pm + 1, abs(step)))
+        tstart = time.time()
+        for ll_col, ll_row in tiles:
+            self.planner.check_yield()
+            pos = self.calc_pos(ll_col, ll_row)
+            self.motion.move_absolute({"x": pos["x"], "y": pos["y"]})
+            z, _score = sweep_focus(move_absolute=self.motion.move_absolute,
+                                    wait=kinematics.wait_autofocus,
+                                    get_image=lambda: self.imager.get().array,
+                                    z=pos["z"],
+                                    step=step,
+                                    steps_pm=steps_pm,
+                                    poll=self.planner.check_yield)
+            self.log("Focus map: c=%u, r=%u: z %0.6f => %0.6f" %
+                     (ll_col, self.rows - 1 - ll_row, pos["z"], z))
+            self.focus_map.add(pos["x"], pos["y"], z)
+        self.focus_map.fit()
+        self.log("Focus map: sampled in %0.1f sec" % (time.time() - tstart, ))
+        self.focus_map.log_fit(self.log)
+
+    def scan_begin(self, state):
+        if not self.focus_map:
+            return
+        if self.dry:
+            self.log("Focus map: dry run, using corner plane")
+            return
+        self.sample_focus_map()
+
     def filename_part(self, ul_col, ul_row):
         return 'c%03u_r%03u' % (ul_col, ul_row)
 
     def gen_pos_ll_ul(self):
-        for x in XYPosGenerator(rows=self.rows,
-                                cols=self.cols,
-                                calc_pos=self.calc_pos,
-                                pc=self.pc).run():
+        for x in self.xy_generator().run():
             yield x
 
     def move_absolute(self, pos):
@@ -834,6 +1064,11 @@ class PointGenerator3P(PlannerPlugin):
     def log_scan_begin(self):
         self.log("XY3P")
         log_scan_xy_begin(self)
+        self.xy_generator().log_plan()
+        if self.focus_map:
+            self.log("  Focus map: %s model, %s grid, online %s" %
+                     (self.pc.focus_map.model(), self.pc.focus_map.grid(),
+                      self.pc.focus_map.online()))
 
     def gen_meta(self, meta):
         points = OrderedDict()
@@ -850,7 +1085,10 @@ class PointGenerator3P(PlannerPlugin):
             'points_generated': self.itered_xy_points,
             "points": points,
             "axes": axes,
+            "path": self.xy_generator().meta(),
         }
+        if self.focus_map:
+            meta["points-xy3p"]["focus-map"] = self.focus_map.meta()
 
 
 """
@@ -936,6 +1174,8 @@ class PlannerStacker(PlannerPlugin):
         self.start = self.reference - self.step * (self.total_number - 1) / 2
         self.end = self.start + (self.total_number - 1) * self.step
 
+        # ex: GRBL queues the z steps instead of a round trip + idle poll each
+        self.planner.motion.stream_begin()
         for pointi, point in enumerate(self.points()):
             if pointi == 0:
                 self.planner.log(
@@ -956,6 +1196,15 @@ class PlannerStacker(PlannerPlugin):
                 "stacki": pointi,
             }
             yield modifiers, replace_keys
+        self.planner.motion.stream_end()
+
+    def scan_cleanup(self):
+        # Stack interrupted
+        try:
+            self.planner.motion.stream_end()
+        except Exception as e:
+            self.log("WARNING: stacker: failed to end motion stream: %s" %
+                     (e, ))
 
     def scan_end(self, state):
         """
@@ -1010,9 +1259,25 @@ class StackerDrift(PlannerPlugin):
         self.stacker = self.planner.pipeline["points-stacker"]
         assert self.stacker.mode == "center"
         self.stack = []
+        # Feed stack results into the XY3P focus map instead of an offset
+        self.focus_map = None
+        xy3p = self.planner.pipeline.get("points-xy3p")
+        if xy3p and xy3p.focus_map and self.pc.focus_map.online():
+            self.focus_map = xy3p.focus_map
+
+    def update_focus_map(self, target_pos):
+        pos = self.motion.pos()
+        expected = self.focus_map.z(pos["x"], pos["y"])
+        self.focus_map.add(pos["x"], pos["y"], target_pos, source="stack")
+        self.focus_map.fit()
+        self.log("stacker drift: focus map sample %0.6f vs map %0.6f" %
+                 (target_pos, expected))
 
     def process_stack(self):
         target_pos, fni = choose_best_image(self.stack)
+        if self.focus_map and self.focus_map.ready():
+            self.update_focus_map(target_pos)
+            return
         drift1 = target_pos - self.stacker.reference
         drift2 = target_pos - (self.stacker.reference +
                                self.stacker.drift_offset)
@@ -1165,10 +1430,14 @@ class PlannerKinematics(PlannerPlugin):
 
     def iterate(self, state):
         # wait for movement + flush image
-        if not self.dry:
+        # Fly scan: stage never stops and frames are already fresh
+        if not self.dry and not state.get("fly"):
+            key = self.planner.timeline_key(state)
             tstart = time.time()
+            self.planner.timeline.mark(key, "settle", tstart)
             self.kinematics.wait_imaging_ok()
             tend = time.time()
+            self.planner.timeline.mark(key, "settled", tend)
             self.verbose and self.log("FIXME TMP: net kinematics took %0.3f" %
                                       (tend - tstart, ))
         yield None
@@ -1179,43 +1448,94 @@ class PlannerCaptureImage(PlannerPlugin):
         super().__init__(planner=planner)
         self.images_captured = 0
         self.get_mode = self.pc.j["imager"].get("get_mode", "processed")
+        self.pipelined = self.pc.imager.pipelined_capture()
 
     def scan_begin(self, state):
+        # Drift correction needs the image before the next move
+        if self.pipelined and "stacker-drift" in self.planner.pipeline:
+            self.log("Pipelined capture: disabled by stacker-drift")
+            self.pipelined = False
         properties = self.pc.j["imager"].get("properties")
         if not properties:
             return
         self.log("Imager: setting %u properties" % (len(properties), ))
         self.imager.set_properties(properties)
 
+    def log_scan_begin(self):
+        self.log("Pipelined capture: %s" % (self.pipelined, ))
+
     def scan_end(self, state):
         state["images_captured"] = self.images_captured
 
+    def check_image(self, im):
+        final_wh_hint = self.pc.image_final_wh_hint()
+        if im and final_wh_hint is not None:
+            assert final_wh_hint[0] == im.size[0] and final_wh_hint[
+                1] == im.size[
+                    1], "Unexpected image size: expected %s, got %s" % (
+                        final_wh_hint, im.size)
+
+    def get_pipelined(self, key, fly=None):
+        """
+        Return a Future of the checked CapturedImage
+        as soon as the raw frame is latched
+        """
+        ret = Future()
+        tstart = time.time()
+        self.planner.timeline.mark(key, "capture", tstart)
+        future = self.planner.imager.get_by_mode_async(mode=self.get_mode)
+        tlatched = time.time()
+        self.planner.timeline.mark(key, "latched", tlatched)
+
+        def done(future):
+            self.planner.timeline.mark(key, "processed")
+            try:
+                capim = future.result()
+                self.check_image(capim.image)
+                if fly:
+                    fly.captured(capim)
+            except Exception as e:
+                ret.set_exception(e)
+            else:
+                ret.set_result(capim)
+
+        future.add_done_callback(done)
+        return ret
+
     def iterate(self, state):
         im = None
+        capim = None
+        capim_future = None
         assert state.get("image") is None, "Pipeline already took an image"
         # self.log("Capturing at %s" % pos_str(self.motion.pos()))
         if not self.planner.dry:
             if self.planner.imager.remote():
                 self.planner.imager.take()
+            elif self.pipelined:
+                # Next move goes out while this one is still processing
+                capim_future = self.get_pipelined(
+                    self.planner.timeline_key(state), fly=state.get("fly"))
             else:
+                key = self.planner.timeline_key(state)
                 tstart = time.time()
+                self.planner.timeline.mark(key, "capture", tstart)
                 capim = self.planner.imager.get_by_mode(mode=self.get_mode)
                 im = capim.image
+                if state.get("fly"):
+                    state["fly"].captured(capim)
                 tend = time.time()
+                self.planner.timeline.mark(key, "processed", tend)
                 self.verbose and self.log(
                     "FIXME TMP: actual capture took %0.3f" % (tend - tstart, ))
 
-        final_wh_hint = self.pc.image_final_wh_hint()
-        if im and final_wh_hint is not None:
-            assert final_wh_hint[0] == im.size[0] and final_wh_hint[
-                1] == im.size[
-                    1], "Unexpected image size: expected %s, got %s" % (
-                        final_wh_hint, im.size)
+        self.check_image(im)
 
         self.images_captured += 1
         modifiers = {}
         replace_keys = {
             "captured_image": capim,
+            # Pipelined capture: resolves to captured_image
+            "captured_image_future": capim_future,
             # compatibility to ease transition
             "image": im,
             "images_captured": self.images_captured,
@@ -1242,16 +1562,50 @@ class PlannerSaveImage(PlannerPlugin):
         self.quality = self.pc.imager.save_quality()
         assert not self.planner.imager.remote()
         self.metadata = {}
+        self.writer = None
 
     def log_scan_begin(self):
         self.log("Output dir: %s" % self.planner.out_dir)
         self.log("Output extension: %s" % self.extension)
 
+    def scan_begin(self, state):
+        nthreads = self.pc.imager.save_threads()
+        if nthreads and not self.dry:
+            self.writer = ImageWriter(
+                nthreads=nthreads,
+                max_pending=self.pc.imager.save_queue_size(),
+                result_timeout=self.microscope.usc.imager.processing_timeout(),
+                log=self.log)
+
+    def scan_end(self, state):
+        # Everything on disk before uscan.json / sidecar are written
+        if self.writer:
+            self.writer.flush()
+
+    def scan_cleanup(self):
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+
+    def image_saved(self, fn_full):
+        """
+        Image is completely on disk (maybe called from a writer thread)
+        """
+        ScanIndex.get(os.path.dirname(fn_full)).add(fn_full)
+        self.planner.timeline.mark(
+            os.path.splitext(os.path.basename(fn_full))[0], "saved")
+        self.planner.emit_progress({
+            "type": "image-saved",
+            "image_filename_rel": fn_full,
+        })
+
     def iterate(self, state):
         capim = state.get("captured_image")
-        im = capim.image
+        if capim is None:
+            # Pipelined capture: still being processed
+            capim = state.get("captured_image_future")
         if not self.planner.dry:
-            assert im, "Asked to save image without image given"
+            assert capim, "Asked to save image without image given"
 
         self.images_saved += 1
         img_prefix = self.planner.filanme_prefix(state)
@@ -1262,9 +1616,26 @@ class PlannerSaveImage(PlannerPlugin):
             if self.extension == ".jpg" or self.extension == ".jpeg":
                 kwargs["quality"] = self.quality
             # Includes EXIF
-            capim.save(fn_full, **kwargs)
+            if self.writer:
+                # Blocks if the writers are too far behind
+                self.writer.put(capim,
+                                fn_full,
+                                kwargs,
+                                callback=self.image_saved)
+            else:
+                if isinstance(capim, Future):
+                    timeout = self.microscope.usc.imager.processing_timeout()
+                    capim = capim.result(timeout=timeout)
+                capim.save(fn_full, **kwargs)
+                self.image_saved(fn_full)
+            # Position is still that of this image: record now, not once written
+            if state.get("fly"):
+                # Don't queue behind / race the sweep
+                position = state["fly"].position()
+            else:
+                position = self.motion.pos()
             meta = {
-                "position": self.motion.pos(),
+                "position": position,
             }
             # FIXME: move this to modifiers so its more automatic per plugin
             if "col" in state:
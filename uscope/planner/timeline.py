@@ -0,0 +1,199 @@
+"""
+Per tile event timestamps for a scan
+
+Events, in the order they normally happen for a tile:
+-settle: kinematics starts waiting on the move
+-settled: stage / video pipeline ready
+-capture: frame requested
+-latched: raw frame captured (pipelined capture only)
+-processed: scaled / corrected image ready
+-saved: image completely on disk
+
+With pipelined capture a tile's processed / saved land after
+the next tile's settle, ie processing is hidden behind motion
+
+While tracing (see uscope/trace.py) spans from other threads are kept too
+The Chrome trace combines them with per tile spans between the events above
+Capture events also feed uscope_capture_seconds (see uscope/metrics.py)
+"""
+
+from uscope import metrics
+from uscope import trace
+from collections import deque, OrderedDict
+import json
+import threading
+import time
+
+# Per tile trace spans: (name, start event, end event)
+# capture ends at latched if pipelined, otherwise at processed
+TILE_SPANS = (
+    ("settle", "settle", "settled"),
+    ("capture", "capture", "latched"),
+    ("process", "latched", "processed"),
+    ("save", "processed", "saved"),
+)
+
+
+
+def capture_stage(events, event):
+    """
+    Return (capture_seconds stage, start time) ended by event, if any
+    Pipelined: latch then process. Otherwise a single capture
+    """
+    if event == "latched":
+        start_event, stage = "capture", "latch"
+    elif event == "processed" and "latched" in events:
+        start_event, stage = "latched", "process"
+    elif event == "processed":
+        start_event, stage = "capture", "capture"
+    else:
+        return None
+    if start_event not in events:
+        return None
+    return stage, events[start_event]
+
+
+class ScanTimeline:
+    def __init__(self):
+        # Events may come from writer / processing threads
+        self.lock = threading.Lock()
+        self.spans = deque()
+        self.reset()
+
+    def reset(self, trace_size=None):
+        with self.lock:
+            self.t0 = time.time()
+            # tile key (filename prefix) => {event: time}
+            self.tiles = OrderedDict()
+            if trace_size is not None and trace_size != self.spans.maxlen:
+                self.spans = deque(maxlen=trace_size)
+            else:
+                self.spans.clear()
+            # Not locked => approximate, only used to report drops
+            self.recorded = 0
+
+    def trace_start(self):
+        trace.tracer.start(self)
+
+    def trace_stop(self):
+        trace.tracer.stop(self)
+
+    def record(self, event):
+        """
+        Span from uscope.trace.tracer, any thread
+        deque.append() is atomic: no lock
+        """
+        self.recorded += 1
+        self.spans.append(event)
+
+    def mark(self, key, event, t=None):
+        if t is None:
+            t = time.time()
+        with self.lock:
+            events = self.tiles.setdefault(key, {})
+            events[event] = t
+            stage = capture_stage(events, event)
+        if stage:
+            metrics.capture_seconds.observe(t - stage[1], stage=stage[0])
+
+    def meta(self):
+        """
+        JSON friendly, times relative to scan start
+        """
+        with self.lock:
+            return {
+                "tiles":
+                OrderedDict((key, {
+                    event: round(t - self.t0, 4)
+                    for event, t in events.items()
+                }) for key, events in self.tiles.items()),
+                "summary":
+                self._summary(),
+            }
+
+    def _summary(self):
+        tiles = list(self.tiles.values())
+        ret = {
+            "tiles": len(tiles),
+            # Wall time from settle start to image ready
+            "settle": 0.0,
+            # Processing / saving after the frame was latched
+            "post_latch": 0.0,
+            # Portion of post_latch that ran while the next tile was moving
+            "overlapped": 0.0,
+        }
+        for i, events in enumerate(tiles):
+            if "settle" in events and "settled" in events:
+                ret["settle"] += events["settled"] - events["settle"]
+            start = events.get("latched")
+            end = events.get("saved", events.get("processed"))
+            if start is None or end is None:
+                continue
+            ret["post_latch"] += end - start
+            if i + 1 < len(tiles):
+                next_start = tiles[i + 1].get("settle")
+                if next_start is not None:
+                    ret["overlapped"] += max(0.0, end - max(start, next_start))
+        for k in ("settle", "post_latch", "overlapped"):
+            ret[k] = round(ret[k], 4)
+        return ret
+
+    def log_summary(self, log):
+        with self.lock:
+            summary = self._summary()
+        if not summary["tiles"]:
+            return
+        log("Timeline: %u tiles, %0.1f sec settling" %
+            (summary["tiles"], summary["settle"]))
+        if summary["post_latch"]:
+            log("Timeline: %0.1f / %0.1f sec processing + saving overlapped motion (%0.0f%%)"
+                % (summary["overlapped"], summary["post_latch"],
+                   100.0 * summary["overlapped"] / summary["post_latch"]))
+
+    def dropped(self):
+        """
+        Oldest spans overwritten by the ring buffer
+        """
+        return max(0, self.recorded - len(self.spans))
+
+    def tile_spans(self):
+        """
+        Trace events between each tile's timeline events
+        One pseudo thread per span name
+        """
+        ret = []
+        with self.lock:
+            tiles = list(self.tiles.items())
+        for tid, (name, start, end) in enumerate(TILE_SPANS, 1):
+            for key, events in tiles:
+                tstart = events.get(start)
+                tend = events.get(end)
+                if name == "capture" and tend is None:
+                    tend = events.get("processed")
+                if tstart is None or tend is None:
+                    continue
+                ret.append((name, "tile", tstart, tend - tstart, -tid,
+                            "tiles: " + name, {
+                                "tile": key
+                            }))
+        return ret
+
+    def trace_events(self):
+        return self.tile_spans() + list(self.spans)
+
+    def chrome_trace(self):
+        return trace.chrome_trace(self.trace_events(),
+                                  self.t0,
+                                  dropped=self.dropped())
+
+    def write_trace(self, fn):
+        with open(fn, "w") as f:
+            json.dump(self.chrome_trace(), f)
+
+    def trace_summary(self):
+        return trace.summary(self.trace_events())
+
+    def log_trace_summary(self, log, summary=None):
+        if summary is None:
+            summary = self.trace_summary()
+        trace.log_summary(log, summary, dropped=self.dropped())
@@ -2,6 +2,9 @@ from collections import OrderedDict
 import glob
 import os
 import re
+import json
+import threading
+import time
 
 
 def iindex_filename_key(filename):
@@ -60,12 +63,23 @@ def bucket_group(iindex_in, bucket_key):
     return fns
 
 
+# One pass per filename part instead of a re.match per part type
+IINDEX_PART_RE = re.compile(r"(c|r|h|z|is)([0-9]+)")
+IINDEX_PART_KEYS = {
+    "c": "col",
+    "r": "row",
+    "h": "hdr",
+    "z": "stack",
+    "is": "stabilization",
+}
+IINDEX_EXTENSIONS = (".jpg", ".tif")
+# Hidden such that upload / image globs ignore it
+IINDEX_SIDECAR = ".iindex.json"
+
+
 def iindex_parse_fn(basename):
     """
-    Nobody is going to be impressed with my regular expression skills
-    but this should work...for now
-    2023-10-23: collapsing under its own weight
-    Rewrite this to be more proper
+    Parse a scan image filename like c001_r000_z01_h02.jpg
     """
     ret = {}
     ret["basename"] = basename
@@ -78,39 +92,13 @@ def iindex_parse_fn(basename):
         return
 
     for part in parts.split("_"):
-        m = re.match(r"c([0-9]+)", part)
-        if m:
-            ret["col"] = int(m.group(1))
-            ret["col_str"] = part
-            continue
-
-        m = re.match(r"r([0-9]+)", part)
-        if m:
-            ret["row"] = int(m.group(1))
-            ret["row_str"] = part
-            continue
-
-        m = re.match(r"h([0-9]+)", part)
-        if m:
-            ret["hdr"] = int(m.group(1))
-            ret["hdr_str"] = part
-            continue
-
-        m = re.match(r"z([0-9]+)", part)
-        if m:
-            ret["stack"] = int(m.group(1))
-            ret["stack_str"] = part
-            continue
-
-        m = re.match(r"is([0-9]+)", part)
-        if m:
-            ret["stabilization"] = int(m.group(1))
-            ret["stabilization_str"] = part
-            continue
-
+        m = IINDEX_PART_RE.match(part)
         # Should we allow non-confirming files?
         # return None
-        assert 0, f"Unrecognized part {part} in basename {basename}"
+        assert m, f"Unrecognized part {part} in basename {basename}"
+        key = IINDEX_PART_KEYS[m.group(1)]
+        ret[key] = int(m.group(2))
+        ret[key + "_str"] = part
 
     # HDR: no longer true
     #assert "row" in ret, basename
@@ -119,7 +107,178 @@ def iindex_parse_fn(basename):
     return ret
 
 
-def index_scan_images(dir_in):
+"""
+Incremental index of the images in a scan directory
+Each filename is parsed once
+Directory listings are skipped while the directory is unchanged
+Files can also be added explicitly as they are written (ex: planner, processing stage)
+
+Optionally the file list is saved as a sidecar file
+such that a later run (ex: cs_auto) can skip parsing (and if unchanged, listing) the directory
+"""
+
+
+class ScanIndex:
+    # realpath => ScanIndex, least recently used first
+    indexes = OrderedDict()
+    indexes_lock = threading.Lock()
+    # Long running processes (Argus, imagep daemon) see many scans
+    indexes_max = 16
+
+    def __init__(self, dir_in, sidecar=False):
+        self.dir = os.path.realpath(dir_in)
+        self.sidecar = sidecar
+        self.lock = threading.Lock()
+        # basename => parsed. None if not an image we understand
+        self.parsed = {}
+        # Directory state at last listing
+        self.mtime_ns = None
+        self.listed_ns = None
+        self.iindex_cache = None
+        if sidecar:
+            self.load_sidecar()
+
+    @staticmethod
+    def get(dir_in, sidecar=False):
+        """
+        Shared index for given directory
+        """
+        dir_in = os.path.realpath(dir_in)
+        with ScanIndex.indexes_lock:
+            ret = ScanIndex.indexes.get(dir_in)
+            if ret is None:
+                ret = ScanIndex(dir_in, sidecar=sidecar)
+                ScanIndex.indexes[dir_in] = ret
+                # Evicted indexes are simply rebuilt if needed again
+                while len(ScanIndex.indexes) > ScanIndex.indexes_max:
+                    ScanIndex.indexes.popitem(last=False)
+            else:
+                ScanIndex.indexes.move_to_end(dir_in)
+            return ret
+
+    def sidecar_fn(self):
+        return os.path.join(self.dir, IINDEX_SIDECAR)
+
+    def load_sidecar(self):
+        fn = self.sidecar_fn()
+        try:
+            sidecar_ns = os.stat(fn).st_mtime_ns
+            dir_ns = os.stat(self.dir).st_mtime_ns
+            with open(fn) as f:
+                j = json.load(f)
+            basenames = j["basenames"]
+        except (OSError, ValueError, KeyError):
+            return
+        for basename in basenames:
+            self._add(basename)
+        # Nothing changed since the sidecar => equivalent to a fresh listing
+        # Otherwise (ex: uscan.json written after) the next refresh() lists the directory
+        # and drops / adds files that changed. Parsed entries are reused
+        if dir_ns <= sidecar_ns:
+            self.mtime_ns = dir_ns
+            self.listed_ns = time.time_ns()
+
+    def save_sidecar(self):
+        """
+        Call once the directory is complete (ex: end of processing)
+        """
+        fn = self.sidecar_fn()
+        with self.lock:
+            j = {"basenames": sorted(self.parsed.keys())}
+        tmp_fn = fn + ".tmp"
+        with open(tmp_fn, "w") as f:
+            json.dump(j, f)
+        os.replace(tmp_fn, fn)
+        # The rename itself updates the directory mtime
+        # Touch so the sidecar isn't immediately older than its directory
+        os.utime(fn)
+
+    def _add(self, basename):
+        if basename in self.parsed:
+            return
+        if not basename.endswith(IINDEX_EXTENSIONS):
+            return
+        self.parsed[basename] = iindex_parse_fn(basename)
+        self.iindex_cache = None
+
+    def add(self, basename):
+        """
+        Register a file just written to this directory
+        """
+        with self.lock:
+            self._add(os.path.basename(basename))
+
+    def refresh(self):
+        """
+        Pick up files added / removed on disk
+        """
+        with self.lock:
+            try:
+                mtime_ns = os.stat(self.dir).st_mtime_ns
+            except FileNotFoundError:
+                mtime_ns = None
+            # Coarse timestamp filesystems: only trust a listing taken
+            # well after the last modification
+            if mtime_ns is not None and mtime_ns == self.mtime_ns and self.listed_ns - mtime_ns > 2e9:
+                return self
+            listed_ns = time.time_ns()
+            if mtime_ns is None:
+                basenames = set()
+            else:
+                basenames = set(entry.name for entry in os.scandir(self.dir)
+                                if entry.name.endswith(IINDEX_EXTENSIONS))
+            for basename in set(self.parsed.keys()) - basenames:
+                del self.parsed[basename]
+                self.iindex_cache = None
+            for basename in basenames:
+                self._add(basename)
+            self.mtime_ns = mtime_ns
+            self.listed_ns = listed_ns
+        return self
+
+    def iindex(self):
+        """
+        Return index in index_scan_images() format
+        """
+        with self.lock:
+            if self.iindex_cache is None:
+                self.iindex_cache = self._make_iindex()
+            return self.iindex_cache
+
+    def _make_iindex(self):
+        ret = OrderedDict()
+        images = OrderedDict()
+        cols = 0
+        rows = 0
+        hdrs = 0
+        stacks = 0
+        stabilization = 0
+        crs = OrderedDict()
+        for basename in sorted(self.parsed.keys()):
+            v = self.parsed[basename]
+            if not v:
+                continue
+            images[basename] = v
+            crs[(v.get("col"), v.get("row"))] = v
+            stabilization = max(stabilization, v.get("stabilization", -1) + 1)
+            hdrs = max(hdrs, v.get("hdr", -1) + 1)
+            stacks = max(stacks, v.get("stack", -1) + 1)
+            rows = max(rows, v.get("row", 0) + 1)
+            cols = max(cols, v.get("col", 0) + 1)
+
+        ret["dir"] = self.dir
+        ret["images"] = images
+        ret["crs"] = crs
+        ret["stabilization"] = stabilization
+        ret["hdrs"] = hdrs
+        ret["stacks"] = stacks
+        ret["flat"] = stacks == 0 and hdrs == 0 and stabilization == 0
+        ret["cols"] = cols
+        ret["rows"] = rows
+        return ret
+
+
+def index_scan_images(dir_in, sidecar=False):
     """
     Return dict of image_name to
     {
@@ -143,44 +302,8 @@ def index_scan_images(dir_in):
             },
         },
     }
+
+    Backed by a shared ScanIndex: repeat calls only parse new files
+    Treat the returned value as read only
     """
-    ret = OrderedDict()
-    images = OrderedDict()
-    cols = 0
-    rows = 0
-    hdrs = 0
-    stacks = 0
-    stabilization = 0
-    crs = OrderedDict()
-    for fn_full in sorted(
-            list(glob.glob(dir_in + "/*.jpg")) +
-            list(glob.glob(dir_in + "/*.tif"))):
-        basename = os.path.basename(fn_full)
-
-        v = iindex_parse_fn(basename)
-        if not v:
-            continue
-        images[basename] = v
-        crs[(v.get("col"), v.get("row"))] = v
-        stabilization = max(stabilization, v.get("stabilization", -1) + 1)
-        hdrs = max(hdrs, v.get("hdr", -1) + 1)
-        stacks = max(stacks, v.get("stack", -1) + 1)
-        rows = max(rows, v.get("row", 0) + 1)
-        cols = max(cols, v.get("col", 0) + 1)
-
-    # xxx: maybe this removes /
-    # yes
-    working_dir = os.path.realpath(dir_in)
-    # while working_dir[-1] == "/":
-    #    working_dir = working_dir[0:len(working_dir) - 1]
-
-    ret["dir"] = working_dir
-    ret["images"] = images
-    ret["crs"] = crs
-    ret["stabilization"] = stabilization
-    ret["hdrs"] = hdrs
-    ret["stacks"] = stacks
-    ret["flat"] = stacks == 0 and hdrs == 0 and stabilization == 0
-    ret["cols"] = cols
-    ret["rows"] = rows
-    return ret
+    return ScanIndex.get(dir_in, sidecar=sidecar).refresh().iindex()
@@ -1,4 +1,6 @@
-from flask import current_app, request
+from flask import current_app, request, Response
+from uscope import metrics
+from uscope.imagep.daemon import ImagepClient
 from http import HTTPStatus
 import json
 import base64
@@ -25,7 +27,51 @@ def except_wrap(func):
     return wrapper
 
 
+def metrics_update():
+    # Fleet dashboards tell scopes apart by these labels
+    metrics.microscope_info.set(1,
+                                name=plugin.microscope_model(),
+                                serial=plugin.microscope_serial() or "")
+    metrics.sample()
+
+
+def imagep_metrics():
+    """
+    Scan processing runs in the imagep daemon, which counts its own metrics
+    None if it isn't running
+    """
+    return ImagepClient(autostart=False).metrics()
+
+
 def make_app(app):
+    # OpenMetrics (Prometheus) text for scraping
+    # Not JSON => not except_wrap
+    @app.route('/metrics', methods=['GET'])
+    def metrics_openmetrics():
+        metrics_update()
+        remotes = {}
+        imagep = imagep_metrics()
+        if imagep:
+            remotes["imagep"] = imagep["export"]
+        return Response(metrics.openmetrics(remotes=remotes),
+                        content_type=metrics.CONTENT_TYPE_OPENMETRICS)
+
+    @app.route('/get/metrics', methods=['GET'])
+    @except_wrap
+    def metrics_json():
+        metrics_update()
+        imagep = imagep_metrics()
+        return {
+            'data': {
+                "current": metrics.getj(),
+                # Periodic samples, oldest first
+                "rolling": metrics.rolling(),
+                # Daemon's current values, None if not running
+                "imagep": imagep["current"] if imagep else None,
+            },
+            'status': HTTPStatus.OK,
+        }
+
     @app.route('/get/position', methods=['GET'])
     @except_wrap
     def position():
@@ -0,0 +1,200 @@
+"""
+Scan timeline tracing
+
+Spans (name, category, start, duration, thread) from any thread are routed
+to the ScanTimeline of each planner currently recording (see Tracer.start())
+A nested planner (ex: composite snapshot) records its own scan
+without touching the enclosing one
+Recording is off unless enabled (see BaseConfig.trace()):
+a span with nothing recording is a single attribute check
+
+Export (ScanTimeline.chrome_trace()) is Chrome trace event JSON
+Open in ui.perfetto.dev or chrome://tracing
+
+Categories:
+-tile: per tile settle, capture, process, save from the timeline marks
+-motion: move
+-kinematics: frame-sync
+-timer: LogTimer blocks (ex: wait motion, get_processed)
+-gstreamer: frame copied out of the pipeline
+-imagep: CSImageProcessor plugin tasks
+-save: encode + write
+"""
+
+from collections import OrderedDict
+import os
+import threading
+import time
+
+
+class Span:
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.tstart = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.tracer.complete(self.name, self.cat, self.tstart, args=self.args)
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+def percentile(values, fraction):
+    """
+    values: sorted
+    """
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Tracer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Replaced rather than modified: recording threads don't lock
+        self.recorders = ()
+        self.enabled = False
+
+    def start(self, recorder):
+        """
+        recorder.record(event) gets every span until stop(recorder)
+        """
+        with self.lock:
+            self.recorders = self.recorders + (recorder, )
+            self.enabled = True
+
+    def stop(self, recorder):
+        with self.lock:
+            self.recorders = tuple(r for r in self.recorders
+                                   if r is not recorder)
+            self.enabled = bool(self.recorders)
+
+    def record(self, event):
+        for recorder in self.recorders:
+            recorder.record(event)
+
+    def span(self, name, cat, args=None):
+        """
+        with tracer.span("move", "motion"):
+        """
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, cat, args)
+
+    def complete(self, name, cat, tstart, tend=None, args=None):
+        """
+        Record a span that has already happened
+        """
+        if not self.enabled:
+            return
+        if tend is None:
+            tend = time.time()
+        thread = threading.current_thread()
+        self.record((name, cat, tstart, tend - tstart, thread.ident,
+                     thread.name, args))
+
+    def instant(self, name, cat, t=None, args=None):
+        if not self.enabled:
+            return
+        if t is None:
+            t = time.time()
+        thread = threading.current_thread()
+        self.record((name, cat, t, None, thread.ident, thread.name, args))
+
+
+def chrome_trace(events, t0, dropped=0):
+    """
+    events: [(name, cat, start, duration or None if instant, tid, thread name, args)]
+    Chrome trace event format, times in us relative to t0
+    """
+    pid = os.getpid()
+    threads = OrderedDict()
+    ret = []
+    for name, cat, t, duration, tid, thread_name, args in events:
+        threads[tid] = thread_name
+        event = {
+            "name": name,
+            "cat": cat,
+            "ts": round((t - t0) * 1e6, 1),
+            "pid": pid,
+            "tid": tid,
+        }
+        if duration is None:
+            event["ph"] = "i"
+            event["s"] = "t"
+        else:
+            event["ph"] = "X"
+            event["dur"] = round(duration * 1e6, 1)
+        if args:
+            event["args"] = args
+        ret.append(event)
+    for tid, thread_name in threads.items():
+        ret.append({
+            "name": "thread_name",
+            "ph": "M",
+            "pid": pid,
+            "tid": tid,
+            "args": {
+                "name": thread_name
+            },
+        })
+    return {
+        "traceEvents": ret,
+        "displayTimeUnit": "ms",
+        "otherData": {
+            "dropped": dropped,
+        },
+    }
+
+
+def summary(events):
+    """
+    Per category/name: count, total and percentile latencies in seconds
+    """
+    durations = OrderedDict()
+    for name, cat, _t, duration, _tid, _thread_name, _args in events:
+        if duration is not None:
+            durations.setdefault((cat, name), []).append(duration)
+    ret = OrderedDict()
+    for (cat, name), values in sorted(durations.items()):
+        values.sort()
+        ret["%s/%s" % (cat, name)] = {
+            "count": len(values),
+            "total": round(sum(values), 4),
+            "p50": round(percentile(values, 0.50), 4),
+            "p90": round(percentile(values, 0.90), 4),
+            "p99": round(percentile(values, 0.99), 4),
+            "max": round(values[-1], 4),
+        }
+    return ret
+
+
+def log_summary(log, summary, dropped=0):
+    if not summary:
+        return
+    log("Trace: per stage latency (ms)")
+    log("  %-24s %6s %8s %8s %8s %8s" %
+        ("stage", "count", "p50", "p90", "p99", "max"))
+    for name, row in summary.items():
+        log("  %-24s %6u %8.1f %8.1f %8.1f %8.1f" %
+            (name, row["count"], row["p50"] * 1000, row["p90"] * 1000,
+             row["p99"] * 1000, row["max"] * 1000))
+    if dropped:
+        log("Trace: WARNING: %u oldest events dropped (buffer full)" %
+            (dropped, ))
+
+
+# Process wide: spans come from every thread
+tracer = Tracer()
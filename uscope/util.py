@@ -8,6 +8,7 @@ import json
 import glob
 import errno
 import time
+from uscope.trace import tracer
 
 
 def print_debug(s=None):
@@ -407,6 +408,7 @@ class LogTimer:
 
     def __exit__(self, *args):
         self.end = time.time()
+        tracer.complete(self.name, "timer", self.start, self.end)
         if self.variable:
             if os.getenv(self.variable) != "Y":
                 return
@@ -8,28 +8,8 @@ import glob
 import os
 import math
 from uscope import config
-
-
-def npf2im(statef):
-    #return statef, None
-    rounded = np.round(statef)
-    #print("row1: %s" % rounded[1])
-    statei = np.array(rounded, dtype=np.uint16)
-    #print(len(statei), len(statei[0]), len(statei[0]))
-    height = len(statef)
-    width = len(statef[0])
-
-    # for some reason I isn't working correctly
-    # only L
-    # workaround by plotting manually
-    im = Image.new("RGB", (width, height), "Black")
-    for y, row in enumerate(statei):
-        for x, val in enumerate(row):
-            # this causes really weird issues if not done
-            val = tuple(int(x) for x in val)
-            im.putpixel((x, y), val)
-
-    return im
+from uscope.imagep import flat_field
+from uscope.imagep.flat_field import npf2im
 
 
 def average_imgs(imgs, scalar=None):
@@ -38,10 +18,11 @@ def average_imgs(imgs, scalar=None):
         scalar = 1.0
     scalar = scalar / len(imgs)
 
-    statef = np.zeros((height, width, 3), np.float)
+    statef = np.zeros((height, width, 3), np.float32)
     for im in imgs:
         assert (width, height) == im.size
-        statef = statef + scalar * np.array(im, dtype=np.float)
+        statef += np.asarray(im, dtype=np.float32)
+    statef *= scalar
 
     return statef, npf2im(statef)
 
@@ -155,6 +136,7 @@ def main():
         os.mkdir(dir_out)
 
     ffi_im = Image.open(args.ffi_in)
+    gain = flat_field.gain_map_create(np.asarray(ffi_im.convert("RGB")))
 
     # It's easy to have an outlier that boosts everything
     # hmm
@@ -173,32 +155,8 @@ def main():
     for im_in in sorted(glob.glob(dir_in + "/*.jpg")):
         # im_in = "cal/cal06_ff_1.5x/2023-06-20_01-22-25_blue_20x_cal6_1.5x_pic/c000_r001.jpg"
         print("im", im_in)
-        im = Image.open(im_in)
-        for x in range(im.width):
-            for y in range(im.height):
-                pixr, pixg, pixb = list(im.getpixel((x, y)))
-                ffr, ffg, ffb = list(ffi_im.getpixel((x, y)))
-                # nop
-                if 0:
-                    pixr2 = pixr
-                    pixg2 = pixg
-                    pixb2 = pixb
-                # expected version
-                if 1:
-                    pixr2 = int(math.ceil(min(255, pixr * ffi_rmax / ffr)))
-                    pixg2 = int(math.ceil(min(255, pixg * ffi_gmax / ffg)))
-                    pixb2 = int(math.ceil(min(255, pixb * ffi_bmax / ffb)))
-                # old code sort of hack
-                if 0:
-                    pixr2 = int(min(255, pixr * ffr / ffi_rmin))
-                    pixg2 = int(min(255, pixg * ffg / ffi_gmin))
-                    pixb2 = int(min(255, pixb * ffb / ffi_bmin))
-                if x == 0 and y == 0 or x == 400 and y == 300:
-                    print(
-                        f"x={x}, y={y}: ({pixr}, {pixg}, {pixg}) => ({pixr2}, {pixg2}, {pixg2})"
-                    )
-                    print(pixr, ffi_rmax, ffr, ffi_rmax / ffr)
-                im.putpixel((x, y), (pixr2, pixg2, pixb2))
+        im_np = np.asarray(Image.open(im_in).convert("RGB"))
+        im = Image.fromarray(flat_field.apply_gain_map(im_np, gain))
         im_out = os.path.join(dir_out, os.path.basename(im_in))
         print("Saving to", im_out)
         im.save(im_out)
@@ -4,41 +4,22 @@ import numpy as np
 import glob
 import os
 from uscope import config
+from uscope.imagep import flat_field
+from uscope.imagep.flat_field import npf2im
 import subprocess
 
 
-def npf2im(statef):
-    #return statef, None
-    rounded = np.round(statef)
-    #print("row1: %s" % rounded[1])
-    statei = np.array(rounded, dtype=np.uint16)
-    #print(len(statei), len(statei[0]), len(statei[0]))
-    height = len(statef)
-    width = len(statef[0])
-
-    # for some reason I isn't working correctly
-    # only L
-    # workaround by plotting manually
-    im = Image.new("RGB", (width, height), "Black")
-    for y, row in enumerate(statei):
-        for x, val in enumerate(row):
-            # this causes really weird issues if not done
-            val = tuple(int(x) for x in val)
-            im.putpixel((x, y), val)
-
-    return im
-
-
 def average_imgs(imgs, scalar=None):
     width, height = imgs[0].size
     if not scalar:
         scalar = 1.0
     scalar = scalar / len(imgs)
 
-    statef = np.zeros((height, width, 3), float)
+    statef = np.zeros((height, width, 3), np.float32)
     for im in imgs:
         assert (width, height) == im.size
-        statef = statef + scalar * np.array(im, dtype=float)
+        statef += np.asarray(im, dtype=np.float32)
+    statef *= scalar
 
     return statef, npf2im(statef)
 
@@ -151,6 +132,10 @@ def main():
     fn_out_ffe = dir_out + '/imager_calibration_ffe.tif'
     print(f"Saving {fn_out_ff}")
     ffi.save(fn_out_ff)
+    # Gain map cache is rebuilt on next use
+    fn_out_gain = flat_field.gain_map_fn(fn_out_ff)
+    if os.path.exists(fn_out_gain):
+        os.unlink(fn_out_gain)
     # FIXME: find some way to generate this by CLI
     print(f"Saving {fn_out_ffe}")
     # histeq_im(ffi).save(dir_out + '/ffe.tif')
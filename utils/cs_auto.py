@@ -8,6 +8,7 @@ TODO: parallel
 """
 
 from uscope.imagep.pipeline import process_dir, already_uploaded
+from uscope.imagep.daemon import ImagepClient
 from uscope.cloud_stitch import CSInfo
 from uscope.util import add_bool_arg
 from uscope import config
@@ -17,13 +18,33 @@ import time
 import json
 
 
-def run(directories, batch_sleep=2400, microscope_name=None, *args, **kwargs):
+def run(directories,
+        batch_sleep=2400,
+        microscope_name=None,
+        daemon=False,
+        *args,
+        **kwargs):
+    if daemon:
+        client = ImagepClient()
+        # Set when the server starts
+        kwargs.pop("nthreads", None)
+        kwargs.pop("backend", None)
+
+        def process(directory, *args, microscope_name=None, **kwargs):
+            ret = client.process_dir(directory,
+                                     microscope=microscope_name,
+                                     **kwargs)
+            if not ret["ok"]:
+                raise Exception(ret["error"])
+    else:
+        process = process_dir
+
     if directories:
         for directory in directories:
-            process_dir(directory,
-                        microscope_name=microscope_name,
-                        *args,
-                        **kwargs)
+            process(directory,
+                    microscope_name=microscope_name,
+                    *args,
+                    **kwargs)
     else:
         # Something 3 like execution units right now
         burst_size = 2
@@ -48,10 +69,10 @@ def run(directories, batch_sleep=2400, microscope_name=None, *args, **kwargs):
                 print(
                     "WARNING: throttling upload to let stitch server catch up")
                 time.sleep(batch_sleep)
-            process_dir(directory,
-                        *args,
-                        microscope_name=microscope_name,
-                        **kwargs)
+            process(directory,
+                    *args,
+                    microscope_name=microscope_name,
+                    **kwargs)
             uploads += 1
 
 
@@ -77,6 +98,14 @@ def main():
         help="Best effort in lieu of crashing on error (ex: stack failure)")
     add_bool_arg(parser, "--quick-pano", default=None, help="")
     parser.add_argument("--threads", default=None)
+    parser.add_argument(
+        "--backend",
+        default=None,
+        help="Image processing workers: thread (default) or process")
+    add_bool_arg(parser,
+                 "--daemon",
+                 default=False,
+                 help="Use the persistent image processing service")
     parser.add_argument("--access-key")
     parser.add_argument("--secret-key")
     parser.add_argument("--id-key")
@@ -114,7 +143,9 @@ def main():
         lazy=args.lazy,
         batch_sleep=args.batch_sleep,
         nthreads=args.threads,
+        backend=args.backend,
         microscope_name=args.microscope,
+        daemon=args.daemon,
         configj=j,
         verbose=args.verbose)
 
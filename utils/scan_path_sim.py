@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Estimate XY scan motion time for each path pattern
+Ex: ./utils/scan_path_sim.py --cols 20 --rows 15 --step-x 0.8 --step-y 0.6 --backlash 0.05 --compensation -1
+Ex: ./utils/scan_path_sim.py --uscan scan/uscan.json
+
+--uscan replays the points (including any exclusions / skew) of a previous scan
+Velocities aren't recorded there and still come from the command line
+"""
+
+from uscope.planner import path
+import json
+
+
+def uscan_tiles(fn):
+    """
+    Return cols, rows, {(ll_col, ll_row): pos}, pconfig
+    """
+    with open(fn) as f:
+        j = json.load(f)
+    points = None
+    for k in ("points-xy2p", "points-xy3p"):
+        if k in j:
+            points = j[k]["points"]
+    if points is None:
+        raise ValueError("No XY points in %s" % fn)
+    cols = max(point["col"] for point in points.values()) + 1
+    rows = max(point["row"] for point in points.values()) + 1
+    positions = {}
+    for point in points.values():
+        pos = dict([(axis, point[axis]) for axis in ("x", "y", "z")
+                    if axis in point])
+        positions[(point["col"], rows - 1 - point["row"])] = pos
+    return cols, rows, positions, j.get("pconfig", {})
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Estimate scan motion time per XY path pattern")
+    parser.add_argument("--uscan", help="Take points from this uscan.json")
+    parser.add_argument("--cols", type=int, default=10)
+    parser.add_argument("--rows", type=int, default=10)
+    parser.add_argument("--step-x", type=float, default=1.0, help="mm")
+    parser.add_argument("--step-y", type=float, default=0.75, help="mm")
+    parser.add_argument("--velocity",
+                        type=float,
+                        default=1000.0,
+                        help="mm / min, all axes")
+    parser.add_argument("--acceleration",
+                        type=float,
+                        default=100.0,
+                        help="mm / sec2, all axes")
+    parser.add_argument("--backlash",
+                        type=float,
+                        default=None,
+                        help="mm, XY (default: uscan.json or 0)")
+    parser.add_argument("--compensation",
+                        type=int,
+                        default=None,
+                        help="-1 or +1, XY (default: uscan.json or -1)")
+    parser.add_argument("--tsettle",
+                        type=float,
+                        default=None,
+                        help="sec per tile (default: uscan.json or 0)")
+    args = parser.parse_args()
+
+    backlash = {}
+    compensation = {}
+    tsettle = 0.0
+    if args.uscan:
+        cols, rows, positions, pconfig = uscan_tiles(args.uscan)
+        pmotion = pconfig.get("motion", {})
+        backlash_j = pmotion.get("backlash", {})
+        if type(backlash_j) in (float, int):
+            backlash_j = {"x": backlash_j, "y": backlash_j}
+        backlash = dict(backlash_j)
+        compensation = dict([(axis, -1) for axis, v in backlash.items() if v])
+        compensation_j = pmotion.get("backlash_compensation", {})
+        if type(compensation_j) is int:
+            compensation_j = dict([(axis, compensation_j)
+                                   for axis in compensation])
+        compensation.update(compensation_j)
+        tsettle = pconfig.get("kinematics", {}).get("tsettle_motion", 0.0)
+        calc_pos = lambda col, row: positions[(col, row)]
+        tiles = set(positions.keys())
+    else:
+        cols = args.cols
+        rows = args.rows
+        calc_pos = lambda col, row: {
+            "x": col * args.step_x,
+            "y": row * args.step_y
+        }
+        tiles = set([(col, row) for col in range(cols) for row in range(rows)])
+    for axis in ("x", "y"):
+        if args.backlash is not None:
+            backlash[axis] = args.backlash
+        if args.compensation is not None:
+            compensation[axis] = args.compensation
+        elif backlash.get(axis):
+            compensation.setdefault(axis, -1)
+    if args.tsettle is not None:
+        tsettle = args.tsettle
+
+    model = path.MotionModel(velocities=dict([(axis, args.velocity)
+                                              for axis in "xyz"]),
+                             accelerations=dict([(axis, args.acceleration)
+                                                 for axis in "xyz"]),
+                             backlash=backlash,
+                             compensation=compensation,
+                             tsettle=tsettle)
+    # Lower left isn't necessarily part of an irregular scan
+    start = calc_pos(*min(tiles, key=lambda tile: (tile[1], tile[0])))
+    simulated = path.simulate(tiles=tiles,
+                              cols=cols,
+                              rows=rows,
+                              calc_pos=calc_pos,
+                              model=model,
+                              start=start)
+    print("%u tiles (%u cols x %u rows)" % (len(tiles), cols, rows))
+    print("Backlash: %s, compensation: %s, settle %0.3f sec / tile" %
+          (backlash, compensation, tsettle))
+    best, _order, best_seconds = path.best_order(simulated)
+    for name, (_order, seconds) in simulated.items():
+        print("  %-20s %8.1f sec%s" %
+              (name, seconds, "  (best)" if name == best else ""))
+    print("Best: %s, %0.1f sec" % (best, best_seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Compare stabilization engine memory / time against the original
+concatenate + np.median implementation
+Ex: ./utils/stabilization_benchmark.py --frames 8 --width 5472 --height 3648
+"""
+
+from uscope.imagep import stabilization
+import numpy as np
+import tempfile
+import tracemalloc
+import time
+
+
+def original(frames):
+    image_stack = np.concatenate([im[..., None] for im in frames], axis=3)
+    return np.median(image_stack, axis=3).astype(np.uint8)
+
+
+def engine(frames, mode, max_ram_bytes, spill_dir):
+    stack = stabilization.FrameStack(len(frames),
+                                     max_ram_bytes=max_ram_bytes,
+                                     spill_dir=spill_dir)
+    try:
+        for frame in frames:
+            stack.add(frame)
+        return stabilization.stabilize(stack, mode=mode)
+    finally:
+        stack.close()
+
+
+def bench(name, func, frames_bytes):
+    tracemalloc.start()
+    tstart = time.time()
+    ret = func()
+    dt = time.time() - tstart
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("%-24s: %6.2f sec, peak %7.1f MB (+ %0.1f MB input frames)" %
+          (name, dt, peak / 1e6, frames_bytes / 1e6))
+    return ret
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark stabilization engine")
+    parser.add_argument("--frames", type=int, default=8)
+    parser.add_argument("--width", type=int, default=2592)
+    parser.add_argument("--height", type=int, default=1944)
+    parser.add_argument("--max-ram-mb",
+                        type=int,
+                        default=1,
+                        help="Spill threshold for the spill run")
+    parser.add_argument("--skip-original", action="store_true")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    base = rng.integers(0, 200, (args.height, args.width, 3), dtype=np.uint8)
+    frames = [
+        base + rng.integers(0, 50, base.shape, dtype=np.uint8)
+        for _i in range(args.frames)
+    ]
+    frames_bytes = sum(frame.nbytes for frame in frames)
+    print("%u frames %uw x %uh" % (args.frames, args.width, args.height))
+
+    ref = None
+    if not args.skip_original:
+        ref = bench("original", lambda: original(frames), frames_bytes)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for mode in stabilization.MODES:
+            out = bench("engine %s" % mode,
+                        lambda: engine(frames, mode, None, None), frames_bytes)
+            if ref is not None and mode == "median":
+                assert (out == ref).all(), "median mismatch"
+        bench(
+            "engine median (spill)", lambda: engine(
+                frames, "median", args.max_ram_mb * 1024 * 1024, tmp_dir),
+            frames_bytes)
+
+
+if __name__ == "__main__":
+    main()
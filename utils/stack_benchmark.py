@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Compare focus stacking engines on a sample stack
+Ex: ./utils/stack_benchmark.py --microscope lip-a2 scan/stack/c000_r000_z*.jpg
+
+If no images are given a synthetic stack is generated
+"""
+
+from uscope.imagep.plugins import StackEnfusePlugin, StackNativePlugin
+from uscope.imagep.util import EtherealImageR, EtherealImageW
+from uscope.microscope import get_virtual_microscope, get_mconfig
+from uscope import config
+from PIL import Image
+import numpy as np
+import cv2
+import tempfile
+import time
+import os
+
+
+def synthetic_stack(dir_out, n=5, width=1600, height=1200):
+    """
+    Texture that is sharp in a different horizontal band per image
+    """
+    rng = np.random.default_rng(0)
+    texture = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    fns = []
+    for i in range(n):
+        blurred = cv2.GaussianBlur(texture, (0, 0), 4)
+        y0 = height * i // n
+        y1 = height * (i + 1) // n
+        blurred[y0:y1] = texture[y0:y1]
+        fn = os.path.join(dir_out, "z%02u.jpg" % i)
+        Image.fromarray(blurred).save(fn, quality=90)
+        fns.append(fn)
+    return fns
+
+
+def sharpness(fn):
+    gray = cv2.cvtColor(np.asarray(Image.open(fn)), cv2.COLOR_RGB2GRAY)
+    return cv2.Laplacian(gray, cv2.CV_64F).var()
+
+
+def bench(name, plugin, fns, dir_out, iters):
+    fn_out = os.path.join(dir_out, name + ".jpg")
+    dts = []
+    for _i in range(iters):
+        data_in = {"images": [EtherealImageR(fn=fn) for fn in fns]}
+        data_out = {"image": EtherealImageW(want_fn=fn_out)}
+        tstart = time.time()
+        plugin.run(data_in=data_in, data_out=data_out)
+        dts.append(time.time() - tstart)
+    dt = min(dts)
+    print("%-12s: %0.3f sec / stack, %0.2f stacks / sec, sharpness %0.1f" %
+          (name, dt, 1 / dt, sharpness(fn_out)))
+    return dt
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark stack-native vs stack-enfuse")
+    parser.add_argument("--microscope")
+    parser.add_argument("--iters", type=int, default=3)
+    parser.add_argument("--align",
+                        default=None,
+                        help="stack-native alignment: none, phase, ecc")
+    parser.add_argument("--out-dir",
+                        default=None,
+                        help="Keep output images here")
+    parser.add_argument("fns_in", nargs="*")
+    args = parser.parse_args()
+
+    get_virtual_microscope(mconfig=get_mconfig(name=args.microscope))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dir_out = args.out_dir or tmp_dir
+        fns = sorted(args.fns_in)
+        if not fns:
+            print("Generating synthetic stack")
+            fns = synthetic_stack(tmp_dir)
+        print("Stack: %u images" % len(fns))
+
+        native = StackNativePlugin(log=None)
+        if args.align:
+            native.align = args.align
+        dt_native = bench("stack-native", native, fns, dir_out, args.iters)
+
+        if config.get_bc().enfuse_cli():
+            dt_enfuse = bench("stack-enfuse", StackEnfusePlugin(log=None), fns,
+                              dir_out, args.iters)
+            print("Speedup: %0.1fx" % (dt_enfuse / dt_native, ))
+        else:
+            print("stack-enfuse: skip (enfuse not found)")
+
+
+if __name__ == "__main__":
+    main()